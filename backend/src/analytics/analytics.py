@@ -1,12 +1,49 @@
 """
-Analytics API routes for music listening insights
+Analytics API routes for music listening insights.
+Computed from the user's mood sessions and Spotify listening history through
+the per-user time series in timeseries.py (fed and backfilled by rollups.py).
+Trending across all users comes from the streaming sketches in sketches.py, and
+moods for untagged plays from the batch classifier in ml/mood_classifier.py.
 """
+import time
+from datetime import date, datetime, timezone
 from typing import Optional, List
-from fastapi import APIRouter
+import numpy as np
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 
+from ..ml.evaluation import load_evaluation_results
+from ..ml.mood_classifier import get_mood_classifier
+from ..storage.async_storage import run_sync
+from ..storage.listening_events import listening_event_store
+from ..storage.backend import MOODS, MAX_AGGREGATE_DAYS, SECONDS_PER_DAY
+from .rollups import analytics_rollups
+from .sketches import trending_sketches, DIMENSIONS, SCOPES, TRENDING_WINDOW_DAYS
+from .timeseries import (
+    UserTimeSeries, day_number,
+    SESSIONS, MOOD_MS, AGREE, CLASSIFIED, PLAYS, LISTEN_MS,
+)
+
 router = APIRouter()
 
+# Length of each overview window in days; changes are against the window before it
+TIME_FILTER_DAYS = {"Today": 1, "This Week": 7, "This Month": 30, "This Year": 365}
+MOOD_COLORS = {
+    "Happy": "#4CAF50",
+    "Energized": "#FFC107",
+    "Calm": "#9C27B0",
+    "Sad": "#2196F3",
+    "Angry": "#F44336",
+}
+# Assigned to top genres by rank
+GENRE_COLORS = ["#4CAF50", "#FFC107", "#F44336", "#2196F3", "#9C27B0"]
+TOP_K = 5
+# Most plays classified in one history-moods response
+MAX_CLASSIFIED_PLAYS = 5000
+MS_PER_HOUR = 3_600_000
+# Longest mood history range served in one response
+MAX_HISTORY_DAYS = 10 * MAX_AGGREGATE_DAYS
+
 class MoodStat(BaseModel):
     mood: str
     percentage: float
@@ -27,106 +64,228 @@ class TopGenre(BaseModel):
     percentage: float
     color: str
 
-@router.get("/api/analytics/overview")
-def get_analytics_overview(time_filter: str = "This Week", user_id: Optional[str] = None):
+def _percent_change(current: float, previous: float) -> str:
+    """Signed change like "+12%"; anything from nothing counts as +100%"""
+    if previous == 0:
+        return "+100%" if current > 0 else "+0%"
+    return f"{round((current - previous) * 100 / previous):+d}%"
+
+def _date(day: int) -> datetime:
+    return datetime.fromtimestamp(day * SECONDS_PER_DAY, tz=timezone.utc)
+
+def compute_overview(series: UserTimeSeries, days: int, now: float) -> dict:
+    """Overview for the last `days` days (including today) from a user's time series"""
+    end = day_number(now) + 1
+    first = end - days
+    daily = series.daily(first, end)
+    totals = daily.sum(axis=0)
+    previous = series.window(first - days, first)
+
+    mood_counts = totals[SESSIONS]
+    tagged = mood_counts.sum()
+    mood_stats = [
+        MoodStat(
+            mood=MOODS[i],
+            percentage=round(float(mood_counts[i]) * 100 / tagged, 1) if tagged else 0.0,
+            color=MOOD_COLORS[MOODS[i]],
+            hours=round(float(totals[MOOD_MS][i]) / MS_PER_HOUR, 1),
+        ).model_dump()
+        for i in np.argsort(-mood_counts, kind="stable")
+    ]
+
+    hours = daily[:, LISTEN_MS] / MS_PER_HOUR
+    label = "%a" if days <= 7 else "%b %d"
+    listening_data = [
+        ListeningData(day=_date(day).strftime(label), hours=round(h, 1)).model_dump()
+        for day, h in zip(range(first, end), hours.tolist())
+    ]
+
+    previous_artists = series.counts("artist", first - days, first)
+    top_artists = [
+        TopArtist(name=name, plays=plays, change=_percent_change(plays, previous_artists.get(name, 0))).model_dump()
+        for name, plays in series.top("artist", first, end, TOP_K)
+    ]
+
+    genres = series.counts("genre", first, end)
+    genre_plays = sum(genres.values())
+    top_genres = [
+        TopGenre(name=name, percentage=round(plays * 100 / genre_plays, 1), color=GENRE_COLORS[rank]).model_dump()
+        for rank, (name, plays) in enumerate(series.top("genre", first, end, TOP_K))
+    ]
+
+    total_hours = float(totals[LISTEN_MS]) / MS_PER_HOUR
+    return {
+        "total_listening_hours": round(total_hours, 1),
+        "daily_average": round(total_hours / days, 1),
+        "total_plays": int(totals[PLAYS]),
+        "top_mood": mood_stats[0]["mood"] if tagged else None,
+        "mood_percentage": mood_stats[0]["percentage"] if tagged else 0,
+        # change in listening time against the previous window of the same length
+        "week_change": _percent_change(float(totals[LISTEN_MS]), float(previous[LISTEN_MS])),
+        "mood_stats": mood_stats,
+        "listening_data": listening_data,
+        "top_artists": top_artists,
+        "top_genres": top_genres,
+    }
+
+def compute_mood_history(series: UserTimeSeries, first: int, end: int) -> List[dict]:
+    """One entry per day for epoch days [first, end), oldest first"""
+    daily = series.daily(first, end)
+
+    counts = daily[:, SESSIONS]
+    totals = counts.sum(axis=1, keepdims=True)
+    distribution = np.divide(counts * 100, totals, out=np.zeros_like(counts), where=totals > 0).round(1)
+    dominant = np.where(totals[:, 0] > 0, counts.argmax(axis=1), -1)
+    hours = (daily[:, LISTEN_MS] / MS_PER_HOUR).round(2)
+
+    return [
+        {
+            "date": _date(day).strftime("%Y-%m-%d"),
+            "dominant_mood": MOODS[mood] if mood >= 0 else None,
+            "listening_hours": h,
+            "mood_distribution": dict(zip(MOODS, shares)),
+        }
+        for day, mood, h, shares in zip(range(first, end), dominant.tolist(), hours.tolist(), distribution.tolist())
+    ]
+
+def compute_accuracy(series: UserTimeSeries, now: float) -> dict:
     """
-    Get analytics overview including mood distribution, listening time, etc.
-    In production, this would query user's actual listening data
+    How often the content model's nearest mood prototype agrees with the moods
+    the user tagged over the last MAX_AGGREGATE_DAYS days
     """
-    
-    # Mock analytics data
-    overview = {
-        "total_listening_hours": 41.0,
-        "daily_average": 5.9,
-        "top_mood": "Happy",
-        "mood_percentage": 35,
-        "week_change": "+23%",
-        "mood_stats": [
-            {"mood": "Happy", "percentage": 35, "color": "#4CAF50", "hours": 14.2},
-            {"mood": "Energized", "percentage": 25, "color": "#FFC107", "hours": 10.1},
-            {"mood": "Calm", "percentage": 20, "color": "#9C27B0", "hours": 8.3},
-            {"mood": "Sad", "percentage": 15, "color": "#2196F3", "hours": 6.1},
-            {"mood": "Angry", "percentage": 5, "color": "#F44336", "hours": 2.3}
-        ],
-        "listening_data": [
-            {"day": "Mon", "hours": 3.2},
-            {"day": "Tue", "hours": 2.8},
-            {"day": "Wed", "hours": 4.1},
-            {"day": "Thu", "hours": 3.7},
-            {"day": "Fri", "hours": 5.2},
-            {"day": "Sat", "hours": 6.8},
-            {"day": "Sun", "hours": 4.9}
-        ],
-        "top_artists": [
-            {"name": "The Weeknd", "plays": 47, "change": "+12%"},
-            {"name": "Dua Lipa", "plays": 39, "change": "+8%"},
-            {"name": "Post Malone", "plays": 34, "change": "-3%"},
-            {"name": "Olivia Rodrigo", "plays": 28, "change": "+15%"},
-            {"name": "Imagine Dragons", "plays": 25, "change": "+5%"}
-        ],
-        "top_genres": [
-            {"name": "Pop", "percentage": 32, "color": "#4CAF50"},
-            {"name": "Hip-Hop", "percentage": 28, "color": "#FFC107"},
-            {"name": "Rock", "percentage": 18, "color": "#F44336"},
-            {"name": "Electronic", "percentage": 12, "color": "#2196F3"},
-            {"name": "Indie", "percentage": 10, "color": "#9C27B0"}
-        ]
+    end = day_number(now) + 1
+    totals = series.window(end - MAX_AGGREGATE_DAYS, end)
+    agree, classified = totals[AGREE], totals[CLASSIFIED]
+    evaluated = int(classified.sum())
+
+    def percent(hits: float, total: float) -> Optional[float]:
+        return round(hits * 100 / total, 1) if total else None
+
+    return {
+        "overall_accuracy": percent(float(agree.sum()), evaluated),
+        "mood_accuracy": {mood: percent(float(agree[i]), float(classified[i])) for i, mood in enumerate(MOODS)},
+        "sessions_evaluated": evaluated,
+        # tagged tracks that aren't in the catalog can't be scored
+        "sessions_unmatched": int(totals[SESSIONS].sum()) - evaluated,
     }
-    
+
+def compute_history_moods(firebase_user_id: str, limit: int) -> dict:
+    """Inferred mood and confidence for the user's most recent ingested plays, newest first"""
+    plays = get_mood_classifier().classify_history(listening_event_store.recent(firebase_user_id, limit))
+    counts = {mood: 0 for mood in MOODS}
+    for play in plays:
+        if play["mood"] is not None:
+            counts[play["mood"]] += 1
+    classified = sum(counts.values())
+    return {
+        "plays": plays,
+        "mood_distribution": {
+            mood: round(count * 100 / classified, 1) if classified else 0.0 for mood, count in counts.items()
+        },
+        "plays_classified": classified,
+        # tracks outside the catalog have no audio features to classify
+        "plays_unclassified": len(plays) - classified,
+    }
+
+@router.get("/api/analytics/overview")
+async def get_analytics_overview(
+    time_filter: str = "This Week",
+    firebase_user_id: str = Query(..., description="Firebase user ID")
+):
+    """
+    Get analytics overview including mood distribution, listening time, top artists and genres.
+    """
+    days = TIME_FILTER_DAYS.get(time_filter)
+    if days is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid time_filter. Must be one of {list(TIME_FILTER_DAYS)}"
+        )
+
+    try:
+        series = await analytics_rollups.get(firebase_user_id)
+        overview = await run_sync(compute_overview, series, days, time.time())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing analytics: {str(e)}")
+
     return {"analytics": overview, "time_filter": time_filter}
 
 @router.get("/api/analytics/mood-history")
-def get_mood_history(days: int = 30, user_id: Optional[str] = None):
+async def get_mood_history(
+    days: int = Query(30, ge=1, le=MAX_AGGREGATE_DAYS, description="Days of history, including today"),
+    firebase_user_id: str = Query(..., description="Firebase user ID"),
+    start: Optional[date] = Query(None, description="First day (YYYY-MM-DD); overrides days"),
+    end: Optional[date] = Query(None, description="Last day, inclusive (YYYY-MM-DD); defaults to today")
+):
     """
-    Get mood listening history over time
+    Get mood listening history over time, for the last `days` days or any start/end range
     """
-    # Mock mood history data
-    mood_history = []
-    import datetime
-    
-    base_date = datetime.datetime.now() - datetime.timedelta(days=days)
-    
-    for i in range(days):
-        date = base_date + datetime.timedelta(days=i)
-        mood_history.append({
-            "date": date.strftime("%Y-%m-%d"),
-            "dominant_mood": ["Happy", "Energized", "Calm", "Sad"][i % 4],
-            "listening_hours": 2.5 + (i % 5) * 0.8,
-            "mood_distribution": {
-                "Happy": max(0, 40 - (i % 10) * 2),
-                "Energized": max(0, 25 + (i % 8) * 2),
-                "Calm": max(0, 20 + (i % 6) * 1),
-                "Sad": max(0, 10 + (i % 4) * 2),
-                "Angry": max(0, 5 + (i % 3))
-            }
-        })
-    
+    last = (end - date(1970, 1, 1)).days if end else day_number(time.time())
+    first = (start - date(1970, 1, 1)).days if start else last - days + 1
+    if not 0 < last - first + 1 <= MAX_HISTORY_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"start must be on or before end, at most {MAX_HISTORY_DAYS} days apart"
+        )
+
+    try:
+        series = await analytics_rollups.get(firebase_user_id)
+        mood_history = await run_sync(compute_mood_history, series, first, last + 1)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing mood history: {str(e)}")
+
     return {"mood_history": mood_history}
 
 @router.get("/api/analytics/recommendations-accuracy")
-def get_recommendations_accuracy(user_id: Optional[str] = None):
+async def get_recommendations_accuracy(firebase_user_id: str = Query(..., description="Firebase user ID")):
     """
-    Get accuracy metrics for mood-based recommendations
+    Get accuracy metrics for mood-based recommendations: the user's prototype agreement,
+    plus the latest offline evaluation across all users (ml/evaluation.py), if one has run
     """
-    accuracy_data = {
-        "overall_accuracy": 87.3,
-        "mood_accuracy": {
-            "Happy": 92.1,
-            "Energized": 88.7,
-            "Calm": 85.4,
-            "Sad": 83.2,
-            "Angry": 79.8
-        },
-        "user_feedback": {
-            "liked": 76,
-            "disliked": 12,
-            "neutral": 45
-        },
-        "improvement_suggestions": [
-            "More variety in Happy mood recommendations",
-            "Better detection of energy levels",
-            "Include more recent releases"
-        ]
-    }
-    
+    try:
+        series = await analytics_rollups.get(firebase_user_id)
+        accuracy_data = await run_sync(compute_accuracy, series, time.time())
+        accuracy_data["offline_evaluation"] = await run_sync(load_evaluation_results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing accuracy: {str(e)}")
+
     return {"recommendations_accuracy": accuracy_data}
+
+@router.get("/api/analytics/history-moods")
+async def get_history_moods(
+    firebase_user_id: str = Query(..., description="Firebase user ID"),
+    limit: int = Query(1000, ge=1, le=MAX_CLASSIFIED_PLAYS, description="Most recent plays to classify")
+):
+    """
+    Get an inferred mood and confidence for each play in the user's ingested listening history
+    """
+    try:
+        history_moods = await run_sync(compute_history_moods, firebase_user_id, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error classifying listening history: {str(e)}")
+
+    return {"history_moods": history_moods}
+
+@router.get("/api/analytics/trending")
+async def get_trending(
+    mood: str = Query("All", description=f"One of {SCOPES}"),
+    dimension: str = Query("artists", description=f"One of {list(DIMENSIONS)}"),
+    days: int = Query(TRENDING_WINDOW_DAYS, ge=1, le=TRENDING_WINDOW_DAYS, description="Days, including today"),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """
+    Get the most played artists, genres or tracks across all users for a mood.
+    Counts are approximate; error_bounds gives the guarantees for this window.
+    """
+    if mood not in SCOPES or dimension not in DIMENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"mood must be one of {SCOPES} and dimension one of {list(DIMENSIONS)}"
+        )
+
+    try:
+        trending = await run_sync(trending_sketches.trending, mood, dimension, days, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing trending: {str(e)}")
+
+    return {"trending": trending, "mood": mood, "dimension": dimension, "days": days}
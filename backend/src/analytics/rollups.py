@@ -0,0 +1,371 @@
+"""
+Per-user daily analytics rollups.
+Each mood session and listening event is joined to the catalog (genre, artist,
+duration) once, when it is written, and appended to the user's columnar,
+month-partitioned time series (timeseries.py), whose partitions keep daily
+aggregates. Overview, mood history and accuracy queries are then a slice and a
+sum over those aggregates instead of a scan of raw sessions and events.
+
+A user's history from before the time series existed is backfilled from
+storage on first read; after that record_sessions/record_events on the write
+paths keep it current. The same writes also feed the global trending
+sketches (sketches.py). Workers on the node share the time series on disk.
+
+Writes handled on another node are picked up by a reconcile on read, at most
+ANALYTICS_ROLLUP_MAX_AGE_SECONDS after the last one: it reads only the sessions
+created since the previous reconcile (less ANALYTICS_RECONCILE_OVERLAP_SECONDS,
+for writes still in flight then) and the events past the series' watermark.
+The series' applied.json keeps that watermark and the ids of sessions applied
+within the overlap, so a play is never appended twice. Deleted sessions only
+drop out when the series is rebuilt from scratch, which happens in the
+background once the last build is ANALYTICS_REBUILD_MAX_AGE_SECONDS old.
+"""
+import os
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..ml.dataset_loader import get_preprocessor
+from ..ml.mood_classifier import get_mood_classifier
+from ..storage import async_storage
+from ..storage.backend import MOODS, SECONDS_PER_DAY
+from ..storage.listening_events import ListeningEventStore, listening_event_store
+from .timeseries import ColumnarEventStore, UserTimeSeries, columnar_event_store, ROW_DTYPE
+from .sketches import TrendingSketches, trending_sketches, ALL_MOODS
+
+ANALYTICS_ROLLUP_MAX_AGE_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_MAX_AGE_SECONDS", "300"))
+ANALYTICS_RECONCILE_OVERLAP_SECONDS = float(os.getenv("ANALYTICS_RECONCILE_OVERLAP_SECONDS", "600"))
+ANALYTICS_REBUILD_MAX_AGE_SECONDS = float(os.getenv("ANALYTICS_REBUILD_MAX_AGE_SECONDS", str(7 * 86400)))
+
+MOOD_INDEX = {mood: i for i, mood in enumerate(MOODS)}
+
+SESSION_FIELDS = ["trackId", "mood", "intensity", "artistName"]
+
+
+class CatalogJoin:
+    """
+    Resolves track ids to catalog rows and the per-row columns analytics needs:
+    duration, genre, primary artist and nearest general mood prototype.
+    Columns are materialized once per loaded catalog version.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._preprocessor = None
+        self._duration_ms = None
+        self._genre = None
+        self._artist = None
+
+    def _load(self):
+        with self._lock:
+            preprocessor = get_preprocessor()
+            if self._preprocessor is not preprocessor or self._version != preprocessor.version:
+                df = preprocessor.df
+                n = len(df)
+                if "duration_ms" in df.columns:
+                    self._duration_ms = df["duration_ms"].fillna(0).to_numpy(dtype=np.float64)
+                else:
+                    self._duration_ms = np.zeros(n)
+                self._genre = df["track_genre"].astype(str).to_numpy(dtype=object)
+                # Multi-artist tracks are credited to their first artist
+                self._artist = df["artists"].astype(str).str.split(";").str[0].to_numpy(dtype=object)
+                self._preprocessor = preprocessor
+                self._version = preprocessor.version
+            return preprocessor
+
+    def join(self, track_ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Catalog columns for each track id. Tracks missing from the catalog get
+        row -1, duration 0, genre/artist None and mood -1.
+        """
+        preprocessor = self._load()
+        rows = preprocessor.find_track_indices([str(track_id) for track_id in track_ids])
+        known = rows >= 0
+        known_rows = rows[known]
+
+        duration_ms = np.zeros(len(rows))
+        duration_ms[known] = self._duration_ms[known_rows]
+        genre = np.full(len(rows), None, dtype=object)
+        genre[known] = self._genre[known_rows]
+        artist = np.full(len(rows), None, dtype=object)
+        artist[known] = self._artist[known_rows]
+        # Each catalog track is classified once and cached by the classifier
+        mood, _ = get_mood_classifier().classify_rows(rows)
+        return {"row": rows, "duration_ms": duration_ms, "genre": genre, "artist": artist, "mood": mood}
+
+
+class AnalyticsRollups:
+    """Feeds the per-user time series from the write paths and reconciles it with storage"""
+
+    def __init__(
+        self,
+        event_store: ListeningEventStore = listening_event_store,
+        store: ColumnarEventStore = columnar_event_store,
+        catalog: Optional[CatalogJoin] = None,
+        sketches: TrendingSketches = trending_sketches,
+        max_age_seconds: float = ANALYTICS_ROLLUP_MAX_AGE_SECONDS,
+        overlap_seconds: float = ANALYTICS_RECONCILE_OVERLAP_SECONDS,
+        rebuild_max_age_seconds: float = ANALYTICS_REBUILD_MAX_AGE_SECONDS,
+        clock=time.time
+    ):
+        self.event_store = event_store
+        self.store = store
+        self.catalog = catalog or CatalogJoin()
+        self.sketches = sketches
+        self.max_age_seconds = max_age_seconds
+        self.overlap_seconds = overlap_seconds
+        self.rebuild_max_age_seconds = rebuild_max_age_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Writes recorded while a user's history is being backfilled
+        self._building: Dict[str, List[Tuple[str, List[dict]]]] = {}
+        self._build_locks: Dict[str, asyncio.Lock] = {}
+        self._rebuilds: Dict[str, asyncio.Task] = {}
+
+    def _plays(self, kind: str, items: List[dict]) -> Dict[str, np.ndarray]:
+        """
+        Sessions or listening events joined to the catalog. Spotify's duration
+        and artist fill in for event tracks the catalog doesn't have.
+        """
+        if kind == "sessions":
+            items = [s for s in items if s.get("mood") in MOOD_INDEX]
+            now = self._clock()
+            created = [s.get("createdAt") for s in items]
+            timestamps = [c if isinstance(c, (int, float)) else now for c in created]
+            moods = [MOOD_INDEX[s["mood"]] for s in items]
+            intensity = [s.get("intensity") or 0 for s in items]
+            track_ids = [s.get("trackId") or "" for s in items]
+            durations = None
+            artists = [s.get("artistName") for s in items]
+        else:
+            tracks = [event["item"].get("track") or {} for event in items]
+            timestamps = [event["played_at_ms"] / 1000 for event in items]
+            moods = [-1] * len(items)
+            intensity = [0] * len(items)
+            track_ids = [track.get("id") or "" for track in tracks]
+            durations = [track.get("duration_ms") or 0 for track in tracks]
+            artists = [(track.get("artists") or [{}])[0].get("name") for track in tracks]
+
+        joined = self.catalog.join(track_ids)
+        duration_ms = joined["duration_ms"]
+        if durations is not None:
+            duration_ms = np.where(joined["row"] >= 0, duration_ms, np.asarray(durations, dtype=np.float64))
+        return {
+            "ts": np.asarray(timestamps, dtype=np.float64),
+            "mood": np.asarray(moods, dtype=np.int64),
+            "predicted": joined["mood"],
+            "intensity": np.asarray(intensity, dtype=np.int64),
+            "duration_ms": duration_ms,
+            "track_id": track_ids,
+            "artist": [a or b for a, b in zip(joined["artist"].tolist(), artists)],
+            "genre": joined["genre"].tolist(),
+        }
+
+    def _rows(self, series: UserTimeSeries, plays: Dict[str, np.ndarray]) -> np.ndarray:
+        """Time series records for joined plays"""
+        rows = np.zeros(len(plays["ts"]), dtype=ROW_DTYPE)
+        rows["ts"] = plays["ts"]
+        rows["day"] = np.floor_divide(rows["ts"], SECONDS_PER_DAY)
+        rows["mood"] = plays["mood"]
+        rows["predicted"] = plays["predicted"]
+        rows["intensity"] = plays["intensity"]
+        rows["duration_ms"] = plays["duration_ms"]
+        rows["artist"] = series.encode(plays["artist"])
+        rows["genre"] = series.encode(plays["genre"])
+        return rows
+
+    def _unapplied(self, applied: dict, kind: str, items: List[dict]) -> List[dict]:
+        """The items not yet in the series, noting them in applied"""
+        if kind == "sessions":
+            ledger = applied.setdefault("sessions", {})
+            items = [s for s in items if s.get("id") is None or s["id"] not in ledger]
+            now = self._clock()
+            for session in items:
+                if session.get("id") is not None:
+                    created = session.get("createdAt")
+                    ledger[session["id"]] = created if isinstance(created, (int, float)) else now
+            # A reconcile never reads further back than this again
+            cutoff = applied.get("reconciled_at", now) - self.overlap_seconds
+            applied["sessions"] = {sid: created for sid, created in ledger.items() if created >= cutoff}
+        else:
+            watermark = applied.get("events_ms", -1)
+            items = [e for e in items if e["played_at_ms"] > watermark]
+            if items:
+                applied["events_ms"] = max(watermark, max(e["played_at_ms"] for e in items))
+        return items
+
+    def _append(self, firebase_user_id: str, kind: str, items: List[dict], plays: Optional[dict] = None):
+        if not items:
+            return
+        with self.store.lock(firebase_user_id):
+            applied = self.store.applied(firebase_user_id)
+            new_items = self._unapplied(applied, kind, items)
+            if new_items:
+                if len(new_items) != len(items):
+                    plays = None
+                series = self.store.user(firebase_user_id)
+                series.append(self._rows(series, plays if plays is not None else self._plays(kind, new_items)))
+            self.store.set_applied(firebase_user_id, applied)
+
+    def _trend(self, firebase_user_id: str, plays: Dict[str, np.ndarray]):
+        """Count plays in the global trending sketches, under the tagged mood or else the model's"""
+        moods = np.where(plays["mood"] >= 0, plays["mood"], plays["predicted"]).tolist()
+        self.sketches.add(
+            firebase_user_id,
+            plays["ts"].tolist(),
+            [MOODS[m] if m >= 0 else ALL_MOODS for m in moods],
+            plays["track_id"],
+            plays["artist"],
+            plays["genre"],
+        )
+
+    def _record(self, firebase_user_id: str, kind: str, items: List[dict]):
+        if not items:
+            return
+        try:
+            plays = self._plays(kind, items)
+            self._trend(firebase_user_id, plays)
+        except Exception as e:
+            print(f"✗ Failed to update analytics for {firebase_user_id}: {e}")
+            return
+
+        with self._lock:
+            building = self._building.get(firebase_user_id)
+            if building is not None:
+                building.append((kind, items))
+                return
+        if not self.store.is_backfilled(firebase_user_id):
+            return  # Picked up from storage, including this write, by the backfill on first read
+
+        try:
+            self._append(firebase_user_id, kind, items, plays)
+        except Exception as e:
+            print(f"✗ Failed to update analytics for {firebase_user_id}: {e}")
+
+    def record_sessions(self, firebase_user_id: str, sessions: List[dict]):
+        """Add newly saved mood sessions to the user's time series"""
+        self._record(firebase_user_id, "sessions", sessions)
+
+    def record_events(self, firebase_user_id: str, events: List[dict]):
+        """Add newly stored listening events to the user's time series"""
+        self._record(firebase_user_id, "events", events)
+
+    def _needs_build(self, firebase_user_id: str, applied: dict) -> bool:
+        # A series built before applied.json existed can't be reconciled without double counting
+        return not self.store.is_backfilled(firebase_user_id) or "reconciled_at" not in applied
+
+    def _is_fresh(self, firebase_user_id: str) -> bool:
+        applied = self.store.applied(firebase_user_id)
+        if self._needs_build(firebase_user_id, applied):
+            return False
+        return self._clock() - applied["reconciled_at"] < self.max_age_seconds
+
+    @asynccontextmanager
+    async def _build_lock(self, firebase_user_id: str):
+        """One build per user at a time; the lock is forgotten once its holder is done, so only users mid-build keep one"""
+        lock = self._build_locks.setdefault(firebase_user_id, asyncio.Lock())
+        try:
+            async with lock:
+                yield
+        finally:
+            if self._build_locks.get(firebase_user_id) is lock:
+                del self._build_locks[firebase_user_id]
+
+    async def get(self, firebase_user_id: str) -> UserTimeSeries:
+        """
+        The user's time series, backfilled from stored sessions and events on first use
+        and reconciled with what storage has gained once older than max_age_seconds
+        """
+        if not self._is_fresh(firebase_user_id):
+            async with self._build_lock(firebase_user_id):
+                if not self._is_fresh(firebase_user_id):
+                    applied = self.store.applied(firebase_user_id)
+                    if self._needs_build(firebase_user_id, applied):
+                        await self._build(firebase_user_id)
+                    else:
+                        await self._reconcile(firebase_user_id, applied)
+
+        backfilled_at = self.store.backfilled_at(firebase_user_id)
+        if backfilled_at is not None and self._clock() - backfilled_at >= self.rebuild_max_age_seconds:
+            self._schedule_rebuild(firebase_user_id)
+        return self.store.user(firebase_user_id)
+
+    async def _build(self, firebase_user_id: str):
+        """Rebuild the series from everything in storage"""
+        with self._lock:
+            self._building[firebase_user_id] = []
+        try:
+            started_at = self._clock()
+            sessions = await async_storage.get_user_sessions(firebase_user_id, fields=SESSION_FIELDS)
+            events = await async_storage.run_sync(self.event_store.since, firebase_user_id, -1)
+            await async_storage.run_sync(self._backfill, firebase_user_id, sessions, events, started_at)
+        finally:
+            with self._lock:
+                self._building.pop(firebase_user_id, None)
+
+    async def _reconcile(self, firebase_user_id: str, applied: dict):
+        """Append what storage has gained since the last reconcile, e.g. writes handled on another node"""
+        started_at = self._clock()
+        sessions = await async_storage.get_user_sessions(
+            firebase_user_id, fields=SESSION_FIELDS, since=applied["reconciled_at"] - self.overlap_seconds
+        )
+        events = await async_storage.run_sync(self.event_store.since, firebase_user_id, applied.get("events_ms", -1))
+        await async_storage.run_sync(self._apply_reconcile, firebase_user_id, sessions, events, started_at)
+
+    def _apply_reconcile(self, firebase_user_id: str, sessions: List[dict], events: List[dict], started_at: float):
+        with self.store.lock(firebase_user_id):
+            self._append(firebase_user_id, "sessions", sessions)
+            self._append(firebase_user_id, "events", events)
+            applied = self.store.applied(firebase_user_id)
+            applied["reconciled_at"] = max(applied.get("reconciled_at", started_at), started_at)
+            self.store.set_applied(firebase_user_id, applied)
+
+    def _schedule_rebuild(self, firebase_user_id: str):
+        """Rebuild the series in the background (dropping deleted sessions); reads keep using the current one"""
+        if firebase_user_id in self._rebuilds:
+            return
+
+        async def rebuild():
+            try:
+                async with self._build_lock(firebase_user_id):
+                    await self._build(firebase_user_id)
+            except Exception as e:
+                print(f"✗ Failed to rebuild analytics for {firebase_user_id}: {e}")
+
+        task = asyncio.get_running_loop().create_task(rebuild())
+        self._rebuilds[firebase_user_id] = task
+        task.add_done_callback(lambda _: self._rebuilds.pop(firebase_user_id, None))
+
+    def _backfill(self, firebase_user_id: str, sessions: List[dict], events: List[dict], started_at: float) -> UserTimeSeries:
+        # Other workers' reads and writes wait for the whole rebuild
+        with self.store.lock(firebase_user_id):
+            return self._rebuild(firebase_user_id, sessions, events, started_at)
+
+    def _rebuild(self, firebase_user_id: str, sessions: List[dict], events: List[dict], started_at: float) -> UserTimeSeries:
+        # Anything on disk without a manifest is left from an interrupted backfill
+        self.store.clear(firebase_user_id)
+        # Writes after started_at that storage didn't return are picked up by the next reconcile
+        self.store.set_applied(firebase_user_id, {"reconciled_at": started_at})
+        self._append(firebase_user_id, "sessions", sessions)
+        self._append(firebase_user_id, "events", events)
+
+        # Apply writes recorded during the backfill; ones storage already returned are skipped
+        while True:
+            with self._lock:
+                recorded = self._building[firebase_user_id]
+                if not recorded:
+                    del self._building[firebase_user_id]
+                    self.store.mark_backfilled(firebase_user_id, started_at)
+                    return self.store.user(firebase_user_id)
+                self._building[firebase_user_id] = []
+            for kind, items in recorded:
+                self._append(firebase_user_id, kind, items)
+
+
+# Global instance
+analytics_rollups = AnalyticsRollups()
@@ -0,0 +1,391 @@
+"""
+Streaming sketches for global (all users) trending artists, genres and tracks
+per mood, updated on the session and listening-event write paths.
+
+Every sketch has a fixed size, merges with another sketch of the same shape,
+and serializes to a flat npz, so daily buckets from several workers can be
+combined. Error bounds, with N the number of plays in the merged window:
+
+- SpaceSaving(capacity=k): every item played more than N/k times is in the
+  summary, and each reported count overestimates the true count by at most
+  its `error` field, itself at most N/k. An add costs O(1), or amortized
+  O(log k) when it evicts.
+- CountMinSketch(width=w, depth=d): an estimate never undercounts and
+  overcounts by more than (e/w)*N with probability at most e^-d
+  (w=2048, d=5: within 0.13% of N with 99.3% confidence).
+- HyperLogLog(precision=p): distinct-count estimate with relative standard
+  error 1.04/sqrt(2^p) (p=12: about 1.6%).
+
+Trending plays are reported as min(Space-Saving count, Count-Min estimate),
+both of which are upper bounds, with `plays - error` as the guaranteed lower bound.
+"""
+import io
+import os
+import time
+import math
+import heapq
+import shutil
+import hashlib
+import pathlib
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..storage.backend import MOODS, SECONDS_PER_DAY
+
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+# Optional directory shared by workers on one node; each worker's buckets are
+# snapshotted there and merged into every trending query
+SKETCH_SNAPSHOT_DIR = os.getenv("SKETCH_SNAPSHOT_DIR")
+SKETCH_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SKETCH_SNAPSHOT_INTERVAL_SECONDS", "10"))
+
+TRENDING_CAPACITY = 200
+CMS_WIDTH = 2048
+CMS_DEPTH = 5
+HLL_PRECISION = 12
+# Daily buckets kept; the longest trending window is this many days including today
+TRENDING_WINDOW_DAYS = 7
+
+DIMENSIONS = ("artists", "genres", "tracks")
+# Buckets per mood plus one across all moods
+ALL_MOODS = "All"
+SCOPES = MOODS + [ALL_MOODS]
+
+_MASK64 = (1 << 64) - 1
+
+
+def stable_hash(key: str) -> Tuple[int, int]:
+    """Two 64-bit hashes of key, identical in every process (unlike hash())"""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class CountMinSketch:
+    """Frequency estimates for arbitrary keys in width x depth counters"""
+
+    def __init__(self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _cells(self, key: str) -> np.ndarray:
+        h1, h2 = stable_hash(key)
+        return np.array([((h1 + i * h2) & _MASK64) % self.width for i in range(self.depth)], dtype=np.int64)
+
+    def add(self, key: str, count: int = 1):
+        self.table[np.arange(self.depth), self._cells(key)] += count
+        self.total += count
+
+    def estimate(self, key: str) -> int:
+        return int(self.table[np.arange(self.depth), self._cells(key)].min())
+
+    def merge(self, other: "CountMinSketch"):
+        if self.table.shape != other.table.shape:
+            raise ValueError("Count-Min sketches must have the same width and depth to merge")
+        self.table += other.table
+        self.total += other.total
+
+    def error_bound(self) -> float:
+        """Overcount that is exceeded with probability at most e^-depth"""
+        return math.e / self.width * self.total
+
+
+class SpaceSaving:
+    """Top-k heavy hitters with per-item overestimation bounds"""
+
+    def __init__(self, capacity: int = TRENDING_CAPACITY):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.total = 0
+        # Min-heap with one (count, item) entry per counter, built on the first eviction.
+        # Increments don't touch it, so an entry's count can be stale (never too high);
+        # stale entries are refreshed as they surface, keeping evictions amortized O(log k)
+        self._heap: Optional[List[Tuple[int, str]]] = None
+
+    def add(self, item: str, count: int = 1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            # Replace the smallest counter; its count becomes the newcomer's error
+            victim = self._pop_min()
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[item] = floor + count
+            self.errors[item] = floor
+            heapq.heappush(self._heap, (floor + count, item))
+
+    def _pop_min(self) -> str:
+        """Remove and return the item with the smallest counter from the heap"""
+        if self._heap is None:
+            self._heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self._heap)
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts[item] == count:
+                return item
+            heapq.heappush(self._heap, (self.counts[item], item))
+
+    def _floor(self) -> int:
+        """Largest count an item missing from the summary can have"""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def merge(self, other: "SpaceSaving"):
+        """Mergeable-summaries combine: an item missing on one side is charged that side's floor"""
+        floor, other_floor = self._floor(), other._floor()
+        counts, errors = {}, {}
+        for item in self.counts.keys() | other.counts.keys():
+            counts[item] = self.counts.get(item, floor) + other.counts.get(item, other_floor)
+            errors[item] = self.errors.get(item, floor) + other.errors.get(item, other_floor)
+        kept = sorted(counts, key=counts.get, reverse=True)[:self.capacity]
+        self.counts = {item: counts[item] for item in kept}
+        self.errors = {item: errors[item] for item in kept}
+        self.total += other.total
+        self._heap = None
+
+    def top(self, k: int) -> List[Tuple[str, int, int]]:
+        """(item, count, error) for the k largest counters"""
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(item, count, self.errors[item]) for item, count in items]
+
+    def error_bound(self) -> float:
+        return self.total / self.capacity
+
+
+class HyperLogLog:
+    """Distinct-count estimator over 2^precision one-byte registers"""
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, key: str):
+        h, _ = stable_hash(key)
+        bucket = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[bucket]:
+            self.registers[bucket] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        if self.precision != other.precision:
+            raise ValueError("HyperLogLogs must have the same precision to merge")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class DayBucket:
+    """One day of sketches: per scope (mood or All) and dimension, plus distinct listeners/tracks"""
+
+    def __init__(self):
+        self.heavy = {(scope, dim): SpaceSaving() for scope in SCOPES for dim in DIMENSIONS}
+        self.frequency = {dim: CountMinSketch() for dim in DIMENSIONS}
+        self.listeners = {scope: HyperLogLog() for scope in SCOPES}
+        self.distinct_tracks = {scope: HyperLogLog() for scope in SCOPES}
+        self.plays = {scope: 0 for scope in SCOPES}
+
+    def add(self, firebase_user_id: str, scope: str, track_id: str, artist: Optional[str], genre: Optional[str]):
+        for s in (scope, ALL_MOODS) if scope != ALL_MOODS else (ALL_MOODS,):
+            self.plays[s] += 1
+            self.listeners[s].add(firebase_user_id)
+            for dim, value in (("artists", artist), ("genres", genre), ("tracks", track_id)):
+                if value:
+                    self.heavy[(s, dim)].add(value)
+                    self.frequency[dim].add(f"{s}\x1f{value}")
+            if track_id:
+                self.distinct_tracks[s].add(track_id)
+
+    def merge(self, other: "DayBucket"):
+        for key, summary in self.heavy.items():
+            summary.merge(other.heavy[key])
+        for dim, cms in self.frequency.items():
+            cms.merge(other.frequency[dim])
+        for scope in SCOPES:
+            self.listeners[scope].merge(other.listeners[scope])
+            self.distinct_tracks[scope].merge(other.distinct_tracks[scope])
+            self.plays[scope] += other.plays[scope]
+
+    def to_bytes(self) -> bytes:
+        """Flat npz of every sketch in the bucket"""
+        arrays = {}
+        for (scope, dim), summary in self.heavy.items():
+            items = list(summary.counts)
+            arrays[f"ss/{scope}/{dim}/items"] = np.array(items, dtype=str)
+            arrays[f"ss/{scope}/{dim}/counts"] = np.array([summary.counts[i] for i in items], dtype=np.int64)
+            arrays[f"ss/{scope}/{dim}/errors"] = np.array([summary.errors[i] for i in items], dtype=np.int64)
+            arrays[f"ss/{scope}/{dim}/total"] = np.int64(summary.total)
+        for dim, cms in self.frequency.items():
+            arrays[f"cms/{dim}/table"] = cms.table
+            arrays[f"cms/{dim}/total"] = np.int64(cms.total)
+        for scope in SCOPES:
+            arrays[f"hll/{scope}/listeners"] = self.listeners[scope].registers
+            arrays[f"hll/{scope}/tracks"] = self.distinct_tracks[scope].registers
+            arrays[f"plays/{scope}"] = np.int64(self.plays[scope])
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DayBucket":
+        bucket = cls()
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            for (scope, dim), summary in bucket.heavy.items():
+                items = arrays[f"ss/{scope}/{dim}/items"].tolist()
+                summary.counts = dict(zip(items, arrays[f"ss/{scope}/{dim}/counts"].tolist()))
+                summary.errors = dict(zip(items, arrays[f"ss/{scope}/{dim}/errors"].tolist()))
+                summary.total = int(arrays[f"ss/{scope}/{dim}/total"])
+                summary._heap = None
+            for dim, cms in bucket.frequency.items():
+                cms.table = arrays[f"cms/{dim}/table"].copy()
+                cms.total = int(arrays[f"cms/{dim}/total"])
+            for scope in SCOPES:
+                bucket.listeners[scope].registers = arrays[f"hll/{scope}/listeners"].copy()
+                bucket.distinct_tracks[scope].registers = arrays[f"hll/{scope}/tracks"].copy()
+                bucket.plays[scope] = int(arrays[f"plays/{scope}"])
+        return bucket
+
+
+class TrendingSketches:
+    """
+    Sliding window of daily buckets. A trending query merges at most
+    TRENDING_WINDOW_DAYS fixed-size buckets (plus other workers' snapshots),
+    so its cost doesn't grow with the number of plays or users.
+    """
+
+    def __init__(
+        self,
+        snapshot_dir: Optional[str] = SKETCH_SNAPSHOT_DIR,
+        worker_id: Optional[str] = None,
+        clock=time.time
+    ):
+        self.snapshot_dir = pathlib.Path(snapshot_dir) if snapshot_dir else None
+        self.worker_id = worker_id or f"{os.uname().nodename if hasattr(os, 'uname') else 'node'}-{os.getpid()}"
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._days: Dict[int, DayBucket] = {}
+        self._dirty: set = set()
+        self._last_snapshot = 0.0
+        # day the snapshot directory was last cleaned up for
+        self._expired_day: Optional[int] = None
+
+    def _expire(self, today: int):
+        for day in [d for d in self._days if d <= today - TRENDING_WINDOW_DAYS]:
+            del self._days[day]
+            self._dirty.discard(day)
+        if self.snapshot_dir is not None and self._expired_day != today:
+            # once a day, drop snapshot days that left the window, with the files of
+            # workers that have since exited; other workers may be removing them too
+            self._expired_day = today
+            if self.snapshot_dir.exists():
+                for directory in self.snapshot_dir.iterdir():
+                    if directory.is_dir() and directory.name.isdigit() and int(directory.name) <= today - TRENDING_WINDOW_DAYS:
+                        shutil.rmtree(directory, ignore_errors=True)
+
+    def add(
+        self,
+        firebase_user_id: str,
+        timestamps: Sequence[float],
+        scopes: Sequence[str],
+        track_ids: Sequence[str],
+        artists: Sequence[Optional[str]],
+        genres: Sequence[Optional[str]]
+    ):
+        """Count plays; anything older than the window is ignored"""
+        today = int(self._clock() // SECONDS_PER_DAY)
+        with self._lock:
+            self._expire(today)
+            for ts, scope, track_id, artist, genre in zip(timestamps, scopes, track_ids, artists, genres):
+                day = int(ts // SECONDS_PER_DAY)
+                if not today - TRENDING_WINDOW_DAYS < day <= today:
+                    continue
+                bucket = self._days.get(day)
+                if bucket is None:
+                    bucket = self._days[day] = DayBucket()
+                bucket.add(firebase_user_id, scope, track_id, artist, genre)
+                self._dirty.add(day)
+        if self.snapshot_dir is not None and self._clock() - self._last_snapshot >= SKETCH_SNAPSHOT_INTERVAL_SECONDS:
+            self.snapshot()
+
+    def snapshot(self):
+        """Write this worker's changed buckets to the shared snapshot directory"""
+        if self.snapshot_dir is None:
+            return
+        with self._lock:
+            dirty = {day: self._days[day].to_bytes() for day in self._dirty if day in self._days}
+            self._dirty.clear()
+            self._last_snapshot = self._clock()
+        for day, data in dirty.items():
+            directory = self.snapshot_dir / str(day)
+            directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = directory / f"{self.worker_id}.npz.tmp"
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, directory / f"{self.worker_id}.npz")
+
+    def _other_workers(self, day: int) -> Iterable[DayBucket]:
+        if self.snapshot_dir is None:
+            return
+        directory = self.snapshot_dir / str(day)
+        if not directory.exists():
+            return
+        for path in directory.glob("*.npz"):
+            if path.stem != self.worker_id:
+                yield DayBucket.from_bytes(path.read_bytes())
+
+    def window(self, days: int) -> DayBucket:
+        """All buckets for the last `days` days (including today), merged"""
+        today = int(self._clock() // SECONDS_PER_DAY)
+        merged = DayBucket()
+        with self._lock:
+            self._expire(today)
+            local = [self._days[day] for day in range(today - days + 1, today + 1) if day in self._days]
+            for bucket in local:
+                merged.merge(bucket)
+        for day in range(today - days + 1, today + 1):
+            for bucket in self._other_workers(day):
+                merged.merge(bucket)
+        return merged
+
+    def trending(self, scope: str, dimension: str, days: int = TRENDING_WINDOW_DAYS, limit: int = 10) -> dict:
+        """Heavy hitters for one mood (or All) and dimension, with their error bounds"""
+        if self.snapshot_dir is not None:
+            self.snapshot()
+        window = self.window(days)
+        summary = window.heavy[(scope, dimension)]
+        cms = window.frequency[dimension]
+        items = []
+        for name, count, error in summary.top(limit):
+            plays = min(count, cms.estimate(f"{scope}\x1f{name}"))
+            items.append({"name": name, "plays": plays, "min_plays": max(count - error, 0)})
+        return {
+            "items": items,
+            "total_plays": window.plays[scope],
+            "distinct_listeners": window.listeners[scope].estimate(),
+            "distinct_tracks": window.distinct_tracks[scope].estimate(),
+            "error_bounds": {
+                "plays_max_overcount": round(min(summary.error_bound(), cms.error_bound()), 1),
+                "count_min_confidence": round(1 - math.exp(-cms.depth), 4),
+                "distinct_relative_std_error": round(window.listeners[scope].relative_error(), 4),
+            },
+        }
+
+
+# Global instance
+trending_sketches = TrendingSketches()
@@ -0,0 +1,238 @@
+"""
+Tests for the per-user analytics rollups behind the analytics endpoints
+"""
+import sys
+import asyncio
+import pathlib
+
+import numpy as np
+import pytest
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.backend import init_storage, close_storage, MOODS
+from src.storage.sqlite_storage import SQLiteStorageBackend
+from src.storage.listening_events import ListeningEventStore
+from src.analytics import rollups as rollups_module
+from src.analytics.rollups import AnalyticsRollups
+from src.analytics.timeseries import ColumnarEventStore
+from src.analytics.analytics import compute_overview, compute_mood_history, compute_accuracy
+
+DAY = 86400
+NOW = 20000 * DAY + 3600  # an hour into a UTC day
+
+# track id -> (duration_ms, genre, artist, nearest mood)
+CATALOG = {
+    "t-happy": (180000, "pop", "Artist A", "Happy"),
+    "t-calm": (240000, "ambient", "Artist B", "Calm"),
+    "t-sad": (200000, "indie", "Artist A", "Happy"),  # the model disagrees with a Sad tag
+}
+
+
+class FakeCatalog:
+    def join(self, track_ids):
+        rows = np.array([i if t in CATALOG else -1 for i, t in enumerate(track_ids)], dtype=np.int64)
+        entries = [CATALOG.get(t) for t in track_ids]
+        return {
+            "row": rows,
+            "duration_ms": np.array([e[0] if e else 0 for e in entries], dtype=np.float64),
+            "genre": np.array([e[1] if e else None for e in entries], dtype=object),
+            "artist": np.array([e[2] if e else None for e in entries], dtype=object),
+            "mood": np.array([MOODS.index(e[3]) if e else -1 for e in entries], dtype=np.int64),
+        }
+
+
+def event(track_id, played_at, duration_ms=100000, artist="Spotify Artist"):
+    return {
+        "played_at_ms": int(played_at * 1000),
+        "item": {"track": {"id": track_id, "duration_ms": duration_ms, "artists": [{"name": artist}]}},
+    }
+
+
+@pytest.fixture
+def storage(tmp_path):
+    backend = init_storage(SQLiteStorageBackend(str(tmp_path / "test.db")))
+    yield backend
+    close_storage()
+
+
+@pytest.fixture
+def rollups(tmp_path, storage):
+    return AnalyticsRollups(
+        event_store=ListeningEventStore(tmp_path / "events"),
+        store=ColumnarEventStore(tmp_path / "analytics"),
+        catalog=FakeCatalog(),
+        clock=lambda: NOW,
+    )
+
+
+def save(storage, track_id, mood, created_at, intensity=50):
+    session = storage.save_user_session("u1", track_id, mood, intensity=intensity)
+    with storage.pool.connection() as conn, conn:
+        conn.execute("UPDATE user_sessions SET createdAt = ? WHERE id = ?", (created_at, session["id"]))
+    session["createdAt"] = created_at
+    return session
+
+
+def test_overview_from_sessions_and_events(storage, rollups):
+    save(storage, "t-happy", "Happy", NOW - 60)
+    save(storage, "t-happy", "Happy", NOW - DAY)
+    save(storage, "t-calm", "Calm", NOW - 2 * DAY)
+    save(storage, "t-happy", "Happy", NOW - 8 * DAY)  # previous week
+    rollups.event_store._events["u1"] = [event("not-in-catalog", NOW - 30)]
+    rollups.event_store._high_water["u1"] = int((NOW - 30) * 1000)
+
+    series = asyncio.run(rollups.get("u1"))
+    overview = compute_overview(series, 7, NOW)
+
+    assert [s["mood"] for s in overview["mood_stats"][:2]] == ["Happy", "Calm"]
+    assert overview["mood_stats"][0]["percentage"] == pytest.approx(66.7)
+    assert overview["total_plays"] == 4
+    # 2 x 180s + 240s of tagged tracks + 100s played outside the catalog
+    assert overview["total_listening_hours"] == round(700000 / 3600000, 1)
+    assert len(overview["listening_data"]) == 7
+    assert overview["top_artists"][0] == {"name": "Artist A", "plays": 2, "change": "+100%"}
+    assert {g["name"] for g in overview["top_genres"]} == {"pop", "ambient"}
+    # 700s this week against 180s the week before
+    assert overview["week_change"] == "+289%"
+
+
+def test_incremental_writes_match_a_rebuild(storage, rollups):
+    asyncio.run(rollups.get("u1"))
+    sessions = [
+        save(storage, "t-happy", "Happy", NOW - 10),
+        save(storage, "t-sad", "Sad", NOW - 3 * DAY, intensity=90),
+        save(storage, "unknown", "Angry", NOW - 40 * DAY),
+    ]
+    rollups.record_sessions("u1", sessions)
+    stored = rollups.event_store.append("u1", [
+        {"played_at": "2024-10-04T00:30:00Z", "track": {"id": "t-calm", "duration_ms": 1}},
+    ])
+    rollups.record_events("u1", stored)
+    incremental = asyncio.run(rollups.get("u1"))
+    daily = incremental.daily(19000, 20001)
+    overview = compute_overview(incremental, 365, NOW)
+
+    rollups.store.clear("u1")
+    rebuilt = asyncio.run(rollups.get("u1"))
+    assert rebuilt is not incremental
+    assert np.array_equal(daily, rebuilt.daily(19000, 20001))
+    assert overview == compute_overview(rebuilt, 365, NOW)
+
+    accuracy = compute_accuracy(rebuilt, NOW)
+    assert accuracy["mood_accuracy"]["Happy"] == 100.0
+    assert accuracy["mood_accuracy"]["Sad"] == 0.0
+    assert accuracy["mood_accuracy"]["Angry"] is None
+    assert accuracy["sessions_evaluated"] == 2 and accuracy["sessions_unmatched"] == 1
+
+
+def test_writes_during_a_build_are_counted_once(storage, rollups):
+    first = save(storage, "t-happy", "Happy", NOW - 10)
+    backfill = rollups._backfill
+
+    def backfill_with_concurrent_writes(uid, sessions, events, started_at):
+        # one write storage already returned, one it didn't
+        late = save(storage, "t-calm", "Calm", NOW - 5)
+        rollups.record_sessions(uid, [first])
+        rollups.record_sessions(uid, [late])
+        return backfill(uid, sessions, events, started_at)
+
+    rollups._backfill = backfill_with_concurrent_writes
+    series = asyncio.run(rollups.get("u1"))
+    history = compute_mood_history(series, 19971, 20001)
+
+    assert len(history) == 30 and history[-1]["date"] == "2024-10-04"
+    assert history[-1]["mood_distribution"]["Happy"] == 50.0
+    assert history[-1]["mood_distribution"]["Calm"] == 50.0
+    assert history[0]["dominant_mood"] is None
+
+    # recorded after the backfill: appended straight to the time series
+    rollups.record_sessions("u1", [save(storage, "t-happy", "Happy", NOW - 1)])
+    assert compute_mood_history(series, 20000, 20001)[0]["dominant_mood"] == "Happy"
+
+
+def test_series_is_reconciled_with_storage_once_stale(storage, tmp_path):
+    clock = [NOW]
+    rollups = AnalyticsRollups(
+        event_store=ListeningEventStore(tmp_path / "events"),
+        store=ColumnarEventStore(tmp_path / "analytics"),
+        catalog=FakeCatalog(),
+        max_age_seconds=300,
+        clock=lambda: clock[0],
+    )
+    save(storage, "t-happy", "Happy", NOW - 60)
+    assert compute_overview(asyncio.run(rollups.get("u1")), 7, NOW)["total_plays"] == 1
+
+    # written by another node: storage has it, this node's series doesn't
+    save(storage, "t-calm", "Calm", NOW - 30)
+    assert compute_overview(asyncio.run(rollups.get("u1")), 7, NOW)["total_plays"] == 1
+    clock[0] = NOW + 301
+    assert compute_overview(asyncio.run(rollups.get("u1")), 7, NOW)["total_plays"] == 2
+    assert rollups._build_locks == {}
+
+
+def test_reconcile_reads_only_recent_sessions(storage, tmp_path, monkeypatch):
+    clock = [NOW]
+    rollups = AnalyticsRollups(
+        event_store=ListeningEventStore(tmp_path / "events"),
+        store=ColumnarEventStore(tmp_path / "analytics"),
+        catalog=FakeCatalog(),
+        max_age_seconds=300,
+        overlap_seconds=600,
+        clock=lambda: clock[0],
+    )
+    save(storage, "t-happy", "Happy", NOW - 3 * DAY)
+    save(storage, "t-happy", "Happy", NOW - 60)
+    asyncio.run(rollups.get("u1"))
+
+    reads = []
+    get_user_sessions = rollups_module.async_storage.get_user_sessions
+
+    async def spy(firebase_user_id, **kwargs):
+        reads.append(kwargs.get("since"))
+        return await get_user_sessions(firebase_user_id, **kwargs)
+
+    monkeypatch.setattr(rollups_module.async_storage, "get_user_sessions", spy)
+    # one write recorded on this node, one handled by another node, both inside the overlap
+    rollups.record_sessions("u1", [save(storage, "t-calm", "Calm", NOW + 100)])
+    save(storage, "t-sad", "Sad", NOW + 200)
+    rollups.event_store.append("u1", [{"played_at": "2024-10-04T00:50:00Z", "track": {"id": "t-calm"}}])
+
+    clock[0] = NOW + 301
+    series = asyncio.run(rollups.get("u1"))
+    assert reads == [NOW - 600]
+    assert compute_overview(series, 7, NOW + 301)["total_plays"] == 5
+
+    # nothing new: the next reconcile appends nothing twice
+    clock[0] = NOW + 700
+    series = asyncio.run(rollups.get("u1"))
+    assert reads == [NOW - 600, NOW - 299]
+    assert compute_overview(series, 7, NOW + 700)["total_plays"] == 5
+
+
+def test_deleted_sessions_drop_out_after_a_background_rebuild(storage, tmp_path):
+    clock = [NOW]
+    rollups = AnalyticsRollups(
+        event_store=ListeningEventStore(tmp_path / "events"),
+        store=ColumnarEventStore(tmp_path / "analytics"),
+        catalog=FakeCatalog(),
+        rebuild_max_age_seconds=DAY,
+        clock=lambda: clock[0],
+    )
+    save(storage, "t-happy", "Happy", NOW - 60)
+    deleted = save(storage, "t-calm", "Calm", NOW - 30)
+
+    async def run():
+        await rollups.get("u1")
+        storage.delete_user_session(deleted["id"])
+        clock[0] = NOW + DAY
+        # served from the current series while the rebuild runs
+        stale = compute_overview(await rollups.get("u1"), 7, NOW)["total_plays"]
+        await asyncio.gather(*rollups._rebuilds.values())
+        return stale
+
+    assert asyncio.run(run()) == 2
+    assert compute_overview(rollups.store.user("u1"), 7, NOW)["total_plays"] == 1
+    assert rollups.store.backfilled_at("u1") == NOW + DAY
@@ -0,0 +1,133 @@
+"""
+Tests for the streaming trending sketches and their error bounds
+"""
+import sys
+import pathlib
+from collections import Counter
+
+import numpy as np
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.analytics.sketches import SpaceSaving, CountMinSketch, HyperLogLog, DayBucket, TrendingSketches
+
+DAY = 86400
+NOW = 20000 * DAY + 3600
+
+
+def zipf_stream(n, seed):
+    rng = np.random.default_rng(seed)
+    return [f"artist {i}" for i in rng.zipf(1.3, n) % 5000]
+
+
+def test_merged_heavy_hitters_stay_within_bounds():
+    halves = [zipf_stream(20000, seed) for seed in (1, 2)]
+    exact = Counter(halves[0] + halves[1])
+    n = sum(exact.values())
+
+    summaries, sketches = [], []
+    for stream in halves:
+        summary, cms = SpaceSaving(capacity=100), CountMinSketch()
+        for item in stream:
+            summary.add(item)
+            cms.add(item)
+        summaries.append(summary)
+        sketches.append(cms)
+    summary, cms = summaries[0], sketches[0]
+    summary.merge(summaries[1])
+    cms.merge(sketches[1])
+
+    # everything above N/k is reported, and counts bracket the truth
+    for item, count in exact.items():
+        if count > n / 100:
+            assert item in summary.counts
+    for item, count, error in summary.top(100):
+        assert count - error <= exact[item] <= count
+        assert error <= summary.error_bound()
+    for item, count in exact.most_common(50):
+        assert count <= cms.estimate(item) <= count + cms.error_bound()
+    assert [item for item, _, _ in summary.top(5)] == [item for item, _ in exact.most_common(5)]
+
+
+def test_hyperloglog_merge_estimates_distinct_count():
+    left, right = HyperLogLog(), HyperLogLog()
+    for i in range(30000):
+        left.add(f"user {i}")
+    for i in range(20000, 50000):
+        right.add(f"user {i}")
+    left.merge(right)
+    assert abs(left.estimate() - 50000) < 4 * left.relative_error() * 50000
+
+    small = HyperLogLog()
+    for i in range(100):
+        small.add(f"user {i % 40}")
+    assert abs(small.estimate() - 40) <= 2
+
+
+def test_window_expires_days_and_merges_worker_snapshots(tmp_path):
+    clock = [NOW]
+    workers = [TrendingSketches(snapshot_dir=tmp_path, worker_id=f"w{i}", clock=lambda: clock[0]) for i in range(2)]
+    workers[0].add("u1", [NOW - 6 * DAY, NOW - 30 * DAY], ["Happy", "Happy"], ["t1", "t1"], ["A", "A"], ["pop", "pop"])
+    workers[1].add("u2", [NOW, NOW], ["Happy", "Calm"], ["t1", "t2"], ["A", "B"], ["pop", None])
+    workers[0].snapshot()
+
+    trending = workers[1].trending("Happy", "artists")
+    assert trending["items"] == [{"name": "A", "plays": 2, "min_plays": 2}]
+    assert trending["distinct_listeners"] == 2
+    assert workers[1].trending("All", "genres")["total_plays"] == 3
+    assert workers[1].trending("Happy", "artists", days=1)["total_plays"] == 1
+
+    # a day later, the six-day-old play has left the week
+    clock[0] = NOW + DAY
+    assert workers[0].trending("Happy", "tracks")["items"] == [{"name": "t1", "plays": 1, "min_plays": 1}]
+
+
+def test_bucket_round_trips_through_bytes():
+    bucket = DayBucket()
+    for i, artist in enumerate(zipf_stream(500, seed=3)):
+        bucket.add(f"u{i % 7}", "Sad", f"t{i % 13}", artist, "indie")
+    restored = DayBucket.from_bytes(bucket.to_bytes())
+    key = ("Sad", "artists")
+    assert restored.heavy[key].top(10) == bucket.heavy[key].top(10)
+    assert np.array_equal(restored.frequency["tracks"].table, bucket.frequency["tracks"].table)
+    assert restored.listeners["All"].estimate() == 7
+    assert restored.plays == bucket.plays
+
+
+def test_space_saving_evicts_the_smallest_counter():
+    summary = SpaceSaving(capacity=50)
+    counts, errors = {}, {}
+    for item in zipf_stream(5000, seed=4):
+        # reference: a full scan for the smallest counter, ties broken by item
+        if item in counts:
+            counts[item] += 1
+        elif len(counts) < 50:
+            counts[item], errors[item] = 1, 0
+        else:
+            victim = min(counts, key=lambda i: (counts[i], i))
+            floor = counts.pop(victim)
+            del errors[victim]
+            counts[item], errors[item] = floor + 1, floor
+        summary.add(item)
+    assert summary.counts == counts and summary.errors == errors
+
+    # summaries rebuilt by a merge keep evicting correctly
+    summary.merge(SpaceSaving(capacity=50))
+    summary.add("newcomer")
+    assert summary.errors["newcomer"] == min(counts.values())
+
+
+def test_expired_snapshot_days_are_removed(tmp_path):
+    clock = [NOW]
+    worker = TrendingSketches(snapshot_dir=tmp_path, worker_id="w0", clock=lambda: clock[0])
+    worker.add("u1", [NOW - 6 * DAY, NOW], ["Happy", "Happy"], ["t1", "t2"], ["A", "B"], ["pop", "pop"])
+    worker.snapshot()
+    # files left behind by a worker that has exited
+    (tmp_path / str(NOW // DAY - 6) / "gone-123.npz").write_bytes(b"")
+    assert sorted(p.name for p in tmp_path.iterdir()) == [str(NOW // DAY - 6), str(NOW // DAY)]
+
+    clock[0] = NOW + DAY
+    worker.trending("Happy", "artists")
+    assert [p.name for p in tmp_path.iterdir()] == [str(NOW // DAY)]
@@ -0,0 +1,127 @@
+"""
+Tests for the columnar, month-partitioned analytics time series
+"""
+import sys
+import pathlib
+
+import numpy as np
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.analytics import timeseries
+from src.analytics.timeseries import ColumnarEventStore, ROW_DTYPE, SESSIONS, PLAYS, LISTEN_MS
+
+DAY = 86400
+FIRST_DAY = 19723  # 2024-01-01
+
+
+def random_rows(series, n, days, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = np.zeros(n, dtype=ROW_DTYPE)
+    rows["day"] = rng.integers(FIRST_DAY, FIRST_DAY + days, n)
+    rows["ts"] = rows["day"] * DAY + rng.integers(0, DAY, n)
+    rows["mood"] = rng.integers(-1, 5, n)
+    rows["predicted"] = rng.integers(-1, 5, n)
+    rows["intensity"] = rng.integers(0, 101, n)
+    rows["duration_ms"] = rng.integers(60000, 300000, n)
+    rows["artist"] = series.encode([f"artist {i}" for i in rng.integers(0, 20, n)])
+    rows["genre"] = series.encode([None if i == 0 else f"genre {i}" for i in rng.integers(0, 5, n)])
+    return rows
+
+
+def naive_daily(rows, first, end):
+    out = np.zeros((end - first, timeseries.NUM_COLUMNS))
+    for row in rows:
+        if first <= row["day"] < end:
+            d = row["day"] - first
+            out[d, PLAYS] += 1
+            out[d, LISTEN_MS] += row["duration_ms"]
+            if row["mood"] >= 0:
+                out[d, SESSIONS.start + row["mood"]] += 1
+    return out
+
+
+def test_ranges_match_a_scan_and_survive_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(timeseries, "TAIL_COMPACT_ROWS", 100)
+    store = ColumnarEventStore(tmp_path)
+    series = store.user("u1")
+    rows = random_rows(series, 3000, days=400)
+    # arrive in a few out-of-order batches, some large enough to compact
+    for batch in np.array_split(rows, 7):
+        series.append(batch)
+
+    first, end = FIRST_DAY + 50, FIRST_DAY + 200
+    expected = naive_daily(rows, first, end)
+    columns = [PLAYS, LISTEN_MS] + list(range(SESSIONS.start, SESSIONS.stop))
+    assert np.allclose(series.daily(first, end)[:, columns], expected[:, columns])
+
+    in_range = rows[(rows["day"] >= first) & (rows["day"] < end)]
+    artist_counts = series.counts("artist", first, end)
+    assert sum(artist_counts.values()) == len(in_range)
+    assert sum(series.counts("genre", first, end).values()) == int((in_range["genre"] >= 0).sum())
+
+    # a fresh store over the same files (npz generations plus tails) sees the same data
+    reloaded = ColumnarEventStore(tmp_path).user("u1")
+    assert np.array_equal(reloaded.daily(first, end), series.daily(first, end))
+    assert reloaded.counts("artist", first, end) == artist_counts
+    assert list(tmp_path.glob("u1/*.npz"))
+
+
+def test_range_query_loads_only_overlapping_months(tmp_path):
+    store = ColumnarEventStore(tmp_path)
+    series = store.user("u1")
+    series.append(random_rows(series, 2000, days=366))
+    assert len(list(tmp_path.glob("u1/*.tail"))) == 12  # all of 2024
+
+    store._users.clear()
+    series = store.user("u1")
+    series.daily(FIRST_DAY + 31, FIRST_DAY + 45)  # February only
+    assert [str(np.datetime64(m, "M")) for m in series._partitions] == ["2024-02"]
+
+
+def test_torn_tail_record_is_dropped(tmp_path):
+    store = ColumnarEventStore(tmp_path)
+    series = store.user("u1")
+    rows = random_rows(series, 10, days=5)
+    series.append(rows)
+    tail = next(tmp_path.glob("u1/*.tail"))
+    with open(tail, "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    reloaded = ColumnarEventStore(tmp_path).user("u1")
+    assert reloaded.window(FIRST_DAY, FIRST_DAY + 5)[PLAYS] == 10
+    reloaded.append(rows[:1])
+    again = ColumnarEventStore(tmp_path).user("u1")
+    assert again.window(FIRST_DAY, FIRST_DAY + 5)[PLAYS] == 11
+
+
+def test_workers_sharing_a_directory_see_each_others_writes(tmp_path, monkeypatch):
+    monkeypatch.setattr(timeseries, "TAIL_COMPACT_ROWS", 8)
+    worker_a = ColumnarEventStore(tmp_path).user("u1")
+    worker_b = ColumnarEventStore(tmp_path).user("u1")
+    rows_a = random_rows(worker_a, 5, days=5, seed=1)
+    worker_a.append(rows_a)
+    assert worker_a.window(FIRST_DAY, FIRST_DAY + 5)[PLAYS] == 5  # loaded by A
+
+    # B appends (with names A has never seen), then A appends enough to compact
+    rows_b = random_rows(worker_b, 3, days=5, seed=2)
+    rows_b["artist"] = worker_b.encode(["only b 1", "only b 2", "only b 1"])
+    worker_b.append(rows_b)
+    more_a = random_rows(worker_a, 6, days=5, seed=3)
+    more_a["artist"] = worker_a.encode(["only a"] * 6)
+    worker_a.append(more_a)
+    assert list(tmp_path.glob("u1/*.npz"))
+
+    fresh = ColumnarEventStore(tmp_path).user("u1")
+    for series in (fresh, worker_a, worker_b):
+        assert series.window(FIRST_DAY, FIRST_DAY + 5)[PLAYS] == 14
+        counts = series.counts("artist", FIRST_DAY, FIRST_DAY + 5)
+        assert counts["only b 1"] == 2 and counts["only b 2"] == 1 and counts["only a"] == 6
+    # one dictionary: a name has the same code in every worker
+    assert worker_a.encode(["only b 2"])[0] == worker_b.encode(["only b 2"])[0] == fresh.encode(["only b 2"])[0]
+
+    # a clear (rebuild) by one worker is seen by the other
+    ColumnarEventStore(tmp_path).clear("u1")
+    assert worker_b.window(FIRST_DAY, FIRST_DAY + 5)[PLAYS] == 0
@@ -0,0 +1,518 @@
+"""
+Columnar, month-partitioned store of each user's plays (mood sessions and
+listening events), kept on local disk as derived analytics data.
+
+Layout per user (ANALYTICS_DATA_DIR/<user>/):
+- YYYY-MM.npz: one array per column, rows sorted by day, plus day_offsets,
+  the day index: rows of day first_day + i are day_offsets[i]:day_offsets[i+1]
+- YYYY-MM.<generation>.tail: fixed-width records appended since the last
+  compaction; merged into the npz (bumping its generation) once large enough
+- dictionary.txt: artist and genre names, code = line number
+- manifest.json: written once the user's history has been backfilled
+- applied.json: the rollups' watermarks for reconciling with storage (rollups.py)
+
+A loaded partition also keeps its daily aggregate (days x NUM_COLUMNS),
+computed with bincount when it's loaded and updated on append, so a date range
+query only loads the months it overlaps and sums a slice of their aggregates.
+
+Every worker process on the node shares these files. All reads and writes of a
+user's series hold an exclusive lock on ANALYTICS_DATA_DIR/<user>.lock, and
+under it each process catches its in-memory partitions and dictionary up with
+what other workers appended or compacted before using them.
+"""
+import os
+import re
+import json
+import fcntl
+import shutil
+import hashlib
+import pathlib
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..storage.backend import MOODS, SECONDS_PER_DAY
+
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+ANALYTICS_DATA_DIR = pathlib.Path(
+    os.getenv("ANALYTICS_DATA_DIR", str(backend_dir / "data" / "analytics"))
+)
+# Tail records merged into a month's npz once this many have accumulated
+TAIL_COMPACT_ROWS = 1024
+
+NUM_MOODS = len(MOODS)
+
+# One row per play; mood is -1 for untagged plays (listening events),
+# predicted/artist/genre are -1 when unknown
+ROW_DTYPE = np.dtype([
+    ("ts", "<f8"),
+    ("day", "<i4"),
+    ("mood", "i1"),
+    ("predicted", "i1"),
+    ("intensity", "<i2"),
+    ("duration_ms", "<i4"),
+    ("artist", "<i4"),
+    ("genre", "<i4"),
+])
+COLUMNS = ROW_DTYPE.names
+
+# Column layout of the daily aggregates
+SESSIONS = slice(0, NUM_MOODS)                  # sessions tagged with each mood
+INTENSITY = slice(NUM_MOODS, 2 * NUM_MOODS)     # summed intensity per mood
+MOOD_MS = slice(2 * NUM_MOODS, 3 * NUM_MOODS)   # duration of tagged tracks per mood
+AGREE = slice(3 * NUM_MOODS, 4 * NUM_MOODS)     # tags the content model's nearest mood agrees with
+CLASSIFIED = slice(4 * NUM_MOODS, 5 * NUM_MOODS)  # tags whose track the content model could score
+PLAYS = 5 * NUM_MOODS                           # sessions plus listening events
+LISTEN_MS = PLAYS + 1
+NUM_COLUMNS = LISTEN_MS + 1
+
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def day_number(timestamp: float) -> int:
+    """Days since the epoch (UTC) for a unix timestamp"""
+    return int(timestamp // SECONDS_PER_DAY)
+
+
+def month_of(days: np.ndarray) -> np.ndarray:
+    """Months since 1970-01 for epoch day numbers"""
+    return np.asarray(days, dtype="datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def month_bounds(month: int) -> Tuple[int, int]:
+    """(first day, end day) of a month since 1970-01"""
+    first = np.datetime64(month, "M")
+    return int(first.astype("datetime64[D]").astype(np.int64)), int((first + 1).astype("datetime64[D]").astype(np.int64))
+
+
+def month_name(month: int) -> str:
+    return str(np.datetime64(month, "M"))
+
+
+def daily_aggregate(columns: Dict[str, np.ndarray], first_day: int, n_days: int) -> np.ndarray:
+    """(n_days, NUM_COLUMNS) sums for rows whose day is in [first_day, first_day + n_days)"""
+    out = np.zeros((n_days, NUM_COLUMNS))
+    if len(columns["day"]) == 0:
+        return out
+    d = columns["day"].astype(np.int64) - first_day
+    duration = columns["duration_ms"].astype(np.float64)
+    out[:, PLAYS] = np.bincount(d, minlength=n_days)
+    out[:, LISTEN_MS] = np.bincount(d, weights=duration, minlength=n_days)
+
+    mood = columns["mood"].astype(np.int64)
+    tagged = mood >= 0
+    cell = d[tagged] * NUM_MOODS + mood[tagged]
+    size = n_days * NUM_MOODS
+
+    def per_mood(mask=None, weights=None) -> np.ndarray:
+        cells = cell if mask is None else cell[mask]
+        return np.bincount(cells, weights=weights, minlength=size).reshape(n_days, NUM_MOODS)
+
+    out[:, SESSIONS] = per_mood()
+    out[:, INTENSITY] = per_mood(weights=columns["intensity"][tagged].astype(np.float64))
+    out[:, MOOD_MS] = per_mood(weights=duration[tagged])
+    predicted = columns["predicted"][tagged].astype(np.int64)
+    out[:, CLASSIFIED] = per_mood(predicted >= 0)
+    out[:, AGREE] = per_mood(predicted == mood[tagged])
+    return out
+
+
+def file_stamp(path: pathlib.Path) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime, size) of a file, or None if it doesn't exist; changes whenever the file is replaced"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class UserLock:
+    """
+    Exclusive lock on one user's series: re-entrant across this process's threads,
+    and an flock on a lock file next to the user's directory across worker processes
+    (outside the directory, so clearing the user doesn't remove a held lock).
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self) -> "UserLock":
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a+b")
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+class MonthPartition:
+    """One user-month of plays: columns sorted by day, the day index and the daily aggregate"""
+
+    def __init__(self, month: int, columns: Dict[str, np.ndarray], generation: int = 0):
+        self.month = month
+        self.first_day, end_day = month_bounds(month)
+        self.n_days = end_day - self.first_day
+        self.generation = generation
+        self.tail_rows = 0
+        # what this copy has read from disk: the npz it was loaded from, its tail file and bytes of it
+        self.npz_stamp = None
+        self.tail_inode = None
+        self.tail_bytes = 0
+        self._set_columns(columns)
+        self.daily = daily_aggregate(self.columns, self.first_day, self.n_days)
+
+    def _set_columns(self, columns: Dict[str, np.ndarray]):
+        day = columns["day"]
+        if np.all(day[1:] >= day[:-1]):
+            # Plays mostly arrive in time order, so appends rarely need a sort
+            self.columns = {name: np.asarray(columns[name]) for name in COLUMNS}
+        else:
+            order = np.argsort(day, kind="stable")
+            self.columns = {name: np.asarray(columns[name])[order] for name in COLUMNS}
+        self.day_offsets = np.searchsorted(
+            self.columns["day"], np.arange(self.first_day, self.first_day + self.n_days + 1)
+        )
+
+    def __len__(self) -> int:
+        return len(self.columns["day"])
+
+    def append(self, rows: np.ndarray):
+        """Add records (ROW_DTYPE) that fall in this month"""
+        new = {name: rows[name] for name in COLUMNS}
+        self._set_columns({name: np.concatenate([self.columns[name], new[name]]) for name in COLUMNS})
+        self.daily += daily_aggregate(new, self.first_day, self.n_days)
+
+    def row_range(self, first_day: int, end_day: int) -> Tuple[int, int]:
+        """Rows for days [first_day, end_day) as a slice range, via the day index"""
+        lo = min(max(first_day - self.first_day, 0), self.n_days)
+        hi = min(max(end_day - self.first_day, 0), self.n_days)
+        return int(self.day_offsets[lo]), int(self.day_offsets[hi])
+
+
+class UserTimeSeries:
+    """A user's partitions, loaded from disk on first touch and caught up with other workers' writes on every use"""
+
+    def __init__(self, directory: pathlib.Path, lock: Optional[UserLock] = None):
+        self.directory = directory
+        self.lock = lock or UserLock(directory.parent / f"{directory.name}.lock")
+        self._partitions: Dict[int, MonthPartition] = {}
+        self._strings: List[str] = []
+        self._codes: Dict[str, int] = {}
+        # dictionary.txt already read: its inode and bytes
+        self._dictionary_inode = None
+        self._dictionary_bytes = 0
+
+    # Dictionary encoding of artist and genre names
+
+    def _sync_dictionary(self):
+        """Read names other workers appended to dictionary.txt (caller holds the lock)"""
+        path = self.directory / "dictionary.txt"
+        stamp = file_stamp(path)
+        if stamp is None or stamp[0] != self._dictionary_inode:
+            # first read, or the user was cleared (and maybe rebuilt) by another worker: start over
+            self._strings, self._codes, self._dictionary_bytes = [], {}, 0
+            self._dictionary_inode = stamp[0] if stamp is not None else None
+        size = stamp[2] if stamp is not None else 0
+        if size == self._dictionary_bytes:
+            return
+        with open(path, "r+b") as f:
+            f.seek(self._dictionary_bytes)
+            raw = f.read(size - self._dictionary_bytes)
+            complete = raw.rfind(b"\n") + 1
+            if complete < len(raw):
+                # Drop a torn final name so later appends start on a fresh line
+                f.truncate(self._dictionary_bytes + complete)
+        for line in raw[:complete].decode("utf-8").split("\n")[:-1]:
+            self._add_string(line)
+        self._dictionary_bytes += complete
+
+    def _add_string(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._strings)
+            self._strings.append(value)
+            self._codes[value] = code
+        return code
+
+    def encode(self, values: Sequence[Optional[str]]) -> np.ndarray:
+        """Codes for names (-1 for None), persisting new names before they are used"""
+        with self.lock:
+            self._sync_dictionary()
+            new = []
+            codes = np.empty(len(values), dtype=np.int32)
+            for i, value in enumerate(values):
+                if not value:
+                    codes[i] = -1
+                    continue
+                value = value.replace("\n", " ")
+                if value not in self._codes:
+                    new.append(value)
+                codes[i] = self._add_string(value)
+            if new:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                data = "".join(value + "\n" for value in new).encode("utf-8")
+                with open(self.directory / "dictionary.txt", "ab") as f:
+                    f.write(data)
+                    self._dictionary_inode = os.fstat(f.fileno()).st_ino
+                self._dictionary_bytes += len(data)
+            return codes
+
+    def decode(self, code: int) -> str:
+        with self.lock:
+            if code >= len(self._strings):
+                self._sync_dictionary()
+            return self._strings[code]
+
+    # Partitions
+
+    def _partition(self, month: int) -> Optional[MonthPartition]:
+        """
+        Partition for a month, caught up with disk, or None if nothing was written for it
+        (caller holds the lock). A compaction by another worker replaces the npz, so the
+        partition is reloaded; rows another worker appended to the tail are read and appended.
+        """
+        name = month_name(month)
+        npz_path = self.directory / f"{name}.npz"
+        npz_stamp = file_stamp(npz_path)
+        partition = self._partitions.get(month)
+        if partition is not None and partition.npz_stamp == npz_stamp:
+            tail_stamp = file_stamp(self.directory / f"{name}.{partition.generation}.tail")
+            size = tail_stamp[2] if tail_stamp is not None else 0
+            size -= (size - partition.tail_bytes) % ROW_DTYPE.itemsize
+            same_tail = tail_stamp is not None and tail_stamp[0] == partition.tail_inode
+            if size == partition.tail_bytes and (same_tail or size == 0):
+                return partition
+            if size > partition.tail_bytes and (same_tail or partition.tail_bytes == 0):
+                with open(self.directory / f"{name}.{partition.generation}.tail", "rb") as f:
+                    f.seek(partition.tail_bytes)
+                    rows = np.frombuffer(f.read(size - partition.tail_bytes), dtype=ROW_DTYPE)
+                partition.append(rows)
+                partition.tail_rows += len(rows)
+                partition.tail_inode = tail_stamp[0]
+                partition.tail_bytes = size
+                return partition
+        self._partitions.pop(month, None)
+
+        generation = 0
+        parts = []
+        if npz_path.exists():
+            with np.load(npz_path) as data:
+                generation = int(data["generation"])
+                parts.append({column: data[column] for column in COLUMNS})
+        tail_path = self.directory / f"{name}.{generation}.tail"
+        tail = np.empty(0, dtype=ROW_DTYPE)
+        tail_inode = None
+        if tail_path.exists():
+            tail_inode = tail_path.stat().st_ino
+            raw = tail_path.read_bytes()
+            torn = len(raw) % ROW_DTYPE.itemsize
+            if torn:
+                # Cut a torn final record so later appends stay aligned
+                raw = raw[:len(raw) - torn]
+                with open(tail_path, "r+b") as f:
+                    f.truncate(len(raw))
+            tail = np.frombuffer(raw, dtype=ROW_DTYPE)
+            parts.append({column: tail[column] for column in COLUMNS})
+        if not parts:
+            return None
+
+        columns = {column: np.concatenate([part[column] for part in parts]) for column in COLUMNS}
+        partition = MonthPartition(month, columns, generation)
+        partition.tail_rows = len(tail)
+        partition.npz_stamp = npz_stamp
+        partition.tail_inode = tail_inode
+        partition.tail_bytes = tail.nbytes
+        self._partitions[month] = partition
+        return partition
+
+    def append(self, rows: np.ndarray):
+        """Persist and index new records (ROW_DTYPE)"""
+        if len(rows) == 0:
+            return
+        with self.lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            months = month_of(rows["day"])
+            for month in np.unique(months).tolist():
+                month_rows = rows[months == month]
+                partition = self._partition(month)
+                generation = partition.generation if partition is not None else 0
+                tail_path = self.directory / f"{month_name(month)}.{generation}.tail"
+                with open(tail_path, "ab") as f:
+                    f.write(month_rows.tobytes())
+                    tail_inode = os.fstat(f.fileno()).st_ino
+
+                if partition is None:
+                    partition = MonthPartition(month, {column: month_rows[column] for column in COLUMNS})
+                    self._partitions[month] = partition
+                else:
+                    partition.append(month_rows)
+                partition.tail_rows += len(month_rows)
+                partition.tail_inode = tail_inode
+                partition.tail_bytes += month_rows.nbytes
+                if partition.tail_rows >= TAIL_COMPACT_ROWS:
+                    self._compact(partition)
+
+    def _compact(self, partition: MonthPartition):
+        """Fold the tail into the npz under the next generation, then drop the old tail"""
+        name = month_name(partition.month)
+        generation = partition.generation + 1
+        tmp_path = self.directory / f"{name}.npz.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, generation=generation, day_offsets=partition.day_offsets, **partition.columns)
+        os.replace(tmp_path, self.directory / f"{name}.npz")
+        (self.directory / f"{name}.{partition.generation}.tail").unlink(missing_ok=True)
+        partition.generation = generation
+        partition.tail_rows = 0
+        partition.tail_inode = None
+        partition.tail_bytes = 0
+        partition.npz_stamp = file_stamp(self.directory / f"{name}.npz")
+
+    def months(self, first_day: int, end_day: int) -> List[MonthPartition]:
+        """Loaded partitions overlapping days [first_day, end_day)"""
+        if end_day <= first_day:
+            return []
+        first_month, last_month = month_of([first_day, end_day - 1]).tolist()
+        with self.lock:
+            partitions = (self._partition(month) for month in range(first_month, last_month + 1))
+            return [p for p in partitions if p is not None]
+
+    def daily(self, first_day: int, end_day: int) -> np.ndarray:
+        """(days, NUM_COLUMNS) aggregates for days [first_day, end_day), zero where nothing was played"""
+        out = np.zeros((max(end_day - first_day, 0), NUM_COLUMNS))
+        with self.lock:
+            for partition in self.months(first_day, end_day):
+                lo = max(first_day, partition.first_day)
+                hi = min(end_day, partition.first_day + partition.n_days)
+                out[lo - first_day:hi - first_day] = partition.daily[lo - partition.first_day:hi - partition.first_day]
+        return out
+
+    def window(self, first_day: int, end_day: int) -> np.ndarray:
+        """Column totals over days [first_day, end_day)"""
+        return self.daily(first_day, end_day).sum(axis=0)
+
+    def counts(self, column: str, first_day: int, end_day: int) -> Dict[str, int]:
+        """Plays per artist or genre over days [first_day, end_day), one bincount per partition"""
+        with self.lock:
+            self._sync_dictionary()
+            totals = np.zeros(len(self._strings), dtype=np.int64)
+            for partition in self.months(first_day, end_day):
+                lo, hi = partition.row_range(first_day, end_day)
+                codes = partition.columns[column][lo:hi]
+                codes = codes[codes >= 0]
+                totals += np.bincount(codes, minlength=len(totals))[:len(totals)]
+            nonzero = np.flatnonzero(totals)
+            return {self._strings[code]: int(totals[code]) for code in nonzero.tolist()}
+
+    def top(self, column: str, first_day: int, end_day: int, k: int) -> List[Tuple[str, int]]:
+        """The k most played artists or genres over days [first_day, end_day)"""
+        counts = self.counts(column, first_day, end_day)
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+class ColumnarEventStore:
+    """Per-user time series under one root directory"""
+
+    def __init__(self, root: pathlib.Path = ANALYTICS_DATA_DIR):
+        self.root = pathlib.Path(root)
+        self._lock = threading.Lock()
+        self._users: Dict[str, UserTimeSeries] = {}
+        self._user_locks: Dict[str, UserLock] = {}
+        self._backfilled: set = set()
+
+    def _directory(self, firebase_user_id: str) -> pathlib.Path:
+        if _SAFE_NAME.match(firebase_user_id):
+            return self.root / firebase_user_id
+        return self.root / hashlib.sha1(firebase_user_id.encode("utf-8")).hexdigest()
+
+    def lock(self, firebase_user_id: str) -> UserLock:
+        """The user's lock; hold it to make several operations atomic across workers"""
+        with self._lock:
+            lock = self._user_locks.get(firebase_user_id)
+            if lock is None:
+                directory = self._directory(firebase_user_id)
+                lock = UserLock(directory.parent / f"{directory.name}.lock")
+                self._user_locks[firebase_user_id] = lock
+            return lock
+
+    def user(self, firebase_user_id: str) -> UserTimeSeries:
+        lock = self.lock(firebase_user_id)
+        with self._lock:
+            series = self._users.get(firebase_user_id)
+            if series is None:
+                series = UserTimeSeries(self._directory(firebase_user_id), lock)
+                self._users[firebase_user_id] = series
+            return series
+
+    def is_backfilled(self, firebase_user_id: str) -> bool:
+        """Whether the user's history before the store existed has been loaded into it"""
+        if firebase_user_id in self._backfilled:
+            return True
+        if (self._directory(firebase_user_id) / "manifest.json").exists():
+            self._backfilled.add(firebase_user_id)
+            return True
+        return False
+
+    def backfilled_at(self, firebase_user_id: str) -> Optional[float]:
+        """When the user's series was last (re)built from storage, by any worker, or None"""
+        try:
+            with open(self._directory(firebase_user_id) / "manifest.json", "r", encoding="utf-8") as f:
+                return float(json.load(f)["backfilled_at"])
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def mark_backfilled(self, firebase_user_id: str, backfilled_at: float):
+        directory = self._directory(firebase_user_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = directory / "manifest.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"backfilled_at": backfilled_at}, f)
+        os.replace(tmp_path, directory / "manifest.json")
+        self._backfilled.add(firebase_user_id)
+
+    def applied(self, firebase_user_id: str) -> dict:
+        """The rollups' record of what they have applied to the user's series since it was built ({} if none)"""
+        try:
+            with open(self._directory(firebase_user_id) / "applied.json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def set_applied(self, firebase_user_id: str, applied: dict):
+        directory = self._directory(firebase_user_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = directory / "applied.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(applied, f)
+        os.replace(tmp_path, directory / "applied.json")
+
+    def clear(self, firebase_user_id: str):
+        """Delete everything stored for a user"""
+        with self.lock(firebase_user_id):
+            with self._lock:
+                self._users.pop(firebase_user_id, None)
+                self._backfilled.discard(firebase_user_id)
+            shutil.rmtree(self._directory(firebase_user_id), ignore_errors=True)
+
+
+# Global instance
+columnar_event_store = ColumnarEventStore()
@@ -5,20 +5,26 @@ import os
 import base64
 import secrets
 from urllib.parse import urlencode
-from datetime import datetime, timedelta
 from typing import Optional
 
-import httpx
 from fastapi import APIRouter, Request, Response, HTTPException, Query
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import RedirectResponse
 from dotenv import load_dotenv
 
-from ..storage.memory_storage import storage  # Keep for state management
-from ..storage.firestore_storage import (
-    save_spotify_tokens as save_tokens_firestore,
-    get_spotify_tokens as get_tokens_firestore,
-    update_spotify_access_token as update_token_firestore,
+from ..storage.memory_storage import storage  # Legacy account store for /auth/spotify/refresh
+from ..storage.oauth_state import get_oauth_state_store
+from .spotify_client import (
+    get_spotify_client,
+    parse_retry_after,
+    SpotifyRateLimitError,
+    SPOTIFY_ACCOUNTS_BASE_URL,
+    HTTP2_AVAILABLE,
 )
+from .token_cache import token_cache
+from .token_refresh_scheduler import TokenRefreshScheduler
+from ..history.ingestion import history_ingestor, IngestionError
+from ..storage import async_storage
 
 # Load environment variables from .env file
 # Look for .env in the backend directory (parent of src)
@@ -28,10 +34,9 @@ load_dotenv(dotenv_path=backend_dir / ".env")
 
 router = APIRouter()
 
-# Spotify OAuth URLs
-SPOTIFY_AUTH_URL = "https://accounts.spotify.com/authorize"
-SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
-SPOTIFY_ME_URL = "https://api.spotify.com/v1/me"
+# Spotify OAuth URLs (API calls go through the shared SpotifyClient)
+SPOTIFY_AUTH_URL = f"{SPOTIFY_ACCOUNTS_BASE_URL}/authorize"
+SPOTIFY_ME_PATH = "/v1/me"
 
 # Environment variables
 CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
@@ -48,6 +53,28 @@ def _basic_auth_header(client_id: str, client_secret: str) -> str:
     return "Basic " + base64.b64encode(creds).decode("utf-8")
 
 
+async def _refresh_access_token(refresh_token: str, firebase_user_id: str) -> dict:
+    """Exchange a refresh token for a new access token (used by the token cache)"""
+    res = await get_spotify_client().post_token(
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+        },
+        authorization=_basic_auth_header(CLIENT_ID, CLIENT_SECRET),
+        user_id=firebase_user_id,
+    )
+    if res.status_code == 429:
+        raise SpotifyRateLimitError(parse_retry_after(res))
+    if res.status_code != 200:
+        raise HTTPException(status_code=400, detail="Failed to refresh token")
+    return res.json()
+
+
+# Proactively refreshes cached tokens before they expire (started in main.py lifespan)
+refresh_scheduler = TokenRefreshScheduler(token_cache, _refresh_access_token)
+token_cache.add_listener(refresh_scheduler.on_token_state)
+
+
 @router.get("/auth/spotify/login")
 def spotify_login(request: Request, response: Response, firebase_user_id: Optional[str] = None):
     """
@@ -78,8 +105,8 @@ def spotify_login(request: Request, response: Response, firebase_user_id: Option
     # Generate state for CSRF protection
     state = secrets.token_hex(16)
     
-    # Store state in memory storage (temporary, for validation)
-    storage.store_state(state)
+    # Store state in the shared state store so any worker can validate the callback
+    get_oauth_state_store().store(state)
     
     # Build Spotify authorization URL
     params = {
@@ -133,7 +160,7 @@ async def spotify_callback(
     # Validate state
     if not state or not cookie_state or state != cookie_state:
         raise HTTPException(status_code=400, detail="State mismatch - possible CSRF attack")
-    if not storage.validate_state(state):
+    if not await async_storage.run_sync(get_oauth_state_store().consume, state):
         raise HTTPException(status_code=400, detail="Invalid or expired state")
     if not code:
         raise HTTPException(status_code=400, detail="Missing authorization code")
@@ -143,20 +170,19 @@ async def spotify_callback(
             detail="Spotify OAuth not configured."
         )
     redirect_uri = REDIRECT_URI.rstrip('/')
+    client = get_spotify_client()
     # Exchange code for tokens
-    async with httpx.AsyncClient() as client:
-        token_res = await client.post(
-            SPOTIFY_TOKEN_URL,
-            data={
-                "grant_type": "authorization_code",
-                "code": code,
-                "redirect_uri": redirect_uri,
-            },
-            headers={
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Authorization": _basic_auth_header(CLIENT_ID, CLIENT_SECRET),
-            },
-        )
+    # rate-limited as the signing-in user (checked below, once the tokens are in hand)
+    cookie_user_id = request.cookies.get("firebase_user_id")
+    token_res = await client.post_token(
+        data={
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": redirect_uri,
+        },
+        authorization=_basic_auth_header(CLIENT_ID, CLIENT_SECRET),
+        user_id=cookie_user_id,
+    )
     if token_res.status_code != 200:
         raise HTTPException(
             status_code=400,
@@ -167,12 +193,8 @@ async def spotify_callback(
     refresh_token = token_json.get("refresh_token")
     expires_in = token_json["expires_in"]
     scope = token_json.get("scope", "")
-    # Fetch Spotify user profile
-    async with httpx.AsyncClient() as client:
-        me_res = await client.get(
-            SPOTIFY_ME_URL,
-            headers={"Authorization": f"Bearer {access_token}"},
-        )
+    # Fetch Spotify user profile (reuses the connection from the token exchange)
+    me_res = await client.api_get("me", SPOTIFY_ME_PATH, access_token, user_id=cookie_user_id)
     if me_res.status_code != 200:
         raise HTTPException(
             status_code=400,
@@ -196,7 +218,7 @@ async def spotify_callback(
     firebase_email = spotify_email  # In production, get from Firebase Auth token
     
     # Store tokens in Firestore
-    save_tokens_firestore(
+    token_data = await async_storage.save_spotify_tokens(
         firebase_user_id=firebase_user_id,
         spotify_user_id=spotify_user_id,
         access_token=access_token,
@@ -205,6 +227,7 @@ async def spotify_callback(
         scope=scope,
         email=firebase_email
     )
+    token_cache.store(firebase_user_id, token_data)
     
     # Redirect to frontend
     redirect_url = f"{FRONTEND_URL}/dashboard"
@@ -241,18 +264,13 @@ async def spotify_refresh(spotify_user_id: str):
         )
     
     # Refresh the token
-    async with httpx.AsyncClient() as client:
-        res = await client.post(
-            SPOTIFY_TOKEN_URL,
-            data={
-                "grant_type": "refresh_token",
-                "refresh_token": account.refresh_token,
-            },
-            headers={
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Authorization": _basic_auth_header(CLIENT_ID, CLIENT_SECRET),
-            },
-        )
+    res = await get_spotify_client().post_token(
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": account.refresh_token,
+        },
+        authorization=_basic_auth_header(CLIENT_ID, CLIENT_SECRET),
+    )
     
     if res.status_code != 200:
         raise HTTPException(
@@ -283,106 +301,69 @@ async def spotify_refresh(spotify_user_id: str):
 
 
 @router.get("/api/me/recently-played")
-async def get_recently_played(firebase_user_id: str = Query(..., description="Firebase user ID")):
+async def get_recently_played(
+    firebase_user_id: str = Query(..., description="Firebase user ID"),
+    limit: int = Query(20, ge=1, le=50, description="Number of plays to return")
+):
     """
-    Get user's recently played tracks from Spotify.
+    Get user's recently played tracks.
+    New plays are ingested incrementally from Spotify into the local listening-event
+    store, and the response is read from that store.
     Requires firebase_user_id to retrieve tokens from Firestore.
     """
-    SPOTIFY_RECENTLY_PLAYED_URL = "https://api.spotify.com/v1/me/player/recently-played"
-    
     if not CLIENT_ID or not CLIENT_SECRET:
         raise HTTPException(
             status_code=500,
             detail="Spotify OAuth not configured."
         )
     
-    # Get tokens from Firestore
+    # Get tokens (cached in-process, loaded from Firestore on miss)
     try:
-        token_data = get_tokens_firestore(firebase_user_id)
-        print(f"Debug: Retrieved token data for user {firebase_user_id}: {bool(token_data)}")
-        if token_data:
-            print(f"Debug: Token data keys: {list(token_data.keys())}")
-            print(f"Debug: Has accessToken: {bool(token_data.get('accessToken'))}")
+        token_state = await token_cache.get(firebase_user_id)
     except Exception as e:
         print(f"Error getting tokens from Firestore: {e}")
-        import traceback
-        traceback.print_exc()
         raise HTTPException(
             status_code=500,
             detail=f"Error retrieving tokens: {str(e)}"
         )
     
-    if not token_data or not token_data.get("accessToken"):
-        print(f"Debug: No token data found for user {firebase_user_id}")
+    if not token_state or not token_state.access_token:
         raise HTTPException(
             status_code=401,
             detail="Spotify not connected. Please connect your Spotify account."
         )
     
-    access_token = token_data["accessToken"]
-    refresh_token = token_data.get("refreshToken")
-    expires_at = token_data.get("expiresAt")
-    
-    # Check if token is expired and refresh if needed
-    if expires_at:
-        # Handle Firestore Timestamp
-        if hasattr(expires_at, 'timestamp'):
-            # Firestore Timestamp object
-            expires_at_dt = datetime.fromtimestamp(expires_at.timestamp())
-        elif isinstance(expires_at, datetime):
-            expires_at_dt = expires_at
-        else:
-            # Try to convert if it's a different format
-            expires_at_dt = expires_at
-        
-        if isinstance(expires_at_dt, datetime) and expires_at_dt <= datetime.utcnow():
-            # Token expired, refresh it
-            if not refresh_token:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Token expired and no refresh token available"
-                )
-            
-            async with httpx.AsyncClient() as client:
-                res = await client.post(
-                    SPOTIFY_TOKEN_URL,
-                    data={
-                        "grant_type": "refresh_token",
-                        "refresh_token": refresh_token,
-                    },
-                    headers={
-                        "Content-Type": "application/x-www-form-urlencoded",
-                        "Authorization": _basic_auth_header(CLIENT_ID, CLIENT_SECRET),
-                    },
-                )
-            
-            if res.status_code == 200:
-                data = res.json()
-                new_access_token = data["access_token"]
-                new_expires_in = data["expires_in"]
-                new_refresh_token = data.get("refresh_token", refresh_token)
-                
-                # Update token in Firestore
-                update_token_firestore(firebase_user_id, new_access_token, new_expires_in)
-                access_token = new_access_token
-            else:
-                raise HTTPException(status_code=400, detail="Failed to refresh token")
-    
-    # Fetch recently played tracks
-    async with httpx.AsyncClient() as client:
-        res = await client.get(
-            SPOTIFY_RECENTLY_PLAYED_URL,
-            headers={"Authorization": f"Bearer {access_token}"},
-            params={"limit": 20},
-        )
-    
-    if res.status_code != 200:
-        raise HTTPException(
-            status_code=res.status_code,
-            detail=f"Spotify API error: {res.text}"
-        )
-    
-    return res.json()
+    # Refresh if expired; concurrent requests share one refresh
+    if token_state.is_expired():
+        if not token_state.refresh_token:
+            raise HTTPException(
+                status_code=400,
+                detail="Token expired and no refresh token available"
+            )
+        try:
+            token_state = await token_cache.refresh(firebase_user_id, _refresh_access_token)
+        except SpotifyRateLimitError as e:
+            raise HTTPException(
+                status_code=429,
+                detail="Spotify rate limit reached, please retry shortly",
+                headers={"Retry-After": str(int(e.retry_after + 0.999))}
+            )
+    
+    access_token = token_state.access_token
+    
+    # Pull only plays newer than what we've stored, then serve from the local store
+    try:
+        ingested = await history_ingestor.ingest(get_spotify_client(), firebase_user_id, access_token)
+    except IngestionError as e:
+        stored = await run_in_threadpool(history_ingestor.recent_items, firebase_user_id, limit)
+        if not stored:
+            headers = {"Retry-After": str(int(e.retry_after + 0.999))} if e.retry_after is not None else None
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+        # Spotify is unavailable or throttling; what we already have is still useful
+        return {"items": stored, "stale": True}
+    
+    items = await run_in_threadpool(history_ingestor.recent_items, firebase_user_id, limit)
+    return {"items": items, "ingested": ingested, "stale": False}
 
 
 @router.get("/auth/spotify/debug")
@@ -437,6 +418,19 @@ def spotify_debug():
     }
 
 
+@router.get("/auth/spotify/debug/latency")
+def spotify_latency():
+    """
+    Per-endpoint latency and rate-limit counters recorded by the shared Spotify client.
+    """
+    client = get_spotify_client()
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "endpoints": client.latency_stats(),
+        "rate_limit": client.rate_limit_stats(),
+    }
+
+
 @router.get("/auth/spotify/logout")
 def spotify_logout(response: Response):
     """
@@ -0,0 +1,348 @@
+"""
+Shared, pooled HTTP client for Spotify Web API and Accounts calls.
+One application-scoped instance is created in the main.py lifespan and
+reused by every route so connections (and TLS sessions) are kept alive.
+
+The client is rate-limit aware: it applies app-wide and per-user token
+buckets, honors Retry-After on 429, coalesces identical in-flight GETs and
+serves short-lived cached GET responses while Spotify is throttling us.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import pathlib
+from collections import deque, OrderedDict
+from typing import Deque, Dict, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from .rate_limit import TokenBucket, BucketRegistry
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Load environment variables
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+load_dotenv(dotenv_path=backend_dir / ".env")
+
+SPOTIFY_ACCOUNTS_BASE_URL = os.getenv("SPOTIFY_ACCOUNTS_BASE_URL", "https://accounts.spotify.com").rstrip("/")
+SPOTIFY_API_BASE_URL = os.getenv("SPOTIFY_API_BASE_URL", "https://api.spotify.com").rstrip("/")
+
+# Pool tuning
+MAX_CONNECTIONS = int(os.getenv("SPOTIFY_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SPOTIFY_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY_SECONDS = 30.0
+CONNECT_TIMEOUT_SECONDS = 5.0
+READ_TIMEOUT_SECONDS = 10.0
+POOL_TIMEOUT_SECONDS = 5.0
+
+LATENCY_SAMPLE_SIZE = 512
+DEFAULT_RETRY_AFTER_SECONDS = 1.0
+
+# Rate limiting
+APP_RATE_PER_SECOND = float(os.getenv("SPOTIFY_APP_RATE_PER_SECOND", "20"))
+APP_BURST = float(os.getenv("SPOTIFY_APP_BURST", "40"))
+USER_RATE_PER_SECOND = float(os.getenv("SPOTIFY_USER_RATE_PER_SECOND", "2"))
+USER_BURST = float(os.getenv("SPOTIFY_USER_BURST", "10"))
+MAX_429_RETRIES = 2
+# Don't hold a request open longer than this waiting out a Retry-After
+MAX_RETRY_WAIT_SECONDS = 5.0
+
+# Short-TTL GET cache, served while throttled
+STALE_RESPONSE_TTL_SECONDS = float(os.getenv("SPOTIFY_STALE_RESPONSE_TTL_SECONDS", "60"))
+RESPONSE_CACHE_MAX_ENTRIES = 2048
+
+
+class SpotifyRateLimitError(Exception):
+    """Spotify answered 429 Too Many Requests"""
+
+    def __init__(self, retry_after: float = DEFAULT_RETRY_AFTER_SECONDS):
+        super().__init__(f"Spotify rate limit hit, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(response: httpx.Response) -> float:
+    """Seconds to wait from a 429 response's Retry-After header"""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER_SECONDS)))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER_SECONDS
+
+
+class EndpointStats:
+    """Latency counters for one logical Spotify endpoint"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples: Deque[float] = deque(maxlen=LATENCY_SAMPLE_SIZE)
+
+    def record(self, elapsed_ms: float, ok: bool):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.samples.append(elapsed_ms)
+
+    def summary(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def pct(p: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 2)
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.max_ms, 2),
+        }
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled async client (HTTP/2 when h2 is installed)"""
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(
+            READ_TIMEOUT_SECONDS,
+            connect=CONNECT_TIMEOUT_SECONDS,
+            pool=POOL_TIMEOUT_SECONDS,
+        ),
+    )
+
+
+def _token_key(access_token: str) -> str:
+    """Digest of a bearer token, for keying on it without keeping the token itself around"""
+    return hashlib.blake2b(access_token.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class SpotifyClient:
+    """
+    Thin wrapper over a shared httpx.AsyncClient.
+    Every call is tagged with a logical endpoint name and its latency recorded.
+    """
+
+    def __init__(
+        self,
+        http: Optional[httpx.AsyncClient] = None,
+        accounts_base_url: str = SPOTIFY_ACCOUNTS_BASE_URL,
+        api_base_url: str = SPOTIFY_API_BASE_URL,
+        app_bucket: Optional[TokenBucket] = None,
+        user_buckets: Optional[BucketRegistry] = None,
+        stale_ttl_seconds: float = STALE_RESPONSE_TTL_SECONDS,
+    ):
+        self.http = http or create_http_client()
+        self.accounts_base_url = accounts_base_url.rstrip("/")
+        self.api_base_url = api_base_url.rstrip("/")
+        self.stats: Dict[str, EndpointStats] = {}
+        self.app_bucket = app_bucket if app_bucket is not None else TokenBucket(APP_RATE_PER_SECOND, APP_BURST)
+        self.user_buckets = user_buckets if user_buckets is not None else BucketRegistry(USER_RATE_PER_SECOND, USER_BURST)
+        self.stale_ttl_seconds = stale_ttl_seconds
+        # Spotify told us to back off until this time (monotonic)
+        self._throttled_until = 0.0
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._responses: "OrderedDict[Tuple, Tuple[float, httpx.Response]]" = OrderedDict()
+        self.throttled = 0
+        self.coalesced = 0
+        self.served_stale = 0
+
+    @property
+    def token_url(self) -> str:
+        return f"{self.accounts_base_url}/api/token"
+
+    def is_throttled(self) -> bool:
+        return time.monotonic() < self._throttled_until
+
+    async def _send(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send one request and record its latency under endpoint"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = await self.http.request(method, url, **kwargs)
+            ok = response.status_code < 500 and response.status_code != 429
+            return response
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            self.stats.setdefault(endpoint, EndpointStats()).record(elapsed_ms, ok)
+
+    async def request(
+        self,
+        endpoint: str,
+        method: str,
+        url: str,
+        user_key: Optional[str] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """
+        Send a request through the app and user rate limits.
+        On 429, waits out Retry-After and retries (a bounded number of times);
+        the final 429 response is returned to the caller if retries run out.
+        """
+        for attempt in range(MAX_429_RETRIES + 1):
+            delay = self._throttled_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.app_bucket.acquire()
+            await self.user_buckets.acquire(user_key)
+
+            response = await self._send(endpoint, method, url, **kwargs)
+            if response.status_code != 429:
+                return response
+
+            self.throttled += 1
+            retry_after = parse_retry_after(response)
+            self._throttled_until = max(self._throttled_until, time.monotonic() + retry_after)
+            if attempt == MAX_429_RETRIES or retry_after > MAX_RETRY_WAIT_SECONDS:
+                return response
+        return response
+
+    async def post_token(self, data: dict, authorization: str, user_id: Optional[str] = None) -> httpx.Response:
+        """
+        POST to the Accounts token endpoint (code exchange or refresh).
+        user_id (the Firebase user, when known) puts the call in that user's rate-limit bucket.
+        """
+        endpoint = "token:" + data.get("grant_type", "unknown")
+        return await self.request(
+            endpoint,
+            "POST",
+            self.token_url,
+            user_key=user_id,
+            data=data,
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Authorization": authorization,
+            },
+        )
+
+    async def api_get(
+        self,
+        endpoint: str,
+        path: str,
+        access_token: str,
+        params: Optional[dict] = None,
+        user_id: Optional[str] = None
+    ) -> httpx.Response:
+        """
+        GET a Web API path (e.g. /v1/me) with a user's bearer token.
+        Identical concurrent GETs share one upstream request, and a recent
+        successful response is served if Spotify is throttling us.
+        user_id (the Firebase user) keys the per-user rate limit, so it survives token
+        refreshes; without it the limit is per access token.
+        """
+        token_key = _token_key(access_token)
+        user_key = user_id or token_key
+        # keyed on a digest of the token, so cached responses don't keep raw tokens in memory
+        key = (path, tuple(sorted((params or {}).items())), token_key)
+
+        cached = self._cached_response(key)
+        if cached is not None and self.is_throttled():
+            self.served_stale += 1
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+        else:
+            # A task of its own, so a caller that goes away only stops waiting; the others still get the response
+            pending = asyncio.ensure_future(self._fetch(key, endpoint, path, user_key, access_token, params))
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda task: self._inflight.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _fetch(
+        self, key: Tuple, endpoint: str, path: str, user_key: str, access_token: str, params: Optional[dict]
+    ) -> httpx.Response:
+        response = await self.request(
+            endpoint,
+            "GET",
+            f"{self.api_base_url}{path}",
+            user_key=user_key,
+            headers={"Authorization": f"Bearer {access_token}"},
+            params=params,
+        )
+        if response.status_code == 200:
+            self._remember_response(key, response)
+        elif response.status_code == 429:
+            cached = self._cached_response(key)
+            if cached is not None:
+                self.served_stale += 1
+                response = cached
+        return response
+
+    def _cached_response(self, key: Tuple) -> Optional[httpx.Response]:
+        entry = self._responses.get(key)
+        if entry is None:
+            return None
+        stored_at, response = entry
+        if time.monotonic() - stored_at > self.stale_ttl_seconds:
+            del self._responses[key]
+            return None
+        return response
+
+    def _remember_response(self, key: Tuple, response: httpx.Response):
+        self._responses[key] = (time.monotonic(), response)
+        self._responses.move_to_end(key)
+        while len(self._responses) > RESPONSE_CACHE_MAX_ENTRIES:
+            self._responses.popitem(last=False)
+
+    def latency_stats(self) -> dict:
+        return {name: stats.summary() for name, stats in sorted(self.stats.items())}
+
+    def rate_limit_stats(self) -> dict:
+        return {
+            "throttled": self.throttled,
+            "throttled_for_seconds": round(max(0.0, self._throttled_until - time.monotonic()), 2),
+            "coalesced": self.coalesced,
+            "served_stale": self.served_stale,
+            "tracked_users": len(self.user_buckets),
+        }
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+# Application-scoped client, managed by the main.py lifespan
+_client: Optional[SpotifyClient] = None
+
+
+def init_spotify_client() -> SpotifyClient:
+    """Create the shared Spotify client. Call once at application startup."""
+    global _client
+    if _client is None:
+        _client = SpotifyClient()
+    return _client
+
+
+async def close_spotify_client():
+    """Close pooled connections. Call at application shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_spotify_client() -> SpotifyClient:
+    """
+    Get the shared Spotify client. Raises error if not initialized.
+    """
+    if _client is None:
+        raise RuntimeError(
+            "Spotify client not initialized. Please call init_spotify_client() at application startup."
+        )
+    return _client
@@ -0,0 +1,168 @@
+"""
+Local stand-in for the Spotify Accounts and Web API used by the auth tests.
+Runs a threaded HTTP/1.1 server on 127.0.0.1 with keep-alive so connection
+reuse can be observed.
+"""
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeSpotifyServer:
+    """
+    Serves /api/token, /v1/me and /v1/me/player/recently-played.
+    Counts TCP connections and requests per path, and can inject 429s
+    and response latency.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.recently_played_items = []
+        self.delay = 0.0
+        self.throttle_remaining = 0
+        self.retry_after = "1"
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def throttle(self, count: int, retry_after: float = 1):
+        """Answer the next `count` requests with 429 Too Many Requests"""
+        with self.lock:
+            self.throttle_remaining = count
+            self.retry_after = str(retry_after)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, method: str, path: str, query: dict, body: dict, headers) -> tuple:
+        """Return (status, json_body, extra_headers) for a request"""
+        if self.delay:
+            time.sleep(self.delay)
+
+        with self.lock:
+            if self.throttle_remaining > 0:
+                self.throttle_remaining -= 1
+                return 429, {"error": {"status": 429, "message": "API rate limit exceeded"}}, {
+                    "Retry-After": self.retry_after
+                }
+
+        if method == "POST" and path == "/api/token":
+            grant_type = body.get("grant_type")
+            if grant_type == "authorization_code":
+                return 200, {
+                    "access_token": "access-1",
+                    "refresh_token": "refresh-1",
+                    "expires_in": 3600,
+                    "scope": "user-read-recently-played",
+                }, {}
+            if grant_type == "refresh_token":
+                return 200, {"access_token": "access-2", "expires_in": 3600}, {}
+            return 400, {"error": "unsupported_grant_type"}, {}
+
+        if not headers.get("Authorization", "").startswith("Bearer "):
+            return 401, {"error": {"status": 401, "message": "No token provided"}}, {}
+
+        if method == "GET" and path == "/v1/me":
+            return 200, {"id": "spotify-user-1", "email": "user@example.com"}, {}
+
+        if method == "GET" and path == "/v1/me/player/recently-played":
+            return 200, self._recently_played_page(query), {}
+
+        return 404, {"error": {"status": 404, "message": "Not found"}}, {}
+
+    def add_play(self, played_at_ms: int, track_id: str = "track"):
+        """Add a play; items are kept newest first like Spotify returns them"""
+        played_at = datetime.fromtimestamp(played_at_ms / 1000, tz=timezone.utc)
+        item = {
+            "played_at": played_at.isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "track": {"id": track_id, "name": f"Song {track_id}", "uri": f"spotify:track:{track_id}",
+                      "duration_ms": 180000, "artists": [{"id": "a1", "name": "Artist"}],
+                      "album": {"id": "al1", "name": "Album", "images": []}},
+        }
+        with self.lock:
+            self.recently_played_items.append(item)
+            self.recently_played_items.sort(key=lambda i: i["played_at"], reverse=True)
+
+    def _recently_played_page(self, query: dict) -> dict:
+        """Cursor paging: `after`/`before` are epoch ms, results newest first"""
+        def ms(item):
+            value = datetime.fromisoformat(item["played_at"].replace("Z", "+00:00"))
+            return int(value.timestamp() * 1000)
+
+        limit = int(query.get("limit", ["20"])[0])
+        items = list(self.recently_played_items)
+        if "after" in query:
+            items = [i for i in items if ms(i) > int(query["after"][0])]
+        if "before" in query:
+            items = [i for i in items if ms(i) < int(query["before"][0])]
+        page, rest = items[:limit], items[limit:]
+        cursors = {"after": str(ms(page[0])), "before": str(ms(page[-1]))} if page else None
+        return {
+            "items": page,
+            "cursors": cursors,
+            "next": f"{self.base_url}/v1/me/player/recently-played?before={cursors['before']}" if rest else None,
+            "limit": limit,
+        }
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length).decode("utf-8") if length else ""
+                body = {k: v[0] for k, v in parse_qs(raw).items()}
+                with fake.lock:
+                    fake.requests[parsed.path] = fake.requests.get(parsed.path, 0) + 1
+
+                status, payload, extra_headers = fake.handle(
+                    method, parsed.path, parse_qs(parsed.query), body, self.headers
+                )
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in extra_headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+        return Handler
@@ -0,0 +1,178 @@
+"""
+Rate-limit behaviour of the Spotify client against a fake server that injects 429s
+"""
+import sys
+import time
+import asyncio
+import pathlib
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.auth.spotify_client import SpotifyClient
+from src.auth.rate_limit import TokenBucket, BucketRegistry
+from fake_spotify import FakeSpotifyServer
+
+RECENTLY_PLAYED = "/v1/me/player/recently-played"
+
+
+def _client_for(server: FakeSpotifyServer, **kwargs) -> SpotifyClient:
+    return SpotifyClient(accounts_base_url=server.base_url, api_base_url=server.base_url, **kwargs)
+
+
+def test_honors_retry_after_then_succeeds():
+    async def run(server):
+        client = _client_for(server)
+        try:
+            start = time.monotonic()
+            res = await client.api_get("recently-played", RECENTLY_PLAYED, "tok", params={"limit": 20})
+            return res, time.monotonic() - start, client.throttled
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        server.throttle(1, retry_after=0.3)
+        res, elapsed, throttled = asyncio.run(run(server))
+        assert res.status_code == 200
+        assert throttled == 1
+        assert elapsed >= 0.3
+        assert server.requests[RECENTLY_PLAYED] == 2
+
+
+def test_gives_up_when_retry_after_is_too_long():
+    async def run(server):
+        client = _client_for(server)
+        try:
+            return await client.api_get("me", "/v1/me", "tok")
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        server.throttle(1, retry_after=60)
+        res = asyncio.run(run(server))
+        assert res.status_code == 429
+        assert server.requests["/v1/me"] == 1
+
+
+def test_coalesces_identical_inflight_gets():
+    async def run(server):
+        client = _client_for(server)
+        try:
+            results = await asyncio.gather(*[
+                client.api_get("recently-played", RECENTLY_PLAYED, "tok", params={"limit": 20})
+                for _ in range(20)
+            ])
+            return results, client.coalesced
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        server.delay = 0.1
+        results, coalesced = asyncio.run(run(server))
+        assert all(r.status_code == 200 for r in results)
+        assert server.requests[RECENTLY_PLAYED] == 1
+        assert coalesced == 19
+
+
+def test_cancelled_caller_does_not_cancel_coalesced_gets():
+    async def run(server):
+        client = _client_for(server)
+        try:
+            first = asyncio.ensure_future(client.api_get("me", "/v1/me", "tok"))
+            await asyncio.sleep(0.02)
+            second = asyncio.ensure_future(client.api_get("me", "/v1/me", "tok"))
+            await asyncio.sleep(0.02)
+            first.cancel()  # the first caller's client disconnects
+            return await second
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        server.delay = 0.1
+        res = asyncio.run(run(server))
+        assert res.status_code == 200
+        assert server.requests["/v1/me"] == 1
+
+
+def test_serves_cached_response_while_throttled():
+    async def run(server):
+        client = _client_for(server)
+        try:
+            first = await client.api_get("recently-played", RECENTLY_PLAYED, "tok", params={"limit": 20})
+            server.throttle(100, retry_after=60)
+            second = await client.api_get("recently-played", RECENTLY_PLAYED, "tok", params={"limit": 20})
+            # while throttled, repeats are answered locally without touching Spotify
+            third = await client.api_get("recently-played", RECENTLY_PLAYED, "tok", params={"limit": 20})
+            # the cache is keyed on a digest of the bearer token, never the token itself
+            assert all("tok" not in key for key in client._responses)
+            return first, second, third, client.served_stale
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        server.recently_played_items = [{"played_at": "2024-01-01T00:00:00Z"}]
+        first, second, third, served_stale = asyncio.run(run(server))
+        assert first.status_code == second.status_code == third.status_code == 200
+        assert third.json() == first.json()
+        assert served_stale == 2
+        assert server.requests[RECENTLY_PLAYED] == 2
+
+
+def test_per_user_bucket_limits_one_user_only():
+    async def run(server):
+        client = _client_for(server, user_buckets=BucketRegistry(rate=5, capacity=2))
+        try:
+            start = time.monotonic()
+            # 5 distinct calls for one user: 2 burst + 3 at 5/s
+            for i in range(5):
+                await client.api_get("recently-played", RECENTLY_PLAYED, "heavy-user", params={"limit": i + 1})
+            heavy = time.monotonic() - start
+
+            start = time.monotonic()
+            await asyncio.gather(*[client.api_get("me", "/v1/me", f"user-{i}") for i in range(5)])
+            light = time.monotonic() - start
+            return heavy, light
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        heavy, light = asyncio.run(run(server))
+        assert heavy >= 0.4
+        assert light < heavy
+
+
+def test_user_bucket_outlives_token_refreshes():
+    async def run(server):
+        client = _client_for(server, user_buckets=BucketRegistry(rate=5, capacity=2))
+        try:
+            start = time.monotonic()
+            # a fresh access token each call, as after refreshes: still one user's bucket
+            for i in range(4):
+                await client.api_get("me", "/v1/me", f"token-{i}", user_id="u1")
+            await client.post_token(
+                data={"grant_type": "refresh_token", "refresh_token": "r"}, authorization="Basic test", user_id="u1"
+            )
+            return time.monotonic() - start, len(client.user_buckets)
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        elapsed, buckets = asyncio.run(run(server))
+        # 2 burst + 3 at 5/s
+        assert elapsed >= 0.5
+        assert buckets == 1
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=100, capacity=5)
+
+    async def run():
+        start = time.monotonic()
+        for _ in range(25):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+    # 5 from the burst, 20 more at 100/s
+    assert 0.18 <= elapsed < 1.0
@@ -0,0 +1,83 @@
+"""
+Tests for the shared Spotify client against a local stand-in server
+"""
+import sys
+import asyncio
+import pathlib
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.auth.spotify_client import SpotifyClient
+from fake_spotify import FakeSpotifyServer
+
+
+def _client_for(server: FakeSpotifyServer) -> SpotifyClient:
+    return SpotifyClient(accounts_base_url=server.base_url, api_base_url=server.base_url)
+
+
+def test_callback_flow_reuses_connection():
+    """Token exchange followed by /me should share one pooled connection"""
+    async def run(server):
+        client = _client_for(server)
+        try:
+            token_res = await client.post_token(
+                data={"grant_type": "authorization_code", "code": "abc", "redirect_uri": "http://x"},
+                authorization="Basic test",
+            )
+            assert token_res.status_code == 200
+            access_token = token_res.json()["access_token"]
+
+            me_res = await client.api_get("me", "/v1/me", access_token)
+            assert me_res.status_code == 200
+            assert me_res.json()["id"] == "spotify-user-1"
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        asyncio.run(run(server))
+        assert server.connections == 1
+        assert server.requests == {"/api/token": 1, "/v1/me": 1}
+
+
+def test_records_per_endpoint_latency():
+    """Each logical endpoint gets its own latency counters"""
+    async def run(server):
+        client = _client_for(server)
+        try:
+            for _ in range(5):
+                await client.api_get("recently-played", "/v1/me/player/recently-played", "tok", params={"limit": 20})
+            await client.post_token(data={"grant_type": "refresh_token", "refresh_token": "r"}, authorization="Basic test")
+            return client.latency_stats()
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        stats = asyncio.run(run(server))
+
+    assert set(stats) == {"recently-played", "token:refresh_token"}
+    assert stats["recently-played"]["count"] == 5
+    assert stats["recently-played"]["errors"] == 0
+    assert stats["recently-played"]["p95_ms"] >= stats["recently-played"]["p50_ms"] > 0
+    assert stats["token:refresh_token"]["count"] == 1
+
+
+def test_concurrent_calls_share_pool():
+    """A burst of concurrent calls is served from a bounded set of pooled connections"""
+    async def run(server):
+        client = _client_for(server)
+        try:
+            for _ in range(3):
+                results = await asyncio.gather(*[
+                    client.api_get("me", "/v1/me", f"tok-{i}") for i in range(10)
+                ])
+                assert all(r.status_code == 200 for r in results)
+        finally:
+            await client.aclose()
+
+    with FakeSpotifyServer() as server:
+        asyncio.run(run(server))
+        assert server.requests["/v1/me"] == 30
+        # later bursts reuse keep-alive connections opened by the first one
+        assert server.connections <= 10
@@ -0,0 +1,124 @@
+"""
+Tests for the Spotify token cache (TTL hits and single-flight refresh)
+"""
+import sys
+import asyncio
+import pathlib
+from datetime import datetime, timedelta
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.auth.token_cache import TokenCache
+
+
+class FakeTokenStore:
+    """Stands in for the Firestore token functions"""
+
+    def __init__(self, expires_at):
+        self.loads = 0
+        self.writes = []
+        self.doc = {"accessToken": "old", "refreshToken": "refresh-1", "expiresAt": expires_at}
+
+    def load(self, firebase_user_id):
+        self.loads += 1
+        return dict(self.doc)
+
+    def write(self, firebase_user_id, access_token, expires_in, refresh_token=None):
+        self.writes.append((firebase_user_id, access_token, expires_in, refresh_token))
+
+
+def test_cached_reads_hit_firestore_once():
+    store = FakeTokenStore(datetime.utcnow() + timedelta(hours=1))
+    cache = TokenCache(loader=store.load, writer=store.write)
+
+    async def run():
+        for _ in range(10):
+            state = await cache.get("user-1")
+            assert state.access_token == "old"
+            assert not state.is_expired()
+
+    asyncio.run(run())
+    assert store.loads == 1
+
+
+def test_least_recently_used_users_are_evicted():
+    store = FakeTokenStore(datetime.utcnow() + timedelta(hours=1))
+    cache = TokenCache(loader=store.load, writer=store.write, max_users=2)
+
+    async def run():
+        await cache.get("a")
+        await cache.get("b")
+        await cache.get("a")  # b is now the least recently used
+        await cache.get("c")
+
+    asyncio.run(run())
+    assert list(cache._entries) == ["a", "c"]
+    assert cache.peek("b") is None
+    assert store.loads == 3
+
+
+def test_concurrent_refresh_is_single_flight():
+    store = FakeTokenStore(datetime.utcnow() - timedelta(minutes=1))
+    cache = TokenCache(loader=store.load, writer=store.write)
+    calls = []
+
+    async def refresher(refresh_token, firebase_user_id):
+        calls.append(refresh_token)
+        await asyncio.sleep(0.05)
+        return {"access_token": "new", "expires_in": 3600, "refresh_token": "refresh-2"}
+
+    async def run():
+        state = await cache.get("user-1")
+        assert state.is_expired()
+        results = await asyncio.gather(*[cache.refresh("user-1", refresher) for _ in range(25)])
+        await cache.drain()
+        return results
+
+    results = asyncio.run(run())
+    assert calls == ["refresh-1"]
+    assert {r.access_token for r in results} == {"new"}
+    assert results[0].refresh_token == "refresh-2"
+    # write-through happened once, off the request path
+    assert store.writes == [("user-1", "new", 3600, "refresh-2")]
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_refresh():
+    store = FakeTokenStore(datetime.utcnow() - timedelta(minutes=1))
+    cache = TokenCache(loader=store.load, writer=store.write)
+
+    async def refresher(refresh_token, firebase_user_id):
+        await asyncio.sleep(0.05)
+        return {"access_token": "new", "expires_in": 3600}
+
+    async def run():
+        first = asyncio.ensure_future(cache.refresh("user-1", refresher))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(cache.refresh("user-1", refresher))
+        await asyncio.sleep(0)
+        first.cancel()  # the request that started the refresh goes away
+        state = await second
+        await cache.drain()
+        return state
+
+    assert asyncio.run(run()).access_token == "new"
+    assert store.writes == [("user-1", "new", 3600, None)]
+
+
+def test_failed_refresh_propagates_to_all_waiters():
+    store = FakeTokenStore(datetime.utcnow() - timedelta(minutes=1))
+    cache = TokenCache(loader=store.load, writer=store.write)
+
+    async def refresher(refresh_token, firebase_user_id):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("spotify down")
+
+    async def run():
+        return await asyncio.gather(
+            *[cache.refresh("user-1", refresher) for _ in range(5)], return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert store.writes == []
@@ -0,0 +1,102 @@
+"""
+Tests for the background token refresh scheduler
+"""
+import sys
+import time
+import asyncio
+import pathlib
+from datetime import datetime, timedelta
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.auth.token_cache import TokenCache
+from src.auth.token_refresh_scheduler import TokenRefreshScheduler
+from src.auth.spotify_client import SpotifyRateLimitError
+
+
+def _token_docs(n, expires_in_seconds):
+    expires_at = datetime.utcnow() + timedelta(seconds=expires_in_seconds)
+    return {
+        f"user-{i}": {"accessToken": "old", "refreshToken": f"refresh-{i}", "expiresAt": expires_at}
+        for i in range(n)
+    }
+
+
+def test_refreshes_before_expiry_with_bounded_concurrency():
+    docs = _token_docs(8, expires_in_seconds=2)
+    active = 0
+    max_active = 0
+
+    async def refresher(refresh_token, firebase_user_id):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.05)
+        active -= 1
+        return {"access_token": "new", "expires_in": 3600}
+
+    async def run():
+        cache = TokenCache(loader=lambda uid: dict(docs[uid]), writer=lambda *args: None)
+        # margin larger than the remaining lifetime: capped at half of it, so every token is due after ~1s
+        scheduler = TokenRefreshScheduler(cache, refresher, margin_seconds=60, concurrency=3)
+        cache.add_listener(scheduler.on_token_state)
+        scheduler.start()
+        try:
+            for uid in docs:
+                await cache.get(uid)
+            await asyncio.sleep(1.5)
+            # tokens were refreshed before they expired, so no request would refresh inline
+            assert all(not cache.peek(uid).is_expired() for uid in docs)
+            assert {cache.peek(uid).access_token for uid in docs} == {"new"}
+            # rescheduled for the next expiry
+            assert scheduler.pending() == len(docs)
+        finally:
+            await scheduler.stop()
+            await cache.drain()
+
+    asyncio.run(run())
+    assert max_active <= 3
+
+
+def test_backs_off_on_rate_limit():
+    docs = _token_docs(3, expires_in_seconds=2)
+    calls = []
+
+    async def refresher(refresh_token, firebase_user_id):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise SpotifyRateLimitError(retry_after=0.3)
+        return {"access_token": "new", "expires_in": 3600}
+
+    async def run():
+        cache = TokenCache(loader=lambda uid: dict(docs[uid]), writer=lambda *args: None)
+        scheduler = TokenRefreshScheduler(cache, refresher, margin_seconds=60, concurrency=1)
+        cache.add_listener(scheduler.on_token_state)
+        scheduler.start()
+        try:
+            for uid in docs:
+                await cache.get(uid)
+            await asyncio.sleep(1.8)
+            assert scheduler.rate_limited == 1
+            assert {cache.peek(uid).access_token for uid in docs} == {"new"}
+        finally:
+            await scheduler.stop()
+            await cache.drain()
+
+    asyncio.run(run())
+    # nothing was sent to Spotify during the Retry-After window
+    assert calls[1] - calls[0] >= 0.3
+
+
+def test_margin_is_capped_at_half_the_token_lifetime():
+    async def refresher(refresh_token, firebase_user_id):
+        return {"access_token": "new", "expires_in": 3600}
+
+    scheduler = TokenRefreshScheduler(TokenCache(loader=lambda uid: None, writer=lambda *args: None), refresher, margin_seconds=300)
+    now = time.time()
+    scheduler.schedule("short", datetime.utcnow() + timedelta(seconds=100))
+    scheduler.schedule("long", datetime.utcnow() + timedelta(seconds=3600))
+    assert abs(scheduler._due["short"] - (now + 50)) < 1
+    assert abs(scheduler._due["long"] - (now + 3300)) < 1
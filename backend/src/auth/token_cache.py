@@ -0,0 +1,219 @@
+"""
+In-process cache of Spotify token state, keyed by Firebase user ID.
+Sits in front of get_spotify_tokens/update_spotify_access_token so hot paths
+don't hit the storage backend on every request, and makes expired-token refresh
+single-flight: one refresh per user serves every concurrent waiter.
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from ..storage.async_storage import run_sync
+from ..storage.backend import get_storage
+from ..storage.firestore_storage import ONE_HOUR_IN_SECONDS
+
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+TOKEN_CACHE_MAX_USERS = int(os.getenv("TOKEN_CACHE_MAX_USERS", "10000"))
+# Treat tokens as expired slightly early so they don't lapse mid-request
+EXPIRY_SKEW_SECONDS = 30
+
+
+def to_utc_naive(value) -> Optional[datetime]:
+    """Normalize a Firestore Timestamp / datetime to a naive UTC datetime"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            return datetime.utcfromtimestamp(value.timestamp())
+        return value
+    if hasattr(value, 'timestamp'):
+        return datetime.utcfromtimestamp(value.timestamp())
+    return None
+
+
+@dataclass
+class TokenState:
+    """Decrypted token state for one user"""
+    firebase_user_id: str
+    access_token: Optional[str]
+    refresh_token: Optional[str]
+    expires_at: Optional[datetime]
+    spotify_user_id: Optional[str] = None
+    scope: Optional[str] = None
+    cached_at: float = 0.0
+    last_used: float = 0.0
+
+    @classmethod
+    def from_doc(cls, firebase_user_id: str, token_data: dict) -> "TokenState":
+        return cls(
+            firebase_user_id=firebase_user_id,
+            access_token=token_data.get("accessToken"),
+            refresh_token=token_data.get("refreshToken"),
+            expires_at=to_utc_naive(token_data.get("expiresAt")),
+            spotify_user_id=token_data.get("spotifyUserId"),
+            scope=token_data.get("scope"),
+            cached_at=time.monotonic(),
+            last_used=time.monotonic(),
+        )
+
+    def is_expired(self, skew_seconds: int = EXPIRY_SKEW_SECONDS) -> bool:
+        if self.expires_at is None:
+            return False
+        return self.expires_at - timedelta(seconds=skew_seconds) <= datetime.utcnow()
+
+
+# Refresher: takes a refresh token and the Firebase user it belongs to, returns Spotify's token JSON
+Refresher = Callable[[str, str], Awaitable[dict]]
+# Listener: notified whenever a user's token state is loaded, stored or refreshed
+Listener = Callable[[TokenState], None]
+
+
+class TokenCache:
+    """
+    TTL cache of TokenState with single-flight refresh and background write-through,
+    bounded to the max_users most recently used users
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = TOKEN_CACHE_TTL_SECONDS,
+        loader: Optional[Callable[[str], Optional[dict]]] = None,
+        writer: Optional[Callable[..., None]] = None,
+        max_users: int = TOKEN_CACHE_MAX_USERS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        # Default to the storage backend chosen at startup
+        self._loader = loader or (lambda *args: get_storage().get_spotify_tokens(*args))
+        self._writer = writer or (lambda *args: get_storage().update_spotify_access_token(*args))
+        # least recently used first
+        self._entries: "OrderedDict[str, TokenState]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Future] = {}
+        self._pending_writes: Set[asyncio.Task] = set()
+        self._listeners: List[Listener] = []
+
+    def add_listener(self, listener: Listener):
+        """Register a callback for token state changes (e.g. the refresh scheduler)"""
+        self._listeners.append(listener)
+
+    def _set(self, state: TokenState):
+        self._entries[state.firebase_user_id] = state
+        self._entries.move_to_end(state.firebase_user_id)
+        while len(self._entries) > self.max_users:
+            # an evicted user is loaded from storage again if they come back
+            self._entries.popitem(last=False)
+        for listener in self._listeners:
+            listener(state)
+
+    def peek(self, firebase_user_id: str) -> Optional[TokenState]:
+        """Cached state without loading or touching it"""
+        return self._entries.get(firebase_user_id)
+
+    def _fresh(self, state: TokenState) -> bool:
+        return time.monotonic() - state.cached_at < self.ttl_seconds
+
+    async def get(self, firebase_user_id: str) -> Optional[TokenState]:
+        """Cached token state, loading from storage on miss or TTL expiry"""
+        return await self._get(firebase_user_id, touch=True)
+
+    async def _get(self, firebase_user_id: str, touch: bool) -> Optional[TokenState]:
+        """touch=False is for background callers that must not count as user activity"""
+        previous = self._entries.get(firebase_user_id)
+        if previous is not None and self._fresh(previous):
+            if touch:
+                previous.last_used = time.monotonic()
+                self._entries.move_to_end(firebase_user_id)
+            return previous
+
+        token_data = await run_sync(self._loader, firebase_user_id)
+        if not token_data:
+            self._entries.pop(firebase_user_id, None)
+            return None
+
+        state = TokenState.from_doc(firebase_user_id, token_data)
+        if not touch and previous is not None:
+            state.last_used = previous.last_used
+        self._set(state)
+        return state
+
+    def store(self, firebase_user_id: str, token_data: dict) -> TokenState:
+        """Populate the cache from a token doc we just wrote (e.g. after OAuth callback)"""
+        state = TokenState.from_doc(firebase_user_id, token_data)
+        self._set(state)
+        return state
+
+    def invalidate(self, firebase_user_id: str):
+        self._entries.pop(firebase_user_id, None)
+
+    async def refresh(self, firebase_user_id: str, refresher: Refresher, min_ttl_seconds: int = 0) -> TokenState:
+        """
+        Refresh the user's access token. Concurrent callers for the same user
+        share one Spotify round-trip; the Firestore update happens in the background.
+        Tokens valid for more than min_ttl_seconds are returned unchanged.
+        """
+        pending = self._refreshing.get(firebase_user_id)
+        if pending is None:
+            # A task of its own, so a caller that goes away only stops waiting; the others still get the token
+            pending = asyncio.ensure_future(self._refresh(firebase_user_id, refresher, min_ttl_seconds))
+            self._refreshing[firebase_user_id] = pending
+            pending.add_done_callback(lambda task: self._refreshing.pop(firebase_user_id, None))
+        return await asyncio.shield(pending)
+
+    async def _refresh(self, firebase_user_id: str, refresher: Refresher, min_ttl_seconds: int) -> TokenState:
+        state = await self._get(firebase_user_id, touch=False)
+        if state is None or not state.refresh_token:
+            raise LookupError(f"No refresh token stored for user {firebase_user_id}")
+
+        if not state.is_expired(skew_seconds=max(EXPIRY_SKEW_SECONDS, min_ttl_seconds)):
+            # Someone else refreshed it (e.g. another worker via Firestore)
+            return state
+
+        data = await refresher(state.refresh_token, firebase_user_id)
+        return self._apply_refresh(state, data)
+
+    def _apply_refresh(self, state: TokenState, data: dict) -> TokenState:
+        """Update cached state from Spotify's refresh response and write through to storage"""
+        access_token = data["access_token"]
+        expires_in = int(data["expires_in"])
+        refresh_token = data.get("refresh_token")  # Spotify sometimes rotates it
+
+        new_state = TokenState(
+            firebase_user_id=state.firebase_user_id,
+            access_token=access_token,
+            refresh_token=refresh_token or state.refresh_token,
+            expires_at=datetime.utcnow() + timedelta(seconds=min(expires_in, ONE_HOUR_IN_SECONDS)),
+            spotify_user_id=state.spotify_user_id,
+            scope=state.scope,
+            cached_at=time.monotonic(),
+            last_used=state.last_used,
+        )
+        self._set(new_state)
+        self._write_behind(state.firebase_user_id, access_token, expires_in, refresh_token)
+        return new_state
+
+    def _write_behind(self, firebase_user_id: str, access_token: str, expires_in: int, refresh_token: Optional[str]):
+        async def write():
+            try:
+                await run_sync(
+                    self._writer, firebase_user_id, access_token, expires_in, refresh_token
+                )
+            except Exception as e:
+                # The cache still holds the new token; next load from Firestore may refresh again
+                print(f"Error writing refreshed token for user {firebase_user_id}: {e}")
+
+        task = asyncio.get_running_loop().create_task(write())
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def drain(self):
+        """Wait for background storage writes (call at shutdown)"""
+        if self._pending_writes:
+            await asyncio.gather(*list(self._pending_writes), return_exceptions=True)
+
+
+# Global instance for the Spotify routes
+token_cache = TokenCache()
@@ -0,0 +1,165 @@
+"""
+Background scheduler that refreshes Spotify access tokens shortly before they
+expire, so user-facing requests almost never pay for an inline refresh.
+Expiry times live in a min-heap; refreshes run with bounded concurrency and
+back off globally when Spotify rate-limits us.
+"""
+import os
+import time
+import heapq
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from .token_cache import TokenCache, TokenState, Refresher
+from .spotify_client import SpotifyRateLimitError
+
+REFRESH_MARGIN_SECONDS = int(os.getenv("SPOTIFY_REFRESH_MARGIN_SECONDS", "300"))
+REFRESH_CONCURRENCY = int(os.getenv("SPOTIFY_REFRESH_CONCURRENCY", "4"))
+# Stop refreshing users who haven't used the app for this long
+REFRESH_ACTIVE_WINDOW_SECONDS = int(os.getenv("SPOTIFY_REFRESH_ACTIVE_WINDOW_SECONDS", str(24 * 3600)))
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 300.0
+
+
+class TokenRefreshScheduler:
+    """
+    Min-heap of (refresh_at, firebase_user_id). Entries are lazily invalidated:
+    only the most recent due time recorded in _due for a user is acted on.
+    """
+
+    def __init__(
+        self,
+        cache: TokenCache,
+        refresher: Refresher,
+        margin_seconds: int = REFRESH_MARGIN_SECONDS,
+        concurrency: int = REFRESH_CONCURRENCY,
+        active_window_seconds: int = REFRESH_ACTIVE_WINDOW_SECONDS,
+    ):
+        self.cache = cache
+        self.refresher = refresher
+        self.margin_seconds = margin_seconds
+        self.active_window_seconds = active_window_seconds
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._backoff_until = 0.0
+        self.refreshed = 0
+        self.rate_limited = 0
+
+    # -- scheduling --
+
+    def on_token_state(self, state: TokenState):
+        """TokenCache listener: (re)schedule whenever a user's expiry changes"""
+        if state.expires_at is not None and state.refresh_token:
+            self.schedule(state.firebase_user_id, state.expires_at)
+
+    def schedule(self, firebase_user_id: str, expires_at: datetime):
+        """
+        Refresh firebase_user_id margin_seconds before expires_at (naive UTC). The margin is
+        capped at half the remaining lifetime, so a margin configured at or above the token
+        lifetime doesn't make every new token due at once (and refreshed in a loop).
+        """
+        expires_in = (expires_at - datetime.utcnow()).total_seconds()
+        margin = min(self.margin_seconds, expires_in / 2)
+        self._push(firebase_user_id, time.time() + expires_in - margin)
+
+    def unschedule(self, firebase_user_id: str):
+        self._due.pop(firebase_user_id, None)
+        self._failures.pop(firebase_user_id, None)
+
+    def _push(self, firebase_user_id: str, due_at: float):
+        if self._due.get(firebase_user_id) == due_at:
+            return
+        self._due[firebase_user_id] = due_at
+        heapq.heappush(self._heap, (due_at, firebase_user_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._due)
+
+    # -- lifecycle --
+
+    def start(self):
+        """Start the scheduler loop on the running event loop"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            wait = None
+
+            if now < self._backoff_until:
+                wait = self._backoff_until - now
+            else:
+                while self._heap and self._heap[0][0] <= now:
+                    due_at, firebase_user_id = heapq.heappop(self._heap)
+                    if self._due.get(firebase_user_id) != due_at:
+                        continue  # superseded by a later schedule() call
+                    del self._due[firebase_user_id]
+                    task = asyncio.get_running_loop().create_task(self._refresh_one(firebase_user_id))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+                if self._heap:
+                    wait = self._heap[0][0] - now
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refresh_one(self, firebase_user_id: str):
+        async with self._semaphore:
+            # Respect a rate-limit backoff that started while we were queued
+            delay = self._backoff_until - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            state = self.cache.peek(firebase_user_id)
+            if state is None or time.monotonic() - state.last_used > self.active_window_seconds:
+                # Inactive (or evicted from the cache) user; they'll refresh inline if they come back
+                self.unschedule(firebase_user_id)
+                self.cache.invalidate(firebase_user_id)
+                return
+
+            try:
+                # refresh() reschedules us through the cache listener when the token changes
+                state = await self.cache.refresh(firebase_user_id, self.refresher, min_ttl_seconds=self.margin_seconds)
+                self._failures.pop(firebase_user_id, None)
+                self.refreshed += 1
+                if firebase_user_id not in self._due:
+                    self.on_token_state(state)
+            except SpotifyRateLimitError as e:
+                self.rate_limited += 1
+                self._backoff_until = max(self._backoff_until, time.time() + e.retry_after)
+                self._push(firebase_user_id, self._backoff_until)
+            except LookupError:
+                # Tokens deleted or no refresh token; nothing to keep fresh
+                self.unschedule(firebase_user_id)
+            except Exception as e:
+                failures = self._failures.get(firebase_user_id, 0) + 1
+                self._failures[firebase_user_id] = failures
+                retry_in = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (failures - 1))
+                print(f"Token refresh failed for user {firebase_user_id} (attempt {failures}): {e}")
+                self._push(firebase_user_id, time.time() + retry_in)
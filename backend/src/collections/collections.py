@@ -1,82 +1,190 @@
-from fastapi import APIRouter
-from typing import Optional
+"""
+Collections API routes: user-created sets of catalog tracks.
+Collections are stored through the storage layer with songCount, lastUpdated
+and their first few track ids kept on the collection itself, so listing a
+user's collections is one query. Tracks are hydrated from the catalog in one
+bulk lookup per response. Smart collections are built on the fly from the
+user's tagged and played tracks by ml/smart_collections.py.
+"""
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+from ..ml.dataset_loader import get_preprocessor
+from ..ml.smart_collections import build_smart_collections
+from ..storage import async_storage
+from ..storage.backend import MOODS
+from ..storage.listening_events import listening_event_store
+from ..analytics.analytics import MOOD_COLORS
 
 router = APIRouter()
 
-@router.get("/api/collections")
-async def get_collections():
-    """Get user's music collections/playlists"""
-    # Mock data for now
-    collections = [
-        {
-            "id": 1,
-            "name": "Happy Vibes",
-            "mood": "Happy",
-            "songCount": 25,
-            "lastUpdated": "2 days ago",
-            "color": "#4CAF50",
-            "songs": [
-                {"title": "Blinding Lights", "artist": "The Weeknd"},
-                {"title": "Levitating", "artist": "Dua Lipa"},
-                {"title": "Good as Hell", "artist": "Lizzo"}
-            ]
-        },
-        {
-            "id": 2,
-            "name": "Chill Nights",
-            "mood": "Calm",
-            "songCount": 18,
-            "lastUpdated": "1 week ago",
-            "color": "#9C27B0",
-            "songs": [
-                {"title": "Watermelon Sugar", "artist": "Harry Styles"},
-                {"title": "Sunflower", "artist": "Post Malone"},
-                {"title": "Circles", "artist": "Post Malone"}
-            ]
-        },
-        {
-            "id": 3,
-            "name": "Workout Energy",
-            "mood": "Energized",
-            "songCount": 32,
-            "lastUpdated": "3 days ago",
-            "color": "#FFC107",
-            "songs": [
-                {"title": "Thunder", "artist": "Imagine Dragons"},
-                {"title": "Believer", "artist": "Imagine Dragons"},
-                {"title": "Stronger", "artist": "Kelly Clarkson"}
-            ]
-        },
-        {
-            "id": 4,
-            "name": "Rainy Day Blues",
-            "mood": "Sad",
-            "songCount": 15,
-            "lastUpdated": "5 days ago",
-            "color": "#2196F3",
+DEFAULT_COLOR = "#4CAF50"
+# Upper bound on tracks added or removed in one request
+MAX_TRACKS_PER_REQUEST = 500
+# Most recent plays grouped into smart collections
+SMART_COLLECTION_PLAYS = 2000
+SMART_COLLECTION_FIELDS = ["trackId", "mood"]
+
+class CreateCollectionRequest(BaseModel):
+    firebase_user_id: str
+    name: str = Field(..., min_length=1, max_length=100)
+    mood: Optional[str] = None
+    color: Optional[str] = Field(None, max_length=20)
+
+class CollectionTracksRequest(BaseModel):
+    firebase_user_id: str
+    track_ids: List[str] = Field(..., min_length=1, max_length=MAX_TRACKS_PER_REQUEST)
+
+def _hydrate(track_ids: List[str]) -> List[dict]:
+    """Catalog metadata for each track id, in order; tracks no longer in the catalog keep just their id"""
+    preprocessor = get_preprocessor()
+    rows = preprocessor.find_track_indices(track_ids)
+    found = iter(preprocessor.get_tracks_by_indices(rows))
+    return [next(found) if row >= 0 else {"track_id": track_id} for track_id, row in zip(track_ids, rows.tolist())]
+
+def _render_collections(collections: List[dict]) -> List[dict]:
+    """Collections as the frontend shows them, with every preview hydrated in one lookup"""
+    previews = iter(_hydrate([track_id for c in collections for track_id in c["previewTrackIds"]]))
+    rendered = []
+    for collection in collections:
+        songs = [next(previews) for _ in collection["previewTrackIds"]]
+        rendered.append({
+            "id": collection["id"],
+            "name": collection["name"],
+            "mood": collection["mood"],
+            "color": collection["color"] or MOOD_COLORS.get(collection["mood"], DEFAULT_COLOR),
+            "songCount": collection["songCount"],
+            "createdAt": collection["createdAt"],
+            "lastUpdated": collection["lastUpdated"],
             "songs": [
-                {"title": "Someone Like You", "artist": "Adele"},
-                {"title": "Fix You", "artist": "Coldplay"},
-                {"title": "Hurt", "artist": "Johnny Cash"}
-            ]
-        }
-    ]
-    
+                {"track_id": song["track_id"], "title": song.get("track_name"), "artist": song.get("artists")}
+                for song in songs
+            ],
+        })
+    return rendered
+
+@router.get("/api/collections")
+async def get_collections(firebase_user_id: str = Query(..., description="Firebase user ID")):
+    """Get user's music collections, most recently updated first"""
+    try:
+        collections = await async_storage.list_collections(firebase_user_id)
+        rendered = await run_in_threadpool(_render_collections, collections)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching collections: {str(e)}")
+
+    return {"collections": rendered}
+
+def _build_smart_collections(firebase_user_id: str, sessions: List[dict]) -> List[dict]:
+    events = listening_event_store.recent(firebase_user_id, SMART_COLLECTION_PLAYS)
+    collections = build_smart_collections(sessions, events)
+    for collection in collections:
+        collection["color"] = MOOD_COLORS.get(collection["mood"], DEFAULT_COLOR)
+    return collections
+
+@router.get("/api/collections/smart")
+async def get_smart_collections(firebase_user_id: str = Query(..., description="Firebase user ID")):
+    """
+    Smart collections: the user's tagged and recently played tracks grouped into sub-moods
+    (a mood within one cluster of similar-sounding catalog tracks), each with a few suggestions
+    """
+    try:
+        sessions = await async_storage.get_user_sessions(firebase_user_id, fields=SMART_COLLECTION_FIELDS)
+        collections = await run_in_threadpool(_build_smart_collections, firebase_user_id, sessions)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error building smart collections: {str(e)}")
+
     return {"collections": collections}
 
 @router.post("/api/collections")
-async def create_collection(name: str, mood: str):
-    """Create a new music collection"""
-    # Mock implementation
-    return {
-        "success": True,
-        "collection": {
-            "id": 999,
-            "name": name,
-            "mood": mood,
-            "songCount": 0,
-            "lastUpdated": "just now",
-            "color": "#4CAF50",
-            "songs": []
-        }
-    }
+async def create_collection(request: CreateCollectionRequest):
+    """Create a new, empty music collection"""
+    if request.mood is not None and request.mood not in MOODS:
+        raise HTTPException(status_code=400, detail=f"Invalid mood. Must be one of {MOODS}")
+
+    try:
+        collection = await async_storage.create_collection(
+            request.firebase_user_id, request.name, request.mood, request.color
+        )
+        rendered = await run_in_threadpool(_render_collections, [collection])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating collection: {str(e)}")
+
+    return {"success": True, "collection": rendered[0]}
+
+@router.delete("/api/collections/{collection_id}")
+async def delete_collection(collection_id: str, firebase_user_id: str = Query(..., description="Firebase user ID")):
+    """Delete a collection and all of its tracks"""
+    try:
+        deleted = await async_storage.delete_collection(firebase_user_id, collection_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting collection: {str(e)}")
+
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Collection not found")
+    return {"success": True}
+
+@router.get("/api/collections/{collection_id}/tracks")
+async def get_collection_tracks(
+    collection_id: str,
+    firebase_user_id: str = Query(..., description="Firebase user ID"),
+    limit: int = Query(50, ge=1, le=100, description="Page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """
+    Get a collection's tracks in the order they were added, one page at a time, with catalog metadata.
+    Pass the returned next_cursor to get the following page; it is null on the last page.
+    """
+    try:
+        page = await async_storage.get_collection_tracks_page(firebase_user_id, collection_id, limit, cursor)
+        if page is None:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        tracks, next_cursor = page
+        hydrated = await run_in_threadpool(_hydrate, [track["trackId"] for track in tracks])
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching collection tracks: {str(e)}")
+
+    for track_info, track in zip(hydrated, tracks):
+        track_info["added_at"] = track["addedAt"]
+    return {"count": len(hydrated), "tracks": hydrated, "next_cursor": next_cursor}
+
+@router.post("/api/collections/{collection_id}/tracks")
+async def add_collection_tracks(collection_id: str, request: CollectionTracksRequest):
+    """
+    Add many tracks to a collection in one write. Tracks already in it are skipped;
+    track ids that aren't in the catalog are not added and are returned as unknown_track_ids.
+    """
+    try:
+        rows = await run_in_threadpool(lambda: get_preprocessor().find_track_indices(request.track_ids))
+        known = [track_id for track_id, row in zip(request.track_ids, rows.tolist()) if row >= 0]
+        unknown = [track_id for track_id, row in zip(request.track_ids, rows.tolist()) if row < 0]
+        collection = await async_storage.add_collection_tracks(request.firebase_user_id, collection_id, known)
+        if collection is None:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        rendered = await run_in_threadpool(_render_collections, [collection])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding tracks: {str(e)}")
+
+    return {"success": True, "collection": rendered[0], "unknown_track_ids": unknown}
+
+@router.post("/api/collections/{collection_id}/tracks/remove")
+async def remove_collection_tracks(collection_id: str, request: CollectionTracksRequest):
+    """Remove many tracks from a collection in one write; ids not in the collection are ignored"""
+    try:
+        collection = await async_storage.remove_collection_tracks(request.firebase_user_id, collection_id, request.track_ids)
+        if collection is None:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        rendered = await run_in_threadpool(_render_collections, [collection])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error removing tracks: {str(e)}")
+
+    return {"success": True, "collection": rendered[0]}
@@ -0,0 +1,53 @@
+"""
+Route-level tests for the collection endpoints
+"""
+import sys
+import pathlib
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.backend import init_storage, close_storage
+from src.storage.sqlite_storage import SQLiteStorageBackend
+from src.collections import collections
+from src.collections.collections import router
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, fake_catalog):
+    catalog = fake_catalog(n=10)
+    callers = []
+
+    def get_preprocessor():
+        callers.append(threading.current_thread())
+        return catalog
+
+    monkeypatch.setattr(collections, "get_preprocessor", get_preprocessor)
+    init_storage(SQLiteStorageBackend(str(tmp_path / "test.db")))
+    app = FastAPI()
+    app.include_router(router)
+    with TestClient(app) as test_client:
+        yield test_client, callers
+    close_storage()
+
+
+def test_catalog_lookups_run_off_the_event_loop(client):
+    client, callers = client
+    loop_thread = client.portal.call(threading.current_thread)
+
+    created = client.post("/api/collections", json={"firebase_user_id": "u1", "name": "Mix"}).json()
+    collection_id = created["collection"]["id"]
+    added = client.post(
+        f"/api/collections/{collection_id}/tracks",
+        json={"firebase_user_id": "u1", "track_ids": ["t1", "missing", "t2"]},
+    ).json()
+
+    assert added["unknown_track_ids"] == ["missing"]
+    assert [song["track_id"] for song in added["collection"]["songs"]] == ["t1", "t2"]
+    assert len(callers) >= 2 and loop_thread not in callers
@@ -0,0 +1,39 @@
+"""
+Fixtures shared by the test packages
+"""
+import numpy as np
+import pytest
+
+
+class FakeCatalog:
+    """
+    Stand-in for the preprocessed catalog: row i is track t{i} with random features,
+    except the rows listed in duplicates, which repeat another row's track (the same
+    song listed under a second genre).
+    """
+
+    def __init__(self, n=500, d=8, seed=0, duplicates=None):
+        self.feature_matrix = np.random.default_rng(seed).normal(size=(n, d))
+        self.version = "v1"
+        self.track_ids = [f"t{(duplicates or {}).get(row, row)}" for row in range(n)]
+        self.rows = {}
+        for row, track_id in enumerate(self.track_ids):
+            self.rows.setdefault(track_id, []).append(row)
+
+    def find_track_indices(self, track_ids):
+        return np.array([self.rows.get(t, [-1])[0] for t in track_ids], dtype=np.int64)
+
+    def find_track_rows(self, track_ids):
+        return np.unique(np.array([row for t in track_ids for row in self.rows.get(t, [])], dtype=np.int64))
+
+    def get_tracks_by_indices(self, indices):
+        return [
+            {"track_id": self.track_ids[i], "track_name": f"song {i}", "artists": "someone"}
+            for i in indices
+        ]
+
+
+@pytest.fixture
+def fake_catalog():
+    """Builds a FakeCatalog, e.g. fake_catalog(n=3000, d=12, duplicates={2500: 1})"""
+    return FakeCatalog
@@ -0,0 +1 @@
+# Listening history module
@@ -0,0 +1,147 @@
+"""
+Incremental ingestion of a user's Spotify recently-played history into the
+local listening-event store. Each poll fetches only plays newer than the
+user's high-water mark, walking Spotify's before/after cursors.
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from ..auth.spotify_client import SpotifyClient, parse_retry_after
+from ..storage.listening_events import ListeningEventStore, listening_event_store, played_at_ms
+from ..analytics.rollups import analytics_rollups
+from ..recommendations.played_tracks import played_track_filters
+
+SPOTIFY_RECENTLY_PLAYED_PATH = "/v1/me/player/recently-played"
+PAGE_LIMIT = 50  # Spotify's maximum
+MAX_PAGES = 20
+# Don't poll Spotify for the same user more often than this
+INGEST_MIN_INTERVAL_SECONDS = float(os.getenv("INGEST_MIN_INTERVAL_SECONDS", "60"))
+# Per-user lock and poll time are dropped once a user hasn't been ingested for this long
+INGEST_IDLE_SECONDS = float(os.getenv("INGEST_IDLE_SECONDS", "600"))
+
+
+class IngestionError(Exception):
+    """Spotify refused a recently-played request"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class ListeningHistoryIngestor:
+    """Per-user ingestion jobs; at most one runs per user at a time"""
+
+    def __init__(
+        self,
+        store: ListeningEventStore = listening_event_store,
+        min_interval_seconds: float = INGEST_MIN_INTERVAL_SECONDS,
+    ):
+        self.store = store
+        self.min_interval_seconds = min_interval_seconds
+        # forgetting a poll time never lets a user be polled early once min_interval_seconds has passed
+        self.idle_seconds = max(INGEST_IDLE_SECONDS, min_interval_seconds)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._last_polled: Dict[str, float] = {}
+        # user -> when an ingest last started or finished, least recently used first
+        self._last_used: "OrderedDict[str, float]" = OrderedDict()
+
+    async def _get_page(self, client: SpotifyClient, access_token: str, params: dict, firebase_user_id: Optional[str]) -> dict:
+        res = await client.api_get(
+            "recently-played", SPOTIFY_RECENTLY_PLAYED_PATH, access_token, params=params, user_id=firebase_user_id
+        )
+        if res.status_code == 429:
+            raise IngestionError(429, "Spotify rate limit reached", retry_after=parse_retry_after(res))
+        if res.status_code != 200:
+            raise IngestionError(res.status_code, f"Spotify API error: {res.text}")
+        return res.json()
+
+    async def fetch_delta(
+        self,
+        client: SpotifyClient,
+        access_token: str,
+        high_water: Optional[int],
+        firebase_user_id: Optional[str] = None
+    ) -> List[dict]:
+        """Fetch plays newer than high_water (epoch ms), oldest pages last"""
+        if high_water is not None:
+            page = await self._get_page(client, access_token, {"limit": PAGE_LIMIT, "after": high_water}, firebase_user_id)
+            items = page.get("items") or []
+            if len(items) < PAGE_LIMIT:
+                # The whole delta fit in one page
+                return items
+
+        # First ingest, or more new plays than one page: walk back from now
+        # with the `before` cursor until we reach the high-water mark
+        collected = []
+        params = {"limit": PAGE_LIMIT}
+        for _ in range(MAX_PAGES):
+            page = await self._get_page(client, access_token, params, firebase_user_id)
+            items = page.get("items") or []
+            collected.extend(items)
+
+            before = (page.get("cursors") or {}).get("before")
+            reached_known = high_water is not None and any(played_at_ms(i) <= high_water for i in items)
+            if not items or not before or reached_known or not page.get("next"):
+                break
+            params = {"limit": PAGE_LIMIT, "before": before}
+        return collected
+
+    async def ingest(self, client: SpotifyClient, firebase_user_id: str, access_token: str, force: bool = False) -> int:
+        """
+        Pull new plays for a user into the store. Returns how many were stored.
+        Skipped (returns 0) if the user was polled within min_interval_seconds, unless force.
+        """
+        self._touch(firebase_user_id)
+        lock = self._locks.setdefault(firebase_user_id, asyncio.Lock())
+        try:
+            async with lock:
+                last = self._last_polled.get(firebase_user_id)
+                if not force and last is not None and time.monotonic() - last < self.min_interval_seconds:
+                    return 0
+
+                high_water = await run_in_threadpool(self.store.high_water_mark, firebase_user_id)
+                items = await self.fetch_delta(client, access_token, high_water, firebase_user_id)
+                stored = await run_in_threadpool(self.store.append, firebase_user_id, items)
+                if stored:
+                    await run_in_threadpool(analytics_rollups.record_events, firebase_user_id, stored)
+                    await run_in_threadpool(played_track_filters.record_events, firebase_user_id, stored)
+                self._last_polled[firebase_user_id] = time.monotonic()
+                return len(stored)
+        finally:
+            self._touch(firebase_user_id)
+            self._forget_idle()
+
+    def _touch(self, firebase_user_id: str):
+        self._last_used[firebase_user_id] = time.monotonic()
+        self._last_used.move_to_end(firebase_user_id)
+
+    def _forget_idle(self):
+        """Drop the lock and poll time of users not ingested for idle_seconds"""
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._last_used:
+            firebase_user_id, used = next(iter(self._last_used.items()))
+            if used >= cutoff:
+                break
+            lock = self._locks.get(firebase_user_id)
+            if lock is not None and lock.locked():
+                # still ingesting; look again once it's idle
+                self._touch(firebase_user_id)
+                continue
+            del self._last_used[firebase_user_id]
+            self._locks.pop(firebase_user_id, None)
+            self._last_polled.pop(firebase_user_id, None)
+
+    def recent_items(self, firebase_user_id: str, limit: int = 20) -> List[dict]:
+        """Stored plays in Spotify's recently-played item shape, newest first"""
+        return [event["item"] for event in self.store.recent(firebase_user_id, limit)]
+
+
+# Global instance
+history_ingestor = ListeningHistoryIngestor()
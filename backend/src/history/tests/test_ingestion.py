@@ -0,0 +1,102 @@
+"""
+Tests for incremental recently-played ingestion against the fake Spotify server
+"""
+import sys
+import asyncio
+import pathlib
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+sys.path.insert(0, str(backend_dir / "src" / "auth" / "tests"))
+
+from src.auth.spotify_client import SpotifyClient
+from src.history.ingestion import ListeningHistoryIngestor
+from src.storage.listening_events import ListeningEventStore
+from fake_spotify import FakeSpotifyServer
+
+RECENTLY_PLAYED = "/v1/me/player/recently-played"
+T0 = 1_700_000_000_000
+
+
+def _ingest(server, ingestor):
+    async def run():
+        client = SpotifyClient(accounts_base_url=server.base_url, api_base_url=server.base_url)
+        try:
+            return await ingestor.ingest(client, "user-1", "tok", force=True)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+def test_first_ingest_walks_before_cursor(tmp_path):
+    ingestor = ListeningHistoryIngestor(store=ListeningEventStore(tmp_path))
+    with FakeSpotifyServer() as server:
+        for i in range(120):
+            server.add_play(T0 + i * 60_000, track_id=f"t{i}")
+
+        assert _ingest(server, ingestor) == 120
+        # 3 pages of 50, newest first
+        assert server.requests[RECENTLY_PLAYED] == 3
+
+    assert ingestor.store.high_water_mark("user-1") == T0 + 119 * 60_000
+    items = ingestor.recent_items("user-1", limit=2)
+    assert [i["track"]["id"] for i in items] == ["t119", "t118"]
+
+
+def test_later_polls_fetch_only_the_delta(tmp_path):
+    ingestor = ListeningHistoryIngestor(store=ListeningEventStore(tmp_path))
+    with FakeSpotifyServer() as server:
+        for i in range(30):
+            server.add_play(T0 + i * 60_000, track_id=f"t{i}")
+        assert _ingest(server, ingestor) == 30
+
+        # nothing new: one cheap request, nothing stored
+        assert _ingest(server, ingestor) == 0
+
+        for i in range(30, 35):
+            server.add_play(T0 + i * 60_000, track_id=f"t{i}")
+        assert _ingest(server, ingestor) == 5
+        assert server.requests[RECENTLY_PLAYED] == 3
+
+    assert ingestor.store.count("user-1") == 35
+
+
+def test_store_survives_restart(tmp_path):
+    with FakeSpotifyServer() as server:
+        for i in range(10):
+            server.add_play(T0 + i * 60_000, track_id=f"t{i}")
+        _ingest(server, ListeningHistoryIngestor(store=ListeningEventStore(tmp_path)))
+
+        # a fresh process reads the log and high-water mark back from disk
+        restarted = ListeningHistoryIngestor(store=ListeningEventStore(tmp_path))
+        assert restarted.store.high_water_mark("user-1") == T0 + 9 * 60_000
+        assert _ingest(server, restarted) == 0
+        assert restarted.store.count("user-1") == 10
+
+
+def test_idle_users_are_forgotten(tmp_path):
+    ingestor = ListeningHistoryIngestor(store=ListeningEventStore(tmp_path))
+    with FakeSpotifyServer() as server:
+        server.add_play(T0, track_id="t0")
+        _ingest(server, ingestor)
+    assert set(ingestor._locks) == set(ingestor._last_polled) == {"user-1"}
+
+    # another user's ingest sweeps out user-1 once it has been idle long enough
+    ingestor._last_used["user-1"] -= ingestor.idle_seconds + 1
+    ingestor._touch("user-2")
+    ingestor._forget_idle()
+    assert "user-1" not in ingestor._locks and "user-1" not in ingestor._last_polled
+    assert list(ingestor._last_used) == ["user-2"]
+
+
+def test_event_logs_kept_in_memory_for_recent_users_only(tmp_path):
+    store = ListeningEventStore(tmp_path, max_users=2)
+    for i, user_id in enumerate(["a", "b", "c"]):
+        store.append(user_id, [{"played_at": f"2024-01-0{i + 1}T00:00:00Z", "track": {"id": f"t{i}"}}])
+    assert list(store._events) == ["b", "c"] and set(store._high_water) == {"b", "c"}
+
+    # evicted logs are read back from disk
+    assert store.count("a") == 1 and store.high_water_mark("a") is not None
+    assert list(store._events) == ["c", "a"]
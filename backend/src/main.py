@@ -1,12 +1,22 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import uvicorn
 import pathlib
 
-from .auth.spotify import router as spotify_router
-from .storage.firestore_storage import init_firestore
+from .auth.spotify import router as spotify_router, refresh_scheduler
+from .recommendations.recommendations import router as recommendations_router
+from .analytics.analytics import router as analytics_router
+from .collections.collections import router as collections_router
+from .storage.backend import init_storage, close_storage
+from .storage.oauth_state import init_oauth_state_store, close_oauth_state_store
+from .storage.async_storage import shutdown_executor
+from .storage.session_queue import session_queue
+from .auth.spotify_client import init_spotify_client, close_spotify_client
+from .auth.token_cache import token_cache
+from .compression import CompressionMiddleware
 
 # Load environment variables from .env file
 # Look for .env in the backend directory (parent of src)
@@ -16,23 +26,47 @@ load_dotenv(dotenv_path=backend_dir / ".env")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Initialize Firestore
+    # Startup: Create the pooled Spotify HTTP client and start proactive token refresh
+    init_spotify_client()
+    refresh_scheduler.start()
+    # Initialize the storage backend (Firestore or SQLite, per STORAGE_BACKEND)
     try:
-        init_firestore()
+        init_storage()
         print("✓ Application startup complete")
     except Exception as e:
-        print(f"✗ Failed to initialize Firestore: {e}")
-        print("⚠ Application will start but Firestore operations will fail")
+        print(f"✗ Failed to initialize storage: {e}")
+        print("⚠ Application will start but storage operations will fail")
+    # OAuth state store shared by all workers (OAUTH_STATE_BACKEND)
+    try:
+        init_oauth_state_store()
+    except Exception as e:
+        print(f"✗ Failed to initialize OAuth state store: {e}")
+        print("⚠ Application will start but Spotify login will fail")
+    # Flush queued mood sessions in the background (SESSION_WRITE_BEHIND)
+    if session_queue is not None:
+        session_queue.start()
     yield
-    # Shutdown: Cleanup if needed
+    # Shutdown: Stop refreshing, flush pending token and session writes, then close pooled connections
+    await refresh_scheduler.stop()
+    await token_cache.drain()
+    if session_queue is not None:
+        await session_queue.stop()
+    shutdown_executor()
+    close_storage()
+    close_oauth_state_store()
+    await close_spotify_client()
     print("Application shutdown")
 
 
 app = FastAPI(
     title="CS320 Final Project API",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Compress large responses (brotli if installed, otherwise gzip)
+app.add_middleware(CompressionMiddleware)
+
 # Configure CORS to allow frontend requests
 app.add_middleware(
     CORSMiddleware,
@@ -47,6 +81,12 @@ app.add_middleware(
 
 # Include auth routes
 app.include_router(spotify_router, tags=["spotify"])
+# Include recommendation routes
+app.include_router(recommendations_router, tags=["recommendations"])
+# Include analytics routes
+app.include_router(analytics_router, tags=["analytics"])
+# Include collection routes
+app.include_router(collections_router, tags=["collections"])
 
 @app.get("/")
 async def read_root():
@@ -1,9 +1,21 @@
+import os
 import pandas as pd
 import numpy as np
-from typing import Dict, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple
 import pathlib
 from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import MiniBatchKMeans
 import pickle
+import hashlib
+import threading
+
+def _write_atomically(path: pathlib.Path, write: Callable[[BinaryIO], None]):
+    """Write through a temporary file and rename, so loaders in other workers never see a partial file"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
 
 class MoodDatasetPreprocessor:
     """
@@ -23,6 +35,20 @@ class MoodDatasetPreprocessor:
         self.scaler = StandardScaler()
         # we store track info separately
         self.track_metadata = None
+        # identifies the loaded catalog artifacts (used to key response caches)
+        self.version = None
+        # column arrays for bulk result rendering, built lazily from df
+        self._track_columns = None
+        # track_id -> row index, built lazily from df
+        self._track_index = None
+        # every row of each track_id (ids can repeat across genres): id -> group, rows by group, group offsets
+        self._track_rows = None
+        # mini-batch k-means over feature_matrix: (k, d) centroids and each row's cluster
+        self.cluster_centroids = None
+        self.cluster_assignments = None
+        # rows grouped by cluster, built lazily from cluster_assignments
+        self._cluster_order = None
+        self._cluster_offsets = None
         
     def load_raw_data(self) -> pd.DataFrame:
         """Load the raw CSV dataset"""
@@ -103,6 +129,14 @@ class MoodDatasetPreprocessor:
         
         return feature_df, metadata_df
     
+    def _compute_version(self, *paths: pathlib.Path) -> str:
+        """Fingerprint the given artifact files by name, size and mtime"""
+        digest = hashlib.blake2b(digest_size=8)
+        for path in paths:
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+        return digest.hexdigest()
+    
     def scale_features(self, feature_df: pd.DataFrame) -> np.ndarray:
         """Scale features to have mean 0 and std 1 for similarity calculations"""
         scaled_features = self.scaler.fit_transform(feature_df)
@@ -127,26 +161,142 @@ class MoodDatasetPreprocessor:
         # store metadata with original DataFrame
         self.df = df
         self.track_metadata = metadata_df
+        self._track_columns = None
+        self._track_index = None
+        self._track_rows = None
+        self.version = self._compute_version(self.csv_path)
+        
+        # group tracks into sub-mood clusters
+        self.cluster_features()
         
     
+    # mini-batch k-means settings; a fixed seed keeps clusters stable across rebuilds
+    CLUSTER_COUNT = 64
+    CLUSTER_BATCH_SIZE = 4096
+    CLUSTER_SEED = 0
+    
+    def cluster_features(self, n_clusters: Optional[int] = None) -> None:
+        """Run mini-batch k-means over feature_matrix, storing centroids and track->cluster assignments"""
+        n_clusters = min(n_clusters or self.CLUSTER_COUNT, len(self.feature_matrix))
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            batch_size=self.CLUSTER_BATCH_SIZE,
+            random_state=self.CLUSTER_SEED,
+            n_init=3,
+        )
+        self.cluster_assignments = kmeans.fit_predict(self.feature_matrix).astype(np.int32)
+        self.cluster_centroids = kmeans.cluster_centers_
+        self._cluster_order = None
+        self._cluster_offsets = None
+    
+    def get_cluster_members(self, cluster: int) -> np.ndarray:
+        """Rows assigned to a cluster (slices of one argsort, built once per assignment)"""
+        if self._cluster_order is None:
+            self._cluster_order = np.argsort(self.cluster_assignments, kind="stable")
+            counts = np.bincount(self.cluster_assignments, minlength=len(self.cluster_centroids))
+            self._cluster_offsets = np.concatenate([[0], np.cumsum(counts)])
+        return self._cluster_order[self._cluster_offsets[cluster]:self._cluster_offsets[cluster + 1]]
+    
+    # (field, source column, default, python type) for rendered track results
+    TRACK_FIELDS = [
+        ('track_id', 'track_id', '', str),
+        ('track_name', 'track_name', '', str),
+        ('artists', 'artists', '', str),
+        ('album_name', 'album_name', '', str),
+        ('track_genre', 'track_genre', '', str),
+        ('popularity', 'popularity', 0, int),
+        ('explicit', 'explicit', False, bool),
+        ('valence', 'valence', 0.5, float),
+        ('energy', 'energy', 0.5, float),
+        ('danceability', 'danceability', 0.5, float),
+    ]
+    
+    def _get_track_columns(self) -> Dict[str, np.ndarray]:
+        """Materialize result fields as typed numpy columns (once per loaded df)"""
+        if self._track_columns is None:
+            n = len(self.df)
+            columns = {}
+            for field, col, default, cast in self.TRACK_FIELDS:
+                if col in self.df.columns:
+                    series = self.df[col]
+                    if cast is str:
+                        values = series.astype(str).to_numpy(dtype=object)
+                    else:
+                        values = series.fillna(default).to_numpy().astype(cast)
+                else:
+                    values = np.full(n, default, dtype=object if cast is str else cast)
+                columns[field] = values
+            self._track_columns = columns
+        return self._track_columns
+    
+    def get_tracks_by_indices(self, indices: Sequence[int]) -> List[Dict]:
+        """
+        Get track metadata for many indices at once.
+        Builds results column-wise with one fancy-index per field instead of a row lookup per track.
+        Out-of-range indices are skipped.
+        """
+        if self.df is None:
+            return []
+        
+        idx = np.asarray(indices, dtype=np.int64)
+        idx = idx[(idx >= 0) & (idx < len(self.df))]
+        if len(idx) == 0:
+            return []
+        
+        columns = self._get_track_columns()
+        fields = list(columns.keys())
+        # .tolist() converts numpy scalars to native python types in one pass
+        values = [columns[field][idx].tolist() for field in fields]
+        return [dict(zip(fields, row)) for row in zip(*values)]
+    
+    def _get_track_index(self) -> Dict[str, int]:
+        """Map track_id to its first row in df (once per loaded df)"""
+        if self._track_index is None:
+            index = {}
+            for row, track_id in enumerate(self.df['track_id'].astype(str).tolist()):
+                index.setdefault(track_id, row)
+            self._track_index = index
+        return self._track_index
+    
+    def find_track_index(self, track_id: str) -> Optional[int]:
+        """Row index of a track_id, or None if it isn't in the catalog"""
+        if self.df is None:
+            return None
+        return self._get_track_index().get(track_id)
+    
+    def find_track_indices(self, track_ids: Sequence[str]) -> np.ndarray:
+        """Row indices for many track_ids at once; -1 where a track isn't in the catalog"""
+        if self.df is None:
+            return np.full(len(track_ids), -1, dtype=np.int64)
+        index = self._get_track_index()
+        return np.fromiter((index.get(track_id, -1) for track_id in track_ids), dtype=np.int64, count=len(track_ids))
+    
+    def find_track_rows(self, track_ids: Sequence[str]) -> np.ndarray:
+        """Sorted rows of every catalog entry of the given track_ids (a track listed under several genres has several)"""
+        if self.df is None:
+            return np.empty(0, dtype=np.int64)
+        if self._track_rows is None:
+            codes, uniques = pd.factorize(self.df['track_id'].astype(str))
+            self._track_rows = (
+                {track_id: group for group, track_id in enumerate(uniques)},
+                np.argsort(codes, kind="stable"),
+                np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(uniques)))]),
+            )
+        groups_by_id, order, offsets = self._track_rows
+        groups = np.fromiter((groups_by_id.get(track_id, -1) for track_id in track_ids), dtype=np.int64, count=len(track_ids))
+        groups = np.unique(groups[groups >= 0])
+        starts, lengths = offsets[groups], offsets[groups + 1] - offsets[groups]
+        # concatenated slices order[start:start + length], without a python loop
+        positions = np.arange(lengths.sum()) + np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return np.sort(order[positions])
+    
     def get_track_by_index(self, idx: int) -> Optional[Dict]:
         """Get track metadata by index"""
         if self.df is None or idx >= len(self.df):
             return None
         
-        row = self.df.iloc[idx]
-        return {
-            'track_id': str(row.get('track_id', '')),
-            'track_name': str(row.get('track_name', '')),
-            'artists': str(row.get('artists', '')),
-            'album_name': str(row.get('album_name', '')),
-            'track_genre': str(row.get('track_genre', '')),
-            'popularity': int(row.get('popularity', 0)),
-            'explicit': bool(row.get('explicit', False)),
-            'valence': float(row.get('valence', 0.5)),
-            'energy': float(row.get('energy', 0.5)),
-            'danceability': float(row.get('danceability', 0.5)),
-        }
+        tracks = self.get_tracks_by_indices([idx])
+        return tracks[0] if tracks else None
     
     def search_tracks(self, query: str, limit: int = 20) -> pd.DataFrame:
         """Search tracks by name or artist"""
@@ -175,19 +325,35 @@ class MoodDatasetPreprocessor:
         output_dir = pathlib.Path(output_dir)
         output_dir.mkdir(exist_ok=True)
         
+        embeddings_path = output_dir / "mood_embeddings.npy"
+        dataset_path = output_dir / "full_dataset.parquet"
+
         # feature matrix
-        np.save(output_dir / "mood_embeddings.npy", self.feature_matrix)
+        _write_atomically(embeddings_path, lambda f: np.save(f, self.feature_matrix))
         
         # save scaler
-        with open(output_dir / "scaler.pkl", 'wb') as f:
-            pickle.dump(self.scaler, f)
+        _write_atomically(output_dir / "scaler.pkl", lambda f: pickle.dump(self.scaler, f))
         
         # save metadata
-        self.track_metadata.to_parquet(output_dir / "track_metadata.parquet", index=False)
+        _write_atomically(
+            output_dir / "track_metadata.parquet", lambda f: self.track_metadata.to_parquet(f, index=False)
+        )
         
         # save full dataframe (for search functionality)
-        self.df.to_parquet(output_dir / "full_dataset.parquet", index=False)
+        _write_atomically(dataset_path, lambda f: self.df.to_parquet(f, index=False))
         
+        # the version a later load_preprocessed() computes for these files
+        self.version = self._compute_version(embeddings_path, dataset_path)
+        self._save_clusters(output_dir)
+    
+    def _save_clusters(self, output_dir: pathlib.Path):
+        """Save the clustering with the catalog version it was computed for"""
+        _write_atomically(output_dir / "clusters.npz", lambda f: np.savez(
+            f,
+            centroids=self.cluster_centroids,
+            assignments=self.cluster_assignments,
+            version=np.array(self.version),
+        ))
     
     def load_preprocessed(self, data_dir: Optional[pathlib.Path] = None) -> bool:
         """Load previously preprocessed data"""
@@ -212,6 +378,24 @@ class MoodDatasetPreprocessor:
             
             self.track_metadata = pd.read_parquet(metadata_path)
             self.df = pd.read_parquet(dataset_path)
+            self._track_columns = None
+            self._track_index = None
+            self._track_rows = None
+            self.version = self._compute_version(embeddings_path, dataset_path)
+            
+            self.cluster_centroids = None
+            self.cluster_assignments = None
+            self._cluster_order = None
+            self._cluster_offsets = None
+            clusters_path = data_dir / "clusters.npz"
+            if clusters_path.exists():
+                with np.load(clusters_path) as clusters:
+                    if str(clusters["version"]) == self.version:
+                        self.cluster_centroids = clusters["centroids"]
+                        self.cluster_assignments = clusters["assignments"]
+            if self.cluster_assignments is None:
+                # Clustering is an offline step; smart collections stay empty until it's rerun
+                print("Catalog clusters are missing or stale; run `python -m src.ml.dataset_loader` to rebuild them")
             
             return True
 
@@ -221,16 +405,46 @@ class MoodDatasetPreprocessor:
 
 
 _preprocessor_instance = None
+# Request threads can all hit a cold catalog at once; only one of them loads it
+_preprocessor_lock = threading.Lock()
 
 def get_preprocessor() -> MoodDatasetPreprocessor:
     """Get or create the global preprocessor instance"""
     global _preprocessor_instance
     if _preprocessor_instance is None:
-        _preprocessor_instance = MoodDatasetPreprocessor()
+        with _preprocessor_lock:
+            if _preprocessor_instance is None:
+                preprocessor = MoodDatasetPreprocessor()
+                if not preprocessor.load_preprocessed():
+                    preprocessor.preprocess()
+                    # save for next time
+                    preprocessor.save_preprocessed()
+                # published only once loaded, so the unlocked check never sees a half-built catalog
+                _preprocessor_instance = preprocessor
+
+    return _preprocessor_instance
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Preprocess the catalog CSV, cluster it and save the artifacts")
+    parser.add_argument("--csv", type=pathlib.Path, default=None, help="Defaults to data/dataset.csv")
+    parser.add_argument(
+        "--clusters-only", action="store_true", help="Re-cluster the saved artifacts instead of reprocessing the CSV"
+    )
+    args = parser.parse_args()
+
+    preprocessor = MoodDatasetPreprocessor(csv_path=args.csv)
+    if args.clusters_only and preprocessor.load_preprocessed():
+        preprocessor.cluster_features()
+        preprocessor._save_clusters(preprocessor.csv_path.parent)
+    else:
+        preprocessor.preprocess()
+        preprocessor.save_preprocessed()
+    print(f"Saved catalog {preprocessor.version}: {len(preprocessor.feature_matrix)} tracks "
+          f"in {len(preprocessor.cluster_centroids)} clusters")
 
-        if not _preprocessor_instance.load_preprocessed():
-            _preprocessor_instance.preprocess()
-            # save for next time
-            _preprocessor_instance.save_preprocessed()
 
-    return _preprocessor_instance
\ No newline at end of file
+if __name__ == "__main__":
+    main()
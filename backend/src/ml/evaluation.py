@@ -0,0 +1,327 @@
+"""
+Offline evaluation of mood recommendations against logged mood sessions.
+
+Each user's sessions are split by time: the oldest sessions train the
+personalized recommender (as learn_from_user_sessions does) and the tracks the
+user tagged in the newest TEST_FRACTION are the relevant items for each mood.
+Every (user, mood) in the test split is a query, scored for both the general
+and the personalized get_mood_recommendations ranking with precision@k,
+recall@k and NDCG@k. Coverage is the share of the catalog recommended to anyone.
+
+Sessions are read from storage by a thread pool, one page of users at a time.
+Users are scored in chunks on a process pool; within a chunk all personalized
+queries are ranked with a few blocked matrix products. Run offline with
+
+    python -m src.ml.evaluation --workers 8 --k 20
+
+The results are written to EVALUATION_RESULTS_PATH and served by the
+recommendations accuracy endpoint.
+"""
+import os
+import json
+import time
+import pathlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .dataset_loader import get_preprocessor
+from .mood_recommender import MoodRecommender, get_recommender
+
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+EVALUATION_RESULTS_PATH = pathlib.Path(
+    os.getenv("EVALUATION_RESULTS_PATH", str(backend_dir / "data" / "evaluation.json"))
+)
+
+MOODS = list(MoodRecommender.MOOD_PROTOTYPES)
+DEFAULT_K = 20
+TEST_FRACTION = 0.2
+# Users with fewer sessions can't be split into a train and a test part
+MIN_SESSIONS = 5
+PERSONALIZATION_WEIGHT = 0.7
+USERS_PER_CHUNK = 256
+# Personalized queries ranked per matrix product (bounds the score block's memory)
+QUERY_BLOCK = 128
+SESSION_FIELDS = ["trackId", "mood", "intensity"]
+# Concurrent get_user_sessions calls while reading storage (each is a round-trip on Firestore)
+SESSION_FETCH_THREADS = 16
+
+
+class EvaluationCatalog:
+    """Catalog arrays the evaluator ranks against; loaded once per worker process"""
+
+    def __init__(
+        self,
+        feature_matrix: np.ndarray,
+        prototypes: np.ndarray,
+        find_track_indices: Callable[[Sequence[str]], np.ndarray]
+    ):
+        self.feature_matrix = feature_matrix
+        norms = np.linalg.norm(feature_matrix, axis=1, keepdims=True)
+        # cosine similarity against unit queries is a dot product with unit rows
+        self.unit_features = (feature_matrix / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+        self.prototypes = prototypes
+        self.find_track_indices = find_track_indices
+        self._general_top = {}
+
+    @classmethod
+    def load(cls) -> "EvaluationCatalog":
+        preprocessor = get_preprocessor()
+        return cls(
+            preprocessor.feature_matrix,
+            get_recommender().get_mood_prototype_vectors(),
+            preprocessor.find_track_indices,
+        )
+
+    def top_k(self, queries: np.ndarray, k: int) -> np.ndarray:
+        """(len(queries), k) catalog rows by descending cosine similarity to each query"""
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        unit = (queries / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+        k = min(k, len(self.unit_features))
+        ranked = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), QUERY_BLOCK):
+            scores = unit[start:start + QUERY_BLOCK] @ self.unit_features.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+            ranked[start:start + QUERY_BLOCK] = np.take_along_axis(top, order, axis=1)
+        return ranked
+
+    def general_top_k(self, k: int) -> np.ndarray:
+        """Top-k rows per mood for the general (unpersonalized) recommendations"""
+        if k not in self._general_top:
+            self._general_top[k] = self.top_k(self.prototypes, k)
+        return self._general_top[k]
+
+
+def split_sessions(sessions: List[dict], test_fraction: float = TEST_FRACTION) -> Optional[Tuple[List[dict], List[dict]]]:
+    """(train, test) by createdAt, or None if the user has too few sessions"""
+    sessions = [s for s in sessions if s.get("mood") in MOODS and s.get("trackId")]
+    if len(sessions) < MIN_SESSIONS:
+        return None
+    sessions = sorted(sessions, key=lambda s: s.get("createdAt") or 0)
+    cut = min(len(sessions) - 1, max(1, round(len(sessions) * (1 - test_fraction))))
+    return sessions[:cut], sessions[cut:]
+
+
+def _empty_totals(n_tracks: int) -> dict:
+    return {
+        "users": 0,
+        "queries": 0,
+        **{
+            variant: {"precision": 0.0, "recall": 0.0, "ndcg": 0.0, "recommended": np.zeros(n_tracks, dtype=bool)}
+            for variant in ("general", "personalized")
+        },
+    }
+
+
+def _score(totals: dict, ranked: np.ndarray, relevant: List[np.ndarray], k: int):
+    """Add precision/recall/NDCG@k of each ranking against its relevant rows"""
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    for rows, targets in zip(ranked, relevant):
+        hits = np.isin(rows, targets)
+        ideal = discounts[:min(len(targets), k)].sum()
+        totals["precision"] += hits.sum() / k
+        totals["recall"] += hits.sum() / len(targets)
+        totals["ndcg"] += (discounts[:len(rows)] * hits).sum() / ideal
+        totals["recommended"][rows] = True
+
+
+def evaluate_users(
+    catalog: EvaluationCatalog,
+    users: List[List[dict]],
+    k: int = DEFAULT_K,
+    test_fraction: float = TEST_FRACTION,
+    personalization_weight: float = PERSONALIZATION_WEIGHT
+) -> dict:
+    """Metric totals over a chunk of users (each a list of their sessions)"""
+    totals = _empty_totals(len(catalog.feature_matrix))
+    general_top = catalog.general_top_k(k)
+    query_moods, relevant, personal = [], [], []
+
+    for sessions in users:
+        split = split_sessions(sessions, test_fraction)
+        if split is None:
+            continue
+        train, test = split
+        test_rows = catalog.find_track_indices([s["trackId"] for s in test])
+        train_rows = catalog.find_track_indices([s["trackId"] for s in train])
+        train_moods = np.array([MOODS.index(s["mood"]) for s in train])
+        # intensity weighting as in learn_from_user_sessions
+        weights = np.array([float(s.get("intensity")) / 100.0 if s.get("intensity") else 0.5 for s in train])
+
+        queries = 0
+        for m, mood in enumerate(MOODS):
+            targets = np.unique(test_rows[(test_rows >= 0) & np.array([s["mood"] == mood for s in test])])
+            if not len(targets):
+                continue
+            queries += 1
+            query_moods.append(m)
+            relevant.append(targets)
+            selected = (train_moods == m) & (train_rows >= 0)
+            if selected.any():
+                centroid = np.average(catalog.feature_matrix[train_rows[selected]], axis=0, weights=weights[selected])
+                personal.append(personalization_weight * centroid + (1 - personalization_weight) * catalog.prototypes[m])
+            else:
+                personal.append(None)  # no history for this mood: same as general
+        if queries:
+            totals["users"] += 1
+            totals["queries"] += queries
+
+    if not relevant:
+        return totals
+    general_ranked = general_top[query_moods]
+    personal_ranked = general_ranked.copy()
+    learned = [i for i, vector in enumerate(personal) if vector is not None]
+    if learned:
+        personal_ranked[learned] = catalog.top_k(np.vstack([personal[i] for i in learned]), k)
+    _score(totals["general"], general_ranked, relevant, k)
+    _score(totals["personalized"], personal_ranked, relevant, k)
+    return totals
+
+
+def _merge_totals(into: dict, totals: dict):
+    into["users"] += totals["users"]
+    into["queries"] += totals["queries"]
+    for variant in ("general", "personalized"):
+        for metric in ("precision", "recall", "ndcg"):
+            into[variant][metric] += totals[variant][metric]
+        into[variant]["recommended"] |= totals[variant]["recommended"]
+
+
+_worker_catalog: Optional[EvaluationCatalog] = None
+
+def _init_worker(catalog: Optional[EvaluationCatalog]):
+    global _worker_catalog
+    _worker_catalog = catalog or EvaluationCatalog.load()
+
+def _evaluate_chunk(users: List[List[dict]], k: int, test_fraction: float, personalization_weight: float) -> dict:
+    return evaluate_users(_worker_catalog, users, k, test_fraction, personalization_weight)
+
+
+def _user_chunks(storage, chunk_size: int, fetch_threads: int = SESSION_FETCH_THREADS):
+    """Every user's sessions from storage, chunk_size users at a time, fetched concurrently per page of users"""
+    def fetch(user_id: str) -> List[dict]:
+        return storage.get_user_sessions(user_id, fields=SESSION_FIELDS)
+    
+    chunk, after = [], None
+    with ThreadPoolExecutor(max_workers=fetch_threads) as fetcher:
+        while True:
+            user_ids = storage.list_user_ids(after=after)
+            for sessions in fetcher.map(fetch, user_ids):
+                chunk.append(sessions)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if not user_ids:
+                break
+            after = user_ids[-1]
+    if chunk:
+        yield chunk
+
+
+def evaluate(
+    storage,
+    k: int = DEFAULT_K,
+    workers: Optional[int] = None,
+    test_fraction: float = TEST_FRACTION,
+    personalization_weight: float = PERSONALIZATION_WEIGHT,
+    catalog: Optional[EvaluationCatalog] = None,
+    chunk_size: int = USERS_PER_CHUNK
+) -> dict:
+    """
+    Evaluate general vs personalized recommendations for every user in storage.
+    workers <= 1 scores in this process; catalog defaults to the loaded catalog.
+    """
+    started = time.time()
+    workers = workers if workers is not None else os.cpu_count() or 1
+    params = (k, test_fraction, personalization_weight)
+
+    if workers <= 1:
+        catalog = catalog or EvaluationCatalog.load()
+        totals = _empty_totals(len(catalog.feature_matrix))
+        for chunk in _user_chunks(storage, chunk_size):
+            _merge_totals(totals, evaluate_users(catalog, chunk, *params))
+    else:
+        n_tracks = len(catalog.feature_matrix) if catalog is not None else len(get_preprocessor().feature_matrix)
+        totals = _empty_totals(n_tracks)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(catalog,)) as pool:
+            pending = set()
+            for chunk in _user_chunks(storage, chunk_size):
+                # keep storage reads ahead of the workers without queueing everything
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _merge_totals(totals, future.result())
+                pending.add(pool.submit(_evaluate_chunk, chunk, *params))
+            for future in pending:
+                _merge_totals(totals, future.result())
+
+    queries = totals["queries"]
+    results = {
+        "k": k,
+        "users_evaluated": totals["users"],
+        "queries": queries,
+        "test_fraction": test_fraction,
+        "generated_at": time.time(),
+        "duration_seconds": round(time.time() - started, 1),
+    }
+    for variant in ("general", "personalized"):
+        variant_totals = totals[variant]
+        results[variant] = {
+            "precision_at_k": round(float(variant_totals["precision"]) / queries, 4) if queries else None,
+            "recall_at_k": round(float(variant_totals["recall"]) / queries, 4) if queries else None,
+            "ndcg_at_k": round(float(variant_totals["ndcg"]) / queries, 4) if queries else None,
+            "coverage": round(float(variant_totals["recommended"].mean()), 4),
+        }
+    return results
+
+
+def save_evaluation_results(results: dict, path: pathlib.Path = EVALUATION_RESULTS_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+_results_lock = threading.Lock()
+_cached_results: Tuple[Optional[float], Optional[dict]] = (None, None)
+
+def load_evaluation_results(path: pathlib.Path = EVALUATION_RESULTS_PATH) -> Optional[dict]:
+    """The latest saved evaluation, or None if none has been run; re-read only when the file changes"""
+    global _cached_results
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    with _results_lock:
+        if _cached_results[0] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                _cached_results = (mtime, json.load(f))
+        return _cached_results[1]
+
+
+def main():
+    from ..storage.backend import init_storage, close_storage
+
+    parser = argparse.ArgumentParser(description="Offline evaluation of mood recommendations")
+    parser.add_argument("--k", type=int, default=DEFAULT_K)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--test-fraction", type=float, default=TEST_FRACTION)
+    parser.add_argument("--output", type=pathlib.Path, default=EVALUATION_RESULTS_PATH)
+    args = parser.parse_args()
+
+    storage = init_storage()
+    try:
+        results = evaluate(storage, k=args.k, workers=args.workers, test_fraction=args.test_fraction)
+    finally:
+        close_storage()
+    save_evaluation_results(results, args.output)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
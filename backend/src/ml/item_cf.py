@@ -0,0 +1,297 @@
+"""
+Item-item collaborative filtering from logged mood sessions.
+
+Two catalog tracks co-occur when the same user tagged both with the same mood.
+The model keeps the raw co-occurrence counts as a sparse CSR matrix and, per
+track, its TOP_NEIGHBOURS most similar tracks (cosine over co-occurrence,
+c_ij / sqrt(n_i * n_j)) as a second CSR matrix that scoring reads from.
+
+Refreshes are incremental: only sessions created since the last refresh are
+read (one global query by createdAt, not a query per user), only new
+(user, mood, track) memberships add counts, and only the rows whose neighbour
+lists can have changed are re-pruned: those of tracks whose baskets changed,
+plus those listing a track whose basket count changed as a neighbour, since
+its cosines shrank. Deleted sessions leave the model on the next full
+rebuild. Run offline with
+
+    python -m src.ml.item_cf          # incremental
+    python -m src.ml.item_cf --full   # rebuild from every session
+
+The model is written to ITEM_CF_PATH and used by MoodRecommender's hybrid mode.
+"""
+import os
+import time
+import pathlib
+import argparse
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from .dataset_loader import get_preprocessor
+
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+ITEM_CF_PATH = pathlib.Path(os.getenv("ITEM_CF_PATH", str(backend_dir / "data" / "item_cf.npz")))
+
+TOP_NEIGHBOURS = 50
+# Tracks per (user, mood) that count towards co-occurrence; a basket of m tracks adds m^2 pairs
+MAX_BASKET_TRACKS = 500
+# Sessions are re-read this far behind the watermark, so late writes aren't missed
+WATERMARK_OVERLAP_SECONDS = 300
+SESSION_FIELDS = ["firebaseUserId", "trackId", "mood"]
+# Sessions read per storage page; each page is one commit (re-prune) of the model
+SESSIONS_PER_PAGE = 5000
+
+
+def _csr_parts(prefix: str, matrix: sp.csr_matrix) -> dict:
+    return {f"{prefix}_data": matrix.data, f"{prefix}_indices": matrix.indices, f"{prefix}_indptr": matrix.indptr}
+
+
+def _csr_from(prefix: str, archive, n: int) -> sp.csr_matrix:
+    return sp.csr_matrix(
+        (archive[f"{prefix}_data"], archive[f"{prefix}_indices"], archive[f"{prefix}_indptr"]), shape=(n, n)
+    )
+
+
+class ItemCooccurrenceModel:
+    """Co-occurrence counts and top-N neighbours over catalog rows, for one catalog version"""
+
+    def __init__(self, n_items: int, version: Optional[str] = None, top_n: int = TOP_NEIGHBOURS):
+        self.n_items = n_items
+        self.version = version
+        self.top_n = top_n
+        self.counts = sp.csr_matrix((n_items, n_items), dtype=np.int32)
+        # number of (user, mood) baskets each track is in
+        self.item_counts = np.zeros(n_items, dtype=np.int32)
+        self.neighbours = sp.csr_matrix((n_items, n_items), dtype=np.float32)
+        # "user\x1fmood" -> sorted catalog rows
+        self.baskets: Dict[str, np.ndarray] = {}
+        # newest session createdAt seen
+        self.watermark: Optional[float] = None
+        self._pending_rows: List[np.ndarray] = []
+        self._pending_cols: List[np.ndarray] = []
+        self._affected: Set[int] = set()
+        # tracks whose item_counts changed since the last commit
+        self._recounted: Set[int] = set()
+
+    def add_sessions(
+        self,
+        firebase_user_id: str,
+        sessions: List[dict],
+        find_track_indices: Callable[[Sequence[str]], np.ndarray]
+    ) -> int:
+        """
+        Stage one user's sessions; tracks already in their (user, mood) basket are ignored.
+        Returns the number of new memberships. Call commit() to apply them.
+        """
+        by_mood: Dict[str, List[str]] = {}
+        for session in sessions:
+            if session.get("mood") and session.get("trackId"):
+                by_mood.setdefault(session["mood"], []).append(str(session["trackId"]))
+            created_at = session.get("createdAt")
+            if isinstance(created_at, (int, float)) and (self.watermark is None or created_at > self.watermark):
+                self.watermark = float(created_at)
+
+        added = 0
+        for mood, track_ids in by_mood.items():
+            key = f"{firebase_user_id}\x1f{mood}"
+            basket = self.baskets.get(key, np.empty(0, dtype=np.int32))
+            rows = find_track_indices(track_ids)
+            new = np.setdiff1d(rows[rows >= 0].astype(np.int32), basket)
+            new = new[:max(0, MAX_BASKET_TRACKS - len(basket))]
+            if len(new) == 0:
+                continue
+            merged = np.union1d(basket, new)
+            # every new track pairs with every other track in the basket, both ways:
+            # new x new already holds both directions, new x old is mirrored
+            new_rows, new_cols = np.repeat(new, len(new)), np.tile(new, len(new))
+            distinct = new_rows != new_cols
+            old_rows, old_cols = np.repeat(new, len(basket)), np.tile(basket, len(new))
+            self._pending_rows += [new_rows[distinct], old_rows, old_cols]
+            self._pending_cols += [new_cols[distinct], old_cols, old_rows]
+            self.item_counts[new] += 1
+            self.baskets[key] = merged
+            self._affected.update(merged.tolist())
+            self._recounted.update(new.tolist())
+            added += len(new)
+        return added
+
+    def commit(self) -> int:
+        """Fold staged pairs into the counts and re-prune the affected rows; returns rows re-pruned"""
+        if self._recounted:
+            # a larger n_j lowers c_ij / sqrt(n_i * n_j) in every row keeping j, which may reorder that row;
+            # rows not keeping j are unaffected unless c_ij grew too, which puts them in _affected already
+            recounted = np.fromiter(self._recounted, dtype=np.int64, count=len(self._recounted))
+            kept = self.neighbours.tocoo()
+            self._affected.update(np.unique(kept.row[np.isin(kept.col, recounted)]).tolist())
+            self._recounted = set()
+        if self._pending_rows:
+            rows = np.concatenate(self._pending_rows)
+            cols = np.concatenate(self._pending_cols)
+            delta = sp.csr_matrix(
+                (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(self.n_items, self.n_items)
+            )
+            self.counts = (self.counts + delta).tocsr()
+            self._pending_rows, self._pending_cols = [], []
+        affected = np.fromiter(self._affected, dtype=np.int64, count=len(self._affected))
+        self._affected = set()
+        if len(affected):
+            self._prune(np.sort(affected))
+        return len(affected)
+
+    def _prune(self, rows: np.ndarray):
+        """Recompute the top-N neighbour rows for the given catalog rows and splice them in"""
+        block = self.counts[rows].tocoo()
+        item_rows = rows[block.row]
+        similarity = block.data / np.sqrt(
+            self.item_counts[item_rows].astype(np.float64) * self.item_counts[block.col]
+        )
+        # rank within each row, best first
+        order = np.lexsort((-similarity, block.row))
+        ranked_rows = block.row[order]
+        starts = np.searchsorted(ranked_rows, ranked_rows)
+        keep = order[np.arange(len(order)) - starts < self.top_n]
+
+        previous = self.neighbours.tocoo()
+        unchanged = ~np.isin(previous.row, rows)
+        self.neighbours = sp.csr_matrix(
+            (
+                np.concatenate([previous.data[unchanged], similarity[keep].astype(np.float32)]),
+                (
+                    np.concatenate([previous.row[unchanged], item_rows[keep]]),
+                    np.concatenate([previous.col[unchanged], block.col[keep]]),
+                ),
+            ),
+            shape=(self.n_items, self.n_items),
+        )
+
+    def score(self, rows: np.ndarray, weights: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        CF scores from a user's history rows: (catalog rows, summed neighbour similarity)
+        for every track that neighbours the history. Cost is len(rows) * top_n, not the catalog size.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        block = self.neighbours[rows].tocoo()
+        values = block.data.astype(np.float64)
+        if weights is not None:
+            values *= np.asarray(weights, dtype=np.float64)[block.row]
+        candidates, inverse = np.unique(block.col, return_inverse=True)
+        return candidates.astype(np.int64), np.bincount(inverse, weights=values, minlength=len(candidates))
+
+    def save(self, path: pathlib.Path = ITEM_CF_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        keys = list(self.baskets)
+        lengths = np.array([len(self.baskets[key]) for key in keys], dtype=np.int64)
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            n_items=self.n_items,
+            version=self.version or "",
+            top_n=self.top_n,
+            watermark=self.watermark if self.watermark is not None else np.nan,
+            item_counts=self.item_counts,
+            basket_keys=np.array(keys, dtype=str),
+            basket_offsets=np.concatenate([[0], np.cumsum(lengths)]),
+            basket_rows=np.concatenate([self.baskets[key] for key in keys]) if keys else np.empty(0, dtype=np.int32),
+            **_csr_parts("counts", self.counts),
+            **_csr_parts("neighbours", self.neighbours),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: pathlib.Path = ITEM_CF_PATH) -> "ItemCooccurrenceModel":
+        with np.load(path) as archive:
+            n = int(archive["n_items"])
+            model = cls(n, str(archive["version"]) or None, int(archive["top_n"]))
+            watermark = float(archive["watermark"])
+            model.watermark = None if np.isnan(watermark) else watermark
+            model.item_counts = archive["item_counts"]
+            offsets, basket_rows = archive["basket_offsets"], archive["basket_rows"]
+            model.baskets = {
+                str(key): basket_rows[offsets[i]:offsets[i + 1]] for i, key in enumerate(archive["basket_keys"])
+            }
+            model.counts = _csr_from("counts", archive, n)
+            model.neighbours = _csr_from("neighbours", archive, n)
+        return model
+
+
+def refresh(model: ItemCooccurrenceModel, storage, find_track_indices: Callable[[Sequence[str]], np.ndarray]) -> dict:
+    """Add every session created since the model's watermark, one page of sessions per commit"""
+    started = time.time()
+    since = model.watermark - WATERMARK_OVERLAP_SECONDS if model.watermark is not None else None
+    read = added = pruned = 0
+    cursor = None
+    while True:
+        sessions, cursor = storage.get_sessions_created_since(
+            since, limit=SESSIONS_PER_PAGE, cursor=cursor, fields=SESSION_FIELDS
+        )
+        by_user: Dict[str, List[dict]] = {}
+        for session in sessions:
+            by_user.setdefault(session["firebaseUserId"], []).append(session)
+        for user_id, user_sessions in by_user.items():
+            added += model.add_sessions(user_id, user_sessions, find_track_indices)
+        read += len(sessions)
+        pruned += model.commit()
+        if cursor is None:
+            break
+    return {
+        "sessions_read": read,
+        "memberships_added": added,
+        "rows_repruned": pruned,
+        "pairs": int(model.counts.nnz),
+        "duration_seconds": round(time.time() - started, 1),
+    }
+
+
+_model_lock = threading.Lock()
+_cached_model: Tuple[Optional[float], Optional[ItemCooccurrenceModel]] = (None, None)
+
+def load_item_cf(path: pathlib.Path = ITEM_CF_PATH) -> Optional[ItemCooccurrenceModel]:
+    """
+    The latest saved model for the loaded catalog, or None if there is none (or it was built
+    for another catalog version); re-read only when the file changes
+    """
+    global _cached_model
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    with _model_lock:
+        if _cached_model[0] != mtime:
+            _cached_model = (mtime, ItemCooccurrenceModel.load(path))
+        model = _cached_model[1]
+    return model if model.version == get_preprocessor().version else None
+
+
+def main():
+    from ..storage.backend import init_storage, close_storage
+
+    parser = argparse.ArgumentParser(description="Build or update the item-item co-occurrence model")
+    parser.add_argument("--full", action="store_true", help="Rebuild from every session")
+    parser.add_argument("--output", type=pathlib.Path, default=ITEM_CF_PATH)
+    args = parser.parse_args()
+
+    preprocessor = get_preprocessor()
+    model = None
+    if not args.full and args.output.exists():
+        model = ItemCooccurrenceModel.load(args.output)
+        if model.version != preprocessor.version:
+            print("Catalog changed since the last build; rebuilding")
+            model = None
+    if model is None:
+        model = ItemCooccurrenceModel(len(preprocessor.feature_matrix), preprocessor.version)
+
+    storage = init_storage()
+    try:
+        stats = refresh(model, storage, preprocessor.find_track_indices)
+    finally:
+        close_storage()
+    model.save(args.output)
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
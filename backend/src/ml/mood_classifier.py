@@ -0,0 +1,110 @@
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+from .dataset_loader import get_preprocessor
+from .mood_recommender import MoodRecommender, get_recommender
+
+# Softmax temperature over cosine similarities; lower makes confidences sharper
+CONFIDENCE_TEMPERATURE = 0.1
+
+class MoodClassifier:
+    """
+    Assigns each catalog track its nearest general mood prototype, with a confidence.
+    Tracks are scored in batches (one matrix product against all five prototypes)
+    and each catalog row is classified once per loaded catalog version.
+    """
+
+    MOODS = list(MoodRecommender.MOOD_PROTOTYPES)
+
+    def __init__(self, preprocessor=None, prototypes: Optional[np.ndarray] = None):
+        self._preprocessor = preprocessor
+        self._prototypes = prototypes
+        self._lock = threading.Lock()
+        self._version = None
+        # per catalog row: mood index (-1 until classified) and confidence
+        self._mood = None
+        self._confidence = None
+
+    def _get_preprocessor(self):
+        return self._preprocessor if self._preprocessor is not None else get_preprocessor()
+
+    def _get_prototypes(self) -> np.ndarray:
+        if self._prototypes is None:
+            return get_recommender().get_mood_prototype_matrix()
+        return self._prototypes
+
+    def classify_rows(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Mood index and confidence for catalog rows (-1 and 0.0 for rows < 0).
+        Only rows not already cached are scored.
+        """
+        preprocessor = self._get_preprocessor()
+        rows = np.asarray(rows, dtype=np.int64)
+        with self._lock:
+            if self._mood is None or self._version != preprocessor.version or len(self._mood) != len(preprocessor.feature_matrix):
+                n = len(preprocessor.feature_matrix)
+                self._mood = np.full(n, -1, dtype=np.int8)
+                self._confidence = np.zeros(n, dtype=np.float32)
+                self._version = preprocessor.version
+
+            known = rows >= 0
+            pending = np.unique(rows[known])
+            pending = pending[self._mood[pending] < 0]
+            if len(pending):
+                vectors = preprocessor.feature_matrix[pending]
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                similarities = (vectors / np.where(norms == 0, 1.0, norms)) @ self._get_prototypes().T
+                # softmax over the five cosine similarities
+                logits = similarities / CONFIDENCE_TEMPERATURE
+                logits -= logits.max(axis=1, keepdims=True)
+                weights = np.exp(logits)
+                self._mood[pending] = similarities.argmax(axis=1)
+                self._confidence[pending] = weights.max(axis=1) / weights.sum(axis=1)
+
+            mood = np.full(len(rows), -1, dtype=np.int64)
+            confidence = np.zeros(len(rows), dtype=np.float64)
+            mood[known] = self._mood[rows[known]]
+            confidence[known] = self._confidence[rows[known]]
+            return mood, confidence
+
+    def classify(self, track_ids: Sequence[str]) -> List[Dict]:
+        """
+        {trackId, mood, confidence} per track id, in order.
+        Tracks outside the catalog have no audio features: mood None, confidence 0.
+        """
+        rows = self._get_preprocessor().find_track_indices([str(track_id) for track_id in track_ids])
+        mood, confidence = self.classify_rows(rows)
+        return [
+            {
+                "trackId": track_id,
+                "mood": self.MOODS[m] if m >= 0 else None,
+                "confidence": round(c, 3),
+            }
+            for track_id, m, c in zip(track_ids, mood.tolist(), confidence.tolist())
+        ]
+
+    def classify_history(self, events: List[Dict]) -> List[Dict]:
+        """
+        Classify a user's ingested listening events (as kept by ListeningEventStore),
+        one entry per play in the order given
+        """
+        tracks = [event["item"].get("track") or {} for event in events]
+        classified = self.classify([track.get("id") or "" for track in tracks])
+        for entry, event, track in zip(classified, events, tracks):
+            entry["trackName"] = track.get("name")
+            entry["artistName"] = (track.get("artists") or [{}])[0].get("name")
+            entry["playedAt"] = event["item"].get("played_at")
+        return classified
+
+
+_classifier_instance = None
+_classifier_lock = threading.Lock()
+
+def get_mood_classifier() -> MoodClassifier:
+    """Get or create the global classifier instance"""
+    global _classifier_instance
+    if _classifier_instance is None:
+        with _classifier_lock:
+            if _classifier_instance is None:
+                _classifier_instance = MoodClassifier()
+    return _classifier_instance
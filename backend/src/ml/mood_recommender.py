@@ -1,7 +1,13 @@
+import threading
 import numpy as np
 from typing import List, Dict, Optional
 from sklearn.metrics.pairwise import cosine_similarity
 from .dataset_loader import get_preprocessor
+from .item_cf import load_item_cf
+
+MULTI_SEED_MODES = ("centroid", "max")
+# Catalog rows scored per matrix product in max-sim mode (bounds the block's memory to rows x seeds)
+SEED_SCORE_BLOCK = 16384
 
 class MoodRecommender:
     """
@@ -60,6 +66,10 @@ class MoodRecommender:
         self.df = self.preprocessor.df
         self.user_id = user_id
         self.user_mood_centroids = {}  # Learned mood centroids per user
+        self.user_mood_history = {}  # mood -> (catalog rows, weights) the user tagged, for CF
+        self._prototype_vectors = None
+        self._prototype_matrix = None
+        self._unit_features = None
         
         if self.feature_matrix is None:
             raise ValueError("Preprocessor must be initialized first")
@@ -98,7 +108,24 @@ class MoodRecommender:
         # Scale the prototype using the same scaler
         prototype_vector = self.preprocessor.scaler.transform([prototype_row.values])
         return prototype_vector[0]
-    
+
+    def get_mood_prototype_vectors(self) -> np.ndarray:
+        """All general mood prototype vectors (as blended with user centroids), in MOOD_PROTOTYPES order"""
+        if self._prototype_vectors is None:
+            self._prototype_vectors = np.vstack([self._create_mood_prototype_vector(mood) for mood in self.MOOD_PROTOTYPES])
+        return self._prototype_vectors
+
+    def get_mood_prototype_matrix(self) -> np.ndarray:
+        """
+        All general mood prototypes as unit rows, in MOOD_PROTOTYPES order.
+        For any track vector, argmax of (matrix @ vector) is its nearest mood by cosine similarity.
+        """
+        if self._prototype_matrix is None:
+            matrix = self.get_mood_prototype_vectors()
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._prototype_matrix = matrix / np.where(norms == 0, 1.0, norms)
+        return self._prototype_matrix
+
     def learn_from_user_sessions(self, sessions: List[Dict]):
         """
         Learn user-specific mood preferences from logged sessions.
@@ -120,6 +147,7 @@ class MoodRecommender:
         for mood, mood_sessions_list in mood_sessions.items():
             # Get feature vectors for all tracks user tagged with this mood
             track_vectors = []
+            track_rows = []
             for session in mood_sessions_list:
                 # Handle both camelCase (from Firestore) and snake_case
                 track_id = session.get('trackId') or session.get('track_id')
@@ -134,6 +162,7 @@ class MoodRecommender:
                     intensity = session.get('intensity', 50)
                     weight = float(intensity) / 100.0 if intensity else 0.5
                     track_vectors.append((track_vector, weight))
+                    track_rows.append(track_idx)
             
             if track_vectors:
                 # Compute weighted centroid
@@ -143,23 +172,30 @@ class MoodRecommender:
                 weights = weights / weights.sum() if weights.sum() > 0 else weights
                 centroid = np.average(vectors, axis=0, weights=weights)
                 self.user_mood_centroids[mood] = centroid
+                self.user_mood_history[mood] = (np.array(track_rows, dtype=np.int64), weights)
     
     def get_mood_recommendations(
         self, 
         mood: str, 
         top_k: int = 20,
         min_similarity: float = 0.0,
-        personalization_weight: float = 0.7
+        personalization_weight: float = 0.7,
+        cf_weight: float = 0.0,
+        exclude_rows: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """
         Get song recommendations for a given mood.
         If user has learned preferences, blends general prototype with user-specific centroid.
+        With cf_weight > 0 (hybrid mode), also blends in item-item CF scores from the tracks
+        the user tagged with this mood.
         
         Args:
             mood: One of "Happy", "Sad", "Energized", "Angry", "Calm"
             top_k: Number of recommendations to return
             min_similarity: Minimum similarity score threshold
             personalization_weight: 0.0 = only general, 1.0 = only user-specific (default 0.7)
+            cf_weight: 0.0 = only content similarity, 1.0 = only CF (default 0.0)
+            exclude_rows: Catalog rows never to recommend (e.g. tracks the user already played)
         
         Returns:
             List of track dictionaries with similarity scores
@@ -190,31 +226,54 @@ class MoodRecommender:
         # Calculate cosine similarity between mood prototype and all songs
         similarities = cosine_similarity(mood_vector, self.feature_matrix).flatten()
         
+        if cf_weight > 0 and mood in self.user_mood_history:
+            similarities = self._blend_cf(similarities, mood, cf_weight)
+        
         # Get top K indices
-        top_indices = similarities.argsort()[::-1][:top_k]
+        top_indices = self._top_k(similarities, top_k, exclude_rows)
         
         # Filter by minimum similarity
         top_indices = [idx for idx in top_indices if similarities[idx] >= min_similarity]
         
         # Build results
-        recommendations = []
-        for idx in top_indices:
-            track_info = self.preprocessor.get_track_by_index(idx)
-            if track_info:
-                track_info['similarity'] = float(similarities[idx])
-                track_info['similarity_percent'] = round(similarities[idx] * 100, 1)
-                recommendations.append(track_info)
-        
-        return recommendations
+        return self._build_results(top_indices, similarities)
+    
+    def _blend_cf(self, similarities: np.ndarray, mood: str, cf_weight: float) -> np.ndarray:
+        """
+        (1 - cf_weight) * content + cf_weight * CF, with CF scaled to [0, 1].
+        CF scores are only computed for neighbours of the user's history; everything else has CF 0.
+        """
+        model = load_item_cf()
+        if model is None:
+            return similarities
+        rows, weights = self.user_mood_history[mood]
+        candidates, cf_scores = model.score(rows, weights)
+        if len(candidates) == 0 or cf_scores.max() <= 0:
+            return similarities
+        blended = (1 - cf_weight) * similarities
+        blended[candidates] += cf_weight * cf_scores / cf_scores.max()
+        return blended
+    
+    def _top_k(self, similarities: np.ndarray, top_k: int, exclude_rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Indices of the top_k scores, best first. Excluded rows are masked to -inf
+        in place (cost is the number of excluded rows) and never returned.
+        """
+        if exclude_rows is not None and len(exclude_rows):
+            similarities[exclude_rows] = -np.inf
+        top_indices = similarities.argsort()[::-1][:top_k]
+        return top_indices[np.isfinite(similarities[top_indices])]
     
     def get_similar_songs(
         self,
         track_index: int,
-        top_k: int = 10
+        top_k: int = 10,
+        exclude_rows: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """
         Get songs similar to a specific track (by index).
         Useful for "song-based" recommendations.
+        exclude_rows are catalog rows never to return (e.g. tracks the user already played).
         """
         if track_index >= len(self.feature_matrix):
             return []
@@ -226,29 +285,94 @@ class MoodRecommender:
         similarities = cosine_similarity(track_vector, self.feature_matrix).flatten()
         
         # Get top K (excluding the track itself)
-        top_indices = similarities.argsort()[::-1][1:top_k+1]
+        if exclude_rows is None:
+            top_indices = similarities.argsort()[::-1][1:top_k+1]
+        else:
+            similarities[track_index] = -np.inf
+            top_indices = self._top_k(similarities, top_k, exclude_rows)
         
-        recommendations = []
-        for idx in top_indices:
-            track_info = self.preprocessor.get_track_by_index(idx)
-            if track_info:
-                track_info['similarity'] = float(similarities[idx])
-                track_info['similarity_percent'] = round(similarities[idx] * 100, 1)
-                recommendations.append(track_info)
+        return self._build_results(top_indices, similarities)
+    
+    def _get_unit_features(self) -> np.ndarray:
+        """feature_matrix with unit rows, so cosine similarity is a dot product"""
+        if self._unit_features is None:
+            norms = np.linalg.norm(self.feature_matrix, axis=1, keepdims=True)
+            self._unit_features = (self.feature_matrix / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+        return self._unit_features
+    
+    def get_multi_seed_recommendations(
+        self,
+        seed_indices: np.ndarray,
+        top_k: int = 20,
+        mode: str = "centroid",
+        exclude_rows: Optional[np.ndarray] = None
+    ) -> List[Dict]:
+        """
+        Get songs similar to a set of tracks (e.g. a playlist) in one pass; no catalog row of a seed's
+        track_id is ever returned.
         
-        return recommendations
+        Args:
+            seed_indices: Catalog rows of the seed tracks
+            mode: "centroid" scores against the mean of the seeds' unit vectors,
+                  "max" scores each track by its best cosine similarity to any seed
+                  (results then carry the closest seed's track_id as seed_track_id)
+            exclude_rows: Catalog rows never to recommend, besides the seeds
+        """
+        if mode not in MULTI_SEED_MODES:
+            raise ValueError(f"Unknown mode: {mode}. Must be one of {list(MULTI_SEED_MODES)}")
+        seeds = np.unique(np.asarray(seed_indices, dtype=np.int64))
+        if len(seeds) == 0:
+            return []
+        
+        unit_features = self._get_unit_features()
+        unit_seeds = unit_features[seeds]
+        closest = None
+        if mode == "centroid":
+            centroid = unit_seeds.mean(axis=0)
+            similarities = (unit_features @ (centroid / (np.linalg.norm(centroid) or 1.0))).astype(np.float64)
+        else:
+            # one (block x seeds) matrix product per catalog block instead of a pass per seed
+            similarities = np.empty(len(unit_features))
+            closest = np.empty(len(unit_features), dtype=np.int64)
+            for start in range(0, len(unit_features), SEED_SCORE_BLOCK):
+                scores = unit_features[start:start + SEED_SCORE_BLOCK] @ unit_seeds.T
+                closest[start:start + len(scores)] = scores.argmax(axis=1)
+                similarities[start:start + len(scores)] = np.take_along_axis(
+                    scores, closest[start:start + len(scores), None], axis=1
+                )[:, 0]
+        
+        # a seed listed under several genres has several rows; none of them may come back
+        seed_ids = [track['track_id'] for track in self.preprocessor.get_tracks_by_indices(seeds)]
+        excluded = self.preprocessor.find_track_rows(seed_ids)
+        if exclude_rows is not None:
+            excluded = np.concatenate([excluded, exclude_rows])
+        top_indices = self._top_k(similarities, top_k, excluded)
+        results = self._build_results(top_indices, similarities)
+        if closest is not None:
+            seed_ids = self.preprocessor.get_tracks_by_indices(seeds[closest[top_indices]])
+            for track_info, seed in zip(results, seed_ids):
+                track_info['seed_track_id'] = seed['track_id']
+        return results
+    
+    def _build_results(self, indices, similarities: np.ndarray) -> List[Dict]:
+        """Materialize result dicts for all indices in one bulk lookup"""
+        indices = np.asarray(indices, dtype=np.int64)
+        tracks = self.preprocessor.get_tracks_by_indices(indices)
+        scores = similarities[indices].tolist()
+        
+        for track_info, score in zip(tracks, scores):
+            track_info['similarity'] = score
+            track_info['similarity_percent'] = round(score * 100, 1)
+        
+        return tracks
     
     def _find_track_index(self, track_id: str) -> Optional[int]:
         """Find track index in dataset by track_id"""
-        if self.df is None:
-            return None
-        matches = self.df[self.df['track_id'] == track_id]
-        if len(matches) > 0:
-            return matches.index[0]
-        return None
+        return self.preprocessor.find_track_index(track_id)
 
 
 _recommender_instance = None
+_recommender_lock = threading.Lock()
 
 def get_recommender(user_id: Optional[str] = None) -> MoodRecommender:
     """Get or create the global recommender instance"""
@@ -258,5 +382,7 @@ def get_recommender(user_id: Optional[str] = None) -> MoodRecommender:
         return MoodRecommender(user_id=user_id)
 
     if _recommender_instance is None:
-        _recommender_instance = MoodRecommender()
+        with _recommender_lock:
+            if _recommender_instance is None:
+                _recommender_instance = MoodRecommender()
     return _recommender_instance
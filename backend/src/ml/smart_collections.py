@@ -0,0 +1,96 @@
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Optional
+from .dataset_loader import get_preprocessor
+from .mood_classifier import MoodClassifier, get_mood_classifier
+
+# Fewest of the user's tracks that make a sub-mood worth its own collection
+MIN_COLLECTION_TRACKS = 3
+MAX_SMART_COLLECTIONS = 10
+# Catalog tracks suggested per smart collection, scored within its cluster only
+SUGGESTIONS_PER_COLLECTION = 5
+
+
+def build_smart_collections(
+    sessions: List[Dict],
+    events: List[Dict],
+    preprocessor=None,
+    classifier: Optional[MoodClassifier] = None,
+    min_tracks: int = MIN_COLLECTION_TRACKS,
+    limit: int = MAX_SMART_COLLECTIONS,
+    suggestions: int = SUGGESTIONS_PER_COLLECTION,
+) -> List[Dict]:
+    """
+    Group a user's tagged tracks (sessions, with the mood they tagged) and played
+    tracks (listening events, with their classified mood) into sub-moods: one group
+    per (mood, catalog cluster) with at least min_tracks distinct tracks, largest first.
+    A track's most recent tag wins over its classified mood. Grouping is array
+    lookups into the precomputed cluster assignments, and suggestions are scored
+    against the group's centroid among that cluster's members only.
+    Returns no collections while the catalog has no (current) clustering.
+    """
+    preprocessor = preprocessor if preprocessor is not None else get_preprocessor()
+    if preprocessor.cluster_assignments is None:
+        return []
+    classifier = classifier if classifier is not None else get_mood_classifier()
+    moods = MoodClassifier.MOODS
+
+    tagged = [session for session in sessions if session.get("mood") in moods]
+    tagged_rows = preprocessor.find_track_indices([str(session.get("trackId") or "") for session in tagged])
+    tagged_moods = np.array([moods.index(session["mood"]) for session in tagged], dtype=np.int64)
+
+    played_ids = [(event["item"].get("track") or {}).get("id") or "" for event in events]
+    played_rows = preprocessor.find_track_indices(played_ids)
+    played_moods, _ = classifier.classify_rows(played_rows)
+
+    rows = np.concatenate([tagged_rows, played_rows])
+    mood = np.concatenate([tagged_moods, played_moods])
+    known = (rows >= 0) & (mood >= 0)
+    rows, mood = rows[known], mood[known]
+    # np.unique keeps each track's first occurrence: tags (newest first) before plays
+    rows, first = np.unique(rows, return_index=True)
+    mood = mood[first]
+    if len(rows) == 0:
+        return []
+
+    clusters = preprocessor.cluster_assignments[rows].astype(np.int64)
+    keys = mood * len(preprocessor.cluster_centroids) + clusters
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    order = [g for g in np.argsort(-counts, kind="stable") if counts[g] >= min_tracks][:limit]
+
+    features = preprocessor.feature_matrix
+    collections = []
+    for g in order:
+        in_group = inverse == g
+        members = rows[in_group]
+        cluster = int(clusters[in_group][0])
+        group_mood = moods[int(mood[in_group][0])]
+
+        vectors = features[members]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        centroid = (vectors / np.where(norms == 0, 1.0, norms)).mean(axis=0)
+        centroid /= np.linalg.norm(centroid) or 1.0
+
+        candidates = preprocessor.get_cluster_members(cluster)
+        candidates = candidates[~np.isin(candidates, rows)]
+        candidate_vectors = features[candidates]
+        candidate_norms = np.linalg.norm(candidate_vectors, axis=1)
+        scores = (candidate_vectors @ centroid) / np.where(candidate_norms == 0, 1.0, candidate_norms)
+        top = np.argsort(-scores, kind="stable")[:suggestions]
+
+        songs = preprocessor.get_tracks_by_indices(members)
+        genre, _ = Counter(song["track_genre"] for song in songs).most_common(1)[0]
+        suggested = preprocessor.get_tracks_by_indices(candidates[top])
+        for track_info, score in zip(suggested, scores[top].tolist()):
+            track_info["similarity"] = score
+            track_info["similarity_percent"] = round(score * 100, 1)
+        collections.append({
+            "name": f"{group_mood} {genre}".strip(),
+            "mood": group_mood,
+            "cluster": cluster,
+            "genre": genre,
+            "songCount": len(members),
+            "songs": songs,
+            "suggestions": suggested,
+        })
+    return collections
@@ -0,0 +1,87 @@
+"""
+Benchmark for sub-mood clustering of the catalog.
+Times mini-batch k-means over the full feature_matrix (as preprocessing runs it)
+against full-batch k-means, then compares scoring a smart collection's suggestions
+within its cluster against scoring the whole catalog.
+--rows resamples the catalog (with small jitter) up to that many tracks, to time
+a full-size catalog when only a sample is available locally.
+
+Run: python3 src/ml/tests/bench_clustering.py [--clusters 64] [--rows 0] [--repeat 50]
+"""
+import sys
+import time
+import pathlib
+import argparse
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir / "src"))
+
+from ml.dataset_loader import get_preprocessor
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def score_full(features, centroid, k=5):
+    norms = np.linalg.norm(features, axis=1)
+    scores = (features @ centroid) / np.where(norms == 0, 1.0, norms)
+    return np.argpartition(-scores, k)[:k]
+
+
+def score_cluster(features, members, centroid, k=5):
+    vectors = features[members]
+    norms = np.linalg.norm(vectors, axis=1)
+    scores = (vectors @ centroid) / np.where(norms == 0, 1.0, norms)
+    return members[np.argsort(-scores)[:k]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--rows", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    preprocessor = get_preprocessor()
+    rng = np.random.default_rng(0)
+    if args.rows > len(preprocessor.feature_matrix):
+        sample = rng.integers(0, len(preprocessor.feature_matrix), args.rows)
+        jitter = rng.normal(scale=0.05, size=(args.rows, preprocessor.feature_matrix.shape[1]))
+        preprocessor.feature_matrix = preprocessor.feature_matrix[sample] + jitter
+    features = preprocessor.feature_matrix
+    n, d = features.shape
+    print(f"Catalog size: {n} x {d}, clusters: {args.clusters}")
+
+    _, mini_batch = timed(lambda: preprocessor.cluster_features(args.clusters))
+    print(f" mini-batch k-means  {mini_batch:8.2f} s")
+    full, full_batch = timed(lambda: KMeans(n_clusters=args.clusters, n_init=3, random_state=0).fit(features))
+    print(f" full k-means        {full_batch:8.2f} s")
+    print(f" inertia ratio (mini-batch / full): "
+          f"{((features - preprocessor.cluster_centroids[preprocessor.cluster_assignments]) ** 2).sum() / full.inertia_:.3f}")
+
+    sizes = np.bincount(preprocessor.cluster_assignments, minlength=args.clusters)
+    print(f" cluster sizes: min {sizes.min()}, median {int(np.median(sizes))}, max {sizes.max()}")
+
+    # a smart collection's centroid: a handful of tracks from one cluster
+    cluster = int(np.argmax(sizes))
+    _, members_time = timed(lambda: preprocessor.get_cluster_members(cluster), args.repeat)
+    members = preprocessor.get_cluster_members(cluster)
+    centroid = features[members[:10]].mean(axis=0)
+    centroid /= np.linalg.norm(centroid)
+    _, full_time = timed(lambda: score_full(features, centroid), args.repeat)
+    _, local_time = timed(lambda: score_cluster(features, members, centroid), args.repeat)
+    print(f"Suggestions for one smart collection (largest cluster, {len(members)} tracks):")
+    print(f" full catalog        {full_time * 1e3:8.3f} ms")
+    print(f" cluster-local       {(local_time + members_time) * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
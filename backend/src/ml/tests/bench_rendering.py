@@ -0,0 +1,83 @@
+"""
+Benchmark for recommendation result rendering.
+Compares per-row get_track_by_index + stock JSON against bulk column-wise
+materialization + orjson, reporting cost per rendered result.
+
+Run: python3 src/ml/tests/bench_rendering.py [--limit 50] [--repeat 200]
+"""
+import sys
+import json
+import time
+import pathlib
+import argparse
+
+import numpy as np
+import orjson
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir / "src"))
+
+from ml.dataset_loader import get_preprocessor
+
+
+def render_per_row(preprocessor, indices, similarities):
+    """Previous approach: one iloc lookup per result, stock json encoder"""
+    recommendations = []
+    for idx in indices:
+        row = preprocessor.df.iloc[idx]
+        track_info = {
+            'track_id': str(row.get('track_id', '')),
+            'track_name': str(row.get('track_name', '')),
+            'artists': str(row.get('artists', '')),
+            'album_name': str(row.get('album_name', '')),
+            'track_genre': str(row.get('track_genre', '')),
+            'popularity': int(row.get('popularity', 0)),
+            'explicit': bool(row.get('explicit', False)),
+            'valence': float(row.get('valence', 0.5)),
+            'energy': float(row.get('energy', 0.5)),
+            'danceability': float(row.get('danceability', 0.5)),
+        }
+        track_info['similarity'] = float(similarities[idx])
+        track_info['similarity_percent'] = round(float(similarities[idx]) * 100, 1)
+        recommendations.append(track_info)
+    return json.dumps({"recommendations": recommendations}).encode("utf-8")
+
+
+def render_bulk(preprocessor, indices, similarities):
+    """Current approach: column-wise materialization, orjson"""
+    tracks = preprocessor.get_tracks_by_indices(indices)
+    for track_info, score in zip(tracks, similarities[indices].tolist()):
+        track_info['similarity'] = score
+        track_info['similarity_percent'] = round(score * 100, 1)
+    return orjson.dumps({"recommendations": tracks})
+
+
+def bench(fn, preprocessor, indices, similarities, repeat):
+    fn(preprocessor, indices, similarities)  # warm up (builds column cache)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(preprocessor, indices, similarities)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    preprocessor = get_preprocessor()
+    n = len(preprocessor.df)
+    rng = np.random.default_rng(0)
+    similarities = rng.random(n)
+    indices = similarities.argsort()[::-1][:args.limit]
+
+    print(f"Catalog size: {n}, results per request: {args.limit}")
+    for name, fn in [("per-row + json", render_per_row), ("bulk + orjson", render_bulk)]:
+        elapsed = bench(fn, preprocessor, indices, similarities, args.repeat)
+        print(f" {name:16s} {elapsed * 1e3:8.3f} ms/request  {elapsed / args.limit * 1e6:8.2f} us/result")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Tests for loading the preprocessed catalog
+"""
+import sys
+import time
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.ml import dataset_loader
+
+
+def test_cold_get_preprocessor_loads_once(monkeypatch):
+    loads = []
+
+    class SlowPreprocessor:
+        def load_preprocessed(self):
+            loads.append(1)
+            time.sleep(0.05)
+            self.loaded = True
+            return True
+
+    monkeypatch.setattr(dataset_loader, "MoodDatasetPreprocessor", SlowPreprocessor)
+    monkeypatch.setattr(dataset_loader, "_preprocessor_instance", None)
+
+    def get(_):
+        preprocessor = dataset_loader.get_preprocessor()
+        return preprocessor, getattr(preprocessor, "loaded", False)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(get, range(8)))
+
+    assert len(loads) == 1
+    assert all(instance is results[0][0] for instance, _ in results)
+    # nobody is handed the instance before it has finished loading
+    assert all(loaded for _, loaded in results)
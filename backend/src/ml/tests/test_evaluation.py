@@ -0,0 +1,97 @@
+"""
+Tests for the offline recommendation evaluator
+"""
+import sys
+import time
+import pathlib
+import threading
+
+import numpy as np
+import pytest
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.sqlite_storage import SQLiteStorageBackend
+from src.ml.evaluation import EvaluationCatalog, evaluate, evaluate_users, split_sessions, _user_chunks, MOODS
+
+
+def make_catalog(catalog):
+    prototypes = np.random.default_rng(1).normal(size=(5, catalog.feature_matrix.shape[1]))
+    return EvaluationCatalog(catalog.feature_matrix, prototypes, catalog.find_track_indices)
+
+
+def session(track, mood, created_at, intensity=50):
+    return {"trackId": track, "mood": mood, "intensity": intensity, "createdAt": created_at}
+
+
+def test_split_is_by_time_and_needs_enough_sessions():
+    sessions = [session(f"t{i}", "Happy", created_at=10 - i) for i in range(10)]
+    train, test = split_sessions(sessions, test_fraction=0.2)
+    assert [s["createdAt"] for s in test] == [9, 10]
+    assert max(s["createdAt"] for s in train) < 9
+    assert split_sessions(sessions[:3]) is None
+
+
+def test_metrics_match_a_direct_computation(fake_catalog):
+    catalog = make_catalog(fake_catalog(n=300, d=6))
+    k = 10
+    # the user's test tracks for Happy: one in the general top-k, one far outside it
+    general = catalog.general_top_k(k)[MOODS.index("Happy")]
+    outside = next(i for i in range(300) if i not in general)
+    train = [session("t0", "Sad", created_at=i) for i in range(4)]
+    test = [session(f"t{general[3]}", "Happy", created_at=10), session(f"t{outside}", "Happy", created_at=11)]
+    totals = evaluate_users(catalog, [train + test], k=k, test_fraction=0.34)
+
+    assert totals["users"] == 1 and totals["queries"] == 1
+    ideal = 1 + 1 / np.log2(3)
+    assert totals["general"]["precision"] == pytest.approx(1 / k)
+    assert totals["general"]["recall"] == pytest.approx(0.5)
+    assert totals["general"]["ndcg"] == pytest.approx((1 / np.log2(5)) / ideal)
+    # no Happy history to personalize with: same ranking as general
+    assert totals["personalized"]["ndcg"] == totals["general"]["ndcg"]
+
+
+def test_pool_matches_in_process(tmp_path, fake_catalog):
+    storage = SQLiteStorageBackend(str(tmp_path / "test.db"))
+    rng = np.random.default_rng(1)
+    for user in range(40):
+        for i in range(int(rng.integers(3, 30))):
+            storage.save_user_session(f"u{user}", f"t{rng.integers(0, 300)}", MOODS[int(rng.integers(0, 5))], int(rng.integers(0, 101)))
+
+    catalog = make_catalog(fake_catalog(n=300, d=6))
+    serial = evaluate(storage, k=10, workers=1, catalog=catalog, chunk_size=7)
+    pooled = evaluate(storage, k=10, workers=2, catalog=catalog, chunk_size=7)
+    storage.close()
+
+    assert serial["users_evaluated"] == pooled["users_evaluated"] > 0
+    for variant in ("general", "personalized"):
+        assert serial[variant] == pooled[variant]
+        assert 0 < serial[variant]["coverage"] <= 1
+
+
+def test_sessions_are_fetched_concurrently_in_user_order():
+    class SlowStorage:
+        def __init__(self, n):
+            self.user_ids = [f"u{i:03d}" for i in range(n)]
+            self.active = self.peak = 0
+            self.lock = threading.Lock()
+
+        def list_user_ids(self, after=None, limit=1000):
+            return [u for u in self.user_ids if after is None or u > after][:25]
+
+        def get_user_sessions(self, user_id, fields=None):
+            with self.lock:
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            time.sleep(0.01)
+            with self.lock:
+                self.active -= 1
+            return [{"user": user_id}]
+
+    storage = SlowStorage(60)
+    chunks = list(_user_chunks(storage, chunk_size=7, fetch_threads=8))
+    assert [len(chunk) for chunk in chunks] == [7] * 8 + [4]
+    assert [sessions[0]["user"] for chunk in chunks for sessions in chunk] == storage.user_ids
+    assert storage.peak > 1
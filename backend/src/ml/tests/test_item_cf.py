@@ -0,0 +1,107 @@
+"""
+Tests for the item-item co-occurrence model built from mood sessions
+"""
+import sys
+import pathlib
+
+import numpy as np
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.ml import item_cf
+from src.ml.item_cf import ItemCooccurrenceModel, refresh
+
+N_TRACKS = 60
+
+
+def find_track_indices(track_ids):
+    return np.array([int(t[1:]) if t.startswith("t") else -1 for t in track_ids], dtype=np.int64)
+
+
+class FakeStorage:
+    def __init__(self):
+        self.sessions = {}
+
+    def add(self, user_id, track, mood, created_at):
+        self.sessions.setdefault(user_id, []).append(
+            {"firebaseUserId": user_id, "trackId": f"t{track}", "mood": mood, "createdAt": created_at}
+        )
+
+    def get_sessions_created_since(self, since=None, limit=1000, cursor=None, fields=None):
+        ordered = sorted((s for sessions in self.sessions.values() for s in sessions), key=lambda s: s["createdAt"])
+        ordered = [s for s in ordered if since is None or s["createdAt"] >= since]
+        start = cursor or 0
+        end = start + limit
+        return ordered[start:end], end if end < len(ordered) else None
+
+
+def random_sessions(storage, seed, start, count):
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        storage.add(f"u{rng.integers(0, 8)}", int(rng.integers(0, N_TRACKS)), ["Happy", "Sad"][rng.integers(0, 2)],
+                    start + i * 1000)
+
+
+def expected_cooccurrence(storage):
+    baskets = {}
+    for user_id, sessions in storage.sessions.items():
+        for s in sessions:
+            baskets.setdefault((user_id, s["mood"]), set()).add(int(s["trackId"][1:]))
+    counts = np.zeros((N_TRACKS, N_TRACKS))
+    for tracks in baskets.values():
+        for i in tracks:
+            for j in tracks:
+                if i != j:
+                    counts[i, j] += 1
+    return counts
+
+
+def test_incremental_refresh_matches_full_rebuild(tmp_path, monkeypatch):
+    monkeypatch.setattr(item_cf, "SESSIONS_PER_PAGE", 40)
+    storage = FakeStorage()
+    random_sessions(storage, seed=0, start=0, count=150)
+    model = ItemCooccurrenceModel(N_TRACKS, "v1", top_n=5)
+    refresh(model, storage, find_track_indices)
+    model.save(tmp_path / "cf.npz")
+
+    # new sessions are picked up from the watermark; re-reading the overlap changes nothing
+    random_sessions(storage, seed=1, start=10_000_000, count=150)
+    model = ItemCooccurrenceModel.load(tmp_path / "cf.npz")
+    stats = refresh(model, storage, find_track_indices)
+    assert 0 < stats["memberships_added"] <= 150
+
+    full = ItemCooccurrenceModel(N_TRACKS, "v1", top_n=5)
+    refresh(full, storage, find_track_indices)
+    expected = expected_cooccurrence(storage)
+    assert np.array_equal(model.counts.toarray(), expected)
+    assert np.array_equal(full.counts.toarray(), expected)
+    assert np.array_equal(model.item_counts, full.item_counts)
+    # neighbours of rows whose own baskets didn't change were re-pruned as their neighbours' counts grew
+    assert np.allclose(model.neighbours.toarray(), full.neighbours.toarray())
+
+    # every row keeps at most top_n neighbours, and they are its best by co-occurrence cosine
+    n = full.item_counts.astype(float)
+    cosine = expected / np.sqrt(np.outer(n, n), where=np.outer(n, n) > 0, out=np.ones_like(expected))
+    neighbours = full.neighbours.toarray()
+    for row in range(N_TRACKS):
+        kept = np.flatnonzero(neighbours[row])
+        assert len(kept) == min(5, np.count_nonzero(expected[row]))
+        if len(kept):
+            assert np.allclose(neighbours[row, kept], cosine[row, kept])
+            assert cosine[row, kept].min() >= np.sort(cosine[row])[::-1][len(kept) - 1] - 1e-9
+
+
+def test_score_sums_weighted_neighbours_of_history():
+    model = ItemCooccurrenceModel(N_TRACKS, "v1", top_n=10)
+    storage = FakeStorage()
+    random_sessions(storage, seed=2, start=0, count=300)
+    refresh(model, storage, find_track_indices)
+
+    history, weights = np.array([3, 7, 11]), np.array([0.5, 0.3, 0.2])
+    candidates, scores = model.score(history, weights)
+    dense = weights @ model.neighbours.toarray()[history]
+    assert np.array_equal(candidates, np.flatnonzero(dense))
+    assert np.allclose(scores, dense[candidates])
+    assert len(model.score(np.array([], dtype=np.int64))[0]) == 0
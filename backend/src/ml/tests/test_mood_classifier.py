@@ -0,0 +1,57 @@
+"""
+Tests for batch mood classification of catalog tracks and listening history
+"""
+import sys
+import pathlib
+
+import numpy as np
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.ml.mood_classifier import MoodClassifier
+
+
+def make_classifier(catalog):
+    prototypes = np.random.default_rng(1).normal(size=(5, catalog.feature_matrix.shape[1]))
+    prototypes /= np.linalg.norm(prototypes, axis=1, keepdims=True)
+    return MoodClassifier(catalog, prototypes), prototypes
+
+
+def test_batch_matches_per_track_argmax_and_caches_rows(fake_catalog):
+    preprocessor = fake_catalog(n=500, d=8)
+    classifier, prototypes = make_classifier(preprocessor)
+    rows = np.random.default_rng(2).integers(-1, 500, 5000)
+    mood, confidence = classifier.classify_rows(rows)
+
+    for row, m, c in zip(rows[:200], mood[:200], confidence[:200]):
+        if row < 0:
+            assert m == -1 and c == 0
+            continue
+        vector = preprocessor.feature_matrix[row]
+        cosine = prototypes @ (vector / np.linalg.norm(vector))
+        assert m == cosine.argmax()
+        assert 0.2 < c <= 1
+
+    # cached rows aren't rescored, even if the features change underneath
+    preprocessor.feature_matrix[:] = 0
+    assert np.array_equal(classifier.classify_rows(rows)[0], mood)
+    # a new catalog version starts over
+    preprocessor.version = "v2"
+    assert (classifier.classify_rows(rows[rows >= 0])[0] == 0).all()
+
+
+def test_classify_history_labels_each_play(fake_catalog):
+    classifier, _ = make_classifier(fake_catalog(n=500, d=8))
+    events = [
+        {"played_at_ms": 1, "item": {"played_at": "2024-01-01T00:00:00Z",
+                                     "track": {"id": "t3", "name": "Song", "artists": [{"name": "A"}]}}},
+        {"played_at_ms": 2, "item": {"played_at": "2024-01-01T00:05:00Z",
+                                     "track": {"id": "unknown", "name": "Other", "artists": []}}},
+    ]
+    plays = classifier.classify_history(events)
+    assert plays[0]["mood"] in MoodClassifier.MOODS and plays[0]["confidence"] > 0
+    assert plays[0]["trackName"] == "Song" and plays[0]["artistName"] == "A"
+    assert plays[1]["mood"] is None and plays[1]["confidence"] == 0
+    assert plays[1]["playedAt"] == "2024-01-01T00:05:00Z"
@@ -0,0 +1,75 @@
+"""
+Tests for multi-seed ("more like this playlist") recommendations
+"""
+import sys
+import pathlib
+
+import numpy as np
+import pytest
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.ml import mood_recommender
+from src.ml.mood_recommender import MoodRecommender
+
+
+def make_recommender(catalog):
+    recommender = MoodRecommender.__new__(MoodRecommender)
+    recommender.preprocessor = catalog
+    recommender.feature_matrix = catalog.feature_matrix
+    recommender._unit_features = None
+    return recommender
+
+
+def cosine(a, b):
+    return (a @ b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+def test_max_sim_matches_per_seed_loop(monkeypatch, fake_catalog):
+    # several catalog blocks, the last one partial
+    monkeypatch.setattr(mood_recommender, "SEED_SCORE_BLOCK", 700)
+    recommender = make_recommender(fake_catalog(n=3000, d=12))
+    features = recommender.feature_matrix
+    seeds = np.array([5, 17, 900, 2999, 17])
+
+    results = recommender.get_multi_seed_recommendations(seeds, top_k=10, mode="max")
+    best = np.max([[cosine(features[s], row) for row in features] for s in set(seeds.tolist())], axis=0)
+    best[list(set(seeds.tolist()))] = -np.inf
+    expected = np.argsort(-best)[:10]
+    assert [r["track_id"] for r in results] == [f"t{i}" for i in expected]
+    for result, row in zip(results, expected):
+        assert result["similarity"] == pytest.approx(best[row], abs=1e-5)
+        closest = int(result["seed_track_id"][1:])
+        assert cosine(features[closest], features[row]) == pytest.approx(best[row], abs=1e-5)
+
+
+def test_centroid_mode_excludes_seeds_and_played_rows(fake_catalog):
+    recommender = make_recommender(fake_catalog(n=3000, d=12))
+    features = recommender.feature_matrix
+    seeds = np.array([1, 2, 3])
+    unit = features / np.linalg.norm(features, axis=1, keepdims=True)
+    centroid = unit[seeds].mean(axis=0)
+    scores = np.array([cosine(centroid, row) for row in features])
+    ranked = [i for i in np.argsort(-scores) if i not in (1, 2, 3)]
+
+    results = recommender.get_multi_seed_recommendations(seeds, top_k=5, exclude_rows=np.array(ranked[:2], dtype=np.int32))
+    assert [r["track_id"] for r in results] == [f"t{i}" for i in ranked[2:7]]
+    assert "seed_track_id" not in results[0]
+
+    with pytest.raises(ValueError):
+        recommender.get_multi_seed_recommendations(seeds, mode="sum")
+    assert recommender.get_multi_seed_recommendations(np.array([], dtype=np.int64)) == []
+
+
+def test_every_row_of_a_seed_track_is_excluded(fake_catalog):
+    # row 2500 is another catalog entry of seed t1 (the same song listed under a second genre)
+    recommender = make_recommender(fake_catalog(n=3000, d=12, duplicates={2500: 1}))
+    features = recommender.feature_matrix
+    features[2500] = features[1] * 1.01
+
+    for mode in ("centroid", "max"):
+        results = recommender.get_multi_seed_recommendations(np.array([1, 2]), top_k=20, mode=mode)
+        assert len(results) == 20
+        assert not {"t1", "t2"} & {r["track_id"] for r in results}
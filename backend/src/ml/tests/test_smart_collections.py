@@ -0,0 +1,107 @@
+"""
+Tests for catalog clustering and smart collections built from it
+"""
+import sys
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.ml.dataset_loader import MoodDatasetPreprocessor
+from src.ml.mood_classifier import MoodClassifier
+from src.ml.smart_collections import build_smart_collections
+
+
+def write_catalog(path, n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({
+        "track_id": [f"t{i}" for i in range(n)],
+        "artists": [f"artist {i % 40}" for i in range(n)],
+        "album_name": [f"album {i % 60}" for i in range(n)],
+        "track_name": [f"song {i}" for i in range(n)],
+        "popularity": rng.integers(0, 100, n),
+        "duration_ms": rng.integers(120000, 300000, n),
+        "explicit": rng.random(n) < 0.1,
+        "danceability": rng.random(n),
+        "energy": rng.random(n),
+        "key": rng.integers(0, 12, n),
+        "loudness": rng.uniform(-30, 0, n),
+        "mode": rng.integers(0, 2, n),
+        "speechiness": rng.random(n),
+        "acousticness": rng.random(n),
+        "instrumentalness": rng.random(n),
+        "liveness": rng.random(n),
+        "valence": rng.random(n),
+        "tempo": rng.uniform(60, 180, n),
+        "time_signature": 4,
+        "track_genre": [["pop", "rock", "jazz"][i % 3] for i in range(n)],
+    }).to_csv(path, index=False)
+
+
+def make_preprocessor(tmp_path):
+    write_catalog(tmp_path / "dataset.csv")
+    preprocessor = MoodDatasetPreprocessor(csv_path=tmp_path / "dataset.csv")
+    preprocessor.CLUSTER_COUNT = 8
+    preprocessor.preprocess()
+    return preprocessor
+
+
+def test_clusters_persist_and_members_match_assignments(tmp_path):
+    preprocessor = make_preprocessor(tmp_path)
+    assert preprocessor.cluster_centroids.shape == (8, preprocessor.feature_matrix.shape[1])
+    assert preprocessor.cluster_assignments.dtype == np.int32
+    for cluster in range(8):
+        members = preprocessor.get_cluster_members(cluster)
+        assert np.array_equal(members, np.flatnonzero(preprocessor.cluster_assignments == cluster))
+
+    preprocessor.save_preprocessed()
+    loaded = MoodDatasetPreprocessor(csv_path=tmp_path / "dataset.csv")
+    assert loaded.load_preprocessed()
+    assert np.array_equal(loaded.cluster_assignments, preprocessor.cluster_assignments)
+
+    assert loaded.version == preprocessor.version
+    assert not list(tmp_path.glob("*.tmp"))
+
+    # a clustering saved for other artifacts is ignored rather than recomputed on load
+    clusters = (tmp_path / "clusters.npz").read_bytes()
+    preprocessor.df = preprocessor.df.head(100)
+    preprocessor.save_preprocessed()
+    (tmp_path / "clusters.npz").write_bytes(clusters)
+    stale = MoodDatasetPreprocessor(csv_path=tmp_path / "dataset.csv")
+    assert stale.load_preprocessed()
+    assert stale.cluster_assignments is None
+    assert (tmp_path / "clusters.npz").read_bytes() == clusters
+    assert build_smart_collections([{"trackId": "t0", "mood": "Calm"}], [], stale) == []
+
+
+def test_smart_collections_group_by_mood_and_cluster(tmp_path):
+    preprocessor = make_preprocessor(tmp_path)
+    prototypes = np.random.default_rng(1).normal(size=(5, preprocessor.feature_matrix.shape[1]))
+    classifier = MoodClassifier(preprocessor, prototypes / np.linalg.norm(prototypes, axis=1, keepdims=True))
+
+    cluster_zero = preprocessor.get_cluster_members(0)[:4]
+    sessions = [{"trackId": f"t{row}", "mood": "Calm"} for row in cluster_zero]
+    # a play of a tagged track keeps its tag; unknown tracks are ignored
+    events = [{"item": {"track": {"id": f"t{cluster_zero[0]}"}}}, {"item": {"track": {"id": "missing"}}}]
+    events += [{"item": {"track": {"id": f"t{row}"}}} for row in range(100)]
+
+    collections = build_smart_collections(sessions, events, preprocessor, classifier, min_tracks=2)
+    calm = [c for c in collections if c["mood"] == "Calm" and c["cluster"] == 0]
+    assert calm and {f"t{row}" for row in cluster_zero} <= {song["track_id"] for song in calm[0]["songs"]}
+
+    counts = [c["songCount"] for c in collections]
+    assert counts == sorted(counts, reverse=True) and min(counts) >= 2
+    owned = {f"t{row}" for row in range(100)} | {f"t{row}" for row in cluster_zero}
+    for collection in collections:
+        assert len({song["track_id"] for song in collection["songs"]}) == collection["songCount"]
+        members = {f"t{row}" for row in preprocessor.get_cluster_members(collection["cluster"])}
+        for track in collection["suggestions"]:
+            assert track["track_id"] in members and track["track_id"] not in owned
+        scores = [track["similarity"] for track in collection["suggestions"]]
+        assert scores == sorted(scores, reverse=True)
+
+    assert build_smart_collections([], [], preprocessor, classifier) == []
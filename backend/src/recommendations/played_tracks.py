@@ -0,0 +1,127 @@
+"""
+Per-user filters of the catalog tracks a user has already tagged or played,
+so recommendations can leave them out without rescanning history per request.
+Each filter is a sorted int32 array of catalog rows, built once from the
+user's mood sessions and listening history; the session and history write
+paths then merge new tracks in. Filters are kept in memory for the
+MAX_CACHED_USERS most recently used users.
+"""
+import os
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..ml.dataset_loader import get_preprocessor
+from ..storage import async_storage
+from ..storage.listening_events import ListeningEventStore, listening_event_store
+
+MAX_CACHED_USERS = int(os.getenv("PLAYED_FILTER_MAX_USERS", "10000"))
+SESSION_FIELDS = ["trackId"]
+
+
+class PlayedTrackFilters:
+    """Sorted catalog rows of each user's tagged and played tracks, kept current by the write paths"""
+
+    def __init__(
+        self,
+        event_store: ListeningEventStore = listening_event_store,
+        max_users: int = MAX_CACHED_USERS,
+        preprocessor=None
+    ):
+        self.event_store = event_store
+        self.max_users = max_users
+        self._preprocessor = preprocessor
+        self._lock = threading.Lock()
+        # user -> (catalog version, sorted int32 rows), least recently used first
+        self._filters: "OrderedDict[str, Tuple[str, np.ndarray]]" = OrderedDict()
+        # Rows recorded while a user's filter is being built
+        self._building: Dict[str, List[np.ndarray]] = {}
+        self._build_locks: Dict[str, asyncio.Lock] = {}
+
+    def _get_preprocessor(self):
+        return self._preprocessor if self._preprocessor is not None else get_preprocessor()
+
+    def _rows(self, track_ids: Sequence[Optional[str]]) -> np.ndarray:
+        """Sorted catalog rows of the track ids that are in the catalog, every row of a repeated id included"""
+        return self._get_preprocessor().find_track_rows([str(track_id or "") for track_id in track_ids]).astype(np.int32)
+
+    def _add(self, firebase_user_id: str, track_ids: Sequence[Optional[str]]):
+        with self._lock:
+            wanted = firebase_user_id in self._filters or firebase_user_id in self._building
+        if not track_ids or not wanted:
+            return  # picked up from storage when the user's filter is first built
+        rows = self._rows(track_ids)
+        with self._lock:
+            building = self._building.get(firebase_user_id)
+            if building is not None:
+                building.append(rows)
+            cached = self._filters.get(firebase_user_id)
+            if cached is not None:
+                # a filter from another catalog version is rebuilt on the next get()
+                self._filters[firebase_user_id] = (cached[0], np.union1d(cached[1], rows))
+
+    def record_sessions(self, firebase_user_id: str, sessions: List[dict]):
+        """Add the tracks of newly saved mood sessions"""
+        self._add(firebase_user_id, [session.get("trackId") for session in sessions])
+
+    def record_events(self, firebase_user_id: str, events: List[dict]):
+        """Add the tracks of newly stored listening events"""
+        self._add(firebase_user_id, [(event["item"].get("track") or {}).get("id") for event in events])
+
+    @asynccontextmanager
+    async def _build_lock(self, firebase_user_id: str):
+        """One build per user at a time; the lock is forgotten once its holder is done, so only users mid-build keep one"""
+        lock = self._build_locks.setdefault(firebase_user_id, asyncio.Lock())
+        try:
+            async with lock:
+                yield
+        finally:
+            if self._build_locks.get(firebase_user_id) is lock:
+                del self._build_locks[firebase_user_id]
+
+    async def get(self, firebase_user_id: str) -> np.ndarray:
+        """The user's filter, built from stored sessions and listening history on first use"""
+        # a cold catalog load must not block the event loop
+        version = await async_storage.run_sync(lambda: self._get_preprocessor().version)
+        with self._lock:
+            cached = self._filters.get(firebase_user_id)
+            if cached is not None and cached[0] == version:
+                self._filters.move_to_end(firebase_user_id)
+                return cached[1]
+
+        async with self._build_lock(firebase_user_id):
+            with self._lock:
+                cached = self._filters.get(firebase_user_id)
+                if cached is not None and cached[0] == version:
+                    return cached[1]
+                self._filters.pop(firebase_user_id, None)
+                self._building[firebase_user_id] = []
+            try:
+                sessions = await async_storage.get_user_sessions(firebase_user_id, fields=SESSION_FIELDS)
+                events = await async_storage.run_sync(self.event_store.since, firebase_user_id, -1)
+                rows = await async_storage.run_sync(
+                    self._rows,
+                    [session.get("trackId") for session in sessions]
+                    + [(event["item"].get("track") or {}).get("id") for event in events],
+                )
+            except Exception:
+                with self._lock:
+                    self._building.pop(firebase_user_id, None)
+                raise
+
+            with self._lock:
+                # merging is idempotent, so writes storage already returned can be applied again
+                for recorded in self._building.pop(firebase_user_id):
+                    rows = np.union1d(rows, recorded)
+                self._filters[firebase_user_id] = (version, rows)
+                while len(self._filters) > self.max_users:
+                    self._filters.popitem(last=False)
+            return rows
+
+
+# Global instance
+played_track_filters = PlayedTrackFilters()
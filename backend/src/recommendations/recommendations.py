@@ -1,13 +1,35 @@
-from fastapi import APIRouter, Query, HTTPException, Body
+import os
+import time
+import asyncio
+from fastapi import APIRouter, Query, HTTPException, Body, Request
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
-from ..ml.mood_recommender import get_recommender
+from ..ml.mood_recommender import get_recommender, MULTI_SEED_MODES
 from ..ml.dataset_loader import get_preprocessor
-from ..storage.firestore_storage import get_user_sessions, save_user_session
+from ..storage import async_storage
+from ..storage.session_queue import SessionQueueFullError
+from ..analytics.rollups import analytics_rollups
+from .response_cache import response_cache
+from .played_tracks import played_track_filters
 
 router = APIRouter()
 
+# Upper bound on sessions in one batch logging request
+MAX_BATCH_SESSIONS = 1000
+# Upper bound on seed tracks in one multi-seed recommendation request
+MAX_SEED_TRACKS = 500
+# Default page size of /api/sessions once a client pages with limit or cursor
+SESSIONS_PAGE_SIZE = 50
+
+# Personalization reads only the newest sessions, and only the fields it uses,
+# so latency stays bounded for users with long histories
+PERSONALIZATION_MAX_SESSIONS = int(os.getenv("PERSONALIZATION_MAX_SESSIONS", "500"))
+PERSONALIZATION_WINDOW_DAYS = int(os.getenv("PERSONALIZATION_WINDOW_DAYS", "365"))  # 0 = no window
+PERSONALIZATION_FIELDS = ["trackId", "mood", "intensity"]
+
 class RecommendationResponse(BaseModel):
     track_id: str
     track_name: str
@@ -35,6 +57,27 @@ class LogSessionRequest(BaseModel):
     artist_name: Optional[str] = None
     session_type: str = "track"
 
+class BatchSessionItem(BaseModel):
+    track_id: str
+    mood: str
+    intensity: int = 50
+    track_name: Optional[str] = None
+    artist_name: Optional[str] = None
+    session_type: str = "track"
+    # Client-chosen key; resending the same key never logs the session twice
+    idempotency_key: Optional[str] = Field(None, max_length=200)
+
+class LogSessionBatchRequest(BaseModel):
+    firebase_user_id: str
+    sessions: List[BatchSessionItem] = Field(..., min_length=1, max_length=MAX_BATCH_SESSIONS)
+
+class MultiSeedRequest(BaseModel):
+    track_ids: List[str] = Field(..., min_length=1, max_length=MAX_SEED_TRACKS)
+    mode: str = "centroid"
+    limit: int = Field(20, ge=1, le=50)
+    # leaves out tracks this user already tagged or played
+    firebase_user_id: Optional[str] = None
+
 @router.post("/api/sessions/log")
 async def log_mood_session(request: LogSessionRequest):
     """
@@ -56,7 +99,7 @@ async def log_mood_session(request: LogSessionRequest):
         )
     
     try:
-        session_data = save_user_session(
+        session_data = await async_storage.save_user_session(
             firebase_user_id=request.firebase_user_id,
             track_id=request.track_id,
             mood=request.mood,
@@ -65,47 +108,166 @@ async def log_mood_session(request: LogSessionRequest):
             artist_name=request.artist_name,
             session_type=request.session_type
         )
+        await run_in_threadpool(analytics_rollups.record_sessions, request.firebase_user_id, [session_data])
+        await run_in_threadpool(played_track_filters.record_sessions, request.firebase_user_id, [session_data])
         
         return {
             "success": True,
             "session_id": session_data["id"],
             "message": "Mood session logged successfully"
         }
+    except SessionQueueFullError:
+        # write-behind queue is backed up; ask the client to retry shortly
+        raise HTTPException(
+            status_code=503,
+            detail="Too many mood sessions waiting to be saved, please retry",
+            headers={"Retry-After": "1"}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error logging session: {str(e)}")
 
+@router.post("/api/sessions/log/batch")
+async def log_mood_sessions_batch(request: LogSessionBatchRequest):
+    """
+    Log many mood-song sessions in one request (e.g. when a user tags a whole playlist).
+    Each item is validated on its own; valid items are written with batched writes and
+    the user's profile counters updated alongside them. Items carrying an idempotency_key
+    that was already logged are reported as duplicates, so retrying a request is safe.
+    """
+    moods = ["Happy", "Sad", "Energized", "Angry", "Calm"]
+    
+    results: List[Optional[dict]] = [None] * len(request.sessions)
+    valid = []
+    for i, item in enumerate(request.sessions):
+        if item.mood not in moods:
+            results[i] = {"index": i, "status": "invalid", "error": "Invalid mood."}
+        elif not (0 <= item.intensity <= 100):
+            results[i] = {"index": i, "status": "invalid", "error": "Intensity must be between 0 and 100"}
+        else:
+            valid.append((i, item.model_dump()))
+    
+    try:
+        saved = await async_storage.save_user_sessions(
+            request.firebase_user_id, [session for _, session in valid]
+        ) if valid else []
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error logging sessions: {str(e)}")
+    
+    created = []
+    now = time.time()
+    for (i, session), result in zip(valid, saved):
+        results[i] = {
+            "index": i,
+            "status": "created" if result["created"] else "duplicate",
+            "session_id": result["id"],
+        }
+        if result["created"]:
+            created.append({
+                "id": result["id"],
+                "trackId": session["track_id"],
+                "mood": session["mood"],
+                "intensity": session["intensity"],
+                "artistName": session["artist_name"],
+                "createdAt": now,
+            })
+    if created:
+        await run_in_threadpool(analytics_rollups.record_sessions, request.firebase_user_id, created)
+        await run_in_threadpool(played_track_filters.record_sessions, request.firebase_user_id, created)
+    
+    statuses = [result["status"] for result in results]
+    return {
+        "success": True,
+        "created": statuses.count("created"),
+        "duplicates": statuses.count("duplicate"),
+        "invalid": statuses.count("invalid"),
+        "results": results
+    }
+
 @router.get("/api/sessions")
 async def get_user_sessions_endpoint(
     firebase_user_id: str = Query(..., description="Firebase user ID"),
     mood: Optional[str] = Query(None, description="Optional mood filter"),
-    limit: Optional[int] = Query(None, ge=1, le=100, description="Optional limit")):
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Page size (every session if neither limit nor cursor is given)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")):
     """
-    Get user's logged mood sessions.
+    Get user's logged mood sessions, newest first.
+    Without limit or cursor every session is returned (next_cursor is null). With either,
+    one page comes back: pass the returned next_cursor to get the following page; it is
+    null on the last page.
     """
     try:
-        sessions = get_user_sessions(
-            firebase_user_id=firebase_user_id,
-            mood=mood,
-            limit=limit
-        )
+        if limit is None and cursor is None:
+            sessions = await async_storage.get_user_sessions(firebase_user_id=firebase_user_id, mood=mood)
+            next_cursor = None
+        else:
+            sessions, next_cursor = await async_storage.get_user_sessions_page(
+                firebase_user_id=firebase_user_id,
+                mood=mood,
+                limit=limit or SESSIONS_PAGE_SIZE,
+                cursor=cursor
+            )
         
         return {
             "count": len(sessions),
-            "sessions": sessions
+            "sessions": sessions,
+            "next_cursor": next_cursor
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching sessions: {str(e)}")
 
+@router.get("/api/sessions/summary")
+async def get_sessions_summary(
+    firebase_user_id: str = Query(..., description="Firebase user ID"),
+    days: int = Query(30, ge=1, le=366, description="How many days back to summarize")):
+    """
+    Get a user's mood distribution and per-day session counts.
+    Computed with aggregation queries in storage, so no session documents are transferred.
+    """
+    since = time.time() - days * 86400
+    try:
+        mood_summary, daily = await asyncio.gather(
+            async_storage.get_mood_summary(firebase_user_id, since=since),
+            async_storage.get_daily_session_counts(firebase_user_id, since=since),
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error summarizing sessions: {str(e)}")
+    
+    total = sum(summary["count"] for summary in mood_summary.values())
+    moods = [
+        {
+            "mood": mood,
+            "count": summary["count"],
+            "percentage": round(summary["count"] / total * 100, 1),
+            "average_intensity": round(summary["intensitySum"] / summary["count"], 1),
+        }
+        for mood, summary in sorted(mood_summary.items(), key=lambda item: -item[1]["count"])
+    ]
+    
+    return {
+        "days": days,
+        "total_sessions": total,
+        "moods": moods,
+        "daily": daily
+    }
+
 @router.get("/api/recommendations")
 async def get_mood_recommendations(
+    request: Request,
     mood: str = Query(..., description="Mood: Happy, Sad, Energized, Angry, or Calm"),
     limit: int = Query(20, ge=1, le=50, description="Number of recommendations"),
     firebase_user_id: Optional[str] = Query(None, description="Firebase user ID for personalization"),
-    personalization_weight: float = Query(0.7, ge=0.0, le=1.0, description="Personalization weight (0=general, 1=user-specific)")
+    personalization_weight: float = Query(0.7, ge=0.0, le=1.0, description="Personalization weight (0=general, 1=user-specific)"),
+    cf_weight: float = Query(0.0, ge=0.0, le=1.0, description="Item-item CF weight in hybrid scoring (0=content only)"),
+    exclude_played: bool = Query(True, description="Leave out tracks the user already tagged or played")
 ):
     """
     Get song recommendations based on mood.
-    If firebase_user_id is provided, uses personalized recommendations based on user's logged sessions.
+    If firebase_user_id is provided, uses personalized recommendations based on user's logged sessions,
+    blended with item-item collaborative filtering when cf_weight > 0, and leaves out tracks the
+    user already tagged or played unless exclude_played is false.
+    General (non-personalized) results are served from the response cache.
     """
     valid_moods = ["Happy", "Sad", "Energized", "Angry", "Calm"]
     
@@ -117,52 +279,77 @@ async def get_mood_recommendations(
     
     try:
         if firebase_user_id:
-            # user's mood song history from database
-            sessions = get_user_sessions(firebase_user_id=firebase_user_id)
+            # fetch the user's mood song history (and played-track filter, if used) while the personalized recommender is built
+            fetches = [
+                async_storage.get_user_sessions(
+                    firebase_user_id=firebase_user_id,
+                    limit=PERSONALIZATION_MAX_SESSIONS,
+                    fields=PERSONALIZATION_FIELDS,
+                    since=time.time() - PERSONALIZATION_WINDOW_DAYS * 86400 if PERSONALIZATION_WINDOW_DAYS else None,
+                ),
+                run_in_threadpool(get_recommender, user_id=firebase_user_id),
+            ]
+            if exclude_played:
+                fetches.append(played_track_filters.get(firebase_user_id))
+            sessions, recommender, *played = await asyncio.gather(*fetches)
+            played = played[0] if played else None
             
-            # make personalized recommender
-            recommender = get_recommender(user_id=firebase_user_id)
+            def recommend():
+                # learn from user sessions
+                if sessions:
+                    recommender.learn_from_user_sessions(sessions)
+                
+                return recommender.get_mood_recommendations(
+                    mood=mood, 
+                    top_k=limit,
+                    personalization_weight=personalization_weight,
+                    cf_weight=cf_weight,
+                    exclude_rows=played
+                )
             
-            # learn from user sessions
-            if sessions:
-                recommender.learn_from_user_sessions(sessions)
-            
-            recommendations = recommender.get_mood_recommendations(
-                mood=mood, 
-                top_k=limit,
-                personalization_weight=personalization_weight
-            )
+            recommendations = await run_in_threadpool(recommend)
             
-            return {
+            # results are already native python types, so skip jsonable_encoder
+            return ORJSONResponse({
                 "mood": mood,
                 "count": len(recommendations),
                 "personalized": True,
+                "cf_weight": cf_weight,
+                "played_tracks_excluded": len(played) if played is not None else 0,
                 "user_sessions_count": len(sessions),
                 "recommendations": recommendations
-            }
+            })
         else:
             # no user_id so we use general recommendations instead
-            recommender = get_recommender()
-            recommendations = recommender.get_mood_recommendations(mood=mood, top_k=limit)
+            def compute():
+                recommender = get_recommender()
+                recommendations = recommender.get_mood_recommendations(mood=mood, top_k=limit)
+                
+                return {
+                    "mood": mood,
+                    "count": len(recommendations),
+                    "personalized": False,
+                    "recommendations": recommendations
+                }
             
-            return {
-                "mood": mood,
-                "count": len(recommendations),
-                "personalized": False,
-                "recommendations": recommendations
-            }
+            return await response_cache.cached_response(
+                request, "recommendations", {"mood": mood, "limit": limit}, compute
+            )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating recommendations: {str(e)}")
 
 @router.get("/api/suggest")
 async def search_songs(
+    request: Request,
     q: str = Query(..., min_length=1, description="Search query (song name or artist)"),
     limit: int = Query(20, ge=1, le=50, description="Maximum number of results")
 ):
     """
     Search for songs by track name or artist name.
     """
-    try:
+    def compute():
         preprocessor = get_preprocessor()
         results = preprocessor.search_tracks(q, limit=limit)
         
@@ -178,21 +365,29 @@ async def search_songs(
             "count": len(results),
             "results": results.to_dict(orient="records")
         }
+    
+    try:
+        return await response_cache.cached_response(
+            request, "suggest", {"q": q, "limit": limit}, compute
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching songs: {str(e)}")
 
 @router.get("/api/recommendations/by-track")
 async def get_track_recommendations(
+    request: Request,
     index: int = Query(..., ge=0, description="Track index from search results"),
-    limit: int = Query(10, ge=1, le=50, description="Number of recommendations")
+    limit: int = Query(10, ge=1, le=50, description="Number of recommendations"),
+    firebase_user_id: Optional[str] = Query(None, description="Firebase user ID; leaves out tracks they already tagged or played")
 ):
     """
     Get songs similar to a specific track (by index).
     Use this after searching for a song with /api/suggest.
+    Results for a firebase_user_id skip their tagged and played tracks and bypass the response cache.
     """
-    try:
+    def compute(played=None):
         recommender = get_recommender()
-        recommendations = recommender.get_similar_songs(track_index=index, top_k=limit)
+        recommendations = recommender.get_similar_songs(track_index=index, top_k=limit, exclude_rows=played)
         
         if not recommendations:
             raise HTTPException(status_code=404, detail="Track not found")
@@ -202,7 +397,53 @@ async def get_track_recommendations(
             "count": len(recommendations),
             "recommendations": recommendations
         }
+    
+    try:
+        if firebase_user_id:
+            played = await played_track_filters.get(firebase_user_id)
+            return await run_in_threadpool(compute, played)
+        return await response_cache.cached_response(
+            request, "by-track", {"index": index, "limit": limit}, compute
+        )
+    except HTTPException:
+        raise
     except IndexError:
         raise HTTPException(status_code=404, detail="Track index out of range")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating recommendations: {str(e)}")
+
+@router.post("/api/recommendations/by-tracks")
+async def get_multi_seed_recommendations(request: MultiSeedRequest):
+    """
+    Get songs similar to a set of tracks (e.g. "more like this playlist") in one request.
+    mode "centroid" scores against the seeds' average sound; "max" scores each song by its
+    closest seed, so every part of a varied playlist is represented. Seeds are never returned;
+    track ids that aren't in the catalog are returned as unknown_track_ids.
+    """
+    if request.mode not in MULTI_SEED_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Must be one of {list(MULTI_SEED_MODES)}")
+    
+    try:
+        played = await played_track_filters.get(request.firebase_user_id) if request.firebase_user_id else None
+        
+        def compute():
+            rows = get_preprocessor().find_track_indices(request.track_ids)
+            unknown = [track_id for track_id, row in zip(request.track_ids, rows.tolist()) if row < 0]
+            if len(unknown) == len(request.track_ids):
+                raise HTTPException(status_code=404, detail="None of the seed tracks are in the catalog")
+            recommendations = get_recommender().get_multi_seed_recommendations(
+                rows[rows >= 0], top_k=request.limit, mode=request.mode, exclude_rows=played
+            )
+            return {
+                "mode": request.mode,
+                "seed_count": len(request.track_ids) - len(unknown),
+                "unknown_track_ids": unknown,
+                "count": len(recommendations),
+                "recommendations": recommendations
+            }
+        
+        return ORJSONResponse(await run_in_threadpool(compute))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating recommendations: {str(e)}")
@@ -0,0 +1,200 @@
+"""
+In-process response cache for non-personalized recommendation and search routes.
+Entries are keyed on route + query parameters + catalog version, bounded by
+total body bytes with LRU eviction.
+"""
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+import orjson
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+
+from ..ml.dataset_loader import get_preprocessor
+from ..compression import COMPRESSION_MIN_BYTES, choose_encoding, compress
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_AGE = int(os.getenv("RESPONSE_CACHE_MAX_AGE", "300"))
+
+
+@dataclass
+class CachedResponse:
+    """A rendered JSON body with its validator and any compressed variants"""
+    body: bytes
+    etag: str
+    media_type: str = "application/json"
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(v) for v in self.encoded.values())
+
+
+def render_json(payload: Any) -> bytes:
+    """Serialize a response payload to compact JSON bytes"""
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+class ResponseCache:
+    """
+    Byte-bounded LRU cache of rendered responses.
+    Concurrent misses on the same key share a single computation (single-flight).
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, max_age: int = RESPONSE_CACHE_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._size = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(route: str, params: Dict[str, Any], version: Optional[str]) -> str:
+        """Build a cache key from route name, sorted params and catalog version"""
+        parts = "&".join(f"{k}={params[k]}" for k in sorted(params))
+        return f"{route}?{parts}#{version}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        size = entry.size
+        if size > self.max_bytes:
+            return  # never cache something that would evict everything else
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old.size
+
+        self._entries[key] = entry
+        self._size += size
+        self._evict()
+
+    def _evict(self):
+        """Evict least recently used entries until under budget"""
+        while self._size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Any]) -> CachedResponse:
+        """
+        Return the cached entry for key, computing it at most once across concurrent callers.
+        compute is a blocking function returning a JSON-serializable payload; it runs in the threadpool.
+        Exceptions are propagated to every waiter and nothing is cached.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # A task of its own, so a caller that goes away (e.g. its client disconnects)
+            # only stops waiting; the others still get the result
+            pending = asyncio.ensure_future(self._compute(key, compute))
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda task: self._inflight.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _compute(self, key: str, compute: Callable[[], Any]) -> CachedResponse:
+        payload = await run_in_threadpool(compute)
+        body = render_json(payload)
+        entry = CachedResponse(body=body, etag=_make_etag(body))
+        self.put(key, entry)
+        return entry
+
+    def _encoded_body(self, key: str, entry: CachedResponse, encoding: str) -> bytes:
+        """Compressed variant of entry, computed once and charged to the byte budget"""
+        body = entry.encoded.get(encoding)
+        if body is None:
+            body = compress(entry.body, encoding)
+            entry.encoded[encoding] = body
+            if self._entries.get(key) is entry:
+                self._size += len(body)
+                self._evict()
+        return body
+
+    def respond(self, request: Request, key: str, entry: CachedResponse) -> Response:
+        """
+        Build the HTTP response, answering conditional requests with 304.
+        Each encoding of the body gets its own ETag, since their bytes differ.
+        """
+        encoding = None
+        if len(entry.body) >= COMPRESSION_MIN_BYTES:
+            encoding = choose_encoding(request.headers.get("accept-encoding"))
+        etag = _encoding_etag(entry.etag, encoding)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={self.max_age}",
+            "Vary": "Accept-Encoding",
+        }
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        body = entry.body
+        if encoding:
+            body = self._encoded_body(key, entry, encoding)
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=entry.media_type, headers=headers)
+
+    async def cached_response(
+        self,
+        request: Request,
+        route: str,
+        params: Dict[str, Any],
+        compute: Callable[[], Any]
+    ) -> Response:
+        """Serve route from cache, keyed on params and the loaded catalog version"""
+        # the first call loads the catalog, so don't resolve it on the event loop
+        version = await run_in_threadpool(lambda: get_preprocessor().version)
+        key = self.make_key(route, params, version)
+        entry = await self.get_or_compute(key, compute)
+        return self.respond(request, key, entry)
+
+
+def _make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _encoding_etag(etag: str, encoding: Optional[str]) -> str:
+    """ETag of one encoding of a body: the identity ETag with an -<encoding> suffix"""
+    return etag if not encoding else f'{etag[:-1]}-{encoding}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+# Global instance shared by the recommendation routes
+response_cache = ResponseCache()
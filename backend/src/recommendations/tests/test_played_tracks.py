@@ -0,0 +1,101 @@
+"""
+Tests for per-user played-track filters and their use in top-k selection
+"""
+import sys
+import asyncio
+import pathlib
+
+import numpy as np
+import pytest
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.backend import init_storage, close_storage
+from src.storage.sqlite_storage import SQLiteStorageBackend
+from src.storage.listening_events import ListeningEventStore
+from src.storage import async_storage
+from src.recommendations.played_tracks import PlayedTrackFilters
+from src.ml.mood_recommender import MoodRecommender
+
+
+@pytest.fixture
+def storage(tmp_path):
+    backend = init_storage(SQLiteStorageBackend(str(tmp_path / "test.db")))
+    yield backend
+    close_storage()
+
+
+def play(track_id, played_at):
+    return {"played_at": played_at, "track": {"id": track_id}}
+
+
+def test_filter_built_from_history_and_kept_current(tmp_path, storage, fake_catalog):
+    event_store = ListeningEventStore(tmp_path / "events")
+    # t9 is also listed on row 40, as a track under a second genre would be
+    filters = PlayedTrackFilters(event_store, max_users=1, preprocessor=fake_catalog(n=50, duplicates={40: 9}))
+    storage.save_user_session("u1", "t5", "Happy")
+    storage.save_user_session("u1", "not-in-catalog", "Sad")
+    event_store.append("u1", [play("t9", "2024-01-01T00:00:00Z"), play("t5", "2024-01-01T00:05:00Z")])
+
+    rows = asyncio.run(filters.get("u1"))
+    assert rows.dtype == np.int32 and rows.tolist() == [5, 9, 40]
+
+    # writes merge into the cached filter without another scan
+    filters.record_sessions("u1", [{"trackId": "t2"}])
+    filters.record_events("u1", event_store.append("u1", [play("t30", "2024-01-02T00:00:00Z")]))
+    assert asyncio.run(filters.get("u1")).tolist() == [2, 5, 9, 30, 40]
+
+    # least recently used users are evicted, then rebuilt from storage
+    asyncio.run(filters.get("u2"))
+    assert "u1" not in filters._filters
+    filters.record_sessions("u1", [{"trackId": "t7"}])  # not cached: nothing to update
+    assert asyncio.run(filters.get("u1")).tolist() == [5, 9, 30, 40]
+
+
+def test_concurrent_gets_build_once_and_release_the_lock(tmp_path, storage, monkeypatch, fake_catalog):
+    filters = PlayedTrackFilters(ListeningEventStore(tmp_path / "events"), preprocessor=fake_catalog(n=50))
+    storage.save_user_session("u1", "t5", "Happy")
+    reads = []
+    get_user_sessions = async_storage.get_user_sessions
+
+    async def counted(firebase_user_id, **kwargs):
+        reads.append(firebase_user_id)
+        return await get_user_sessions(firebase_user_id, **kwargs)
+
+    monkeypatch.setattr(async_storage, "get_user_sessions", counted)
+
+    async def run():
+        return await asyncio.gather(*(filters.get("u1") for _ in range(5)))
+
+    assert all(rows.tolist() == [5] for rows in asyncio.run(run()))
+    assert reads == ["u1"]
+    # only users with a build in progress hold a lock
+    assert filters._build_locks == {}
+
+
+def test_excluded_rows_never_reach_top_k():
+    recommender = MoodRecommender.__new__(MoodRecommender)
+    similarities = np.random.default_rng(0).random(1000)
+    best = similarities.argsort()[::-1]
+    exclude = np.sort(best[:15]).astype(np.int32)
+
+    top = recommender._top_k(similarities.copy(), 10, exclude)
+    assert top.tolist() == best[15:25].tolist()
+    # fewer candidates than top_k: masked rows are dropped rather than returned
+    assert recommender._top_k(similarities[:12].copy(), 10, np.arange(8)).tolist() == \
+        (similarities[8:12].argsort()[::-1] + 8).tolist()
+
+
+def test_catalog_rows_cover_every_entry_of_a_track():
+    import pandas as pd
+    from src.ml.dataset_loader import MoodDatasetPreprocessor
+
+    preprocessor = MoodDatasetPreprocessor()
+    preprocessor.df = pd.DataFrame({"track_id": ["a", "b", "a", "c", "b", "a"]})
+    assert preprocessor.find_track_rows(["a", "missing"]).tolist() == [0, 2, 5]
+    assert preprocessor.find_track_rows(["c", "b", "b"]).tolist() == [1, 3, 4]
+    assert preprocessor.find_track_rows([]).tolist() == []
+    # the single-row lookup still returns the first entry
+    assert preprocessor.find_track_index("b") == 1
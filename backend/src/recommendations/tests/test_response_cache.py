@@ -0,0 +1,163 @@
+"""
+Tests for the in-process response cache of the recommendation routes
+"""
+import sys
+import time
+import gzip
+import asyncio
+import pathlib
+from types import SimpleNamespace
+
+import pytest
+from starlette.requests import Request
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.recommendations import response_cache
+from src.recommendations.response_cache import ResponseCache, CachedResponse, render_json, _make_etag
+
+
+def make_request(headers=None):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    })
+
+
+def make_entry(payload):
+    body = render_json(payload)
+    return CachedResponse(body=body, etag=_make_etag(body))
+
+
+def test_each_encoding_has_its_own_etag():
+    cache = ResponseCache()
+    entry = make_entry({"tracks": ["x" * 40] * 100})
+    cache.put("k", entry)
+
+    identity = cache.respond(make_request(), "k", entry)
+    zipped = cache.respond(make_request({"Accept-Encoding": "gzip"}), "k", entry)
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(zipped.body) == identity.body
+    assert identity.headers["etag"] == entry.etag
+    assert zipped.headers["etag"] != identity.headers["etag"]
+
+    # a validator only matches the representation it was issued for
+    revalidate = {"Accept-Encoding": "gzip", "If-None-Match": zipped.headers["etag"]}
+    assert cache.respond(make_request(revalidate), "k", entry).status_code == 304
+    revalidate["If-None-Match"] = identity.headers["etag"]
+    assert cache.respond(make_request(revalidate), "k", entry).status_code == 200
+    assert cache.respond(make_request({"If-None-Match": zipped.headers["etag"]}), "k", entry).status_code == 200
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResponseCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"n": len(calls)}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(10)))
+
+    entries = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(entry is entries[0] for entry in entries)
+    assert (cache.misses, cache.hits) == (1, 9)
+
+
+def test_cancelled_caller_does_not_cancel_waiters():
+    cache = ResponseCache()
+
+    def compute():
+        time.sleep(0.05)
+        return {"ok": True}
+
+    async def main():
+        leader = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        leader.cancel()  # the first client disconnects
+        return await waiter
+
+    assert asyncio.run(main()).body == b'{"ok":true}'
+    assert cache.get("k") is not None
+
+
+def test_failed_compute_is_not_cached():
+    cache = ResponseCache()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.get_or_compute("k", fail))
+    assert cache.get("k") is None
+    assert asyncio.run(cache.get_or_compute("k", lambda: [1])).body == b"[1]"
+
+
+def test_evicts_least_recently_used_by_total_bytes():
+    entries = {key: make_entry("x" * 90) for key in "abcd"}  # ~92 bytes each
+    cache = ResponseCache(max_bytes=300)
+    for key in "abc":
+        cache.put(key, entries[key])
+    cache.get("a")  # a is now more recent than b
+    cache.put("d", entries["d"])
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.size_bytes == sum(entries[key].size for key in "acd") <= 300
+    # an entry over the whole budget is never cached
+    cache.put("big", make_entry("x" * 400))
+    assert cache.get("big") is None and cache.get("a") is not None
+
+
+def test_compressed_variants_count_towards_the_budget():
+    cache = ResponseCache()
+    entry = make_entry({"tracks": ["x" * 40] * 100})
+    cache.put("k", entry)
+    cache.respond(make_request({"Accept-Encoding": "gzip"}), "k", entry)
+    assert cache.size_bytes == len(entry.body) + len(entry.encoded["gzip"])
+
+
+def test_catalog_version_change_invalidates_keys(monkeypatch):
+    cache = ResponseCache()
+    preprocessor = SimpleNamespace(version="v1")
+    monkeypatch.setattr(response_cache, "get_preprocessor", lambda: preprocessor)
+    calls = []
+
+    def compute():
+        calls.append(preprocessor.version)
+        return {"version": preprocessor.version}
+
+    def serve(params):
+        return asyncio.run(cache.cached_response(make_request(), "mood", params, compute))
+
+    assert serve({"mood": "Happy", "limit": 20}).body == b'{"version":"v1"}'
+    serve({"limit": 20, "mood": "Happy"})  # same params in another order
+    assert calls == ["v1"]
+
+    preprocessor.version = "v2"
+    assert serve({"mood": "Happy", "limit": 20}).body == b'{"version":"v2"}'
+    assert calls == ["v1", "v2"]
+
+
+def test_if_none_match_returns_304():
+    cache = ResponseCache(max_age=60)
+    entry = make_entry({"tracks": []})
+    cache.put("k", entry)
+
+    response = cache.respond(make_request({"If-None-Match": f'"other", {entry.etag}'}), "k", entry)
+    assert response.status_code == 304 and response.body == b""
+    assert response.headers["etag"] == entry.etag
+    assert response.headers["cache-control"] == "public, max-age=60"
+    assert cache.respond(make_request({"If-None-Match": "W/" + entry.etag}), "k", entry).status_code == 304
+    assert cache.respond(make_request({"If-None-Match": "*"}), "k", entry).status_code == 304
+    assert cache.respond(make_request({"If-None-Match": '"stale"'}), "k", entry).status_code == 200
@@ -0,0 +1,101 @@
+"""
+Route-level tests for the mood session endpoints
+"""
+import sys
+import pathlib
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.backend import init_storage, close_storage
+from src.storage.sqlite_storage import SQLiteStorageBackend
+from src.recommendations import recommendations
+from src.recommendations.recommendations import router
+
+
+@pytest.fixture
+def client(tmp_path):
+    storage = init_storage(SQLiteStorageBackend(str(tmp_path / "test.db")))
+    app = FastAPI()
+    app.include_router(router)
+    with TestClient(app) as test_client:
+        yield test_client, storage
+    close_storage()
+
+
+def test_sessions_returns_everything_unless_paging(client):
+    client, storage = client
+    storage.save_user_sessions("u1", [{"track_id": f"t{i}", "mood": "Happy", "intensity": i} for i in range(60)])
+
+    # no limit or cursor: every session, as before paging existed
+    everything = client.get("/api/sessions", params={"firebase_user_id": "u1"}).json()
+    assert everything["count"] == 60 and everything["next_cursor"] is None
+
+    seen, cursor = [], None
+    while True:
+        params = {"firebase_user_id": "u1", "limit": 25}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/api/sessions", params=params).json()
+        seen.extend(session["id"] for session in page["sessions"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [session["id"] for session in everything["sessions"]]
+
+    assert client.get("/api/sessions", params={"firebase_user_id": "u1", "cursor": "garbage"}).status_code == 400
+
+
+def test_sessions_summary(client):
+    client, storage = client
+    storage.save_user_sessions("u1", [
+        {"track_id": "t1", "mood": "Happy", "intensity": 80},
+        {"track_id": "t2", "mood": "Happy", "intensity": 60},
+        {"track_id": "t3", "mood": "Sad", "intensity": 30},
+    ])
+    storage.save_user_session("u2", "t4", "Calm")
+
+    summary = client.get("/api/sessions/summary", params={"firebase_user_id": "u1", "days": 7}).json()
+    assert summary["days"] == 7 and summary["total_sessions"] == 3
+    assert summary["moods"] == [
+        {"mood": "Happy", "count": 2, "percentage": 66.7, "average_intensity": 70.0},
+        {"mood": "Sad", "count": 1, "percentage": 33.3, "average_intensity": 30.0},
+    ]
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    assert summary["daily"] == [{"date": today, "count": 3, "intensitySum": 170}]
+
+    empty = client.get("/api/sessions/summary", params={"firebase_user_id": "nobody"}).json()
+    assert (empty["total_sessions"], empty["moods"], empty["daily"]) == (0, [], [])
+    assert client.get("/api/sessions/summary", params={"firebase_user_id": "u1", "days": 400}).status_code == 422
+
+
+def test_played_filter_is_only_built_when_excluding(client, monkeypatch):
+    client, _ = client
+    excluded = []
+
+    class FakeRecommender:
+        def get_mood_recommendations(self, mood, top_k, personalization_weight, cf_weight, exclude_rows):
+            excluded.append(exclude_rows)
+            return []
+
+    async def played(firebase_user_id):
+        return [1, 2, 3]
+
+    monkeypatch.setattr(recommendations, "get_recommender", lambda user_id=None: FakeRecommender())
+    monkeypatch.setattr(recommendations.played_track_filters, "get", played)
+    params = {"mood": "Happy", "firebase_user_id": "u1"}
+    assert client.get("/api/recommendations", params=params).json()["played_tracks_excluded"] == 3
+
+    async def unused(firebase_user_id):
+        raise AssertionError("built the played-track filter without using it")
+
+    monkeypatch.setattr(recommendations.played_track_filters, "get", unused)
+    response = client.get("/api/recommendations", params={**params, "exclude_played": "false"})
+    assert response.status_code == 200 and response.json()["played_tracks_excluded"] == 0
+    assert excluded == [[1, 2, 3], None]
@@ -0,0 +1,261 @@
+"""
+Async variant of the storage API for use inside async route handlers.
+The storage backends (Firestore, SQLite) are synchronous, so each call runs
+on a dedicated thread pool instead of blocking the event loop; independent
+reads can be fanned out concurrently with asyncio.gather.
+
+With SESSION_WRITE_BEHIND enabled, single session saves go through the
+write-behind queue and session reads include the user's queued sessions.
+"""
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .backend import get_storage, project_session
+from .session_queue import session_queue
+
+STORAGE_EXECUTOR_WORKERS = int(os.getenv("STORAGE_EXECUTOR_WORKERS", "16"))
+
+# Created on first use, so a new application lifespan gets a fresh pool after shutdown_executor()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=STORAGE_EXECUTOR_WORKERS, thread_name_prefix="storage")
+        return _executor
+
+
+async def run_sync(fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking storage call on the storage thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_executor():
+    """Stop the storage thread pool (call at application shutdown); the next call starts a new one"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+async def save_spotify_tokens(
+    firebase_user_id: str,
+    spotify_user_id: str,
+    access_token: str,
+    refresh_token: Optional[str],
+    expires_in: int,
+    scope: str,
+    email: Optional[str] = None
+) -> dict:
+    return await run_sync(
+        get_storage().save_spotify_tokens,
+        firebase_user_id=firebase_user_id,
+        spotify_user_id=spotify_user_id,
+        access_token=access_token,
+        refresh_token=refresh_token,
+        expires_in=expires_in,
+        scope=scope,
+        email=email,
+    )
+
+
+async def get_spotify_tokens(firebase_user_id: str) -> Optional[dict]:
+    return await run_sync(get_storage().get_spotify_tokens, firebase_user_id)
+
+
+async def update_spotify_access_token(
+    firebase_user_id: str,
+    access_token: str,
+    expires_in: int,
+    refresh_token: Optional[str] = None
+):
+    return await run_sync(
+        get_storage().update_spotify_access_token,
+        firebase_user_id, access_token, expires_in, refresh_token
+    )
+
+
+async def delete_spotify_tokens(firebase_user_id: str):
+    return await run_sync(get_storage().delete_spotify_tokens, firebase_user_id)
+
+
+async def save_user_session(
+    firebase_user_id: str,
+    track_id: str,
+    mood: str,
+    intensity: int = 50,
+    track_name: Optional[str] = None,
+    artist_name: Optional[str] = None,
+    session_type: str = "track"
+) -> dict:
+    if session_queue is not None:
+        return await session_queue.enqueue(
+            firebase_user_id=firebase_user_id,
+            track_id=track_id,
+            mood=mood,
+            intensity=intensity,
+            track_name=track_name,
+            artist_name=artist_name,
+            session_type=session_type,
+        )
+    return await run_sync(
+        get_storage().save_user_session,
+        firebase_user_id=firebase_user_id,
+        track_id=track_id,
+        mood=mood,
+        intensity=intensity,
+        track_name=track_name,
+        artist_name=artist_name,
+        session_type=session_type,
+    )
+
+
+async def save_user_sessions(firebase_user_id: str, sessions: List[dict]) -> List[dict]:
+    return await run_sync(get_storage().save_user_sessions, firebase_user_id, sessions)
+
+
+async def get_user_profile(firebase_user_id: str) -> Optional[dict]:
+    return await run_sync(get_storage().get_user_profile, firebase_user_id)
+
+
+async def get_user_sessions(
+    firebase_user_id: str,
+    mood: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[Sequence[str]] = None,
+    since: Optional[float] = None
+) -> List[dict]:
+    # Snapshot queued sessions first: one flushed in between then shows up in both lists
+    pending = _pending_sessions(firebase_user_id, mood, fields, since)
+    sessions = await run_sync(
+        get_storage().get_user_sessions,
+        firebase_user_id=firebase_user_id,
+        mood=mood,
+        limit=limit,
+        fields=fields,
+        since=since,
+    )
+    if not pending:
+        return sessions
+    return merge_pending_sessions(pending, sessions, limit)
+
+
+async def get_user_sessions_page(
+    firebase_user_id: str,
+    mood: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+    since: Optional[float] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """Queued (not yet flushed) sessions are prepended to the first page"""
+    pending = _pending_sessions(firebase_user_id, mood, fields, since) if not cursor else []
+    sessions, next_cursor = await run_sync(
+        get_storage().get_user_sessions_page,
+        firebase_user_id=firebase_user_id,
+        mood=mood,
+        limit=limit,
+        cursor=cursor,
+        fields=fields,
+        since=since,
+    )
+    if pending:
+        sessions = merge_pending_sessions(pending, sessions)
+    return sessions, next_cursor
+
+
+async def get_sessions_created_since(
+    since: Optional[float] = None,
+    limit: int = 1000,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """Stored sessions only; queued ones appear once flushed"""
+    return await run_sync(get_storage().get_sessions_created_since, since, limit, cursor, fields)
+
+
+def _pending_sessions(
+    firebase_user_id: str,
+    mood: Optional[str],
+    fields: Optional[Sequence[str]],
+    since: Optional[float]
+) -> List[dict]:
+    if session_queue is None:
+        return []
+    return [
+        project_session(session, fields)
+        for session in session_queue.pending_sessions(firebase_user_id, mood)
+        if not since or session["createdAt"] >= since
+    ]
+
+
+def merge_pending_sessions(pending: List[dict], stored: List[dict], limit: Optional[int] = None) -> List[dict]:
+    """Combine queued and stored sessions, newest first, without duplicates"""
+    pending_ids = {session["id"] for session in pending}
+    merged = pending + [session for session in stored if session["id"] not in pending_ids]
+    merged.sort(key=lambda session: session.get("createdAt") or 0, reverse=True)
+    return merged[:limit] if limit else merged
+
+
+async def get_mood_summary(
+    firebase_user_id: str,
+    since: Optional[float] = None,
+    until: Optional[float] = None
+) -> Dict[str, dict]:
+    return await run_sync(get_storage().get_mood_summary, firebase_user_id, since, until)
+
+
+async def get_daily_session_counts(
+    firebase_user_id: str,
+    since: float,
+    until: Optional[float] = None,
+    mood: Optional[str] = None
+) -> List[dict]:
+    return await run_sync(get_storage().get_daily_session_counts, firebase_user_id, since, until, mood)
+
+
+async def delete_user_session(session_id: str) -> bool:
+    return await run_sync(get_storage().delete_user_session, session_id)
+
+
+async def create_collection(
+    firebase_user_id: str,
+    name: str,
+    mood: Optional[str] = None,
+    color: Optional[str] = None
+) -> dict:
+    return await run_sync(get_storage().create_collection, firebase_user_id, name, mood, color)
+
+
+async def list_collections(firebase_user_id: str) -> List[dict]:
+    return await run_sync(get_storage().list_collections, firebase_user_id)
+
+
+async def delete_collection(firebase_user_id: str, collection_id: str) -> bool:
+    return await run_sync(get_storage().delete_collection, firebase_user_id, collection_id)
+
+
+async def add_collection_tracks(firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+    return await run_sync(get_storage().add_collection_tracks, firebase_user_id, collection_id, track_ids)
+
+
+async def remove_collection_tracks(firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+    return await run_sync(get_storage().remove_collection_tracks, firebase_user_id, collection_id, track_ids)
+
+
+async def get_collection_tracks_page(
+    firebase_user_id: str,
+    collection_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Optional[Tuple[List[dict], Optional[str]]]:
+    return await run_sync(get_storage().get_collection_tracks_page, firebase_user_id, collection_id, limit, cursor)
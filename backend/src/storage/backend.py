@@ -0,0 +1,338 @@
+"""
+Storage backend interface for Spotify tokens and user mood sessions.
+The implementation is chosen at startup with the STORAGE_BACKEND env var:
+"firestore" (default) or "sqlite" for single-node deployments and load
+tests without an external service.
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Tuple, Sequence, Any
+import pathlib
+from dotenv import load_dotenv
+
+# Load environment variables
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+load_dotenv(dotenv_path=backend_dir / ".env")
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()
+
+MOODS = ["Happy", "Sad", "Energized", "Angry", "Calm"]
+# Longest range a per-day aggregation may cover
+MAX_AGGREGATE_DAYS = 366
+SECONDS_PER_DAY = 86400
+# Track ids kept on each collection so a listing can show a preview without reading its tracks
+COLLECTION_PREVIEW_TRACKS = 3
+
+# Global storage backend
+_storage: Optional["StorageBackend"] = None
+
+
+def session_id_for(firebase_user_id: str, idempotency_key: str) -> str:
+    """Deterministic session id, so a retried write lands on the same document"""
+    return hashlib.sha256(f"{firebase_user_id}:{idempotency_key}".encode("utf-8")).hexdigest()[:32]
+
+
+def profile_deltas(sessions: List[dict]) -> Tuple[int, Dict[str, int], Dict[str, int]]:
+    """Session count, per-mood counts and per-mood intensity sums for profile updates"""
+    mood_counts: Dict[str, int] = {}
+    intensity_sums: Dict[str, int] = {}
+    for session in sessions:
+        mood = session["mood"]
+        mood_counts[mood] = mood_counts.get(mood, 0) + 1
+        intensity_sums[mood] = intensity_sums.get(mood, 0) + int(session["intensity"])
+    return len(sessions), mood_counts, intensity_sums
+
+
+def encode_session_cursor(created_at: Any, session_id: str) -> str:
+    """Opaque page cursor: the (createdAt, id) of the last session on the page"""
+    raw = json.dumps([created_at, session_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_session_cursor(cursor: str) -> Tuple[Any, str]:
+    """Inverse of encode_session_cursor; raises ValueError for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, session_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid page cursor")
+    if not isinstance(session_id, str) or not isinstance(created_at, (int, float)):
+        raise ValueError("Invalid page cursor")
+    return created_at, session_id
+
+
+def project_session(session: dict, fields: Optional[Sequence[str]]) -> dict:
+    """Keep only the requested fields (plus id and createdAt, which paging needs)"""
+    if not fields:
+        return session
+    keep = set(fields) | {"id", "createdAt"}
+    return {key: value for key, value in session.items() if key in keep}
+
+
+def day_range(since: float, until: Optional[float] = None) -> List[Tuple[float, float]]:
+    """Split [since, until) into UTC-day-aligned [start, end) pieces"""
+    until = until if until is not None else time.time()
+    if until - since > MAX_AGGREGATE_DAYS * SECONDS_PER_DAY:
+        raise ValueError(f"Date range is limited to {MAX_AGGREGATE_DAYS} days")
+    ranges = []
+    start = since
+    while start < until:
+        end = min((start // SECONDS_PER_DAY + 1) * SECONDS_PER_DAY, until)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def day_key(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+class StorageBackend(ABC):
+    """
+    Documents use the Firestore field names (firebaseUserId, accessToken,
+    expiresAt, createdAt, ...) whatever the backend, so callers don't
+    need to know which one is active.
+    """
+
+    @abstractmethod
+    def save_spotify_tokens(
+        self,
+        firebase_user_id: str,
+        spotify_user_id: str,
+        access_token: str,
+        refresh_token: Optional[str],
+        expires_in: int,
+        scope: str,
+        email: Optional[str] = None
+    ) -> dict:
+        """Save (overwrite) a user's Spotify tokens, returns the stored token data"""
+
+    @abstractmethod
+    def get_spotify_tokens(self, firebase_user_id: str) -> Optional[dict]:
+        """Token data or None; expired tokens are returned so the caller can refresh"""
+
+    @abstractmethod
+    def update_spotify_access_token(
+        self,
+        firebase_user_id: str,
+        access_token: str,
+        expires_in: int,
+        refresh_token: Optional[str] = None
+    ):
+        """Update the access token after a refresh (and the refresh token if rotated)"""
+
+    @abstractmethod
+    def delete_spotify_tokens(self, firebase_user_id: str):
+        """Clear a user's tokens (for logout)"""
+
+    @abstractmethod
+    def save_user_session(
+        self,
+        firebase_user_id: str,
+        track_id: str,
+        mood: str,
+        intensity: int = 50,
+        track_name: Optional[str] = None,
+        artist_name: Optional[str] = None,
+        session_type: str = "track"
+    ) -> dict:
+        """Save a mood-song session, returns the session data including its id"""
+
+    @abstractmethod
+    def save_user_sessions(self, firebase_user_id: str, sessions: List[dict]) -> List[dict]:
+        """
+        Save many sessions for one user and update their profile counters in one step.
+        Each session dict has track_id, mood, intensity, track_name, artist_name,
+        session_type and an optional idempotency_key; sessions whose key was already
+        written are skipped. Returns {"id", "created"} per session, in order.
+        """
+
+    @abstractmethod
+    def get_user_profile(self, firebase_user_id: str) -> Optional[dict]:
+        """Profile counters (sessionCount, moodCounts, intensitySums) or None"""
+
+    @abstractmethod
+    def list_user_ids(self, after: Optional[str] = None, limit: int = 1000) -> List[str]:
+        """
+        Ids of users with at least one session, in id order, starting after
+        `after`. Fewer than limit ids are returned only on the last page.
+        """
+
+    @abstractmethod
+    def get_user_sessions(
+        self,
+        firebase_user_id: str,
+        mood: Optional[str] = None,
+        limit: Optional[int] = None,
+        fields: Optional[Sequence[str]] = None,
+        since: Optional[float] = None
+    ) -> List[dict]:
+        """
+        A user's sessions, newest first, createdAt as epoch seconds.
+        fields projects each session down to those fields (id and createdAt are
+        always included); since (epoch seconds) drops older sessions.
+        """
+
+    @abstractmethod
+    def get_user_sessions_page(
+        self,
+        firebase_user_id: str,
+        mood: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None,
+        since: Optional[float] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        One page of get_user_sessions plus the cursor for the next page
+        (None on the last page). Raises ValueError for a malformed cursor.
+        """
+
+    @abstractmethod
+    def get_sessions_created_since(
+        self,
+        since: Optional[float] = None,
+        limit: int = 1000,
+        cursor: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        One page of every user's sessions created at or after since (all if None),
+        oldest first, plus the cursor for the next page (None on the last page).
+        fields projects as in get_user_sessions; firebaseUserId is always included.
+        Raises ValueError for a malformed cursor.
+        """
+
+    @abstractmethod
+    def get_mood_summary(
+        self,
+        firebase_user_id: str,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> Dict[str, dict]:
+        """
+        {mood: {"count", "intensitySum"}} over the user's sessions with
+        since <= createdAt < until (epoch seconds; None = unbounded).
+        Computed server-side, without reading the session documents.
+        """
+
+    @abstractmethod
+    def get_daily_session_counts(
+        self,
+        firebase_user_id: str,
+        since: float,
+        until: Optional[float] = None,
+        mood: Optional[str] = None
+    ) -> List[dict]:
+        """
+        [{"date": "YYYY-MM-DD", "count", "intensitySum"}] per UTC day in
+        [since, until), oldest first, days without sessions omitted.
+        Raises ValueError for ranges over MAX_AGGREGATE_DAYS days.
+        """
+
+    @abstractmethod
+    def delete_user_session(self, session_id: str) -> bool:
+        """Delete a session by id, False if not found"""
+
+    @abstractmethod
+    def create_collection(
+        self,
+        firebase_user_id: str,
+        name: str,
+        mood: Optional[str] = None,
+        color: Optional[str] = None
+    ) -> dict:
+        """Create an empty collection and return it"""
+
+    @abstractmethod
+    def list_collections(self, firebase_user_id: str) -> List[dict]:
+        """
+        A user's collections, most recently updated first, in one query.
+        Each carries its denormalized songCount, lastUpdated (epoch seconds)
+        and previewTrackIds (its first COLLECTION_PREVIEW_TRACKS tracks).
+        """
+
+    @abstractmethod
+    def delete_collection(self, firebase_user_id: str, collection_id: str) -> bool:
+        """Delete a collection and its tracks, False if the user has no such collection"""
+
+    @abstractmethod
+    def add_collection_tracks(self, firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+        """
+        Append tracks, skipping ones already in the collection, and update its
+        songCount/lastUpdated/previewTrackIds in the same write.
+        Returns the updated collection, None if the user has no such collection.
+        """
+
+    @abstractmethod
+    def remove_collection_tracks(self, firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+        """Remove tracks (missing ones are ignored); otherwise like add_collection_tracks"""
+
+    @abstractmethod
+    def get_collection_tracks_page(
+        self,
+        firebase_user_id: str,
+        collection_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Optional[Tuple[List[dict], Optional[str]]]:
+        """
+        One page of [{"trackId", "addedAt"}] in the order added, plus the next
+        cursor (None on the last page). None if the user has no such collection;
+        raises ValueError for a malformed cursor.
+        """
+
+    def close(self):
+        """Release connections (called at application shutdown)"""
+
+
+def init_storage(backend: Optional[StorageBackend] = None) -> StorageBackend:
+    """
+    Initialize the storage backend selected by STORAGE_BACKEND,
+    or install the given backend. Must be called once at application startup.
+    """
+    global _storage
+
+    if backend is not None:
+        _storage = backend
+        return _storage
+
+    if _storage is not None:
+        return _storage  # Already initialized
+
+    if STORAGE_BACKEND == "firestore":
+        from .firestore_storage import FirestoreStorageBackend
+        _storage = FirestoreStorageBackend()
+    elif STORAGE_BACKEND == "sqlite":
+        from .sqlite_storage import SQLiteStorageBackend
+        _storage = SQLiteStorageBackend()
+    else:
+        raise RuntimeError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected 'firestore' or 'sqlite')")
+
+    print(f"✓ Storage backend: {STORAGE_BACKEND}")
+    return _storage
+
+
+def get_storage() -> StorageBackend:
+    """
+    Get the storage backend. Raises error if not initialized.
+    """
+    if _storage is None:
+        raise RuntimeError(
+            "Storage not initialized. Please call init_storage() at application startup."
+        )
+    return _storage
+
+
+def close_storage():
+    """Close the storage backend (call at application shutdown)"""
+    global _storage
+
+    if _storage is not None:
+        _storage.close()
+        _storage = None
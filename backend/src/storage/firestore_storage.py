@@ -3,13 +3,28 @@ Firestore storage for Spotify tokens and user data.
 """
 import os
 import json
-from datetime import datetime, timedelta
-from typing import Optional, List
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Sequence, Tuple, Dict
 import pathlib
 from dotenv import load_dotenv
 
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import Conflict
+
+from .backend import (
+    StorageBackend,
+    session_id_for,
+    profile_deltas,
+    encode_session_cursor,
+    decode_session_cursor,
+    MOODS,
+    day_range,
+    day_key,
+    SECONDS_PER_DAY,
+    COLLECTION_PREVIEW_TRACKS,
+)
 
 # Load environment variables
 backend_dir = pathlib.Path(__file__).parent.parent.parent
@@ -22,6 +37,22 @@ SPOTIFY_TOKENS_COLLECTION = "spotifyTokens"
 ONE_HOUR_IN_SECONDS = 3600
 
 USER_SESSIONS_COLLECTION = "userSessions"
+USER_PROFILES_COLLECTION = "userProfiles"
+COLLECTIONS_COLLECTION = "collections"
+# Subcollection of each collection document, one document per track (ID = track ID)
+COLLECTION_TRACKS_SUBCOLLECTION = "tracks"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Aggregation queries are one RPC each; run a request's queries in parallel
+AGGREGATION_CONCURRENCY = int(os.getenv("FIRESTORE_AGGREGATION_CONCURRENCY", "8"))
+_aggregation_pool = ThreadPoolExecutor(max_workers=AGGREGATION_CONCURRENCY, thread_name_prefix="firestore-agg")
+
+# Firestore's limit on writes per batch; one write per batch is the profile update
+MAX_BATCH_WRITES = 500
+SESSIONS_PER_BATCH = MAX_BATCH_WRITES - 1
+# Likewise for collection tracks, whose collection document is updated in the same transaction
+TRACKS_PER_TRANSACTION = MAX_BATCH_WRITES - 1
 
 
 def init_firestore():
@@ -167,49 +198,20 @@ def get_spotify_tokens(firebase_user_id: str) -> Optional[dict]:
     """
     db = get_db()
     token_doc_ref = db.collection(SPOTIFY_TOKENS_COLLECTION).document(firebase_user_id)
-    
-    print(f"Debug Firestore path: {token_doc_ref.path}, collection: {SPOTIFY_TOKENS_COLLECTION}, doc_id: {firebase_user_id}")
-    print(f"Debug Firestore project: {db.project}")
-    
     token_doc = token_doc_ref.get()
     
-    print(f"Debug Firestore doc exists: {token_doc.exists}")
-    
     if not token_doc.exists:
-        print(f"Debug: Document does not exist at path: {token_doc_ref.path}")
         return None
     
-    token_data = token_doc.to_dict()
-    
-    print(f"Debug Firestore data keys: {list(token_data.keys()) if token_data else 'None'}")
-    if token_data:
-        print(f"Debug: accessToken present: {'accessToken' in token_data}")
-        if token_data.get('accessToken'):
-            print(f"Debug: accessToken value (first 20 chars): {token_data['accessToken'][:20]}")
-        
-        # Check expiration for logging only (don't filter it out)
-        if "expiresAt" in token_data:
-            expires_at = token_data["expiresAt"]
-            # Handle Firestore Timestamp
-            if hasattr(expires_at, 'timestamp'):
-                expires_at_dt = datetime.fromtimestamp(expires_at.timestamp())
-            elif isinstance(expires_at, datetime):
-                expires_at_dt = expires_at
-            else:
-                expires_at_dt = expires_at
-            
-            if isinstance(expires_at_dt, datetime):
-                is_expired = expires_at_dt <= datetime.utcnow()
-                print(f"Debug: Token expiration check - expires_at: {expires_at_dt}, now: {datetime.utcnow()}, expired: {is_expired}")
-    
     # Return the data regardless of expiration - let the caller handle refresh logic
-    return token_data
+    return token_doc.to_dict()
 
 
 def update_spotify_access_token(
     firebase_user_id: str,
     access_token: str,
-    expires_in: int
+    expires_in: int,
+    refresh_token: Optional[str] = None
 ):
     """
     Update Spotify access token (for refresh scenarios).
@@ -218,6 +220,7 @@ def update_spotify_access_token(
         firebase_user_id: Firebase Auth user ID
         access_token: New access token
         expires_in: New expiration time in seconds
+        refresh_token: New refresh token, if Spotify rotated it
     """
     db = get_db()
     token_doc_ref = db.collection(SPOTIFY_TOKENS_COLLECTION).document(firebase_user_id)
@@ -226,13 +229,15 @@ def update_spotify_access_token(
     expiration_time = min(expires_in, ONE_HOUR_IN_SECONDS)
     expires_at = datetime.utcnow() + timedelta(seconds=expiration_time)
     
-    print(f"Debug: Updating token for user {firebase_user_id}, new expires_at: {expires_at}")
-    
-    token_doc_ref.update({
+    updates = {
         "accessToken": access_token,
         "expiresAt": expires_at,
         "updatedAt": firestore.SERVER_TIMESTAMP,
-    })
+    }
+    if refresh_token:
+        updates["refreshToken"] = refresh_token
+    
+    token_doc_ref.update(updates)
 
 
 def delete_spotify_tokens(firebase_user_id: str):
@@ -276,31 +281,171 @@ def save_user_session(
         Saved session data dict
     """
     db = get_db()
-    sessions_ref = db.collection(USER_SESSIONS_COLLECTION)
+    session_ref = db.collection(USER_SESSIONS_COLLECTION).document()  # auto-generated ID
     
-    session_data = {
-        "firebaseUserId": firebase_user_id,
-        "trackId": track_id,
+    session_data = _session_doc(firebase_user_id, {
+        "track_id": track_id,
         "mood": mood,
         "intensity": intensity,
-        "sessionType": session_type,
-        "trackName": track_name,
-        "artistName": artist_name,
+        "track_name": track_name,
+        "artist_name": artist_name,
+        "session_type": session_type,
+    })
+    
+    # Write the session and its profile counters together
+    batch = db.batch()
+    batch.create(session_ref, session_data)
+    batch.set(_profile_ref(db, firebase_user_id), _profile_update([session_data]), merge=True)
+    batch.commit()
+    session_data["id"] = session_ref.id
+    
+    return session_data
+
+
+def _session_doc(firebase_user_id: str, session: dict) -> dict:
+    return {
+        "firebaseUserId": firebase_user_id,
+        "trackId": session["track_id"],
+        "mood": session["mood"],
+        "intensity": session.get("intensity", 50),
+        "sessionType": session.get("session_type", "track"),
+        "trackName": session.get("track_name"),
+        "artistName": session.get("artist_name"),
         "createdAt": firestore.SERVER_TIMESTAMP,
         "updatedAt": firestore.SERVER_TIMESTAMP,
     }
+
+
+def _profile_ref(db: firestore.Client, firebase_user_id: str):
+    return db.collection(USER_PROFILES_COLLECTION).document(firebase_user_id)
+
+
+def _profile_update(sessions: List[dict], sign: int = 1) -> dict:
+    """Merge-set payload incrementing (or, with sign=-1, decrementing) the profile counters"""
+    count, mood_counts, intensity_sums = profile_deltas(sessions)
+    return {
+        "sessionCount": firestore.Increment(sign * count),
+        "moodCounts": {mood: firestore.Increment(sign * n) for mood, n in mood_counts.items()},
+        "intensitySums": {mood: firestore.Increment(sign * n) for mood, n in intensity_sums.items()},
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+
+
+def save_user_sessions(firebase_user_id: str, sessions: List[dict]) -> List[dict]:
+    """
+    Save many mood-song sessions for one user with batched writes.
     
-    # Add document with auto-generated ID
-    doc_ref = sessions_ref.add(session_data)[1]  # Returns (write_result, doc_ref)
-    session_data["id"] = doc_ref.id
+    Each batch holds up to SESSIONS_PER_BATCH sessions plus one increment of the
+    user's profile counters, so a batch's sessions and counters commit together.
+    Sessions with an idempotency_key get a deterministic document ID; keys that
+    were already written are reported as not created and not counted again.
     
-    return session_data
+    Args:
+        firebase_user_id: Firebase Auth user ID
+        sessions: Dicts with track_id, mood, intensity, track_name, artist_name,
+            session_type and optional idempotency_key
+    
+    Returns:
+        List of {"id", "created"} in input order
+    """
+    db = get_db()
+    results = []
+    for start in range(0, len(sessions), SESSIONS_PER_BATCH):
+        results.extend(_save_session_batch(db, firebase_user_id, sessions[start:start + SESSIONS_PER_BATCH]))
+    return results
+
+
+def _save_session_batch(db: firestore.Client, firebase_user_id: str, sessions: List[dict], retry: bool = True) -> List[dict]:
+    sessions_ref = db.collection(USER_SESSIONS_COLLECTION)
+    refs = [
+        sessions_ref.document(session_id_for(firebase_user_id, s["idempotency_key"]))
+        if s.get("idempotency_key") else sessions_ref.document()
+        for s in sessions
+    ]
+    
+    # One round-trip to find keys written by an earlier attempt
+    keyed_refs = [ref for ref, s in zip(refs, sessions) if s.get("idempotency_key")]
+    existing = {doc.id for doc in db.get_all(keyed_refs) if doc.exists} if keyed_refs else set()
+    
+    batch = db.batch()
+    written = []
+    results = []
+    for ref, session in zip(refs, sessions):
+        if ref.id in existing:
+            results.append({"id": ref.id, "created": False})
+            continue
+        existing.add(ref.id)  # the same key twice in one request
+        session_data = _session_doc(firebase_user_id, session)
+        batch.create(ref, session_data)
+        written.append(session_data)
+        results.append({"id": ref.id, "created": True})
+    
+    if written:
+        batch.set(_profile_ref(db, firebase_user_id), _profile_update(written), merge=True)
+        try:
+            batch.commit()
+        except Conflict:
+            # A concurrent retry created some of these documents first; nothing from
+            # this batch was applied, so re-check and write whatever is still missing
+            if not retry:
+                raise
+            return _save_session_batch(db, firebase_user_id, sessions, retry=False)
+    
+    return results
+
+
+def get_user_profile(firebase_user_id: str) -> Optional[dict]:
+    """
+    Get a user's profile counters (sessionCount, moodCounts, intensitySums).
+    
+    Args:
+        firebase_user_id: Firebase Auth user ID
+    
+    Returns:
+        Profile dict or None if the user has no sessions yet
+    """
+    doc = _profile_ref(get_db(), firebase_user_id).get()
+    if not doc.exists:
+        return None
+    profile = doc.to_dict()
+    profile["firebaseUserId"] = firebase_user_id
+    return profile
+
+
+def list_user_ids(after: Optional[str] = None, limit: int = 1000) -> List[str]:
+    """
+    List users with at least one session, from their profile documents.
+    
+    Args:
+        after: Optional user ID to start after (keyset paging)
+        limit: Maximum number of IDs to return
+    
+    Returns:
+        User IDs in document ID order; fewer than limit only on the last page
+    """
+    db = get_db()
+    profiles = db.collection(USER_PROFILES_COLLECTION)
+    user_ids = []
+    while len(user_ids) < limit:
+        query = profiles.order_by(firestore.FieldPath.document_id()).select(["sessionCount"])
+        if after is not None:
+            query = query.start_after({firestore.FieldPath.document_id(): profiles.document(after)})
+        page_size = limit - len(user_ids)
+        docs = list(query.limit(page_size).stream())
+        # profiles whose sessions were all deleted keep a zero count
+        user_ids.extend(doc.id for doc in docs if (doc.to_dict() or {}).get("sessionCount", 0) > 0)
+        if len(docs) < page_size:
+            break
+        after = docs[-1].id
+    return user_ids
 
 
 def get_user_sessions(
     firebase_user_id: str,
     mood: Optional[str] = None,
-    limit: Optional[int] = None
+    limit: Optional[int] = None,
+    fields: Optional[Sequence[str]] = None,
+    since: Optional[float] = None
 ) -> List[dict]:
     """
     Get user's mood-song sessions from Firestore.
@@ -309,10 +454,123 @@ def get_user_sessions(
         firebase_user_id: Firebase Auth user ID
         mood: Optional mood filter
         limit: Optional limit on number of results
+        fields: Optional projection, e.g. ["trackId", "mood", "intensity"]
+            (id and createdAt are always returned)
+        since: Optional epoch seconds; older sessions are skipped
     
     Returns:
         List of session dicts
     """
+    query = _user_sessions_query(firebase_user_id, mood, fields, since)
+    
+    # Optional limit
+    if limit:
+        query = query.limit(limit)
+    
+    return [_session_from_doc(doc) for doc in query.stream()]
+
+
+def get_user_sessions_page(
+    firebase_user_id: str,
+    mood: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+    since: Optional[float] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Get one page of a user's sessions, newest first.
+    
+    Args:
+        firebase_user_id: Firebase Auth user ID
+        mood: Optional mood filter
+        limit: Page size
+        cursor: next_cursor from the previous page, None for the first page
+        fields: Optional projection (id and createdAt are always returned)
+        since: Optional epoch seconds; older sessions are skipped
+    
+    Returns:
+        (sessions, next_cursor); next_cursor is None on the last page
+    """
+    query = _user_sessions_query(firebase_user_id, mood, fields, since)
+    if cursor:
+        created_at_us, session_id = decode_session_cursor(cursor)
+        query = query.start_after({
+            "createdAt": EPOCH + timedelta(microseconds=created_at_us),
+            "__name__": session_id,
+        })
+    
+    # Fetch one extra document to learn whether there is a next page
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    
+    next_cursor = None
+    if has_more and docs:
+        last = docs[-1]
+        created_at_us = (last.get("createdAt") - EPOCH) // timedelta(microseconds=1)
+        next_cursor = encode_session_cursor(created_at_us, last.id)
+    
+    return [_session_from_doc(doc) for doc in docs], next_cursor
+
+
+def get_sessions_created_since(
+    since: Optional[float] = None,
+    limit: int = 1000,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Get one page of every user's sessions created at or after since, oldest first.
+    
+    Args:
+        since: Optional epoch seconds; older sessions are skipped
+        limit: Page size
+        cursor: next_cursor from the previous page, None for the first page
+        fields: Optional projection (id, firebaseUserId and createdAt are always returned)
+    
+    Returns:
+        (sessions, next_cursor); next_cursor is None on the last page
+    """
+    db = get_db()
+    query = db.collection(USER_SESSIONS_COLLECTION)
+    
+    # Optional recency window (served by the single-field createdAt index)
+    if since:
+        query = query.where("createdAt", ">=", datetime.fromtimestamp(since, tz=timezone.utc))
+    
+    # Only transfer the requested fields
+    if fields:
+        query = query.select(sorted(set(fields) | {"firebaseUserId", "createdAt"}))
+    
+    query = query.order_by("createdAt").order_by("__name__")
+    if cursor:
+        created_at_us, session_id = decode_session_cursor(cursor)
+        query = query.start_after({
+            "createdAt": EPOCH + timedelta(microseconds=created_at_us),
+            "__name__": session_id,
+        })
+    
+    # Fetch one extra document to learn whether there is a next page
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    
+    next_cursor = None
+    if has_more and docs:
+        last = docs[-1]
+        created_at_us = (last.get("createdAt") - EPOCH) // timedelta(microseconds=1)
+        next_cursor = encode_session_cursor(created_at_us, last.id)
+    
+    return [_session_from_doc(doc) for doc in docs], next_cursor
+
+
+def _user_sessions_query(
+    firebase_user_id: str,
+    mood: Optional[str],
+    fields: Optional[Sequence[str]],
+    since: Optional[float]
+):
     db = get_db()
     sessions_ref = db.collection(USER_SESSIONS_COLLECTION)
     
@@ -323,31 +581,134 @@ def get_user_sessions(
     if mood:
         query = query.where("mood", "==", mood)
     
-    # Order by creation time (newest first)
+    # Optional recency window
+    if since:
+        query = query.where("createdAt", ">=", datetime.fromtimestamp(since, tz=timezone.utc))
+    
+    # Only transfer the requested fields
+    if fields:
+        query = query.select(sorted(set(fields) | {"createdAt"}))
+    
+    # Order by creation time (newest first), document ID breaks ties within a batch
     query = query.order_by("createdAt", direction=firestore.Query.DESCENDING)
+    query = query.order_by("__name__", direction=firestore.Query.DESCENDING)
     
-    # Optional limit
-    if limit:
-        query = query.limit(limit)
+    return query
+
+
+def _session_from_doc(doc) -> dict:
+    session_data = doc.to_dict()
+    session_data["id"] = doc.id
+    # Convert Firestore timestamp to epoch seconds
+    if "createdAt" in session_data and hasattr(session_data["createdAt"], "timestamp"):
+        session_data["createdAt"] = session_data["createdAt"].timestamp()
+    return session_data
+
+
+def _aggregate_sessions(
+    firebase_user_id: str,
+    mood: Optional[str],
+    since: Optional[float],
+    until: Optional[float]
+) -> dict:
+    """One count() + sum(intensity) aggregation query; billed per index entries scanned, not per document"""
+    query = get_db().collection(USER_SESSIONS_COLLECTION).where("firebaseUserId", "==", firebase_user_id)
+    if mood:
+        query = query.where("mood", "==", mood)
+    if since is not None:
+        query = query.where("createdAt", ">=", datetime.fromtimestamp(since, tz=timezone.utc))
+    if until is not None:
+        query = query.where("createdAt", "<", datetime.fromtimestamp(until, tz=timezone.utc))
+    
+    aggregation = query.count(alias="count").sum("intensity", alias="intensitySum")
+    values = {result.alias: result.value for result in aggregation.get()[0]}
+    return {"count": int(values.get("count") or 0), "intensitySum": int(values.get("intensitySum") or 0)}
+
+
+def get_mood_summary(
+    firebase_user_id: str,
+    since: Optional[float] = None,
+    until: Optional[float] = None
+) -> Dict[str, dict]:
+    """
+    Get session count and intensity sum per mood using aggregation queries.
+    
+    Args:
+        firebase_user_id: Firebase Auth user ID
+        since: Optional epoch seconds (inclusive)
+        until: Optional epoch seconds (exclusive)
     
-    docs = query.stream()
+    Returns:
+        {mood: {"count", "intensitySum"}} for moods with at least one session
+    """
+    results = _aggregation_pool.map(
+        lambda mood: _aggregate_sessions(firebase_user_id, mood, since, until), MOODS
+    )
+    return {mood: result for mood, result in zip(MOODS, results) if result["count"]}
+
+
+def get_daily_session_counts(
+    firebase_user_id: str,
+    since: float,
+    until: Optional[float] = None,
+    mood: Optional[str] = None
+) -> List[dict]:
+    """
+    Get session count and intensity sum per UTC day.
     
-    sessions = []
-    for doc in docs:
-        session_data = doc.to_dict()
-        session_data["id"] = doc.id
-        # Convert Firestore timestamp to ISO string if needed
-        if "createdAt" in session_data and hasattr(session_data["createdAt"], "timestamp"):
-            session_data["createdAt"] = session_data["createdAt"].timestamp()
-        sessions.append(session_data)
+    A single query streams only createdAt and intensity of the sessions in range and the
+    days are bucketed here, rather than one aggregation query per day (366 RPCs for a year).
     
-    return sessions
+    Args:
+        firebase_user_id: Firebase Auth user ID
+        since: Epoch seconds (inclusive)
+        until: Optional epoch seconds (exclusive), defaults to now
+        mood: Optional mood filter
+    
+    Returns:
+        [{"date", "count", "intensitySum"}] oldest first, empty days omitted
+    """
+    ranges = day_range(since, until)  # validates the range length
+    if not ranges:
+        return []
+    query = get_db().collection(USER_SESSIONS_COLLECTION).where("firebaseUserId", "==", firebase_user_id)
+    if mood:
+        query = query.where("mood", "==", mood)
+    query = query.where("createdAt", ">=", datetime.fromtimestamp(ranges[0][0], tz=timezone.utc))
+    query = query.where("createdAt", "<", datetime.fromtimestamp(ranges[-1][1], tz=timezone.utc))
+    query = query.select(["createdAt", "intensity"])
+    
+    days: Dict[int, dict] = {}
+    for doc in query.stream():
+        session = doc.to_dict()
+        day = days.setdefault(int(session["createdAt"].timestamp() // SECONDS_PER_DAY), {"count": 0, "intensitySum": 0})
+        day["count"] += 1
+        day["intensitySum"] += int(session.get("intensity") or 0)
+    return [{"date": day_key(day * SECONDS_PER_DAY), **days[day]} for day in sorted(days)]
+
+
+@firestore.transactional
+def _delete_session_in_transaction(transaction, db: firestore.Client, session_ref) -> bool:
+    # Read inside the transaction so concurrent deletes of one session decrement the profile once
+    snapshot = session_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False
+    session_data = snapshot.to_dict()
+    transaction.delete(session_ref)
+    transaction.set(
+        _profile_ref(db, session_data["firebaseUserId"]),
+        _profile_update([session_data], sign=-1),
+        merge=True
+    )
+    return True
 
 
 def delete_user_session(session_id: str) -> bool:
     """
     Delete a user session by ID.
     
+    The session is read, deleted and taken off its user's profile counters in one transaction.
+    
     Args:
         session_id: Firestore document ID
     
@@ -356,10 +717,298 @@ def delete_user_session(session_id: str) -> bool:
     """
     db = get_db()
     session_ref = db.collection(USER_SESSIONS_COLLECTION).document(session_id)
-    doc = session_ref.get()
+    return _delete_session_in_transaction(db.transaction(), db, session_ref)
+
+
+def _collection_from_doc(doc) -> dict:
+    collection = doc.to_dict()
+    collection["id"] = doc.id
+    collection.pop("nextPosition", None)
+    # Convert Firestore timestamps to epoch seconds
+    for field in ("createdAt", "lastUpdated"):
+        if hasattr(collection.get(field), "timestamp"):
+            collection[field] = collection[field].timestamp()
+    return collection
+
+
+def _owned_collection(snapshot, firebase_user_id: str) -> bool:
+    return snapshot.exists and snapshot.get("firebaseUserId") == firebase_user_id
+
+
+def create_collection(
+    firebase_user_id: str,
+    name: str,
+    mood: Optional[str] = None,
+    color: Optional[str] = None
+) -> dict:
+    """
+    Create an empty collection.
+    
+    Args:
+        firebase_user_id: Firebase Auth user ID
+        name: Collection name
+        mood: Optional mood label
+        color: Optional display color
+    
+    Returns:
+        The new collection dict (timestamps as epoch seconds)
+    """
+    collection_ref = get_db().collection(COLLECTIONS_COLLECTION).document()
+    collection_ref.create({
+        "firebaseUserId": firebase_user_id,
+        "name": name,
+        "mood": mood,
+        "color": color,
+        "songCount": 0,
+        "previewTrackIds": [],
+        "nextPosition": 0,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+        "lastUpdated": firestore.SERVER_TIMESTAMP,
+    })
+    return _collection_from_doc(collection_ref.get())
+
+
+def list_collections(firebase_user_id: str) -> List[dict]:
+    """
+    Get a user's collections, most recently updated first, with one query.
+    songCount, lastUpdated and previewTrackIds are kept on each collection document.
+    
+    Requires a composite index on (firebaseUserId ASC, lastUpdated DESC).
+    """
+    query = (
+        get_db().collection(COLLECTIONS_COLLECTION)
+        .where("firebaseUserId", "==", firebase_user_id)
+        .order_by("lastUpdated", direction=firestore.Query.DESCENDING)
+    )
+    return [_collection_from_doc(doc) for doc in query.stream()]
+
+
+def delete_collection(firebase_user_id: str, collection_id: str) -> bool:
+    """
+    Delete a collection and its tracks.
+    
+    Returns:
+        True if deleted, False if the user has no such collection
+    """
+    db = get_db()
+    collection_ref = db.collection(COLLECTIONS_COLLECTION).document(collection_id)
+    if not _owned_collection(collection_ref.get(), firebase_user_id):
+        return False
+    
+    # The collection disappears from listings first; then its tracks, a batch at a time
+    collection_ref.delete()
+    tracks_ref = collection_ref.collection(COLLECTION_TRACKS_SUBCOLLECTION)
+    while True:
+        docs = list(tracks_ref.limit(MAX_BATCH_WRITES).stream())
+        if not docs:
+            break
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+    return True
+
+
+@firestore.transactional
+def _add_tracks_in_transaction(transaction, collection_ref, firebase_user_id: str, track_ids: List[str]) -> bool:
+    snapshot = collection_ref.get(transaction=transaction)
+    if not _owned_collection(snapshot, firebase_user_id):
+        return False
+    
+    tracks_ref = collection_ref.collection(COLLECTION_TRACKS_SUBCOLLECTION)
+    refs = [tracks_ref.document(track_id) for track_id in track_ids]
+    existing = {doc.id for doc in transaction.get_all(refs) if doc.exists} if refs else set()
+    new_refs = [ref for ref in refs if ref.id not in existing]
+    if not new_refs:
+        return True
+    
+    collection = snapshot.to_dict()
+    position = collection.get("nextPosition", 0)
+    for i, ref in enumerate(new_refs):
+        transaction.create(ref, {"trackId": ref.id, "position": position + i, "addedAt": firestore.SERVER_TIMESTAMP})
+    # New tracks come after every existing one, so they only extend a short preview
+    preview = (collection.get("previewTrackIds") or []) + [ref.id for ref in new_refs]
+    transaction.update(collection_ref, {
+        "songCount": collection.get("songCount", 0) + len(new_refs),
+        "nextPosition": position + len(new_refs),
+        "previewTrackIds": preview[:COLLECTION_PREVIEW_TRACKS],
+        "lastUpdated": firestore.SERVER_TIMESTAMP,
+    })
+    return True
+
+
+def add_collection_tracks(firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+    """
+    Append tracks to a collection, skipping ones it already has.
     
-    if doc.exists:
-        session_ref.delete()
+    Each transaction writes up to TRACKS_PER_TRANSACTION tracks together with the
+    collection's songCount, previewTrackIds and lastUpdated.
+    
+    Returns:
+        The updated collection, or None if the user has no such collection
+    """
+    db = get_db()
+    collection_ref = db.collection(COLLECTIONS_COLLECTION).document(collection_id)
+    track_ids = list(dict.fromkeys(track_ids))
+    for start in range(0, max(len(track_ids), 1), TRACKS_PER_TRANSACTION):
+        chunk = track_ids[start:start + TRACKS_PER_TRANSACTION]
+        if not _add_tracks_in_transaction(db.transaction(), collection_ref, firebase_user_id, chunk):
+            return None
+    return _collection_from_doc(collection_ref.get())
+
+
+@firestore.transactional
+def _remove_tracks_in_transaction(transaction, collection_ref, firebase_user_id: str, track_ids: List[str]) -> bool:
+    snapshot = collection_ref.get(transaction=transaction)
+    if not _owned_collection(snapshot, firebase_user_id):
+        return False
+    
+    tracks_ref = collection_ref.collection(COLLECTION_TRACKS_SUBCOLLECTION)
+    refs = [tracks_ref.document(track_id) for track_id in track_ids]
+    existing = [doc.reference for doc in transaction.get_all(refs) if doc.exists] if refs else []
+    if not existing:
         return True
-    return False
+    
+    collection = snapshot.to_dict()
+    removed = {ref.id for ref in existing}
+    preview = collection.get("previewTrackIds") or []
+    if removed & set(preview):
+        # Refill the preview from the first remaining tracks (reads before any write)
+        query = tracks_ref.order_by("position").limit(COLLECTION_PREVIEW_TRACKS + len(removed))
+        preview = [doc.id for doc in transaction.get(query) if doc.id not in removed]
+    for ref in existing:
+        transaction.delete(ref)
+    transaction.update(collection_ref, {
+        "songCount": collection.get("songCount", 0) - len(existing),
+        "previewTrackIds": preview[:COLLECTION_PREVIEW_TRACKS],
+        "lastUpdated": firestore.SERVER_TIMESTAMP,
+    })
+    return True
+
+
+def remove_collection_tracks(firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+    """
+    Remove tracks from a collection; tracks it doesn't have are ignored.
+    
+    Returns:
+        The updated collection, or None if the user has no such collection
+    """
+    db = get_db()
+    collection_ref = db.collection(COLLECTIONS_COLLECTION).document(collection_id)
+    track_ids = list(dict.fromkeys(track_ids))
+    for start in range(0, max(len(track_ids), 1), TRACKS_PER_TRANSACTION):
+        chunk = track_ids[start:start + TRACKS_PER_TRANSACTION]
+        if not _remove_tracks_in_transaction(db.transaction(), collection_ref, firebase_user_id, chunk):
+            return None
+    return _collection_from_doc(collection_ref.get())
+
+
+def get_collection_tracks_page(
+    firebase_user_id: str,
+    collection_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Optional[Tuple[List[dict], Optional[str]]]:
+    """
+    Get one page of a collection's tracks in the order they were added.
+    
+    Args:
+        firebase_user_id: Firebase Auth user ID (must own the collection)
+        collection_id: Collection document ID
+        limit: Page size
+        cursor: next_cursor from the previous page, None for the first page
+    
+    Returns:
+        ([{"trackId", "addedAt"}], next_cursor), or None if the user has no such collection
+    """
+    collection_ref = get_db().collection(COLLECTIONS_COLLECTION).document(collection_id)
+    if not _owned_collection(collection_ref.get(), firebase_user_id):
+        return None
+    
+    query = collection_ref.collection(COLLECTION_TRACKS_SUBCOLLECTION).order_by("position")
+    if cursor:
+        position, _ = decode_session_cursor(cursor)
+        query = query.start_after({"position": position})
+    
+    # Fetch one extra document to learn whether there is a next page
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    
+    tracks = []
+    for doc in docs:
+        added_at = doc.get("addedAt")
+        tracks.append({"trackId": doc.id, "addedAt": added_at.timestamp() if hasattr(added_at, "timestamp") else added_at})
+    
+    next_cursor = None
+    if has_more and docs:
+        next_cursor = encode_session_cursor(docs[-1].get("position"), docs[-1].id)
+    return tracks, next_cursor
+
+
+
+class FirestoreStorageBackend(StorageBackend):
+    """StorageBackend over the module-level Firestore functions"""
+
+    def __init__(self):
+        init_firestore()
+
+    def save_spotify_tokens(self, *args, **kwargs) -> dict:
+        return save_spotify_tokens(*args, **kwargs)
+
+    def get_spotify_tokens(self, firebase_user_id: str) -> Optional[dict]:
+        return get_spotify_tokens(firebase_user_id)
+
+    def update_spotify_access_token(self, *args, **kwargs):
+        return update_spotify_access_token(*args, **kwargs)
+
+    def delete_spotify_tokens(self, firebase_user_id: str):
+        return delete_spotify_tokens(firebase_user_id)
+
+    def save_user_session(self, *args, **kwargs) -> dict:
+        return save_user_session(*args, **kwargs)
+
+    def save_user_sessions(self, firebase_user_id: str, sessions: List[dict]) -> List[dict]:
+        return save_user_sessions(firebase_user_id, sessions)
+
+    def get_user_profile(self, firebase_user_id: str) -> Optional[dict]:
+        return get_user_profile(firebase_user_id)
+
+    def list_user_ids(self, *args, **kwargs) -> List[str]:
+        return list_user_ids(*args, **kwargs)
+
+    def get_user_sessions(self, *args, **kwargs) -> List[dict]:
+        return get_user_sessions(*args, **kwargs)
+
+    def get_user_sessions_page(self, *args, **kwargs) -> Tuple[List[dict], Optional[str]]:
+        return get_user_sessions_page(*args, **kwargs)
+
+    def get_sessions_created_since(self, *args, **kwargs) -> Tuple[List[dict], Optional[str]]:
+        return get_sessions_created_since(*args, **kwargs)
+
+    def get_mood_summary(self, *args, **kwargs) -> Dict[str, dict]:
+        return get_mood_summary(*args, **kwargs)
+
+    def get_daily_session_counts(self, *args, **kwargs) -> List[dict]:
+        return get_daily_session_counts(*args, **kwargs)
+
+    def delete_user_session(self, session_id: str) -> bool:
+        return delete_user_session(session_id)
+
+    def create_collection(self, *args, **kwargs) -> dict:
+        return create_collection(*args, **kwargs)
+
+    def list_collections(self, firebase_user_id: str) -> List[dict]:
+        return list_collections(firebase_user_id)
+
+    def delete_collection(self, firebase_user_id: str, collection_id: str) -> bool:
+        return delete_collection(firebase_user_id, collection_id)
+
+    def add_collection_tracks(self, firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+        return add_collection_tracks(firebase_user_id, collection_id, track_ids)
+
+    def remove_collection_tracks(self, firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+        return remove_collection_tracks(firebase_user_id, collection_id, track_ids)
 
+    def get_collection_tracks_page(self, *args, **kwargs) -> Optional[Tuple[List[dict], Optional[str]]]:
+        return get_collection_tracks_page(*args, **kwargs)
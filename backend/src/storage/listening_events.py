@@ -0,0 +1,179 @@
+"""
+Local append-only store of Spotify listening events (recently-played items).
+One JSONL log per user plus a small meta file holding the high-water mark
+(the newest played_at ingested), so each poll only has to fetch the delta.
+Logs of the MAX_CACHED_USERS most recently used users are kept in memory.
+"""
+import os
+import re
+import json
+import bisect
+import hashlib
+import pathlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+LISTENING_EVENTS_DIR = pathlib.Path(
+    os.getenv("LISTENING_EVENTS_DIR", str(backend_dir / "data" / "listening_events"))
+)
+
+MAX_CACHED_USERS = int(os.getenv("LISTENING_EVENTS_MAX_CACHED_USERS", "1000"))
+
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def played_at_ms(item: dict) -> int:
+    """Spotify's ISO-8601 played_at as epoch milliseconds"""
+    value = item["played_at"].replace("Z", "+00:00")
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def compact_item(item: dict) -> dict:
+    """Keep only the recently-played fields the app uses"""
+    track = item.get("track") or {}
+    album = track.get("album") or {}
+    return {
+        "played_at": item.get("played_at"),
+        "context": item.get("context"),
+        "track": {
+            "id": track.get("id"),
+            "name": track.get("name"),
+            "uri": track.get("uri"),
+            "duration_ms": track.get("duration_ms"),
+            "explicit": track.get("explicit"),
+            "artists": [{"id": a.get("id"), "name": a.get("name")} for a in track.get("artists") or []],
+            "album": {
+                "id": album.get("id"),
+                "name": album.get("name"),
+                "images": album.get("images") or [],
+            },
+        },
+    }
+
+
+class ListeningEventStore:
+    """
+    Per-user append-only JSONL logs. Events are kept in played_at order;
+    append() drops anything at or below the user's high-water mark, so
+    re-ingesting an overlapping page is harmless.
+    """
+
+    def __init__(self, root: pathlib.Path = LISTENING_EVENTS_DIR, max_users: int = MAX_CACHED_USERS):
+        self.root = pathlib.Path(root)
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # In-memory copy of each user's log, loaded on first access, least recently used first
+        self._events: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self._high_water: Dict[str, Optional[int]] = {}
+
+    def _file_stem(self, firebase_user_id: str) -> str:
+        if _SAFE_NAME.match(firebase_user_id):
+            return firebase_user_id
+        return hashlib.sha1(firebase_user_id.encode("utf-8")).hexdigest()
+
+    def _log_path(self, firebase_user_id: str) -> pathlib.Path:
+        return self.root / f"{self._file_stem(firebase_user_id)}.jsonl"
+
+    def _meta_path(self, firebase_user_id: str) -> pathlib.Path:
+        return self.root / f"{self._file_stem(firebase_user_id)}.meta.json"
+
+    def _load(self, firebase_user_id: str) -> List[dict]:
+        """Load a user's log into memory (caller holds the lock)"""
+        events = self._events.get(firebase_user_id)
+        if events is not None:
+            self._events.move_to_end(firebase_user_id)
+            return events
+
+        events = []
+        log_path = self._log_path(firebase_user_id)
+        if log_path.exists():
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        events.append(json.loads(line))
+
+        high_water = None
+        meta_path = self._meta_path(firebase_user_id)
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                high_water = json.load(f).get("high_water_mark")
+        if events:
+            # The log is the source of truth if the meta write was lost
+            high_water = max(high_water or 0, events[-1]["played_at_ms"])
+
+        self._events[firebase_user_id] = events
+        self._high_water[firebase_user_id] = high_water
+        # the user just loaded is always kept
+        while len(self._events) > max(self.max_users, 1):
+            evicted, _ = self._events.popitem(last=False)
+            del self._high_water[evicted]
+        return events
+
+    def high_water_mark(self, firebase_user_id: str) -> Optional[int]:
+        """Newest played_at (epoch ms) ingested for this user, or None"""
+        with self._lock:
+            self._load(firebase_user_id)
+            return self._high_water[firebase_user_id]
+
+    def append(self, firebase_user_id: str, items: List[dict]) -> List[dict]:
+        """
+        Append recently-played items newer than the high-water mark.
+        Returns the events actually stored (oldest first).
+        """
+        with self._lock:
+            events = self._load(firebase_user_id)
+            high_water = self._high_water[firebase_user_id]
+
+            fresh = {}
+            for item in items:
+                ts = played_at_ms(item)
+                if high_water is None or ts > high_water:
+                    fresh[ts] = {"played_at_ms": ts, "item": compact_item(item)}
+            if not fresh:
+                return []
+
+            new_events = [fresh[ts] for ts in sorted(fresh)]
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self._log_path(firebase_user_id), "a", encoding="utf-8") as f:
+                for event in new_events:
+                    f.write(json.dumps(event, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            high_water = new_events[-1]["played_at_ms"]
+            tmp_path = self._meta_path(firebase_user_id).with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"high_water_mark": high_water}, f)
+            os.replace(tmp_path, self._meta_path(firebase_user_id))
+
+            events.extend(new_events)
+            self._high_water[firebase_user_id] = high_water
+            return new_events
+
+    def recent(self, firebase_user_id: str, limit: int = 20) -> List[dict]:
+        """Most recent events, newest first"""
+        with self._lock:
+            events = self._load(firebase_user_id)
+            return list(reversed(events[-limit:])) if limit > 0 else []
+
+    def since(self, firebase_user_id: str, played_after_ms: int) -> List[dict]:
+        """Events played strictly after played_after_ms, oldest first"""
+        with self._lock:
+            events = self._load(firebase_user_id)
+            start = bisect.bisect_right(events, played_after_ms, key=lambda event: event["played_at_ms"])
+            return events[start:]
+
+    def count(self, firebase_user_id: str) -> int:
+        with self._lock:
+            return len(self._load(firebase_user_id))
+
+
+# Global instance
+listening_event_store = ListeningEventStore()
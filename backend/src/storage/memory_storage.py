@@ -1,12 +1,23 @@
 """
 In-memory storage for Spotify tokens and user data, temporary solution until we implement a proper database.
 """
+import os
+import sys
+import time
+import threading
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import Optional, Dict, Deque, Tuple, Callable
 from dataclasses import dataclass, field
 
+# OAuth states older than this are treated as abandoned logins and dropped
+OAUTH_STATE_TTL_SECONDS = int(os.getenv("OAUTH_STATE_TTL_SECONDS", "600"))
 
-@dataclass
+# __slots__ dataclasses need Python 3.10+; fall back to regular ones on older interpreters
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_SLOTS)
 class SpotifyAccount:
     """Represents a Spotify account linked to a user"""
     spotify_user_id: str
@@ -19,7 +30,7 @@ class SpotifyAccount:
     updated_at: datetime = field(default_factory=datetime.utcnow)
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class User:
     """Represents a user in the system"""
     id: int
@@ -29,28 +40,42 @@ class User:
 
 
 class MemoryStorage:
-    """Simple in-memory storage for development"""
-    
-    def __init__(self):
+    """
+    Simple in-memory storage for development.
+    Lookups go through hash indexes instead of scans, OAuth states expire after
+    a TTL, and every method holds a lock so it is safe from threadpool routes.
+    """
+
+    def __init__(self, state_ttl_seconds: int = OAUTH_STATE_TTL_SECONDS, clock: Callable[[], float] = time.monotonic):
         self.spotify_accounts: Dict[str, SpotifyAccount] = {} # key: spotify_user_id
         self.users: Dict[int, User] = {} # key: user_id
         self.user_id_counter = 1
-        self.state_store: Dict[str, str] = {} # key: state, value: timestamp (for cleanup)
-    
+        self.state_store: Dict[str, float] = {} # key: state, value: expiry time (clock seconds)
+        # Secondary indexes
+        self._user_id_by_spotify_id: Dict[str, int] = {}
+        self._spotify_id_by_user_id: Dict[int, str] = {}
+        # States in expiry order; TTL is fixed, so that is insertion order
+        self._state_expiry: Deque[Tuple[float, str]] = deque()
+        self.state_ttl_seconds = state_ttl_seconds
+        self._clock = clock
+        self._lock = threading.RLock()
+
     def get_or_create_user(self, email: Optional[str], spotify_user_id: str) -> User:
         """Get existing user or create a new one"""
-        # Check if user exists by spotify_user_id
-        for user in self.users.values():
-            if user.spotify_user_id == spotify_user_id:
-                return user
-        
-        # Create new user
-        user_id = self.user_id_counter
-        self.user_id_counter += 1
-        user = User(id=user_id, email=email, spotify_user_id=spotify_user_id)
-        self.users[user_id] = user
-        return user
-    
+        with self._lock:
+            # Check if user exists by spotify_user_id
+            user_id = self._user_id_by_spotify_id.get(spotify_user_id)
+            if user_id is not None:
+                return self.users[user_id]
+
+            # Create new user
+            user_id = self.user_id_counter
+            self.user_id_counter += 1
+            user = User(id=user_id, email=email, spotify_user_id=spotify_user_id)
+            self.users[user_id] = user
+            self._user_id_by_spotify_id[spotify_user_id] = user_id
+            return user
+
     def save_spotify_tokens(
         self,
         spotify_user_id: str,
@@ -62,53 +87,76 @@ class MemoryStorage:
     ) -> SpotifyAccount:
         """Save or update Spotify tokens"""
         expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
-        
-        if spotify_user_id in self.spotify_accounts:
-            # Update existing account
-            account = self.spotify_accounts[spotify_user_id]
-            account.access_token = access_token
-            if refresh_token:
-                account.refresh_token = refresh_token
-            account.scope = scope
-            account.expires_at = expires_at
-            account.updated_at = datetime.utcnow()
-            if user_id:
-                account.user_id = user_id
-        else:
-            # Create new account
-            account = SpotifyAccount(
-                spotify_user_id=spotify_user_id,
-                access_token=access_token,
-                refresh_token=refresh_token,
-                scope=scope,
-                expires_at=expires_at,
-                user_id=user_id
-            )
-            self.spotify_accounts[spotify_user_id] = account
-        
-        return account
-    
+
+        with self._lock:
+            if spotify_user_id in self.spotify_accounts:
+                # Update existing account
+                account = self.spotify_accounts[spotify_user_id]
+                account.access_token = access_token
+                if refresh_token:
+                    account.refresh_token = refresh_token
+                account.scope = scope
+                account.expires_at = expires_at
+                account.updated_at = datetime.utcnow()
+                if user_id:
+                    self._link_user(account, user_id)
+            else:
+                # Create new account
+                account = SpotifyAccount(
+                    spotify_user_id=spotify_user_id,
+                    access_token=access_token,
+                    refresh_token=refresh_token,
+                    scope=scope,
+                    expires_at=expires_at
+                )
+                self.spotify_accounts[spotify_user_id] = account
+                if user_id:
+                    self._link_user(account, user_id)
+
+            return account
+
+    def _link_user(self, account: SpotifyAccount, user_id: int):
+        """Point account at user_id, keeping the user_id -> account index in step"""
+        if account.user_id is not None and self._spotify_id_by_user_id.get(account.user_id) == account.spotify_user_id:
+            del self._spotify_id_by_user_id[account.user_id]
+        account.user_id = user_id
+        self._spotify_id_by_user_id[user_id] = account.spotify_user_id
+
     def get_spotify_account(self, spotify_user_id: str) -> Optional[SpotifyAccount]:
         """Get Spotify account by spotify_user_id"""
-        return self.spotify_accounts.get(spotify_user_id)
-    
+        with self._lock:
+            return self.spotify_accounts.get(spotify_user_id)
+
     def get_spotify_account_by_user_id(self, user_id: int) -> Optional[SpotifyAccount]:
         """Get Spotify account by user_id"""
-        for account in self.spotify_accounts.values():
-            if account.user_id == user_id:
-                return account
-        return None
-    
+        with self._lock:
+            spotify_user_id = self._spotify_id_by_user_id.get(user_id)
+            return self.spotify_accounts.get(spotify_user_id) if spotify_user_id is not None else None
+
+    def _expire_states(self, now: float):
+        """Drop expired states from the front of the expiry queue (amortized O(1) per state)"""
+        while self._state_expiry and self._state_expiry[0][0] <= now:
+            expires_at, state = self._state_expiry.popleft()
+            # Skip if the state was already consumed (or re-stored with a later expiry)
+            if self.state_store.get(state) == expires_at:
+                del self.state_store[state]
+
     def store_state(self, state: str):
         """Store a state value for CSRF protection"""
-        self.state_store[state] = datetime.utcnow().isoformat()
-    
+        with self._lock:
+            now = self._clock()
+            self._expire_states(now)
+            expires_at = now + self.state_ttl_seconds
+            self.state_store[state] = expires_at
+            self._state_expiry.append((expires_at, state))
+
     def validate_state(self, state: str) -> bool:
         """Validate and remove a state value"""
-        if state in self.state_store:
-            del self.state_store[state]
-            return True
-        return False
+        with self._lock:
+            now = self._clock()
+            self._expire_states(now)
+            expires_at = self.state_store.pop(state, None)
+            return expires_at is not None and expires_at > now
 
 
 # Global instance for the storage
@@ -0,0 +1,187 @@
+"""
+OAuth CSRF state store shared by every worker that can receive the Spotify callback.
+Selected with OAUTH_STATE_BACKEND:
+- "memory" (default): process-local MemoryStorage, single worker only
+- "sqlite": a table in a local SQLite file, shared by all workers on one node
+- "firestore": an oauthStates collection, shared across nodes
+Each state is consumed at most once and expires after OAUTH_STATE_TTL_SECONDS.
+"""
+import os
+import time
+import pathlib
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from dotenv import load_dotenv
+
+from .memory_storage import MemoryStorage, storage as memory_storage, OAUTH_STATE_TTL_SECONDS
+
+# Load environment variables
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+load_dotenv(dotenv_path=backend_dir / ".env")
+
+OAUTH_STATE_BACKEND = os.getenv("OAUTH_STATE_BACKEND", "memory").lower()
+# Expired rows are swept every this many stores
+OAUTH_STATE_SWEEP_EVERY = 100
+
+OAUTH_STATES_COLLECTION = "oauthStates"
+
+# Global state store
+_state_store: Optional["OAuthStateStore"] = None
+
+
+class OAuthStateStore(ABC):
+    """Consume-once store for OAuth state values"""
+
+    @abstractmethod
+    def store(self, state: str):
+        """Remember a newly issued state"""
+
+    @abstractmethod
+    def consume(self, state: str) -> bool:
+        """Atomically remove a state; True only for the first caller and only before it expires"""
+
+    def close(self):
+        """Release resources (called at application shutdown)"""
+
+
+class MemoryOAuthStateStore(OAuthStateStore):
+    """Process-local; the callback must reach the worker that issued the state"""
+
+    def __init__(self, storage: MemoryStorage = memory_storage):
+        self.storage = storage
+
+    def store(self, state: str):
+        self.storage.store_state(state)
+
+    def consume(self, state: str) -> bool:
+        return self.storage.validate_state(state)
+
+
+class SQLiteOAuthStateStore(OAuthStateStore):
+    """
+    Shared by every process that opens the same database file. The conditional
+    DELETE runs under SQLite's write lock, so exactly one consumer sees rowcount 1.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl_seconds: int = OAUTH_STATE_TTL_SECONDS):
+        from .sqlite_storage import SQLiteConnectionPool, SQLITE_DB_PATH
+
+        self.pool = SQLiteConnectionPool(path or SQLITE_DB_PATH, size=2)
+        self.ttl_seconds = ttl_seconds
+        self._stores = 0
+        with self.pool.connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS oauth_states (
+                    state TEXT PRIMARY KEY,
+                    expiresAt REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_oauth_states_expires ON oauth_states (expiresAt);
+            """)
+
+    def store(self, state: str):
+        now = time.time()
+        with self.pool.connection() as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO oauth_states (state, expiresAt) VALUES (?, ?)",
+                (state, now + self.ttl_seconds),
+            )
+            # Amortized cleanup of abandoned logins
+            self._stores += 1
+            if self._stores % OAUTH_STATE_SWEEP_EVERY == 0:
+                conn.execute("DELETE FROM oauth_states WHERE expiresAt <= ?", (now,))
+
+    def consume(self, state: str) -> bool:
+        with self.pool.connection() as conn, conn:
+            cursor = conn.execute(
+                "DELETE FROM oauth_states WHERE state = ? AND expiresAt > ?",
+                (state, time.time()),
+            )
+        return cursor.rowcount == 1
+
+    def close(self):
+        self.pool.close()
+
+
+class FirestoreOAuthStateStore(OAuthStateStore):
+    """
+    One document per state, consumed in a transaction so concurrent callbacks
+    can't both succeed. Configure a Firestore TTL policy on expiresAt to have
+    abandoned states deleted server-side.
+    """
+
+    def __init__(self, ttl_seconds: int = OAUTH_STATE_TTL_SECONDS):
+        from .firestore_storage import init_firestore, get_db
+
+        init_firestore()
+        self.db = get_db()
+        self.ttl_seconds = ttl_seconds
+
+    def store(self, state: str):
+        self.db.collection(OAUTH_STATES_COLLECTION).document(state).set({
+            "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+        })
+
+    def consume(self, state: str) -> bool:
+        from firebase_admin import firestore
+
+        doc_ref = self.db.collection(OAUTH_STATES_COLLECTION).document(state)
+
+        @firestore.transactional
+        def consume_in_transaction(transaction) -> bool:
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                return False
+            transaction.delete(doc_ref)
+            return doc.get("expiresAt") > datetime.now(timezone.utc)
+
+        return consume_in_transaction(self.db.transaction())
+
+
+def init_oauth_state_store(store: Optional[OAuthStateStore] = None) -> OAuthStateStore:
+    """
+    Initialize the state store selected by OAUTH_STATE_BACKEND, or install the given one.
+    Must be called once at application startup.
+    """
+    global _state_store
+
+    if store is not None:
+        _state_store = store
+        return _state_store
+
+    if _state_store is not None:
+        return _state_store  # Already initialized
+
+    if OAUTH_STATE_BACKEND == "memory":
+        _state_store = MemoryOAuthStateStore()
+    elif OAUTH_STATE_BACKEND == "sqlite":
+        _state_store = SQLiteOAuthStateStore(os.getenv("OAUTH_STATE_SQLITE_PATH"))
+    elif OAUTH_STATE_BACKEND == "firestore":
+        _state_store = FirestoreOAuthStateStore()
+    else:
+        raise RuntimeError(
+            f"Unknown OAUTH_STATE_BACKEND '{OAUTH_STATE_BACKEND}' (expected 'memory', 'sqlite' or 'firestore')"
+        )
+
+    print(f"✓ OAuth state backend: {OAUTH_STATE_BACKEND}")
+    return _state_store
+
+
+def get_oauth_state_store() -> OAuthStateStore:
+    """
+    Get the OAuth state store. Raises error if not initialized.
+    """
+    if _state_store is None:
+        raise RuntimeError(
+            "OAuth state store not initialized. Please call init_oauth_state_store() at application startup."
+        )
+    return _state_store
+
+
+def close_oauth_state_store():
+    """Close the OAuth state store (call at application shutdown)"""
+    global _state_store
+
+    if _state_store is not None:
+        _state_store.close()
+        _state_store = None
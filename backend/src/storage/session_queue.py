@@ -0,0 +1,300 @@
+"""
+Optional write-behind queue for mood session logging (SESSION_WRITE_BEHIND=1).
+A session is acknowledged once it is appended to a local on-disk log; a
+background flusher commits queued sessions to the storage backend in batches.
+Each queued session carries an idempotency key, so replaying the log after a
+crash (or a flush that failed halfway) never writes a session twice.
+
+Every worker process keeps its own log (session_queue.<pid>.jsonl next to
+SESSION_QUEUE_PATH) and holds an flock on a matching .lock file while it runs.
+At startup a worker adopts the logs of workers that are no longer running.
+"""
+import os
+import json
+import fcntl
+import time
+import uuid
+import asyncio
+import pathlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .backend import get_storage, session_id_for
+
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+SESSION_WRITE_BEHIND = os.getenv("SESSION_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+SESSION_QUEUE_PATH = pathlib.Path(
+    os.getenv("SESSION_QUEUE_PATH", str(backend_dir / "data" / "session_queue.jsonl"))
+)
+SESSION_QUEUE_MAX_PENDING = int(os.getenv("SESSION_QUEUE_MAX_PENDING", "10000"))
+SESSION_FLUSH_BATCH_SIZE = int(os.getenv("SESSION_FLUSH_BATCH_SIZE", "200"))
+SESSION_FLUSH_INTERVAL_SECONDS = float(os.getenv("SESSION_FLUSH_INTERVAL_SECONDS", "1.0"))
+# How long a request waits for room in a full queue before being turned away
+SESSION_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("SESSION_ENQUEUE_TIMEOUT_SECONDS", "2.0"))
+MAX_FLUSH_BACKOFF_SECONDS = 30.0
+
+
+class SessionQueueFullError(Exception):
+    """The write-behind queue stayed full for the whole enqueue timeout"""
+
+
+class SessionWriteBehindQueue:
+    """
+    Pending sessions live in memory (in enqueue order) and in this worker's
+    append-only JSONL log. After each successful flush the log is rewritten with
+    only the sessions still pending. All file and storage work runs on one
+    dedicated thread, so appends, flushes and compaction never interleave.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path = SESSION_QUEUE_PATH,
+        worker_id: Optional[str] = None,
+        max_pending: int = SESSION_QUEUE_MAX_PENDING,
+        batch_size: int = SESSION_FLUSH_BATCH_SIZE,
+        flush_interval_seconds: float = SESSION_FLUSH_INTERVAL_SECONDS,
+        enqueue_timeout_seconds: float = SESSION_ENQUEUE_TIMEOUT_SECONDS,
+    ):
+        self.path = pathlib.Path(path)
+        self.log_path = self.path.with_name(f"{self.path.stem}.{worker_id or os.getpid()}{self.path.suffix}")
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.enqueue_timeout_seconds = enqueue_timeout_seconds
+        self._pending: "OrderedDict[str, dict]" = OrderedDict()  # session id -> queue entry
+        # Guards _pending between the IO thread and readers on the event loop
+        self._lock = threading.Lock()
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-queue")
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Condition] = None
+        self.flushed = 0
+        self._owner = None
+        self._replay()
+
+    async def _run_io(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    # --- On-disk log ---
+
+    def _read_log(self, path: pathlib.Path) -> List[dict]:
+        """Entries of one log, skipping a torn final line from a crash mid-append (never acknowledged)"""
+        entries = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries
+
+    def _orphaned_logs(self) -> List[pathlib.Path]:
+        """Logs whose worker is gone: our own from a previous process with this id, any
+        other worker's log whose lock nobody holds, and a pre-per-worker shared log"""
+        logs = [self.log_path, self.path]
+        for log in sorted(self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}")):
+            if log == self.log_path:
+                continue
+            with open(log.with_suffix(".lock"), "a+b") as owner:
+                try:
+                    fcntl.flock(owner.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # that worker is still running
+                logs.append(log)
+        return [log for log in logs if log.exists()]
+
+    def _replay(self):
+        """Adopt sessions left in logs by workers that are no longer running"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Workers claim their log and adopt others' one at a time, so a lock file is never
+        # removed while another worker is about to take it
+        with open(self.path.with_suffix(".lock"), "a+b") as adopting:
+            fcntl.flock(adopting.fileno(), fcntl.LOCK_EX)
+            # Held for the life of this queue; tells other workers our log is in use
+            self._owner = open(self.log_path.with_suffix(".lock"), "a+b")
+            fcntl.flock(self._owner.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            orphans = self._orphaned_logs()
+            for log in orphans:
+                for entry in self._read_log(log):
+                    self._pending[entry["session"]["id"]] = entry
+            # Move everything into our log before removing the others
+            self._ack([])
+            for log in orphans:
+                if log != self.log_path:
+                    log.unlink()
+                    if log != self.path:
+                        log.with_suffix(".lock").unlink(missing_ok=True)
+        if self._pending:
+            print(f"Replaying {len(self._pending)} queued mood sessions")
+
+    def _append(self, entry: dict):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self._pending[entry["session"]["id"]] = entry
+
+    def _ack(self, session_ids: List[str]):
+        """Drop flushed sessions and compact the log down to what is still pending"""
+        with self._lock:
+            for session_id in session_ids:
+                self._pending.pop(session_id, None)
+            remaining = list(self._pending.values())
+        tmp_path = self.log_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in remaining:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.log_path)
+
+    # --- Producer side ---
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def enqueue(
+        self,
+        firebase_user_id: str,
+        track_id: str,
+        mood: str,
+        intensity: int = 50,
+        track_name: Optional[str] = None,
+        artist_name: Optional[str] = None,
+        session_type: str = "track"
+    ) -> dict:
+        """
+        Durably queue a session and return it in stored-session shape.
+        The id is the one the session will have once flushed.
+        Raises SessionQueueFullError if no room frees up within the enqueue timeout.
+        """
+        if self._space is None:
+            self._space = asyncio.Condition()
+        async with self._space:
+            try:
+                await asyncio.wait_for(
+                    self._space.wait_for(lambda: len(self._pending) < self.max_pending),
+                    timeout=self.enqueue_timeout_seconds,
+                )
+            except asyncio.TimeoutError:
+                raise SessionQueueFullError(f"{len(self._pending)} mood sessions waiting to be written")
+
+        idempotency_key = uuid.uuid4().hex
+        now = time.time()
+        entry = {
+            "firebaseUserId": firebase_user_id,
+            "session": {
+                "id": session_id_for(firebase_user_id, idempotency_key),
+                "firebaseUserId": firebase_user_id,
+                "trackId": track_id,
+                "mood": mood,
+                "intensity": intensity,
+                "sessionType": session_type,
+                "trackName": track_name,
+                "artistName": artist_name,
+                "createdAt": now,
+                "updatedAt": now,
+            },
+            "idempotencyKey": idempotency_key,
+        }
+        await self._run_io(self._append, entry)
+        if self._wakeup is not None and len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return dict(entry["session"])
+
+    def pending_sessions(self, firebase_user_id: str, mood: Optional[str] = None) -> List[dict]:
+        """A user's un-flushed sessions, newest first"""
+        with self._lock:
+            entries = list(self._pending.values())
+        sessions = [
+            dict(entry["session"]) for entry in entries
+            if entry["firebaseUserId"] == firebase_user_id and (not mood or entry["session"]["mood"] == mood)
+        ]
+        sessions.reverse()
+        return sessions
+
+    # --- Flusher ---
+
+    def _write_batch(self, entries: List[dict]) -> List[str]:
+        """Commit queued sessions to storage, one batched write per user"""
+        by_user: Dict[str, List[dict]] = {}
+        for entry in entries:
+            session = entry["session"]
+            by_user.setdefault(entry["firebaseUserId"], []).append({
+                "track_id": session["trackId"],
+                "mood": session["mood"],
+                "intensity": session["intensity"],
+                "track_name": session["trackName"],
+                "artist_name": session["artistName"],
+                "session_type": session["sessionType"],
+                "idempotency_key": entry["idempotencyKey"],
+            })
+        storage = get_storage()
+        for firebase_user_id, sessions in by_user.items():
+            storage.save_user_sessions(firebase_user_id, sessions)
+        return [entry["session"]["id"] for entry in entries]
+
+    async def flush(self) -> int:
+        """Write everything currently queued; returns how many sessions were flushed"""
+        flushed = 0
+        while self._pending:
+            with self._lock:
+                entries = list(self._pending.values())[:self.batch_size]
+            session_ids = await self._run_io(self._write_batch, entries)
+            await self._run_io(self._ack, session_ids)
+            flushed += len(session_ids)
+            self.flushed += len(session_ids)
+            if self._space is not None:
+                async with self._space:
+                    self._space.notify_all()
+        return flushed
+
+    async def _run(self):
+        backoff = self.flush_interval_seconds
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                backoff = self.flush_interval_seconds
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Sessions stay queued (on disk too) and are retried with backoff
+                backoff = min(backoff * 2, MAX_FLUSH_BACKOFF_SECONDS)
+                print(f"Error flushing queued mood sessions ({len(self._pending)} pending): {e}")
+
+    def start(self):
+        """Start the background flusher (call at application startup)"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            if self._pending:
+                self._wakeup.set()  # replayed sessions go out right away
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher after a final flush; anything unwritten stays in the log"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing queued mood sessions at shutdown, {len(self._pending)} left for replay: {e}")
+
+
+# Global instance (only used when SESSION_WRITE_BEHIND is enabled)
+session_queue = SessionWriteBehindQueue() if SESSION_WRITE_BEHIND else None
@@ -0,0 +1,718 @@
+"""
+SQLite storage backend for single-node deployments and load tests.
+Uses WAL mode so readers don't block the writer, a small pool of
+connections shared across the storage thread pool, and parameterized
+statements (sqlite3 keeps them prepared in each connection's statement cache).
+"""
+import os
+import json
+import uuid
+import time
+import queue
+import sqlite3
+import pathlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional, List, Iterator, Sequence, Tuple, Dict
+
+from .backend import (
+    StorageBackend,
+    session_id_for,
+    profile_deltas,
+    encode_session_cursor,
+    decode_session_cursor,
+    day_range,
+    day_key,
+    SECONDS_PER_DAY,
+    COLLECTION_PREVIEW_TRACKS,
+)
+
+backend_dir = pathlib.Path(__file__).parent.parent.parent
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", str(backend_dir / "data" / "app.db"))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+# How long a caller waits for a free connection / for a write lock
+SQLITE_TIMEOUT_SECONDS = float(os.getenv("SQLITE_TIMEOUT_SECONDS", "5"))
+STATEMENT_CACHE_SIZE = 256
+
+ONE_HOUR_IN_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spotify_tokens (
+    firebaseUserId TEXT PRIMARY KEY,
+    spotifyUserId TEXT,
+    accessToken TEXT,
+    refreshToken TEXT,
+    scope TEXT,
+    email TEXT,
+    expiresAt TEXT,
+    createdAt TEXT NOT NULL,
+    updatedAt TEXT NOT NULL,
+    deletedAt TEXT
+);
+
+CREATE TABLE IF NOT EXISTS user_sessions (
+    id TEXT PRIMARY KEY,
+    firebaseUserId TEXT NOT NULL,
+    trackId TEXT NOT NULL,
+    mood TEXT NOT NULL,
+    intensity INTEGER NOT NULL,
+    sessionType TEXT NOT NULL,
+    trackName TEXT,
+    artistName TEXT,
+    createdAt REAL NOT NULL,
+    updatedAt REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_profiles (
+    firebaseUserId TEXT PRIMARY KEY,
+    sessionCount INTEGER NOT NULL DEFAULT 0,
+    updatedAt REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_mood_counts (
+    firebaseUserId TEXT NOT NULL,
+    mood TEXT NOT NULL,
+    sessionCount INTEGER NOT NULL DEFAULT 0,
+    intensitySum INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (firebaseUserId, mood)
+);
+
+CREATE TABLE IF NOT EXISTS collections (
+    id TEXT PRIMARY KEY,
+    firebaseUserId TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mood TEXT,
+    color TEXT,
+    songCount INTEGER NOT NULL DEFAULT 0,
+    previewTrackIds TEXT NOT NULL DEFAULT '[]',
+    nextPosition INTEGER NOT NULL DEFAULT 0,
+    createdAt REAL NOT NULL,
+    lastUpdated REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS collection_tracks (
+    collectionId TEXT NOT NULL,
+    trackId TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    addedAt REAL NOT NULL,
+    PRIMARY KEY (collectionId, trackId)
+);
+
+-- superseded by the (..., createdAt DESC, id DESC) indexes below
+DROP INDEX IF EXISTS idx_user_sessions_user_mood_created;
+DROP INDEX IF EXISTS idx_user_sessions_user_created;
+
+-- mood-filtered history, newest first (id breaks ties for keyset paging)
+CREATE INDEX IF NOT EXISTS idx_user_sessions_user_mood_created_id
+    ON user_sessions (firebaseUserId, mood, createdAt DESC, id DESC);
+-- unfiltered history, newest first
+CREATE INDEX IF NOT EXISTS idx_user_sessions_user_created_id
+    ON user_sessions (firebaseUserId, createdAt DESC, id DESC);
+-- every user's sessions, oldest first (incremental offline jobs)
+CREATE INDEX IF NOT EXISTS idx_user_sessions_created_id
+    ON user_sessions (createdAt, id);
+-- a user's collections, most recently updated first
+CREATE INDEX IF NOT EXISTS idx_collections_user_updated
+    ON collections (firebaseUserId, lastUpdated DESC);
+-- a collection's tracks in the order added (paging and previews)
+CREATE INDEX IF NOT EXISTS idx_collection_tracks_position
+    ON collection_tracks (collectionId, position);
+"""
+
+SESSION_FIELDS = (
+    "id", "firebaseUserId", "trackId", "mood", "intensity", "sessionType",
+    "trackName", "artistName", "createdAt", "updatedAt",
+)
+SESSION_COLUMNS = ", ".join(SESSION_FIELDS)
+
+UPSERT_TOKENS_SQL = """
+INSERT INTO spotify_tokens (
+    firebaseUserId, spotifyUserId, accessToken, refreshToken, scope, email,
+    expiresAt, createdAt, updatedAt, deletedAt
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)
+ON CONFLICT (firebaseUserId) DO UPDATE SET
+    spotifyUserId = excluded.spotifyUserId,
+    accessToken = excluded.accessToken,
+    refreshToken = excluded.refreshToken,
+    scope = excluded.scope,
+    email = excluded.email,
+    expiresAt = excluded.expiresAt,
+    createdAt = excluded.createdAt,
+    updatedAt = excluded.updatedAt,
+    deletedAt = NULL
+"""
+SELECT_TOKENS_SQL = "SELECT * FROM spotify_tokens WHERE firebaseUserId = ?"
+UPDATE_ACCESS_TOKEN_SQL = """
+UPDATE spotify_tokens
+SET accessToken = ?, expiresAt = ?, updatedAt = ?, refreshToken = COALESCE(?, refreshToken)
+WHERE firebaseUserId = ?
+"""
+DELETE_TOKENS_SQL = """
+UPDATE spotify_tokens
+SET accessToken = NULL, refreshToken = NULL, deletedAt = ?
+WHERE firebaseUserId = ?
+"""
+INSERT_SESSION_SQL = f"INSERT INTO user_sessions ({SESSION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+# Idempotent variant: a retried key hits the primary key and is skipped
+INSERT_SESSION_IF_NEW_SQL = f"INSERT OR IGNORE INTO user_sessions ({SESSION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+SELECT_SESSION_SQL = "SELECT firebaseUserId, mood, intensity FROM user_sessions WHERE id = ?"
+UPSERT_PROFILE_SQL = """
+INSERT INTO user_profiles (firebaseUserId, sessionCount, updatedAt) VALUES (?, ?, ?)
+ON CONFLICT (firebaseUserId) DO UPDATE SET
+    sessionCount = sessionCount + excluded.sessionCount,
+    updatedAt = excluded.updatedAt
+"""
+UPSERT_MOOD_COUNTS_SQL = """
+INSERT INTO user_mood_counts (firebaseUserId, mood, sessionCount, intensitySum) VALUES (?, ?, ?, ?)
+ON CONFLICT (firebaseUserId, mood) DO UPDATE SET
+    sessionCount = sessionCount + excluded.sessionCount,
+    intensitySum = intensitySum + excluded.intensitySum
+"""
+SELECT_PROFILE_SQL = "SELECT sessionCount, updatedAt FROM user_profiles WHERE firebaseUserId = ?"
+LIST_USER_IDS_SQL = """
+SELECT DISTINCT firebaseUserId FROM user_sessions
+WHERE firebaseUserId > ?
+ORDER BY firebaseUserId
+LIMIT ?
+"""
+SELECT_MOOD_COUNTS_SQL = "SELECT mood, sessionCount, intensitySum FROM user_mood_counts WHERE firebaseUserId = ?"
+MOOD_SUMMARY_SQL = """
+SELECT mood, COUNT(*) AS count, SUM(intensity) AS intensitySum
+FROM user_sessions
+WHERE firebaseUserId = ? AND createdAt >= ? AND createdAt < ?
+GROUP BY mood
+"""
+DAILY_COUNTS_SQL = f"""
+SELECT CAST(createdAt / {SECONDS_PER_DAY} AS INTEGER) AS day, COUNT(*) AS count, SUM(intensity) AS intensitySum
+FROM user_sessions
+WHERE firebaseUserId = ? AND createdAt >= ? AND createdAt < ?
+GROUP BY day
+ORDER BY day
+"""
+DAILY_COUNTS_BY_MOOD_SQL = f"""
+SELECT CAST(createdAt / {SECONDS_PER_DAY} AS INTEGER) AS day, COUNT(*) AS count, SUM(intensity) AS intensitySum
+FROM user_sessions
+WHERE firebaseUserId = ? AND mood = ? AND createdAt >= ? AND createdAt < ?
+GROUP BY day
+ORDER BY day
+"""
+DELETE_SESSION_SQL = "DELETE FROM user_sessions WHERE id = ?"
+COLLECTION_COLUMNS = "id, firebaseUserId, name, mood, color, songCount, previewTrackIds, createdAt, lastUpdated"
+INSERT_COLLECTION_SQL = """
+INSERT INTO collections (id, firebaseUserId, name, mood, color, createdAt, lastUpdated)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+LIST_COLLECTIONS_SQL = f"""
+SELECT {COLLECTION_COLUMNS} FROM collections
+WHERE firebaseUserId = ?
+ORDER BY lastUpdated DESC
+"""
+SELECT_COLLECTION_SQL = f"SELECT {COLLECTION_COLUMNS} FROM collections WHERE id = ? AND firebaseUserId = ?"
+DELETE_COLLECTION_SQL = "DELETE FROM collections WHERE id = ? AND firebaseUserId = ?"
+DELETE_COLLECTION_TRACKS_SQL = "DELETE FROM collection_tracks WHERE collectionId = ?"
+# Claims a block of positions; as the first write it also takes the write lock
+RESERVE_POSITIONS_SQL = """
+UPDATE collections SET nextPosition = nextPosition + ?
+WHERE id = ? AND firebaseUserId = ?
+RETURNING nextPosition
+"""
+INSERT_COLLECTION_TRACK_SQL = """
+INSERT OR IGNORE INTO collection_tracks (collectionId, trackId, position, addedAt) VALUES (?, ?, ?, ?)
+"""
+DELETE_COLLECTION_TRACK_SQL = "DELETE FROM collection_tracks WHERE collectionId = ? AND trackId = ?"
+SELECT_PREVIEW_SQL = "SELECT trackId FROM collection_tracks WHERE collectionId = ? ORDER BY position LIMIT ?"
+UPDATE_COLLECTION_SUMMARY_SQL = f"""
+UPDATE collections SET songCount = songCount + ?, previewTrackIds = ?, lastUpdated = ?
+WHERE id = ?
+RETURNING {COLLECTION_COLUMNS}
+"""
+SELECT_COLLECTION_TRACKS_SQL = """
+SELECT trackId, position, addedAt FROM collection_tracks
+WHERE collectionId = ? AND position > ?
+ORDER BY position
+LIMIT ?
+"""
+
+
+def _select_sessions_sql(fields: Optional[Sequence[str]], mood: bool, since: bool, after_cursor: bool) -> str:
+    """
+    Session query for one combination of options. Columns come from the
+    SESSION_FIELDS whitelist and every value is a bound parameter, so the
+    handful of distinct statements all stay in the statement cache.
+    """
+    if fields:
+        wanted = set(fields) | {"id", "createdAt"}
+        columns = ", ".join(field for field in SESSION_FIELDS if field in wanted)
+    else:
+        columns = SESSION_COLUMNS
+    where = ["firebaseUserId = ?"]
+    if mood:
+        where.append("mood = ?")
+    if since:
+        where.append("createdAt >= ?")
+    if after_cursor:
+        where.append("(createdAt, id) < (?, ?)")
+    return (
+        f"SELECT {columns} FROM user_sessions WHERE {' AND '.join(where)} "
+        f"ORDER BY createdAt DESC, id DESC LIMIT ?"
+    )
+
+
+def _sessions_since_sql(fields: Optional[Sequence[str]], since: bool, after_cursor: bool) -> str:
+    """Query over every user's sessions, oldest first; see _select_sessions_sql"""
+    if fields:
+        wanted = set(fields) | {"id", "firebaseUserId", "createdAt"}
+        columns = ", ".join(field for field in SESSION_FIELDS if field in wanted)
+    else:
+        columns = SESSION_COLUMNS
+    where = []
+    if since:
+        where.append("createdAt >= ?")
+    if after_cursor:
+        where.append("(createdAt, id) > (?, ?)")
+    where_sql = f"WHERE {' AND '.join(where)} " if where else ""
+    return f"SELECT {columns} FROM user_sessions {where_sql}ORDER BY createdAt, id LIMIT ?"
+
+
+def _collection_from_row(row: sqlite3.Row) -> dict:
+    collection = dict(row)
+    collection["previewTrackIds"] = json.loads(collection["previewTrackIds"])
+    return collection
+
+
+def _expires_at(expires_in: int) -> datetime:
+    # Same cap as the Firestore backend
+    return datetime.utcnow() + timedelta(seconds=min(expires_in, ONE_HOUR_IN_SECONDS))
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+class SQLiteConnectionPool:
+    """Fixed-size pool of connections; callers block while all are checked out"""
+
+    def __init__(self, path: str, size: int = SQLITE_POOL_SIZE, timeout: float = SQLITE_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout = timeout
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        for _ in range(size):
+            conn = self._connect()
+            self._all.append(conn)
+            self._pool.put(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,  # connections move between pool threads, never shared concurrently
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL is durable across application crashes; only an OS crash can lose the last commits
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError("Timed out waiting for a SQLite connection")
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+
+
+class SQLiteStorageBackend(StorageBackend):
+    """StorageBackend on a local SQLite database file"""
+
+    def __init__(self, path: str = SQLITE_DB_PATH, pool_size: int = SQLITE_POOL_SIZE):
+        self.pool = SQLiteConnectionPool(path, size=pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def close(self):
+        self.pool.close()
+
+    # --- Spotify tokens ---
+
+    def save_spotify_tokens(
+        self,
+        firebase_user_id: str,
+        spotify_user_id: str,
+        access_token: str,
+        refresh_token: Optional[str],
+        expires_in: int,
+        scope: str,
+        email: Optional[str] = None
+    ) -> dict:
+        now = datetime.utcnow()
+        expires_at = _expires_at(expires_in)
+        with self.pool.connection() as conn, conn:
+            conn.execute(UPSERT_TOKENS_SQL, (
+                firebase_user_id, spotify_user_id, access_token, refresh_token, scope, email,
+                expires_at.isoformat(), now.isoformat(), now.isoformat(),
+            ))
+        return {
+            "firebaseUserId": firebase_user_id,
+            "spotifyUserId": spotify_user_id,
+            "accessToken": access_token,
+            "refreshToken": refresh_token,
+            "scope": scope,
+            "email": email,
+            "expiresAt": expires_at,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+
+    def get_spotify_tokens(self, firebase_user_id: str) -> Optional[dict]:
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_TOKENS_SQL, (firebase_user_id,)).fetchone()
+        if row is None:
+            return None
+
+        token_data = dict(row)
+        for key in ("expiresAt", "createdAt", "updatedAt", "deletedAt"):
+            token_data[key] = _parse_datetime(token_data[key])
+        if token_data["deletedAt"] is None:
+            del token_data["deletedAt"]
+        return token_data
+
+    def update_spotify_access_token(
+        self,
+        firebase_user_id: str,
+        access_token: str,
+        expires_in: int,
+        refresh_token: Optional[str] = None
+    ):
+        with self.pool.connection() as conn, conn:
+            cursor = conn.execute(UPDATE_ACCESS_TOKEN_SQL, (
+                access_token, _expires_at(expires_in).isoformat(), datetime.utcnow().isoformat(),
+                refresh_token or None, firebase_user_id,
+            ))
+        if cursor.rowcount == 0:
+            raise LookupError(f"No Spotify tokens stored for user {firebase_user_id}")
+
+    def delete_spotify_tokens(self, firebase_user_id: str):
+        with self.pool.connection() as conn, conn:
+            conn.execute(DELETE_TOKENS_SQL, (datetime.utcnow().isoformat(), firebase_user_id))
+
+    # --- User mood sessions ---
+
+    def save_user_session(
+        self,
+        firebase_user_id: str,
+        track_id: str,
+        mood: str,
+        intensity: int = 50,
+        track_name: Optional[str] = None,
+        artist_name: Optional[str] = None,
+        session_type: str = "track"
+    ) -> dict:
+        session_data = self._session_row(firebase_user_id, {
+            "track_id": track_id,
+            "mood": mood,
+            "intensity": intensity,
+            "track_name": track_name,
+            "artist_name": artist_name,
+            "session_type": session_type,
+        }, time.time())
+        with self.pool.connection() as conn, conn:
+            conn.execute(INSERT_SESSION_SQL, tuple(session_data.values()))
+            self._apply_profile_deltas(conn, firebase_user_id, [session_data])
+        return session_data
+
+    def save_user_sessions(self, firebase_user_id: str, sessions: List[dict]) -> List[dict]:
+        now = time.time()
+        results = []
+        written = []
+        # One transaction: every new session plus the profile counters, or nothing
+        with self.pool.connection() as conn, conn:
+            for session in sessions:
+                session_data = self._session_row(firebase_user_id, session, now)
+                cursor = conn.execute(INSERT_SESSION_IF_NEW_SQL, tuple(session_data.values()))
+                created = cursor.rowcount > 0
+                if created:
+                    written.append(session_data)
+                results.append({"id": session_data["id"], "created": created})
+            self._apply_profile_deltas(conn, firebase_user_id, written)
+        return results
+
+    def _session_row(self, firebase_user_id: str, session: dict, now: float) -> dict:
+        key = session.get("idempotency_key")
+        return {
+            "id": session_id_for(firebase_user_id, key) if key else uuid.uuid4().hex,
+            "firebaseUserId": firebase_user_id,
+            "trackId": session["track_id"],
+            "mood": session["mood"],
+            "intensity": session.get("intensity", 50),
+            "sessionType": session.get("session_type", "track"),
+            "trackName": session.get("track_name"),
+            "artistName": session.get("artist_name"),
+            "createdAt": now,
+            "updatedAt": now,
+        }
+
+    def _apply_profile_deltas(self, conn: sqlite3.Connection, firebase_user_id: str, sessions: List[dict], sign: int = 1):
+        """Increment (sign=-1: decrement) profile counters inside the caller's transaction"""
+        if not sessions:
+            return
+        count, mood_counts, intensity_sums = profile_deltas(sessions)
+        conn.execute(UPSERT_PROFILE_SQL, (firebase_user_id, sign * count, time.time()))
+        conn.executemany(UPSERT_MOOD_COUNTS_SQL, [
+            (firebase_user_id, mood, sign * n, sign * intensity_sums[mood])
+            for mood, n in mood_counts.items()
+        ])
+
+    def get_user_profile(self, firebase_user_id: str) -> Optional[dict]:
+        with self.pool.connection() as conn:
+            profile = conn.execute(SELECT_PROFILE_SQL, (firebase_user_id,)).fetchone()
+            mood_rows = conn.execute(SELECT_MOOD_COUNTS_SQL, (firebase_user_id,)).fetchall()
+        if profile is None:
+            return None
+        return {
+            "firebaseUserId": firebase_user_id,
+            "sessionCount": profile["sessionCount"],
+            "moodCounts": {row["mood"]: row["sessionCount"] for row in mood_rows},
+            "intensitySums": {row["mood"]: row["intensitySum"] for row in mood_rows},
+            "updatedAt": profile["updatedAt"],
+        }
+
+    def list_user_ids(self, after: Optional[str] = None, limit: int = 1000) -> List[str]:
+        with self.pool.connection() as conn:
+            rows = conn.execute(LIST_USER_IDS_SQL, (after or "", limit)).fetchall()
+        return [row["firebaseUserId"] for row in rows]
+
+    def get_user_sessions(
+        self,
+        firebase_user_id: str,
+        mood: Optional[str] = None,
+        limit: Optional[int] = None,
+        fields: Optional[Sequence[str]] = None,
+        since: Optional[float] = None
+    ) -> List[dict]:
+        # LIMIT -1 means no limit in SQLite
+        return self._select_sessions(firebase_user_id, mood, limit or -1, None, fields, since)
+
+    def get_user_sessions_page(
+        self,
+        firebase_user_id: str,
+        mood: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None,
+        since: Optional[float] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        after = decode_session_cursor(cursor) if cursor else None
+        # One extra row tells us whether there is a next page
+        sessions = self._select_sessions(firebase_user_id, mood, limit + 1, after, fields, since)
+        if len(sessions) <= limit:
+            return sessions, None
+        sessions = sessions[:limit]
+        last = sessions[-1]
+        return sessions, encode_session_cursor(last["createdAt"], last["id"])
+
+    def get_sessions_created_since(
+        self,
+        since: Optional[float] = None,
+        limit: int = 1000,
+        cursor: Optional[str] = None,
+        fields: Optional[Sequence[str]] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        after = decode_session_cursor(cursor) if cursor else None
+        params = []
+        if since:
+            params.append(since)
+        if after is not None:
+            params.extend(after)
+        params.append(limit + 1)
+        with self.pool.connection() as conn:
+            rows = conn.execute(_sessions_since_sql(fields, bool(since), after is not None), params).fetchall()
+        sessions = [dict(row) for row in rows]
+        if len(sessions) <= limit:
+            return sessions, None
+        sessions = sessions[:limit]
+        last = sessions[-1]
+        return sessions, encode_session_cursor(last["createdAt"], last["id"])
+
+    def _select_sessions(
+        self,
+        firebase_user_id: str,
+        mood: Optional[str],
+        limit: int,
+        after: Optional[Tuple[float, str]],
+        fields: Optional[Sequence[str]],
+        since: Optional[float]
+    ) -> List[dict]:
+        sql = _select_sessions_sql(fields, bool(mood), bool(since), after is not None)
+        params = [firebase_user_id]
+        if mood:
+            params.append(mood)
+        if since:
+            params.append(since)
+        if after is not None:
+            created_at, session_id = after
+            params.extend([created_at, session_id])
+        params.append(limit)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    # --- Aggregates ---
+
+    def get_mood_summary(
+        self,
+        firebase_user_id: str,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> Dict[str, dict]:
+        bounds = (since if since is not None else float("-inf"), until if until is not None else float("inf"))
+        with self.pool.connection() as conn:
+            rows = conn.execute(MOOD_SUMMARY_SQL, (firebase_user_id, *bounds)).fetchall()
+        return {row["mood"]: {"count": row["count"], "intensitySum": row["intensitySum"]} for row in rows}
+
+    def get_daily_session_counts(
+        self,
+        firebase_user_id: str,
+        since: float,
+        until: Optional[float] = None,
+        mood: Optional[str] = None
+    ) -> List[dict]:
+        ranges = day_range(since, until)  # validates the range length
+        if not ranges:
+            return []
+        bounds = (ranges[0][0], ranges[-1][1])
+        with self.pool.connection() as conn:
+            if mood:
+                rows = conn.execute(DAILY_COUNTS_BY_MOOD_SQL, (firebase_user_id, mood, *bounds)).fetchall()
+            else:
+                rows = conn.execute(DAILY_COUNTS_SQL, (firebase_user_id, *bounds)).fetchall()
+        return [
+            {"date": day_key(row["day"] * SECONDS_PER_DAY), "count": row["count"], "intensitySum": row["intensitySum"]}
+            for row in rows
+        ]
+
+    def delete_user_session(self, session_id: str) -> bool:
+        with self.pool.connection() as conn, conn:
+            row = conn.execute(SELECT_SESSION_SQL, (session_id,)).fetchone()
+            if row is None:
+                return False
+            if conn.execute(DELETE_SESSION_SQL, (session_id,)).rowcount == 0:
+                return False  # deleted concurrently
+            self._apply_profile_deltas(conn, row["firebaseUserId"], [dict(row)], sign=-1)
+        return True
+
+    # --- Collections ---
+
+    def create_collection(
+        self,
+        firebase_user_id: str,
+        name: str,
+        mood: Optional[str] = None,
+        color: Optional[str] = None
+    ) -> dict:
+        now = time.time()
+        collection_id = uuid.uuid4().hex
+        with self.pool.connection() as conn, conn:
+            conn.execute(INSERT_COLLECTION_SQL, (collection_id, firebase_user_id, name, mood, color, now, now))
+        return {
+            "id": collection_id,
+            "firebaseUserId": firebase_user_id,
+            "name": name,
+            "mood": mood,
+            "color": color,
+            "songCount": 0,
+            "previewTrackIds": [],
+            "createdAt": now,
+            "lastUpdated": now,
+        }
+
+    def list_collections(self, firebase_user_id: str) -> List[dict]:
+        with self.pool.connection() as conn:
+            rows = conn.execute(LIST_COLLECTIONS_SQL, (firebase_user_id,)).fetchall()
+        return [_collection_from_row(row) for row in rows]
+
+    def delete_collection(self, firebase_user_id: str, collection_id: str) -> bool:
+        with self.pool.connection() as conn, conn:
+            if conn.execute(DELETE_COLLECTION_SQL, (collection_id, firebase_user_id)).rowcount == 0:
+                return False
+            conn.execute(DELETE_COLLECTION_TRACKS_SQL, (collection_id,))
+        return True
+
+    def add_collection_tracks(self, firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+        track_ids = list(dict.fromkeys(track_ids))
+        now = time.time()
+        # One transaction: the new tracks plus the collection's counters and preview
+        with self.pool.connection() as conn, conn:
+            reserved = conn.execute(
+                RESERVE_POSITIONS_SQL, (len(track_ids), collection_id, firebase_user_id)
+            ).fetchall()
+            if not reserved:
+                return None
+            first = reserved[0]["nextPosition"] - len(track_ids)
+            added = conn.executemany(INSERT_COLLECTION_TRACK_SQL, [
+                (collection_id, track_id, first + i, now) for i, track_id in enumerate(track_ids)
+            ]).rowcount if track_ids else 0
+            return self._update_collection_summary(conn, firebase_user_id, collection_id, added, now)
+
+    def remove_collection_tracks(self, firebase_user_id: str, collection_id: str, track_ids: Sequence[str]) -> Optional[dict]:
+        now = time.time()
+        with self.pool.connection() as conn, conn:
+            # Take the write lock before checking ownership, like add_collection_tracks
+            if not conn.execute(RESERVE_POSITIONS_SQL, (0, collection_id, firebase_user_id)).fetchall():
+                return None
+            removed = conn.executemany(DELETE_COLLECTION_TRACK_SQL, [
+                (collection_id, track_id) for track_id in dict.fromkeys(track_ids)
+            ]).rowcount if track_ids else 0
+            return self._update_collection_summary(conn, firebase_user_id, collection_id, -removed, now)
+
+    def _update_collection_summary(
+        self,
+        conn: sqlite3.Connection,
+        firebase_user_id: str,
+        collection_id: str,
+        delta: int,
+        now: float
+    ) -> dict:
+        """Apply a songCount change and refresh the preview inside the caller's transaction"""
+        if delta == 0:
+            # Nothing changed, so lastUpdated stays as it was
+            return _collection_from_row(conn.execute(SELECT_COLLECTION_SQL, (collection_id, firebase_user_id)).fetchone())
+        preview = [row["trackId"] for row in conn.execute(SELECT_PREVIEW_SQL, (collection_id, COLLECTION_PREVIEW_TRACKS))]
+        rows = conn.execute(UPDATE_COLLECTION_SUMMARY_SQL, (delta, json.dumps(preview), now, collection_id)).fetchall()
+        return _collection_from_row(rows[0])
+
+    def get_collection_tracks_page(
+        self,
+        firebase_user_id: str,
+        collection_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Optional[Tuple[List[dict], Optional[str]]]:
+        after = decode_session_cursor(cursor)[0] if cursor else -1
+        with self.pool.connection() as conn:
+            if conn.execute(SELECT_COLLECTION_SQL, (collection_id, firebase_user_id)).fetchone() is None:
+                return None
+            # One extra row tells us whether there is a next page
+            rows = conn.execute(SELECT_COLLECTION_TRACKS_SQL, (collection_id, after, limit + 1)).fetchall()
+        tracks = [{"trackId": row["trackId"], "addedAt": row["addedAt"]} for row in rows[:limit]]
+        if len(rows) <= limit:
+            return tracks, None
+        last = rows[limit - 1]
+        return tracks, encode_session_cursor(last["position"], last["trackId"])
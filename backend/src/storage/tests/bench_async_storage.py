@@ -0,0 +1,75 @@
+"""
+Benchmark for storage access from async handlers.
+Simulates concurrent requests that each read a user's sessions from a SQLite
+backend with added round-trip latency, comparing a blocking call made directly
+in the handler (serializes the event loop) against async_storage (thread pool).
+
+Run: python3 src/storage/tests/bench_async_storage.py [--requests 200] [--latency-ms 20]
+"""
+import sys
+import time
+import asyncio
+import pathlib
+import argparse
+import tempfile
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage import async_storage
+from src.storage.backend import init_storage, get_storage
+from src.storage.sqlite_storage import SQLiteStorageBackend
+
+
+class SlowStorage(SQLiteStorageBackend):
+    """Local backend with an added round-trip latency, standing in for Firestore"""
+
+    def __init__(self, path, latency_seconds):
+        super().__init__(path)
+        self.latency_seconds = latency_seconds
+
+    def get_user_sessions(self, *args, **kwargs):
+        time.sleep(self.latency_seconds)
+        return super().get_user_sessions(*args, **kwargs)
+
+
+async def blocking_handler(user_id):
+    """Previous approach: sync storage call inside an async route"""
+    return get_storage().get_user_sessions(firebase_user_id=user_id)
+
+
+async def async_handler(user_id):
+    return await async_storage.get_user_sessions(firebase_user_id=user_id)
+
+
+async def run(handler, n_requests):
+    start = time.perf_counter()
+    await asyncio.gather(*[handler(f"user-{i}") for i in range(n_requests)])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    storage = init_storage(SlowStorage(str(pathlib.Path(tmp_dir.name) / "bench.db"), args.latency_ms / 1000))
+    for i in range(args.requests):
+        for j in range(10):
+            storage.save_user_session(f"user-{i}", f"t{j}", "Happy")
+
+    print(f"{args.requests} concurrent requests, {args.latency_ms:.0f} ms storage latency, "
+          f"{async_storage.STORAGE_EXECUTOR_WORKERS} storage workers")
+    for name, handler in [("blocking", blocking_handler), ("async_storage", async_handler)]:
+        elapsed = asyncio.run(run(handler, args.requests))
+        print(f" {name:14s} {elapsed:7.3f} s  {args.requests / elapsed:8.1f} req/s")
+    async_storage.shutdown_executor()
+    storage.close()
+    tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
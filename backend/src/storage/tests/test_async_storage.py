@@ -0,0 +1,20 @@
+"""
+Tests for the async storage wrappers
+"""
+import sys
+import asyncio
+import pathlib
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage import async_storage
+
+
+def test_executor_restarts_after_shutdown():
+    # two application lifespans in one process, e.g. successive TestClient contexts
+    for _ in range(2):
+        assert asyncio.run(async_storage.run_sync(sum, [1, 2, 3])) == 6
+        async_storage.shutdown_executor()
+    async_storage.shutdown_executor()  # nothing running: a no-op
@@ -0,0 +1,97 @@
+"""
+Tests for MemoryStorage indexes and OAuth state expiry
+"""
+import sys
+import pathlib
+import threading
+import tracemalloc
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.memory_storage import MemoryStorage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_indexed_lookups():
+    storage = MemoryStorage()
+    users = [storage.get_or_create_user(f"u{i}@example.com", f"spotify-{i}") for i in range(1000)]
+    assert storage.get_or_create_user(None, "spotify-500") is users[500]
+    assert len(storage.users) == 1000
+
+    storage.save_spotify_tokens("spotify-7", "access", "refresh", "scope", 3600, user_id=users[7].id)
+    assert storage.get_spotify_account_by_user_id(users[7].id).spotify_user_id == "spotify-7"
+
+    # relinking an account moves it in the index
+    storage.save_spotify_tokens("spotify-7", "access-2", None, "scope", 3600, user_id=users[8].id)
+    assert storage.get_spotify_account_by_user_id(users[7].id) is None
+    account = storage.get_spotify_account_by_user_id(users[8].id)
+    assert account.access_token == "access-2" and account.refresh_token == "refresh"
+    assert not hasattr(account, "__dict__")  # slots
+
+
+def test_states_are_consumed_once_and_expire():
+    clock = FakeClock()
+    storage = MemoryStorage(state_ttl_seconds=60, clock=clock)
+
+    storage.store_state("a")
+    assert storage.validate_state("a")
+    assert not storage.validate_state("a")
+
+    storage.store_state("b")
+    clock.now = 61
+    assert not storage.validate_state("b")
+    assert storage.state_store == {}
+
+
+def test_memory_stays_flat_under_abandoned_logins():
+    clock = FakeClock()
+    storage = MemoryStorage(state_ttl_seconds=60, clock=clock)
+    per_second = 50  # logins started per simulated second, none completed
+
+    def run(seconds, start):
+        for second in range(start, start + seconds):
+            clock.now = second
+            for i in range(per_second):
+                storage.store_state(f"state-{second}-{i}")
+
+    run(120, 0)  # warm up past one TTL
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    run(600, 120)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # only states from the last TTL window are retained
+    assert len(storage.state_store) <= per_second * 61
+    assert len(storage._state_expiry) <= per_second * 61
+    # 30k abandoned states later, memory is where it was after the first TTL
+    assert current - baseline < 512 * 1024
+
+
+def test_concurrent_state_round_trips():
+    storage = MemoryStorage()
+    failures = []
+
+    def worker(n):
+        for i in range(500):
+            state = f"{n}-{i}"
+            storage.store_state(state)
+            if not storage.validate_state(state):
+                failures.append(state)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert failures == []
+    assert storage.state_store == {}
@@ -0,0 +1,62 @@
+"""
+Tests for the shared OAuth state stores
+"""
+import sys
+import time
+import pathlib
+import threading
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.memory_storage import MemoryStorage
+from src.storage.oauth_state import MemoryOAuthStateStore, SQLiteOAuthStateStore
+
+
+def test_state_issued_by_one_worker_is_consumed_by_another(tmp_path):
+    # two stores on the same file stand in for two uvicorn workers
+    login_worker = SQLiteOAuthStateStore(str(tmp_path / "state.db"))
+    callback_worker = SQLiteOAuthStateStore(str(tmp_path / "state.db"))
+
+    login_worker.store("abc")
+    assert callback_worker.consume("abc")
+    assert not login_worker.consume("abc")
+    assert not callback_worker.consume("never-issued")
+
+    login_worker.close()
+    callback_worker.close()
+
+
+def test_sqlite_state_expires(tmp_path):
+    store = SQLiteOAuthStateStore(str(tmp_path / "state.db"), ttl_seconds=0.05)
+    store.store("abc")
+    time.sleep(0.1)
+    assert not store.consume("abc")
+    store.close()
+
+
+def test_concurrent_callbacks_consume_once(tmp_path):
+    path = str(tmp_path / "state.db")
+    SQLiteOAuthStateStore(path).store("abc")
+    stores = [SQLiteOAuthStateStore(path) for _ in range(8)]
+    results = []
+    barrier = threading.Barrier(len(stores))
+
+    def callback(store):
+        barrier.wait()
+        results.append(store.consume("abc"))
+
+    threads = [threading.Thread(target=callback, args=(store,)) for store in stores]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == [False] * 7 + [True]
+
+
+def test_memory_store_consumes_once():
+    store = MemoryOAuthStateStore(MemoryStorage())
+    store.store("abc")
+    assert store.consume("abc")
+    assert not store.consume("abc")
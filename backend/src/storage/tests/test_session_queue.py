@@ -0,0 +1,124 @@
+"""
+Tests for the write-behind mood session queue
+"""
+import sys
+import asyncio
+import pathlib
+
+import pytest
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.backend import init_storage, close_storage
+from src.storage.sqlite_storage import SQLiteStorageBackend
+from src.storage.session_queue import SessionWriteBehindQueue, SessionQueueFullError
+from src.storage.async_storage import merge_pending_sessions
+
+
+@pytest.fixture
+def storage(tmp_path):
+    backend = init_storage(SQLiteStorageBackend(str(tmp_path / "test.db")))
+    yield backend
+    close_storage()
+
+
+def test_sessions_are_visible_before_and_after_flush(tmp_path, storage):
+    queue = SessionWriteBehindQueue(tmp_path / "queue.jsonl")
+
+    async def run():
+        saved = [await queue.enqueue("u1", f"t{i}", "Happy", intensity=i) for i in range(5)]
+        await queue.enqueue("u2", "other", "Sad")
+
+        # acknowledged but not yet written
+        assert storage.get_user_sessions("u1") == []
+        pending = queue.pending_sessions("u1")
+        assert [s["trackId"] for s in pending] == ["t4", "t3", "t2", "t1", "t0"]
+
+        assert await queue.flush() == 6
+        return saved
+
+    saved = asyncio.run(run())
+    stored = storage.get_user_sessions("u1")
+    # the id handed back at enqueue time is the stored id
+    assert {s["id"] for s in stored} == {s["id"] for s in saved}
+    assert queue.pending_sessions("u1") == []
+    assert storage.get_user_profile("u1")["sessionCount"] == 5
+    assert queue.log_path.read_text() == ""
+
+
+def test_replay_after_restart_writes_each_session_once(tmp_path, storage):
+    path = tmp_path / "queue.jsonl"
+    first = SessionWriteBehindQueue(path, worker_id="w1")
+
+    async def enqueue():
+        for i in range(3):
+            await first.enqueue("u1", f"t{i}", "Calm")
+
+    asyncio.run(enqueue())
+    # simulate a crash after the batch was written but before the log was compacted
+    first._write_batch(list(first._pending.values()))
+    with open(first.log_path, "a", encoding="utf-8") as f:
+        f.write('{"firebaseUserId": "u1", "sess')  # torn final line
+    first._owner.close()  # the worker process exits
+
+    restarted = SessionWriteBehindQueue(path, worker_id="w1")
+    assert len(restarted) == 3
+    assert restarted.log_path.read_text().endswith("\n")
+    assert asyncio.run(restarted.flush()) == 3
+    assert len(storage.get_user_sessions("u1")) == 3
+    assert storage.get_user_profile("u1")["sessionCount"] == 3
+
+
+def test_workers_keep_separate_logs_and_adopt_dead_ones(tmp_path, storage):
+    path = tmp_path / "queue.jsonl"
+    a = SessionWriteBehindQueue(path, worker_id="a")
+    b = SessionWriteBehindQueue(path, worker_id="b")
+
+    async def run():
+        for i in range(3):
+            await a.enqueue("ua", f"a{i}", "Happy")
+            await b.enqueue("ub", f"b{i}", "Sad")
+        # a's compaction leaves b's acknowledged sessions on disk
+        assert await a.flush() == 3
+        await a.enqueue("ua", "a3", "Happy")
+
+    asyncio.run(run())
+    assert len(b._read_log(b.log_path)) == 3
+    b._owner.close()  # b crashes before flushing
+
+    # a new worker takes over b's log but leaves the running worker's alone
+    c = SessionWriteBehindQueue(path, worker_id="c")
+    assert sorted(s["trackId"] for s in c.pending_sessions("ub")) == ["b0", "b1", "b2"]
+    assert c.pending_sessions("ua") == []
+    assert not b.log_path.exists() and len(a) == 1
+    assert asyncio.run(c.flush()) == 3
+    assert len(storage.get_user_sessions("ub")) == 3
+
+
+def test_full_queue_applies_backpressure(tmp_path, storage):
+    queue = SessionWriteBehindQueue(tmp_path / "queue.jsonl", max_pending=2, enqueue_timeout_seconds=0.1)
+
+    async def run():
+        await queue.enqueue("u1", "t0", "Sad")
+        await queue.enqueue("u1", "t1", "Sad")
+        with pytest.raises(SessionQueueFullError):
+            await queue.enqueue("u1", "t2", "Sad")
+
+        # a waiting producer gets in once the flusher makes room
+        waiter = asyncio.ensure_future(queue.enqueue("u1", "t3", "Sad"))
+        await asyncio.sleep(0.02)
+        assert not waiter.done()
+        await queue.flush()
+        await waiter
+
+    asyncio.run(run())
+    assert [s["trackId"] for s in queue.pending_sessions("u1")] == ["t3"]
+
+
+def test_merge_prefers_queued_copy_and_respects_limit():
+    stored = [{"id": "b", "createdAt": 2.0}, {"id": "a", "createdAt": 1.0}]
+    pending = [{"id": "c", "createdAt": 3.0}, {"id": "b", "createdAt": 2.0}]
+    merged = merge_pending_sessions(pending, stored, limit=2)
+    assert [s["id"] for s in merged] == ["c", "b"]
@@ -0,0 +1,268 @@
+"""
+Tests for the SQLite storage backend
+"""
+import sys
+import time
+import pathlib
+import threading
+from datetime import datetime
+
+import pytest
+
+# path
+backend_dir = pathlib.Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from src.storage.sqlite_storage import SQLiteStorageBackend, _select_sessions_sql, _sessions_since_sql
+
+
+def _backend(tmp_path, **kwargs):
+    return SQLiteStorageBackend(str(tmp_path / "test.db"), **kwargs)
+
+
+def test_token_round_trip(tmp_path):
+    storage = _backend(tmp_path)
+    assert storage.get_spotify_tokens("u1") is None
+
+    storage.save_spotify_tokens("u1", "spotify-1", "access-1", "refresh-1", 3600, "user-read-email")
+    tokens = storage.get_spotify_tokens("u1")
+    assert tokens["accessToken"] == "access-1"
+    assert tokens["refreshToken"] == "refresh-1"
+    assert isinstance(tokens["expiresAt"], datetime)
+    assert tokens["expiresAt"] > datetime.utcnow()
+
+    # refresh without rotation keeps the old refresh token
+    storage.update_spotify_access_token("u1", "access-2", 3600)
+    assert storage.get_spotify_tokens("u1")["refreshToken"] == "refresh-1"
+    storage.update_spotify_access_token("u1", "access-3", 3600, refresh_token="refresh-2")
+    tokens = storage.get_spotify_tokens("u1")
+    assert (tokens["accessToken"], tokens["refreshToken"]) == ("access-3", "refresh-2")
+
+    storage.delete_spotify_tokens("u1")
+    tokens = storage.get_spotify_tokens("u1")
+    assert tokens["accessToken"] is None and tokens["refreshToken"] is None
+    storage.close()
+
+
+def test_sessions_newest_first_with_filters(tmp_path):
+    storage = _backend(tmp_path)
+    moods = ["Happy", "Sad", "Happy", "Calm", "Happy"]
+    for i, mood in enumerate(moods):
+        storage.save_user_session("u1", f"t{i}", mood, intensity=10 * i)
+        time.sleep(0.002)
+    storage.save_user_session("u2", "other", "Happy")
+
+    sessions = storage.get_user_sessions("u1")
+    assert [s["trackId"] for s in sessions] == ["t4", "t3", "t2", "t1", "t0"]
+    assert isinstance(sessions[0]["createdAt"], float)
+
+    happy = storage.get_user_sessions("u1", mood="Happy", limit=2)
+    assert [s["trackId"] for s in happy] == ["t4", "t2"]
+
+    assert storage.delete_user_session(happy[0]["id"])
+    assert not storage.delete_user_session(happy[0]["id"])
+    assert len(storage.get_user_sessions("u1")) == 4
+    storage.close()
+
+
+def test_session_queries_use_indexes(tmp_path):
+    storage = _backend(tmp_path)
+    with storage.pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        def plan(sql, params):
+            return " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+        by_mood = plan(_select_sessions_sql(None, mood=True, since=False, after_cursor=False), ("u1", "Happy", 10))
+        unfiltered = plan(_select_sessions_sql(None, mood=False, since=False, after_cursor=False), ("u1", 10))
+        next_page = plan(
+            _select_sessions_sql(["trackId"], mood=True, since=True, after_cursor=True),
+            ("u1", "Happy", 0.0, 5.0, "x", 10),
+        )
+    assert "idx_user_sessions_user_mood_created_id" in by_mood
+    assert "idx_user_sessions_user_created_id" in unfiltered
+    assert "idx_user_sessions_user_mood_created_id" in next_page
+    # the index order serves ORDER BY, no sort step
+    assert "TEMP B-TREE" not in by_mood + unfiltered + next_page
+    storage.close()
+
+
+def test_paging_projection_and_window(tmp_path):
+    storage = _backend(tmp_path)
+    # one batch: every session shares a createdAt, so paging must break ties by id
+    storage.save_user_sessions("u1", [{"track_id": f"t{i}", "mood": "Happy", "intensity": i} for i in range(7)])
+    expected = [s["id"] for s in storage.get_user_sessions("u1")]
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = storage.get_user_sessions_page("u1", limit=3, cursor=cursor, fields=["trackId"])
+        assert all(set(s) == {"id", "createdAt", "trackId"} for s in page)
+        seen.extend(s["id"] for s in page)
+        if cursor is None:
+            break
+    assert seen == expected
+
+    cutoff = time.time()
+    time.sleep(0.01)
+    storage.save_user_session("u1", "recent", "Sad")
+    assert [s["trackId"] for s in storage.get_user_sessions("u1", since=cutoff)] == ["recent"]
+    assert len(storage.get_user_sessions("u1", limit=4)) == 4
+    storage.close()
+
+
+def test_concurrent_writers_share_the_pool(tmp_path):
+    storage = _backend(tmp_path, pool_size=4)
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(50):
+                storage.save_user_session(f"user-{n}", f"t{i}", "Calm")
+                storage.get_user_sessions(f"user-{n}", limit=5)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert all(len(storage.get_user_sessions(f"user-{n}")) == 50 for n in range(8))
+    storage.close()
+
+
+def test_batch_save_is_idempotent_and_updates_profile(tmp_path):
+    storage = _backend(tmp_path)
+    batch = [
+        {"track_id": f"t{i}", "mood": "Happy" if i % 2 else "Sad", "intensity": 10 * i, "idempotency_key": f"k{i}"}
+        for i in range(6)
+    ]
+    results = storage.save_user_sessions("u1", batch)
+    assert [r["created"] for r in results] == [True] * 6
+
+    # a retry of the same request (plus one new and one unkeyed item) only writes the new ones
+    retry = batch + [{"track_id": "t6", "mood": "Calm", "intensity": 50, "idempotency_key": "k6"},
+                     {"track_id": "t7", "mood": "Calm", "intensity": 30}]
+    results = storage.save_user_sessions("u1", retry)
+    assert [r["created"] for r in results] == [False] * 6 + [True, True]
+    assert results[0]["id"] == storage.save_user_sessions("u1", batch[:1])[0]["id"]
+    assert len(storage.get_user_sessions("u1")) == 8
+
+    profile = storage.get_user_profile("u1")
+    assert profile["sessionCount"] == 8
+    assert profile["moodCounts"] == {"Happy": 3, "Sad": 3, "Calm": 2}
+    assert profile["intensitySums"]["Happy"] == 10 + 30 + 50
+
+    # single saves and deletes keep the counters in step
+    storage.save_user_session("u1", "t8", "Sad", intensity=5)
+    assert storage.delete_user_session(results[0]["id"])
+    profile = storage.get_user_profile("u1")
+    assert profile["sessionCount"] == 8
+    assert profile["moodCounts"]["Sad"] == 3
+    assert storage.get_user_profile("u2") is None
+    storage.close()
+
+
+def test_mood_and_daily_aggregates(tmp_path):
+    storage = _backend(tmp_path)
+    day = 86400
+    start = 1_700_006_400  # a UTC midnight
+    rows = [(start + 100, "Happy", 10), (start + 200, "Happy", 30), (start + day + 5, "Sad", 70),
+            (start + 3 * day, "Happy", 50), (start - 10, "Calm", 90)]
+    with storage.pool.connection() as conn, conn:
+        for i, (created_at, mood, intensity) in enumerate(rows):
+            conn.execute(
+                "INSERT INTO user_sessions (id, firebaseUserId, trackId, mood, intensity, sessionType, createdAt, updatedAt) "
+                "VALUES (?, 'u1', 't', ?, ?, 'track', ?, ?)",
+                (f"s{i}", mood, intensity, created_at, created_at),
+            )
+
+    assert storage.get_mood_summary("u1", since=start) == {
+        "Happy": {"count": 3, "intensitySum": 90},
+        "Sad": {"count": 1, "intensitySum": 70},
+    }
+    assert storage.get_mood_summary("u1")["Calm"]["count"] == 1
+
+    daily = storage.get_daily_session_counts("u1", since=start, until=start + 4 * day)
+    assert daily == [
+        {"date": "2023-11-15", "count": 2, "intensitySum": 40},
+        {"date": "2023-11-16", "count": 1, "intensitySum": 70},
+        {"date": "2023-11-18", "count": 1, "intensitySum": 50},
+    ]
+    assert len(storage.get_daily_session_counts("u1", since=start, until=start + 4 * day, mood="Sad")) == 1
+    with pytest.raises(ValueError):
+        storage.get_daily_session_counts("u1", since=start - 400 * day, until=start)
+    storage.close()
+
+
+def test_list_user_ids_pages_in_id_order(tmp_path):
+    storage = _backend(tmp_path)
+    for user in ["u3", "u1", "u2", "u1", "u5"]:
+        storage.save_user_session(user, "t1", "Happy")
+    assert storage.list_user_ids(limit=2) == ["u1", "u2"]
+    assert storage.list_user_ids(after="u2", limit=2) == ["u3", "u5"]
+    assert storage.list_user_ids(after="u5") == []
+    storage.close()
+
+
+def test_collections_keep_counts_and_previews_on_write(tmp_path):
+    storage = _backend(tmp_path)
+    first = storage.create_collection("u1", "Morning", mood="Happy")
+    second = storage.create_collection("u1", "Night", mood="Calm")
+
+    updated = storage.add_collection_tracks("u1", first["id"], ["t1", "t2", "t1", "t3", "t4"])
+    assert updated["songCount"] == 4 and updated["previewTrackIds"] == ["t1", "t2", "t3"]
+    assert storage.add_collection_tracks("u1", first["id"], ["t2"])["songCount"] == 4
+    assert storage.add_collection_tracks("u2", first["id"], ["t5"]) is None
+
+    updated = storage.remove_collection_tracks("u1", first["id"], ["t1", "missing"])
+    assert updated["songCount"] == 3 and updated["previewTrackIds"] == ["t2", "t3", "t4"]
+
+    # most recently updated first, counters read straight off the collection rows
+    listed = storage.list_collections("u1")
+    assert [c["id"] for c in listed] == [first["id"], second["id"]]
+    assert listed[0]["songCount"] == 3 and listed[1]["songCount"] == 0
+
+    storage.add_collection_tracks("u1", first["id"], ["t5"])
+    tracks, cursor = storage.get_collection_tracks_page("u1", first["id"], limit=3)
+    assert [t["trackId"] for t in tracks] == ["t2", "t3", "t4"]
+    tracks, cursor = storage.get_collection_tracks_page("u1", first["id"], limit=3, cursor=cursor)
+    assert [t["trackId"] for t in tracks] == ["t5"] and cursor is None
+    assert storage.get_collection_tracks_page("u2", first["id"]) is None
+
+    assert not storage.delete_collection("u2", first["id"])
+    assert storage.delete_collection("u1", first["id"])
+    assert [c["id"] for c in storage.list_collections("u1")] == [second["id"]]
+    storage.close()
+
+
+def test_sessions_created_since_pages_every_user_oldest_first(tmp_path):
+    storage = _backend(tmp_path)
+    storage.save_user_sessions("u2", [{"track_id": f"a{i}", "mood": "Happy", "intensity": i} for i in range(4)])
+    cutoff = time.time()
+    time.sleep(0.01)
+    storage.save_user_session("u1", "b0", "Sad")
+    storage.save_user_sessions("u3", [{"track_id": f"c{i}", "mood": "Calm", "intensity": i} for i in range(3)])
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = storage.get_sessions_created_since(limit=3, cursor=cursor, fields=["trackId"])
+        assert all(set(s) == {"id", "firebaseUserId", "createdAt", "trackId"} for s in page)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert len(seen) == 8
+    assert [(s["createdAt"], s["id"]) for s in seen] == sorted((s["createdAt"], s["id"]) for s in seen)
+
+    recent, cursor = storage.get_sessions_created_since(cutoff)
+    assert cursor is None
+    assert [s["firebaseUserId"] for s in recent] == ["u1", "u3", "u3", "u3"]
+
+    with storage.pool.connection() as conn:
+        plan = " ".join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN " + _sessions_since_sql(["trackId"], since=True, after_cursor=True), (0.0, 5.0, "x", 10)
+        ))
+    assert "idx_user_sessions_created_id" in plan and "TEMP B-TREE" not in plan
+    storage.close()
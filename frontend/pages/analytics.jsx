@@ -7,6 +7,7 @@ export default function Analytics() {
   const [loading, setLoading] = useState(true);
   const [timeFilter, setTimeFilter] = useState("This Week");
   const [analyticsData, setAnalyticsData] = useState(null);
+  const [userId, setUserId] = useState(null);
   const router = useRouter();
 
   useEffect(() => {
@@ -16,6 +17,7 @@ export default function Analytics() {
         router.push("/");
         return;
       }
+      setUserId(user.uid);
       setLoading(false);
     });
 
@@ -23,9 +25,9 @@ export default function Analytics() {
   }, [router]);
 
   useEffect(() => {
-    if (loading) return;
+    if (loading || !userId) return;
     // Fetch analytics from backend
-    fetch(`http://localhost:8000/api/analytics/overview?time_filter=${timeFilter}`)
+    fetch(`http://localhost:8000/api/analytics/overview?time_filter=${encodeURIComponent(timeFilter)}&firebase_user_id=${userId}`)
       .then(response => response.json())
       .then(data => {
         setAnalyticsData(data.analytics);
@@ -35,7 +37,7 @@ export default function Analytics() {
         console.error('Error fetching analytics:', error);
         setLoading(false);
       });
-  }, [timeFilter]);
+  }, [timeFilter, userId]);
 
   // Use fetched data or fallback to mock data
   const moodStats = analyticsData?.mood_stats || [
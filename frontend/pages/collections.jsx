@@ -6,6 +6,7 @@ import { onAuthStateChange } from "../src/firebase/auth";
 export default function Collections() {
   const [loading, setLoading] = useState(true);
   const [collections, setCollections] = useState([]);
+  const [userId, setUserId] = useState(null);
   const router = useRouter();
 
   useEffect(() => {
@@ -15,14 +16,16 @@ export default function Collections() {
         router.push("/");
         return;
       }
+      setUserId(user.uid);
     });
 
     return () => unsubscribe();
   }, [router]);
 
   useEffect(() => {
+    if (!userId) return;
     // Fetch collections from backend
-    fetch('http://localhost:8000/api/collections')
+    fetch(`http://localhost:8000/api/collections?firebase_user_id=${userId}`)
       .then(response => response.json())
       .then(data => {
         setCollections(data.collections || []);
@@ -89,7 +92,18 @@ export default function Collections() {
         setCollections(mockCollections);
         setLoading(false);
       });
-  }, []);
+  }, [userId]);
+
+  // lastUpdated comes back as epoch seconds; show it relative to now
+  const formatLastUpdated = (lastUpdated) => {
+    if (typeof lastUpdated !== "number") return lastUpdated;
+    const days = Math.floor((Date.now() / 1000 - lastUpdated) / 86400);
+    if (days <= 0) return "today";
+    if (days === 1) return "1 day ago";
+    if (days < 7) return `${days} days ago`;
+    const weeks = Math.floor(days / 7);
+    return weeks === 1 ? "1 week ago" : `${weeks} weeks ago`;
+  };
 
   // Remove filtering - show all collections
   const filteredCollections = collections;
@@ -218,7 +232,7 @@ export default function Collections() {
                   color: "#888", 
                   fontSize: "14px" 
                 }}>
-                  {collection.songCount} songs • {collection.lastUpdated}
+                  {collection.songCount} songs • {formatLastUpdated(collection.lastUpdated)}
                 </p>
               </div>
               <div style={{